@@ -0,0 +1,17 @@
+from django.contrib import admin
+from .models import DailyMailRollup, MessageSizeBucket, AttachmentTypeUsage
+
+@admin.register(DailyMailRollup)
+class DailyMailRollupAdmin(admin.ModelAdmin):
+    list_display = ('email_account', 'day', 'sender_domain', 'message_count', 'total_bytes', 'unread_count', 'spam_count')
+    list_filter = ('day',)
+    search_fields = ('sender_domain', 'email_account__email_address')
+
+@admin.register(MessageSizeBucket)
+class MessageSizeBucketAdmin(admin.ModelAdmin):
+    list_display = ('email_account', 'bucket', 'upper_bound', 'message_count', 'total_bytes')
+
+@admin.register(AttachmentTypeUsage)
+class AttachmentTypeUsageAdmin(admin.ModelAdmin):
+    list_display = ('email_account', 'content_type', 'attachment_count', 'total_bytes')
+    search_fields = ('content_type', 'email_account__email_address')
@@ -0,0 +1,56 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections, connections
+from emails.models import EmailAccount
+from analytics.models import DailyMailRollup
+from analytics.services import RollupService, StorageService
+
+def rebuild_chunk(email_account_id, start_day, end_day):
+    """Rebuild one chunk on a worker thread with its own database connection"""
+    close_old_connections()
+    try:
+        return RollupService.rebuild_range(email_account_id, start_day, end_day)
+    finally:
+        connections.close_all()
+
+class Command(BaseCommand):
+    help = "Rebuild daily mail rollups and storage aggregates from EmailMessage in parallel date chunks"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--account', type=int, action='append', help="Email account ID (repeatable)")
+        parser.add_argument('--user', type=int, help="Rebuild all accounts of this user ID")
+        parser.add_argument('--workers', type=int, default=4, help="Parallel workers")
+        parser.add_argument('--chunk-days', type=int, default=30, help="Days per work chunk")
+
+    def handle(self, *args, **options):
+        accounts = EmailAccount.objects.all()
+        if options['account']:
+            accounts = accounts.filter(id__in=options['account'])
+        if options['user']:
+            accounts = accounts.filter(user_id=options['user'])
+
+        work = []
+        for account_id in accounts.values_list('id', flat=True):
+            chunks = RollupService.backfill_chunks(account_id, chunk_days=options['chunk_days'])
+            # Drop rollups outside the account's current mail history
+            stale = DailyMailRollup.objects.filter(email_account_id=account_id)
+            if chunks:
+                stale = stale.exclude(day__gte=chunks[0][0], day__lt=chunks[-1][1])
+            stale.delete()
+            work.extend((account_id, start, end) for start, end in chunks)
+
+        self.stdout.write(f"Rebuilding {len(work)} chunks with {options['workers']} workers")
+        rows = 0
+        if options['workers'] <= 1:
+            for chunk in work:
+                rows += RollupService.rebuild_range(*chunk)
+        else:
+            with ThreadPoolExecutor(max_workers=options['workers']) as executor:
+                futures = [executor.submit(rebuild_chunk, *chunk) for chunk in work]
+                for future in as_completed(futures):
+                    rows += future.result()
+
+        for account_id in accounts.values_list('id', flat=True):
+            StorageService.rebuild_account(account_id)
+
+        self.stdout.write(self.style.SUCCESS(f"Wrote {rows} rollup rows"))
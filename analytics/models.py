@@ -0,0 +1,73 @@
+from django.db import models
+from emails.models import User, EmailAccount
+
+class DailyMailRollup(models.Model):
+    """
+    Pre-aggregated daily mail counts per account and sender domain.
+
+    Maintained incrementally as messages are ingested and deleted, so
+    analytics never have to aggregate EmailMessage directly.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    email_account = models.ForeignKey(EmailAccount, on_delete=models.CASCADE)
+    day = models.DateField()
+    sender_domain = models.CharField(max_length=255)
+    
+    # Aggregates over live messages
+    message_count = models.IntegerField(default=0)
+    total_bytes = models.BigIntegerField(default=0)
+    unread_count = models.IntegerField(default=0)
+    spam_count = models.IntegerField(default=0)
+    
+    class Meta:
+        unique_together = ('email_account', 'day', 'sender_domain')
+        indexes = [
+            models.Index(fields=['user', 'day']),
+        ]
+    
+    def __str__(self):
+        return f"{self.email_account} {self.day} {self.sender_domain}: {self.message_count}"
+
+class MessageSizeBucket(models.Model):
+    """
+    Live message count and bytes per account in power-of-two size buckets.
+
+    Bucket n holds messages with 2**(n-1) <= size < 2**n (bucket 0 is empty messages).
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    email_account = models.ForeignKey(EmailAccount, on_delete=models.CASCADE)
+    bucket = models.SmallIntegerField()
+    
+    message_count = models.IntegerField(default=0)
+    total_bytes = models.BigIntegerField(default=0)
+    
+    class Meta:
+        unique_together = ('email_account', 'bucket')
+    
+    def __str__(self):
+        return f"{self.email_account} <{self.upper_bound} bytes: {self.message_count}"
+    
+    @property
+    def lower_bound(self):
+        return 2 ** (self.bucket - 1) if self.bucket > 0 else 0
+    
+    @property
+    def upper_bound(self):
+        return 2 ** self.bucket
+
+class AttachmentTypeUsage(models.Model):
+    """
+    Attachment count and bytes per account and content type, over live messages
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    email_account = models.ForeignKey(EmailAccount, on_delete=models.CASCADE)
+    content_type = models.CharField(max_length=100)
+    
+    attachment_count = models.IntegerField(default=0)
+    total_bytes = models.BigIntegerField(default=0)
+    
+    class Meta:
+        unique_together = ('email_account', 'content_type')
+    
+    def __str__(self):
+        return f"{self.email_account} {self.content_type}: {self.total_bytes} bytes"
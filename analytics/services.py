@@ -0,0 +1,440 @@
+import logging
+from collections import defaultdict
+from datetime import datetime, time, timedelta
+from django.db import transaction
+from django.db.models import Count, F, Max, Min, Q, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from sync.models import EmailMessage, EmailAttachment, Thread
+from .models import DailyMailRollup, MessageSizeBucket, AttachmentTypeUsage
+
+logger = logging.getLogger(__name__)
+
+# EmailMessage fields needed to place a message in its rollup row
+ROLLUP_FIELDS = ('user_id', 'email_account_id', 'received_at', 'from_address', 'size', 'is_read', 'is_spam', 'is_deleted')
+
+def sender_domain(from_address):
+    """
+    Lowercased domain part of a sender address
+    """
+    return (from_address or '').rpartition('@')[2].strip().lower()
+
+def size_bucket(size):
+    """
+    Power-of-two histogram bucket for a message size
+    """
+    return max(int(size or 0), 0).bit_length()
+
+def normalize_content_type(content_type):
+    """
+    Lowercased MIME type without parameters
+    """
+    return (content_type or '').split(';', 1)[0].strip().lower() or 'application/octet-stream'
+
+def _as_row(message):
+    if isinstance(message, dict):
+        return message
+    return {field: getattr(message, field) for field in ROLLUP_FIELDS}
+
+def _day(received_at):
+    if isinstance(received_at, str):
+        received_at = parse_datetime(received_at)
+    if timezone.is_aware(received_at):
+        return timezone.localdate(received_at)
+    return received_at.date()
+
+class RollupService:
+    """
+    Service class for maintaining and reading daily mail rollups
+    """
+
+    @staticmethod
+    def snapshot(message):
+        """
+        Capture the rollup-relevant state of a message before it changes
+        """
+        return _as_row(message)
+
+    @staticmethod
+    def record(before=(), after=()):
+        """
+        Move messages between rollup rows.
+
+        before holds the previous state of changed/removed messages and after
+        their new state; each accepts model instances or dicts of ROLLUP_FIELDS.
+        Tombstoned messages never count.
+        """
+        deltas = defaultdict(lambda: [0, 0, 0, 0])
+        size_deltas = defaultdict(lambda: [0, 0])
+        for rows, sign in ((before, -1), (after, 1)):
+            for message in rows:
+                row = _as_row(message)
+                if row.get('is_deleted'):
+                    continue
+                size = row['size'] or 0
+                key = (row['user_id'], row['email_account_id'], _day(row['received_at']), sender_domain(row['from_address']))
+                delta = deltas[key]
+                delta[0] += sign
+                delta[1] += sign * size
+                delta[2] += sign * (not row['is_read'])
+                delta[3] += sign * bool(row['is_spam'])
+                size_delta = size_deltas[(row['user_id'], row['email_account_id'], size_bucket(size))]
+                size_delta[0] += sign
+                size_delta[1] += sign * size
+        RollupService.apply_deltas(deltas)
+        StorageService.apply_size_deltas(size_deltas)
+
+    @staticmethod
+    def record_change(before, after):
+        """
+        Record a single message update, skipping the write when nothing relevant changed
+        """
+        before, after = _as_row(before), _as_row(after)
+        if all(before[field] == after[field] for field in ROLLUP_FIELDS):
+            return
+        RollupService.record(before=[before], after=[after])
+
+    @staticmethod
+    def apply_deltas(deltas):
+        """
+        Add {(user_id, account_id, day, domain): [count, bytes, unread, spam]} to the rollups
+        """
+        deltas = {key: delta for key, delta in deltas.items() if any(delta)}
+        if not deltas:
+            return
+        with transaction.atomic():
+            DailyMailRollup.objects.bulk_create(
+                [
+                    DailyMailRollup(user_id=user_id, email_account_id=account_id, day=day, sender_domain=domain)
+                    for user_id, account_id, day, domain in deltas
+                ],
+                ignore_conflicts=True,
+            )
+            for (user_id, account_id, day, domain), (count, size, unread, spam) in deltas.items():
+                DailyMailRollup.objects.filter(
+                    email_account_id=account_id,
+                    day=day,
+                    sender_domain=domain,
+                ).update(
+                    message_count=F('message_count') + count,
+                    total_bytes=F('total_bytes') + size,
+                    unread_count=F('unread_count') + unread,
+                    spam_count=F('spam_count') + spam,
+                )
+
+    @staticmethod
+    def rebuild_range(email_account_id, start_day, end_day):
+        """
+        Recompute the rollups for one account over [start_day, end_day) from EmailMessage
+        """
+        start = timezone.make_aware(datetime.combine(start_day, time.min))
+        end = timezone.make_aware(datetime.combine(end_day, time.min))
+        aggregates = EmailMessage.objects.live().filter(
+            email_account_id=email_account_id,
+            received_at__gte=start,
+            received_at__lt=end,
+        ).annotate(
+            day=TruncDate('received_at'),
+        ).values('user_id', 'day', 'from_address').annotate(
+            count=Count('id'),
+            total_bytes=Sum('size'),
+            unread=Count('id', filter=Q(is_read=False)),
+            spam=Count('id', filter=Q(is_spam=True)),
+        ).order_by()
+
+        # Fold per-address aggregates into per-domain rows
+        rows = {}
+        for aggregate in aggregates:
+            key = (aggregate['day'], sender_domain(aggregate['from_address']))
+            row = rows.get(key)
+            if row is None:
+                row = rows[key] = DailyMailRollup(
+                    user_id=aggregate['user_id'],
+                    email_account_id=email_account_id,
+                    day=aggregate['day'],
+                    sender_domain=key[1],
+                )
+            row.message_count += aggregate['count']
+            row.total_bytes += aggregate['total_bytes'] or 0
+            row.unread_count += aggregate['unread']
+            row.spam_count += aggregate['spam']
+
+        with transaction.atomic():
+            DailyMailRollup.objects.filter(
+                email_account_id=email_account_id,
+                day__gte=start_day,
+                day__lt=end_day,
+            ).delete()
+            DailyMailRollup.objects.bulk_create(rows.values(), batch_size=1000)
+        return len(rows)
+
+    @staticmethod
+    def backfill_chunks(email_account_id, chunk_days=30):
+        """
+        Split an account's mail history into (start_day, end_day) chunks for rebuilding
+        """
+        bounds = EmailMessage.objects.live().filter(
+            email_account_id=email_account_id,
+        ).aggregate(first=Min('received_at'), last=Max('received_at'))
+        first, last = bounds['first'], bounds['last']
+        if first is None:
+            return []
+        day = _day(first)
+        last_day = _day(last)
+        chunks = []
+        while day <= last_day:
+            chunks.append((day, day + timedelta(days=chunk_days)))
+            day += timedelta(days=chunk_days)
+        return chunks
+
+    @staticmethod
+    def get_rollups(user, start_day, end_day, email_account=None):
+        """
+        Rollup rows for a user over [start_day, end_day], optionally for one account
+        """
+        queryset = DailyMailRollup.objects.filter(user=user, day__gte=start_day, day__lte=end_day)
+        if email_account is not None:
+            queryset = queryset.filter(email_account=email_account)
+        return queryset
+
+    @staticmethod
+    def get_daily_series(user, start_day, end_day, email_account=None):
+        """
+        Per-day totals over a date range, read only from the rollups
+        """
+        return list(
+            RollupService.get_rollups(user, start_day, end_day, email_account)
+            .values('day')
+            .annotate(
+                messages=Sum('message_count'),
+                bytes=Sum('total_bytes'),
+                unread=Sum('unread_count'),
+                spam=Sum('spam_count'),
+            )
+            .order_by('day')
+        )
+
+    @staticmethod
+    def get_top_senders(user, start_day, end_day, email_account=None, limit=20):
+        """
+        Sender domains ranked by message volume over a date range
+        """
+        return list(
+            RollupService.get_rollups(user, start_day, end_day, email_account)
+            .values('sender_domain')
+            .annotate(
+                messages=Sum('message_count'),
+                bytes=Sum('total_bytes'),
+                unread=Sum('unread_count'),
+                spam=Sum('spam_count'),
+            )
+            .order_by('-messages')[:limit]
+        )
+
+class StorageService:
+    """
+    Service class for storage usage analysis, backed by incrementally maintained aggregates
+    """
+
+    @staticmethod
+    def apply_size_deltas(deltas):
+        """
+        Add {(user_id, account_id, bucket): [count, bytes]} to the size histogram
+        """
+        deltas = {key: delta for key, delta in deltas.items() if any(delta)}
+        if not deltas:
+            return
+        with transaction.atomic():
+            MessageSizeBucket.objects.bulk_create(
+                [
+                    MessageSizeBucket(user_id=user_id, email_account_id=account_id, bucket=bucket)
+                    for user_id, account_id, bucket in deltas
+                ],
+                ignore_conflicts=True,
+            )
+            for (user_id, account_id, bucket), (count, size) in deltas.items():
+                MessageSizeBucket.objects.filter(email_account_id=account_id, bucket=bucket).update(
+                    message_count=F('message_count') + count,
+                    total_bytes=F('total_bytes') + size,
+                )
+
+    @staticmethod
+    def apply_attachment_deltas(deltas):
+        """
+        Add {(user_id, account_id, content_type): [count, bytes]} to the per-type usage
+        """
+        deltas = {key: delta for key, delta in deltas.items() if any(delta)}
+        if not deltas:
+            return
+        with transaction.atomic():
+            AttachmentTypeUsage.objects.bulk_create(
+                [
+                    AttachmentTypeUsage(user_id=user_id, email_account_id=account_id, content_type=content_type)
+                    for user_id, account_id, content_type in deltas
+                ],
+                ignore_conflicts=True,
+            )
+            for (user_id, account_id, content_type), (count, size) in deltas.items():
+                AttachmentTypeUsage.objects.filter(email_account_id=account_id, content_type=content_type).update(
+                    attachment_count=F('attachment_count') + count,
+                    total_bytes=F('total_bytes') + size,
+                )
+
+    @staticmethod
+    def record_attachments(email_message, attachments, sign=1):
+        """
+        Count attachments of one live message in or out of the per-type usage
+        """
+        if email_message.is_deleted:
+            return
+        deltas = defaultdict(lambda: [0, 0])
+        for attachment in attachments:
+            delta = deltas[(email_message.user_id, email_message.email_account_id, normalize_content_type(attachment.content_type))]
+            delta[0] += sign
+            delta[1] += sign * (attachment.size or 0)
+        StorageService.apply_attachment_deltas(deltas)
+
+    @staticmethod
+    def record_message_attachments(message_ids, sign):
+        """
+        Move all attachments of the given messages in (+1) or out (-1) of the per-type usage
+        """
+        deltas = defaultdict(lambda: [0, 0])
+        aggregates = EmailAttachment.objects.filter(email_message_id__in=message_ids).values(
+            'email_message__user_id', 'email_message__email_account_id', 'content_type',
+        ).annotate(count=Count('id'), total=Sum('size')).order_by()
+        for aggregate in aggregates:
+            delta = deltas[(
+                aggregate['email_message__user_id'],
+                aggregate['email_message__email_account_id'],
+                normalize_content_type(aggregate['content_type']),
+            )]
+            delta[0] += sign * aggregate['count']
+            delta[1] += sign * (aggregate['total'] or 0)
+        StorageService.apply_attachment_deltas(deltas)
+
+    @staticmethod
+    def rebuild_account(email_account_id):
+        """
+        Recompute the size histogram and attachment usage of one account from scratch
+        """
+        live = EmailMessage.objects.live().filter(email_account_id=email_account_id)
+        buckets = {}
+        for user_id, size in live.values_list('user_id', 'size').iterator(chunk_size=5000):
+            bucket = buckets.setdefault(size_bucket(size), MessageSizeBucket(
+                user_id=user_id, email_account_id=email_account_id, bucket=size_bucket(size),
+            ))
+            bucket.message_count += 1
+            bucket.total_bytes += size or 0
+
+        usage = {}
+        aggregates = EmailAttachment.objects.filter(
+            email_message__email_account_id=email_account_id,
+            email_message__is_deleted=False,
+        ).values('email_message__user_id', 'content_type').annotate(
+            count=Count('id'), total=Sum('size'),
+        ).order_by()
+        for aggregate in aggregates:
+            content_type = normalize_content_type(aggregate['content_type'])
+            row = usage.setdefault(content_type, AttachmentTypeUsage(
+                user_id=aggregate['email_message__user_id'],
+                email_account_id=email_account_id,
+                content_type=content_type,
+            ))
+            row.attachment_count += aggregate['count']
+            row.total_bytes += aggregate['total'] or 0
+
+        with transaction.atomic():
+            MessageSizeBucket.objects.filter(email_account_id=email_account_id).delete()
+            MessageSizeBucket.objects.bulk_create(buckets.values())
+            AttachmentTypeUsage.objects.filter(email_account_id=email_account_id).delete()
+            AttachmentTypeUsage.objects.bulk_create(usage.values())
+
+    @staticmethod
+    def get_size_histogram(user, email_account=None):
+        """
+        Message count and bytes per size bucket, smallest first
+        """
+        queryset = MessageSizeBucket.objects.filter(user=user)
+        if email_account is not None:
+            queryset = queryset.filter(email_account=email_account)
+        return [
+            {
+                'min_size': 2 ** (row['bucket'] - 1) if row['bucket'] > 0 else 0,
+                'max_size': 2 ** row['bucket'],
+                'messages': row['messages'],
+                'bytes': row['bytes'],
+            }
+            for row in queryset.values('bucket').annotate(
+                messages=Sum('message_count'),
+                bytes=Sum('total_bytes'),
+            ).order_by('bucket')
+            if row['messages']
+        ]
+
+    @staticmethod
+    def get_bytes_by_content_type(user, email_account=None, limit=50):
+        """
+        Attachment bytes per content type, largest first
+        """
+        queryset = AttachmentTypeUsage.objects.filter(user=user)
+        if email_account is not None:
+            queryset = queryset.filter(email_account=email_account)
+        return list(
+            queryset.values('content_type').annotate(
+                attachments=Sum('attachment_count'),
+                bytes=Sum('total_bytes'),
+            ).filter(attachments__gt=0).order_by('-bytes')[:limit]
+        )
+
+    @staticmethod
+    def get_largest_messages(user, limit=100):
+        """
+        The largest live messages, read straight off the (user, -size) index
+        """
+        return EmailMessage.objects.live().filter(user=user).order_by('-size').only(
+            'id', 'email_account_id', 'subject', 'from_address', 'received_at', 'size',
+        )[:limit]
+
+    @staticmethod
+    def get_largest_threads(user, limit=20):
+        """
+        Threads ranked by total size, read from the thread rollup
+        """
+        return list(
+            Thread.objects.filter(user=user, message_count__gt=0).order_by('-total_size').values(
+                'id', 'subject', 'message_count', 'total_size',
+            )[:limit]
+        )
+
+    @staticmethod
+    def get_total_usage(user, email_account=None):
+        """
+        Total live messages and bytes, summed from the size histogram
+        """
+        queryset = MessageSizeBucket.objects.filter(user=user)
+        if email_account is not None:
+            queryset = queryset.filter(email_account=email_account)
+        totals = queryset.aggregate(messages=Sum('message_count'), bytes=Sum('total_bytes'))
+        return {'messages': totals['messages'] or 0, 'bytes': totals['bytes'] or 0}
+
+    @staticmethod
+    def estimate_reclaimable_by_sender(user, limit=20):
+        """
+        Bytes that deleting all mail from each sender domain would free, from the daily rollups
+        """
+        return list(
+            DailyMailRollup.objects.filter(user=user).values('sender_domain').annotate(
+                messages=Sum('message_count'),
+                bytes=Sum('total_bytes'),
+            ).filter(messages__gt=0).order_by('-bytes')[:limit]
+        )
+
+    @staticmethod
+    def estimate_reclaimable(queryset):
+        """
+        Messages and bytes that deleting a message queryset (e.g. a selection) would free
+        """
+        totals = queryset.aggregate(messages=Count('id'), bytes=Sum('size'))
+        return {'messages': totals['messages'], 'bytes': totals['bytes'] or 0}
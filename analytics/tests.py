@@ -0,0 +1,183 @@
+from datetime import datetime, timedelta, timezone as dt_timezone
+from django.test import TestCase
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.urls import reverse
+from emails.models import EmailAccount
+from sync.models import EmailMessage
+from sync.services import EmailSyncService
+from review.services import TombstoneService
+from .models import DailyMailRollup, MessageSizeBucket, AttachmentTypeUsage
+from .services import RollupService, StorageService
+from io import StringIO
+
+User = get_user_model()
+
+class RollupTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='testuser',
+            email='test@example.com',
+            password='testpass123'
+        )
+        self.email_account = EmailAccount.objects.create(
+            user=self.user,
+            email_address='test@example.com',
+            provider='imap',
+            imap_server='imap.example.com',
+            smtp_server='smtp.example.com',
+        )
+        self.day = datetime(2025, 3, 1, 12, 0, tzinfo=dt_timezone.utc)
+    
+    def ingest(self, message_id, from_address='news@bulk.example', days_ago=0, **extra):
+        message_data = {
+            'id': message_id,
+            'subject': 'Hello',
+            'from': from_address,
+            'received_at': self.day - timedelta(days=days_ago),
+            'size': 100,
+        }
+        message_data.update(extra)
+        return EmailSyncService.create_or_update_email_message(self.email_account, message_data)[0]
+    
+    def rollup_values(self):
+        return sorted(DailyMailRollup.objects.values_list(
+            'day', 'sender_domain', 'message_count', 'total_bytes', 'unread_count', 'spam_count'
+        ))
+
+class RollupServiceTest(RollupTestCase):
+    def test_ingestion_updates_rollups(self):
+        """Test that new and updated messages keep the rollups current"""
+        self.ingest('1')
+        self.ingest('2', is_spam=True)
+        self.ingest('3', from_address='friend@home.example', days_ago=1, is_read=True)
+        
+        rollup = DailyMailRollup.objects.get(day=self.day.date(), sender_domain='bulk.example')
+        self.assertEqual((rollup.message_count, rollup.total_bytes, rollup.unread_count, rollup.spam_count), (2, 200, 2, 1))
+        
+        # Re-syncing a message as read moves it out of the unread count
+        self.ingest('1', is_read=True)
+        rollup.refresh_from_db()
+        self.assertEqual(rollup.unread_count, 1)
+        self.assertEqual(rollup.message_count, 2)
+    
+    def test_deletion_and_undo_update_rollups(self):
+        """Test that tombstoning removes messages from the rollups and undo adds them back"""
+        message = self.ingest('1')
+        self.ingest('2')
+        
+        _, token = TombstoneService.soft_delete(self.user, [message.pk])
+        self.assertEqual(DailyMailRollup.objects.get().message_count, 1)
+        
+        TombstoneService.undo(self.user, deleted_at=token)
+        self.assertEqual(DailyMailRollup.objects.get().message_count, 2)
+    
+    def test_backfill_matches_incremental(self):
+        """Test that a backfill rebuilds exactly what incremental maintenance produced"""
+        for i in range(10):
+            self.ingest(str(i), from_address=f'user{i % 3}@domain{i % 2}.example', days_ago=i * 20, is_read=bool(i % 2))
+        expected = self.rollup_values()
+        
+        DailyMailRollup.objects.update(message_count=0)
+        DailyMailRollup.objects.create(
+            user=self.user, email_account=self.email_account,
+            day=self.day.date() - timedelta(days=5000), sender_domain='stale.example', message_count=9,
+        )
+        call_command('backfill_rollups', '--workers', '1', '--chunk-days', '30', stdout=StringIO())
+        
+        self.assertEqual(self.rollup_values(), expected)
+    
+    def test_daily_series_and_top_senders(self):
+        """Test reading trends from the rollups"""
+        self.ingest('1')
+        self.ingest('2')
+        self.ingest('3', from_address='friend@home.example', days_ago=1)
+        start, end = self.day.date() - timedelta(days=7), self.day.date()
+        
+        series = RollupService.get_daily_series(self.user, start, end)
+        self.assertEqual([(row['day'], row['messages']) for row in series], [
+            (self.day.date() - timedelta(days=1), 1),
+            (self.day.date(), 2),
+        ])
+        senders = RollupService.get_top_senders(self.user, start, end)
+        self.assertEqual(senders[0]['sender_domain'], 'bulk.example')
+
+class StorageServiceTest(RollupTestCase):
+    def storage_values(self):
+        return (
+            sorted(MessageSizeBucket.objects.values_list('bucket', 'message_count', 'total_bytes')),
+            sorted(AttachmentTypeUsage.objects.values_list('content_type', 'attachment_count', 'total_bytes')),
+        )
+    
+    def test_histogram_and_attachment_types_are_incremental(self):
+        """Test that ingestion, deletion and undo keep storage aggregates current"""
+        message = self.ingest('1', size=5000, attachments=[
+            {'id': 'a1', 'content_type': 'application/PDF; name="x.pdf"', 'size': 4000},
+        ])
+        self.ingest('2', size=100)
+        
+        self.assertEqual(StorageService.get_total_usage(self.user), {'messages': 2, 'bytes': 5100})
+        histogram = StorageService.get_size_histogram(self.user)
+        self.assertEqual([(row['min_size'], row['messages']) for row in histogram], [(64, 1), (4096, 1)])
+        self.assertEqual(StorageService.get_bytes_by_content_type(self.user)[0]['content_type'], 'application/pdf')
+        
+        _, token = TombstoneService.soft_delete(self.user, [message.pk])
+        self.assertEqual(StorageService.get_total_usage(self.user), {'messages': 1, 'bytes': 100})
+        self.assertEqual(StorageService.get_bytes_by_content_type(self.user), [])
+        
+        TombstoneService.undo(self.user, deleted_at=token)
+        self.assertEqual(StorageService.get_bytes_by_content_type(self.user)[0]['bytes'], 4000)
+    
+    def test_backfill_matches_incremental(self):
+        """Test that rebuilding storage aggregates reproduces incremental maintenance"""
+        for i in range(6):
+            self.ingest(str(i), size=10 ** i, attachments=[
+                {'id': f'a{i}', 'content_type': 'image/png' if i % 2 else 'text/plain', 'size': i},
+            ])
+        expected = self.storage_values()
+        
+        MessageSizeBucket.objects.update(message_count=0)
+        AttachmentTypeUsage.objects.all().delete()
+        call_command('backfill_rollups', '--workers', '1', stdout=StringIO())
+        
+        self.assertEqual(self.storage_values(), expected)
+    
+    def test_largest_messages_and_reclaimable(self):
+        """Test top-N largest messages and reclaimable estimates"""
+        for i, size in enumerate([300, 100, 900, 500]):
+            self.ingest(str(i), size=size, from_address=f'a@{"big" if size > 400 else "small"}.example')
+        
+        largest = StorageService.get_largest_messages(self.user, limit=2)
+        self.assertEqual([message.size for message in largest], [900, 500])
+        
+        by_sender = StorageService.estimate_reclaimable_by_sender(self.user)
+        self.assertEqual((by_sender[0]['sender_domain'], by_sender[0]['bytes']), ('big.example', 1400))
+        
+        estimate = StorageService.estimate_reclaimable(EmailMessage.objects.live().filter(size__lt=400))
+        self.assertEqual(estimate, {'messages': 2, 'bytes': 400})
+
+class AnalyticsViewTest(RollupTestCase):
+    def test_daily_volume_reads_only_rollups(self):
+        """Test that the analytics endpoint never touches EmailMessage"""
+        self.ingest('1')
+        self.client.login(username='test@example.com', password='testpass123')
+        
+        with self.assertNumQueries(3):  # session, user, one rollup aggregate
+            response = self.client.get(reverse('analytics:daily_volume'), {
+                'start': '2022-01-01',
+                'end': '2025-12-31',
+            })
+        
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['days'][0]['messages'], 1)
+    
+    def test_storage_endpoints(self):
+        """Test the storage overview and largest-messages endpoints"""
+        self.ingest('1', size=2048)
+        self.client.login(username='test@example.com', password='testpass123')
+        
+        response = self.client.get(reverse('analytics:storage_overview'))
+        self.assertEqual(response.json()['total'], {'messages': 1, 'bytes': 2048})
+        
+        response = self.client.get(reverse('analytics:largest_messages'), {'limit': 10})
+        self.assertEqual(response.json()['messages'][0]['size'], 2048)
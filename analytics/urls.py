@@ -0,0 +1,12 @@
+from django.urls import path
+from . import views
+
+app_name = 'analytics'
+
+urlpatterns = [
+    path('daily/', views.DailyVolumeView.as_view(), name='daily_volume'),
+    path('senders/', views.SenderTrendsView.as_view(), name='sender_trends'),
+    path('storage/', views.StorageOverviewView.as_view(), name='storage_overview'),
+    path('storage/largest/', views.LargestMessagesView.as_view(), name='largest_messages'),
+    path('storage/reclaimable/', views.ReclaimableView.as_view(), name='reclaimable'),
+]
@@ -0,0 +1,116 @@
+from datetime import timedelta
+from django.shortcuts import get_object_or_404
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+from django.views import View
+from core.mixins import AuthRequiredMixin, AjaxResponseMixin, ReplicaReadMixin
+from emails.models import EmailAccount
+from review.models import SelectionSet
+from review.services import SelectionService
+from .services import RollupService, StorageService
+
+class RollupRangeMixin:
+    """Parse the date range and optional account shared by rollup views"""
+    default_days = 365
+    
+    def get_range(self, request):
+        end = parse_date(request.GET.get('end', '')) or timezone.localdate()
+        start = parse_date(request.GET.get('start', '')) or end - timedelta(days=self.default_days)
+        if start > end:
+            raise ValueError("start must not be after end")
+        return start, end
+    
+    def get_account(self, request):
+        account_id = request.GET.get('account')
+        if not account_id:
+            return None
+        return get_object_or_404(EmailAccount, id=account_id, user=request.user)
+
+class DailyVolumeView(AuthRequiredMixin, ReplicaReadMixin, AjaxResponseMixin, RollupRangeMixin, View):
+    """Mail per day over a date range, served from the daily rollups"""
+    
+    def get(self, request):
+        try:
+            start, end = self.get_range(request)
+        except ValueError as e:
+            return self.render_to_json_response({'status': 'error', 'message': str(e)}, status=400)
+        
+        series = RollupService.get_daily_series(request.user, start, end, self.get_account(request))
+        return self.render_to_json_response({
+            'start': start.isoformat(),
+            'end': end.isoformat(),
+            'days': [dict(row, day=row['day'].isoformat()) for row in series],
+        })
+
+class SenderTrendsView(AuthRequiredMixin, ReplicaReadMixin, AjaxResponseMixin, RollupRangeMixin, View):
+    """Top sender domains over a date range, served from the daily rollups"""
+    
+    def get(self, request):
+        try:
+            start, end = self.get_range(request)
+            limit = min(int(request.GET.get('limit', 20)), 100)
+        except ValueError as e:
+            return self.render_to_json_response({'status': 'error', 'message': str(e)}, status=400)
+        
+        senders = RollupService.get_top_senders(request.user, start, end, self.get_account(request), limit=limit)
+        return self.render_to_json_response({
+            'start': start.isoformat(),
+            'end': end.isoformat(),
+            'senders': senders,
+        })
+
+class StorageOverviewView(AuthRequiredMixin, ReplicaReadMixin, AjaxResponseMixin, RollupRangeMixin, View):
+    """Total usage, size histogram and bytes by attachment type"""
+    
+    def get(self, request):
+        account = self.get_account(request)
+        return self.render_to_json_response({
+            'total': StorageService.get_total_usage(request.user, account),
+            'histogram': StorageService.get_size_histogram(request.user, account),
+            'attachment_types': StorageService.get_bytes_by_content_type(request.user, account),
+        })
+
+class LargestMessagesView(AuthRequiredMixin, ReplicaReadMixin, AjaxResponseMixin, View):
+    """Top-N largest live messages and threads"""
+    
+    def get(self, request):
+        try:
+            limit = min(int(request.GET.get('limit', 100)), 500)
+        except ValueError as e:
+            return self.render_to_json_response({'status': 'error', 'message': str(e)}, status=400)
+        
+        messages = StorageService.get_largest_messages(request.user, limit=limit)
+        return self.render_to_json_response({
+            'messages': [
+                {
+                    'id': message.id,
+                    'account': message.email_account_id,
+                    'subject': message.subject,
+                    'from_address': message.from_address,
+                    'received_at': message.received_at.isoformat(),
+                    'size': message.size,
+                }
+                for message in messages
+            ],
+            'threads': StorageService.get_largest_threads(request.user),
+        })
+
+class ReclaimableView(AuthRequiredMixin, ReplicaReadMixin, AjaxResponseMixin, View):
+    """Bytes freed by deleting a selection, or by deleting each top sender domain"""
+    
+    def get(self, request):
+        selection_id = request.GET.get('selection')
+        if selection_id:
+            selection = get_object_or_404(SelectionSet, id=selection_id, user=request.user)
+            return self.render_to_json_response({
+                'selection': selection.id,
+                **StorageService.estimate_reclaimable(SelectionService.get_queryset(selection)),
+            })
+        
+        try:
+            limit = min(int(request.GET.get('limit', 20)), 100)
+        except ValueError as e:
+            return self.render_to_json_response({'status': 'error', 'message': str(e)}, status=400)
+        return self.render_to_json_response({
+            'senders': StorageService.estimate_reclaimable_by_sender(request.user, limit=limit),
+        })
@@ -0,0 +1,129 @@
+"""
+Benchmark cross-account deduplication on a synthetic multi-account corpus.
+
+Ingests the same corpus twice into a throwaway test database, once with
+MESSAGE_DEDUP_ENABLED off and once on, and reports stored body bytes and
+per-message ingest time for both runs as JSON.
+
+    python benchmarks/bench_dedup.py --messages 2000 --accounts 3
+"""
+import argparse
+import json
+import logging
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings.development')
+
+import django
+
+django.setup()
+logging.disable(logging.INFO)
+
+from django.db import connection
+from django.db.models import Sum
+from django.db.models.functions import Length
+from django.test.utils import override_settings, setup_test_environment, teardown_test_environment
+
+def build_corpus(messages, accounts, duplicate_rate, body_size, seed):
+    """
+    Yield (account_index, message_data); duplicates land in several accounts
+    """
+    rng = random.Random(seed)
+    start = datetime(2025, 1, 1, tzinfo=dt_timezone.utc)
+    words = ['invoice', 'meeting', 'report', 'update', 'lunch', 'release', 'offer', 'notice']
+    corpus = []
+    for i in range(messages):
+        body = ' '.join(rng.choice(words) for _ in range(body_size // 7))
+        message = {
+            'subject': f"{rng.choice(words).title()} #{i}",
+            'from': f"sender{rng.randrange(200)}@example{rng.randrange(20)}.com",
+            'to': ['me@example.com'],
+            'sent_at': start + timedelta(minutes=i),
+            'received_at': start + timedelta(minutes=i),
+            'message_id_header': f"<{i}.{seed}@bench.example>",
+            'body_plain': body,
+            'body_html': f"<p>{body}</p>",
+            'size': len(body) * 2,
+        }
+        copies = rng.randint(2, accounts) if accounts > 1 and rng.random() < duplicate_rate else 1
+        for account_index in rng.sample(range(accounts), copies):
+            corpus.append((account_index, dict(message, id=f"{account_index}-{i}")))
+    rng.shuffle(corpus)
+    return corpus
+
+def run(corpus, accounts, dedup):
+    from emails.models import EmailAccount, User
+    from sync.models import EmailMessage, MessageBody
+    from sync.services import EmailSyncService
+
+    EmailMessage.objects.all().delete()
+    MessageBody.objects.all().delete()
+    user, _ = User.objects.get_or_create(username='bench', defaults={'email': 'bench@example.com'})
+    email_accounts = [
+        EmailAccount.objects.get_or_create(
+            user=user,
+            email_address=f"me{i}@example.com",
+            defaults={'provider': 'imap', 'imap_server': 'imap.example.com', 'smtp_server': 'smtp.example.com'},
+        )[0]
+        for i in range(accounts)
+    ]
+
+    with override_settings(MESSAGE_DEDUP_ENABLED=dedup):
+        started = time.perf_counter()
+        for account_index, message_data in corpus:
+            EmailSyncService.create_or_update_email_message(email_accounts[account_index], message_data)
+        elapsed = time.perf_counter() - started
+
+    def body_bytes(queryset):
+        totals = queryset.aggregate(plain=Sum(Length('body_plain')), html=Sum(Length('body_html')))
+        return (totals['plain'] or 0) + (totals['html'] or 0)
+
+    return {
+        'messages': len(corpus),
+        'seconds': round(elapsed, 3),
+        'ms_per_message': round(elapsed * 1000 / len(corpus), 3),
+        'inline_body_bytes': body_bytes(EmailMessage.objects.all()),
+        'shared_body_bytes': body_bytes(MessageBody.objects.all()),
+        'shared_bodies': MessageBody.objects.count(),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--messages', type=int, default=2000, help="Distinct messages in the corpus")
+    parser.add_argument('--accounts', type=int, default=3, help="Accounts per user")
+    parser.add_argument('--duplicate-rate', type=float, default=0.6, help="Share of messages present in several accounts")
+    parser.add_argument('--body-size', type=int, default=4000, help="Approximate plain text body size in bytes")
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    corpus = build_corpus(args.messages, args.accounts, args.duplicate_rate, args.body_size, args.seed)
+
+    setup_test_environment()
+    old_name = connection.creation.create_test_db(verbosity=0)
+    try:
+        baseline = run(corpus, args.accounts, dedup=False)
+        deduped = run(corpus, args.accounts, dedup=True)
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        teardown_test_environment()
+
+    stored_before = baseline['inline_body_bytes'] + baseline['shared_body_bytes']
+    stored_after = deduped['inline_body_bytes'] + deduped['shared_body_bytes']
+    print(json.dumps({
+        'benchmark': 'dedup',
+        'parameters': vars(args),
+        'baseline': baseline,
+        'dedup': deduped,
+        'body_bytes_saved': stored_before - stored_after,
+        'storage_saving_pct': round(100 * (stored_before - stored_after) / stored_before, 1) if stored_before else 0.0,
+        'ingest_overhead_pct': round(100 * (deduped['seconds'] - baseline['seconds']) / baseline['seconds'], 1)
+            if baseline['seconds'] else 0.0,
+    }, indent=2))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,253 @@
+"""
+End-to-end benchmark suite over a synthetic mailbox.
+
+Builds a deterministic mailbox (see synthetic_mailbox.py) and measures, in a
+throwaway test database:
+
+- ingest: MIME parsing plus EmailSyncService.persist_batch, messages/sec
+- list: EmailListView first, middle and last pages
+- detail: EmailDetailView on random messages
+- stats: sync dashboard, analytics rollup and storage views
+- delete: a bulk delete job over the largest newsletter sender, then undo
+
+View scenarios report latency percentiles and SQL query counts. Results are
+written as JSON (to --output or stdout) together with the database vendor,
+mailbox summary and git revision, so runs can be compared over time. The
+database is whatever the settings module configures; for PostgreSQL run
+
+    DJANGO_SETTINGS_MODULE=config.settings.production DB_HOST=... \\
+        python benchmarks/bench_e2e.py --scale 100k --output results/pg-100k.json
+
+    python benchmarks/bench_e2e.py --scale 10k --scenarios ingest list detail
+"""
+import argparse
+import json
+import logging
+import os
+import random
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone as dt_timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings.development')
+
+import django
+
+django.setup()
+logging.disable(logging.INFO)
+
+from django.core.files.storage import InMemoryStorage
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, setup_test_environment, teardown_test_environment
+from django.urls import reverse
+
+from synthetic_mailbox import SCALES, SyntheticMailbox
+from sync.pipeline import parse_fetched
+from sync.providers import FetchedMessage, chunked
+from sync.storage import AttachmentStore
+
+SCENARIOS = ('ingest', 'list', 'detail', 'stats', 'delete')
+
+def percentiles(samples):
+    samples = sorted(samples)
+    def pick(q):
+        return round(samples[min(len(samples) - 1, int(q * len(samples)))] * 1000, 2)
+    return {'p50_ms': pick(0.5), 'p95_ms': pick(0.95), 'max_ms': round(samples[-1] * 1000, 2)}
+
+def timed_get(client, url, repeat):
+    """GET url repeat times; returns latency percentiles and the query count of one request"""
+    latencies = []
+    queries = 0
+    for i in range(repeat):
+        with CaptureQueriesContext(connection) as captured:
+            started = time.perf_counter()
+            response = client.get(url)
+            latencies.append(time.perf_counter() - started)
+        if response.status_code != 200:
+            raise SystemExit(f"GET {url} returned {response.status_code}")
+        queries = len(captured)
+    return dict(percentiles(latencies), queries=queries)
+
+def setup_account():
+    from emails.models import EmailAccount, User
+
+    user = User.objects.create_user(username='bench', email='bench@example.com', password='bench')
+    account = EmailAccount.objects.create(
+        user=user, email_address='me@example.com', provider='imap',
+        imap_server='imap.example.com', smtp_server='smtp.example.com',
+    )
+    return user, account
+
+def run_ingest(mailbox, account, args):
+    from sync.models import EmailMessage
+    from sync.services import EmailSyncService
+
+    store = AttachmentStore(storage=InMemoryStorage())
+    parse_seconds = persist_seconds = 0.0
+    raw_bytes = failed = 0
+    for uids in chunked(mailbox.uids(), args.batch_size):
+        started = time.perf_counter()
+        batch = []
+        for uid in uids:
+            message = mailbox.message(uid)
+            raw_bytes += len(message.raw)
+            extra = {
+                'is_read': '\\Seen' in message.flags,
+                'is_starred': '\\Flagged' in message.flags,
+                'received_at': message.received_at,
+            }
+            batch.append(parse_fetched(FetchedMessage(str(uid), message.raw, extra), store=store))
+        parse_seconds += time.perf_counter() - started
+
+        started = time.perf_counter()
+        failed += EmailSyncService.persist_batch(account, batch)[2]
+        persist_seconds += time.perf_counter() - started
+
+    stored = EmailMessage.objects.filter(email_account=account).count()
+    if stored + failed != len(mailbox) or failed:
+        raise SystemExit(f"Ingest stored {stored} of {len(mailbox)} messages ({failed} failed)")
+    total = parse_seconds + persist_seconds
+    return {
+        'messages': stored,
+        'seconds': round(total, 3),
+        'messages_per_second': round(stored / total, 1),
+        'raw_megabytes_per_second': round(raw_bytes / total / 1e6, 2),
+        'parse_seconds': round(parse_seconds, 3),
+        'persist_seconds': round(persist_seconds, 3),
+    }
+
+def run_list(client, account, args):
+    from sync.models import EmailMessage
+
+    pages = max(1, -(-EmailMessage.objects.live().filter(email_account=account).count() // 50))
+    url = reverse('sync:email_list', kwargs={'account_id': account.id})
+    return {
+        f"page_{page}": timed_get(client, f"{url}?page={page}", args.repeat)
+        for page in sorted({1, (pages + 1) // 2, pages})
+    }
+
+def run_detail(client, account, args):
+    from sync.models import EmailMessage
+
+    rng = random.Random(args.seed)
+    pks = list(EmailMessage.objects.live().filter(email_account=account).values_list('pk', flat=True))
+    latencies = []
+    queries = []
+    for pk in rng.sample(pks, min(len(pks), args.repeat * 10)):
+        with CaptureQueriesContext(connection) as captured:
+            started = time.perf_counter()
+            response = client.get(reverse('sync:email_detail', kwargs={'email_id': pk}))
+            latencies.append(time.perf_counter() - started)
+        if response.status_code != 200:
+            raise SystemExit(f"Detail view for {pk} returned {response.status_code}")
+        queries.append(len(captured))
+    return dict(percentiles(latencies), requests=len(latencies), queries=max(queries))
+
+def run_stats(client, account, args):
+    urls = {
+        'sync_dashboard': reverse('sync:dashboard'),
+        'daily_volume': reverse('analytics:daily_volume') + '?start=2000-01-01',
+        'sender_trends': reverse('analytics:sender_trends') + '?start=2000-01-01',
+        'storage_overview': reverse('analytics:storage_overview'),
+        'largest_messages': reverse('analytics:largest_messages'),
+        'reclaimable': reverse('analytics:reclaimable'),
+        'threads': reverse('sync:thread_list'),
+    }
+    return {name: timed_get(client, url, args.repeat) for name, url in urls.items()}
+
+def run_delete(user, account, args):
+    from django.db.models import Count
+    from review.services import BulkDeleteService
+    from sync.models import EmailMessage
+
+    top = (
+        EmailMessage.objects.live().filter(email_account=account, from_address__startswith='newsletters@')
+        .values('from_address').annotate(count=Count('id')).order_by('-count').first()
+    )
+    if top is None:
+        return {'skipped': 'no newsletter senders'}
+    domain = top['from_address'].split('@')[1]
+
+    started = time.perf_counter()
+    job = BulkDeleteService.create_job(user, account, filters={'from_domain': domain})
+    BulkDeleteService.run_job(job, pause=0)
+    delete_seconds = time.perf_counter() - started
+    started = time.perf_counter()
+    restored = BulkDeleteService.undo_job(job)
+    undo_seconds = time.perf_counter() - started
+    if job.status != 'completed' or restored != job.deleted_messages:
+        raise SystemExit(f"Bulk delete ended {job.status}: {job.deleted_messages} deleted, {restored} restored")
+    return {
+        'messages': job.deleted_messages,
+        'delete_seconds': round(delete_seconds, 3),
+        'undo_seconds': round(undo_seconds, 3),
+        'messages_per_second': round(job.deleted_messages / delete_seconds, 1) if delete_seconds else None,
+    }
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--scale', choices=sorted(SCALES), default=None, help="Preset mailbox size")
+    parser.add_argument('--messages', type=int, default=10000, help="Mailbox size when no --scale is given")
+    parser.add_argument('--scenarios', nargs='+', choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument('--batch-size', type=int, default=200, help="Messages per persist transaction")
+    parser.add_argument('--repeat', type=int, default=5, help="Requests per view measurement")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', default=None, help="Write the JSON results to this file")
+    args = parser.parse_args()
+    messages = SCALES[args.scale] if args.scale else args.messages
+    mailbox = SyntheticMailbox(messages, seed=args.seed)
+
+    setup_test_environment(debug=False)
+    old_name = connection.creation.create_test_db(verbosity=0)
+    results = {}
+    try:
+        user, account = setup_account()
+        client = Client()
+        client.force_login(user)
+        # Views need data, so ingestion always runs; it is only reported when asked for
+        ingest = run_ingest(mailbox, account, args)
+        if 'ingest' in args.scenarios:
+            results['ingest'] = ingest
+        if 'list' in args.scenarios:
+            results['list'] = run_list(client, account, args)
+        if 'detail' in args.scenarios:
+            results['detail'] = run_detail(client, account, args)
+        if 'stats' in args.scenarios:
+            results['stats'] = run_stats(client, account, args)
+        if 'delete' in args.scenarios:
+            results['delete'] = run_delete(user, account, args)
+        database = {'vendor': connection.vendor, 'version': '.'.join(map(str, connection.Database.sqlite_version_info))
+                    if connection.vendor == 'sqlite' else connection.pg_version if connection.vendor == 'postgresql' else None}
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        teardown_test_environment()
+
+    report = json.dumps({
+        'benchmark': 'e2e',
+        'started_at': datetime.now(dt_timezone.utc).isoformat(),
+        'revision': git_revision(),
+        'database': database,
+        'mailbox': mailbox.summary(sample=min(messages, 1000)),
+        'parameters': dict(vars(args), messages=messages),
+        'results': results,
+    }, indent=2)
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, 'w') as f:
+            f.write(report + '\n')
+    print(report)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+"""
+Benchmark HTML-to-text extraction throughput in MB/s of HTML per core.
+
+Generates synthetic marketing-style HTML (nested tables, inline styles,
+tracking scripts) and runs extract_text inline and in worker processes,
+the way the sync pipeline's parse stage does with SYNC_PARSE_PROCESSES,
+reporting throughput as JSON.
+
+    python benchmarks/bench_html_text.py --messages 2000 --workers 4
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings.development')
+
+import django
+
+django.setup()
+
+from sync.text import extract_text
+
+WORDS = ['exclusive', 'offer', 'limited', 'time', 'free', 'shipping', 'new', 'arrivals', 'members', 'save']
+
+def build_html(rng, target_size):
+    """One marketing-style HTML body of roughly target_size bytes"""
+    parts = [
+        '<html><head><style>',
+        ' '.join(f".c{i} {{ color: #{rng.randrange(0xffffff):06x}; padding: {i}px }}" for i in range(40)),
+        '</style><script>window.dataLayer = [];' + 'x();' * 200 + '</script></head><body>',
+    ]
+    size = sum(map(len, parts))
+    while size < target_size:
+        text = ' '.join(rng.choice(WORDS) for _ in range(rng.randint(5, 30)))
+        block = (
+            f'<table class="c{rng.randrange(40)}" width="100%"><tr><td style="font-family:Arial;font-size:14px">'
+            f'<a href="https://example.com/track?id={rng.randrange(10**9)}">{text}</a>&nbsp;&amp;&nbsp;'
+            f'<img src="https://example.com/p.gif" alt="" width="1" height="1"></td></tr></table>\n'
+        )
+        parts.append(block)
+        size += len(block)
+    parts.append('</body></html>')
+    return ''.join(parts)
+
+def extract_all(executor, corpus, chunksize=16):
+    """Run extract_text over every body, in executor's processes if one is given"""
+    args = ([''] * len(corpus), corpus)
+    if executor is None:
+        return list(map(extract_text, *args))
+    return list(executor.map(extract_text, *args, chunksize=chunksize))
+
+def measure(executor, workers, corpus, html_bytes):
+    started = time.perf_counter()
+    extract_all(executor, corpus)
+    elapsed = time.perf_counter() - started
+    cores = max(workers, 1)
+    return {
+        'workers': workers,
+        'seconds': round(elapsed, 3),
+        'mb_per_second': round(html_bytes / elapsed / 1e6, 2),
+        'mb_per_second_per_core': round(html_bytes / elapsed / 1e6 / cores, 2),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--messages', type=int, default=2000)
+    parser.add_argument('--size', type=int, default=40000, help="Approximate HTML bytes per message")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    corpus = [build_html(rng, args.size) for _ in range(args.messages)]
+    html_bytes = sum(len(html.encode()) for html in corpus)
+
+    results = [measure(None, 0, corpus, html_bytes)]
+    if args.workers > 1:
+        with ProcessPoolExecutor(max_workers=args.workers) as executor:
+            # Warm the pool so process start-up is not measured
+            extract_all(executor, corpus[:args.workers * 2], chunksize=1)
+            results.append(measure(executor, args.workers, corpus, html_bytes))
+
+    print(json.dumps({
+        'benchmark': 'html_text',
+        'parameters': vars(args),
+        'html_megabytes': round(html_bytes / 1e6, 2),
+        'results': results,
+    }, indent=2))
+
+if __name__ == '__main__':
+    main()
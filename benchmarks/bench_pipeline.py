@@ -0,0 +1,171 @@
+"""
+Benchmark end-to-end sync throughput of the staged pipeline against the serial path.
+
+A simulated provider serves synthetic raw messages with a fixed round-trip
+latency per fetch request. The serial path fetches, parses and stores one
+batch after another; the pipeline overlaps them through bounded queues.
+Both write into a throwaway test database; results are printed as JSON.
+
+    python benchmarks/bench_pipeline.py --messages 2000 --latency 0.1
+"""
+import argparse
+import json
+import logging
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings.development')
+
+import django
+
+django.setup()
+logging.disable(logging.INFO)
+
+from django.core.files.storage import InMemoryStorage
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from sync.pipeline import parse_fetched
+from sync.providers import FetchedMessage, chunked
+from sync.storage import AttachmentStore
+
+WORDS = ['invoice', 'meeting', 'report', 'update', 'lunch', 'release', 'offer', 'notice']
+
+def build_raw(rng, index, body_size):
+    """One multipart/alternative message with a plain and an HTML part"""
+    body = ' '.join(rng.choice(WORDS) for _ in range(body_size // 7))
+    return (
+        f"From: sender{rng.randrange(200)}@example{rng.randrange(20)}.com\r\n"
+        f"To: me@example.com\r\n"
+        f"Subject: {rng.choice(WORDS).title()} #{index}\r\n"
+        f"Date: Tue, 01 Apr 2025 10:00:00 +0000\r\n"
+        f"Message-ID: <{index}@bench.example>\r\n"
+        f"Content-Type: multipart/alternative; boundary=\"b\"\r\n\r\n"
+        f"--b\r\nContent-Type: text/plain\r\n\r\n{body}\r\n"
+        f"--b\r\nContent-Type: text/html\r\n\r\n<html><body><p>{body}</p></body></html>\r\n"
+        f"--b--\r\n"
+    ).encode()
+
+class SimulatedClient:
+    """Provider client with a fixed round-trip latency per fetch request"""
+
+    def __init__(self, corpus, latency):
+        self.corpus = corpus
+        self.latency = latency
+
+    def list_message_ids(self):
+        return list(self.corpus)
+
+    def fetch_messages(self, message_ids):
+        time.sleep(self.latency)
+        return [FetchedMessage(uid, self.corpus[uid], {}) for uid in message_ids]
+
+    def close(self):
+        pass
+
+def reset():
+    from emails.models import EmailAccount, User
+    from sync.models import EmailMessage, MessageBody, Thread
+
+    EmailMessage.objects.all().delete()
+    MessageBody.objects.all().delete()
+    Thread.objects.all().delete()
+    user, _ = User.objects.get_or_create(username='bench', defaults={'email': 'bench@example.com'})
+    account, _ = EmailAccount.objects.get_or_create(
+        user=user,
+        email_address='me@example.com',
+        defaults={'provider': 'imap', 'imap_server': 'imap.example.com', 'smtp_server': 'smtp.example.com'},
+    )
+    return account
+
+def check_result(path, account, expected, sync_log=None):
+    """Refuse to report timings for a run that did not store every message"""
+    from sync.models import EmailMessage
+
+    stored = EmailMessage.objects.filter(email_account=account).count()
+    if sync_log is not None and sync_log.status != 'completed':
+        raise SystemExit(f"{path} sync ended with status {sync_log.status}: {sync_log.error_message}")
+    if stored != expected:
+        raise SystemExit(f"{path} stored {stored} of {expected} messages")
+
+def run_serial(corpus, latency, batch_size):
+    from sync.services import EmailSyncService
+
+    account = reset()
+    client = SimulatedClient(corpus, latency)
+    store = AttachmentStore(storage=InMemoryStorage())
+    started = time.perf_counter()
+    for batch in chunked(client.list_message_ids(), batch_size):
+        for fetched in client.fetch_messages(batch):
+            EmailSyncService.create_or_update_email_message(account, parse_fetched(fetched, store=store))
+    elapsed = time.perf_counter() - started
+    check_result('serial', account, len(corpus))
+    return {'path': 'serial', 'seconds': round(elapsed, 3)}
+
+def run_pipeline(corpus, latency, batch_size, args):
+    from sync.services import EmailSyncService
+
+    account = reset()
+    started = time.perf_counter()
+    sync_log, metrics = EmailSyncService.sync_account(
+        account.id,
+        client_factory=lambda email_account: SimulatedClient(corpus, latency),
+        store=AttachmentStore(storage=InMemoryStorage()),
+        fetch_workers=args.fetch_workers,
+        fetch_batch_size=batch_size,
+        parse_workers=args.parse_workers,
+        parse_processes=args.parse_processes,
+        persist_batch_size=args.persist_batch_size,
+        queue_size=args.queue_size,
+    )
+    elapsed = time.perf_counter() - started
+    check_result('pipeline', account, len(corpus), sync_log)
+    return {
+        'path': 'pipeline',
+        'seconds': round(elapsed, 3),
+        'status': sync_log.status,
+        'stages': metrics,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--messages', type=int, default=2000)
+    parser.add_argument('--body-size', type=int, default=4000, help="Approximate body size in bytes")
+    parser.add_argument('--latency', type=float, default=0.1, help="Seconds per fetch request")
+    parser.add_argument('--batch-size', type=int, default=25, help="Message IDs per fetch request")
+    parser.add_argument('--fetch-workers', type=int, default=8)
+    parser.add_argument('--parse-workers', type=int, default=2)
+    parser.add_argument('--parse-processes', type=int, default=None, help="Defaults to SYNC_PARSE_PROCESSES")
+    parser.add_argument('--persist-batch-size', type=int, default=100)
+    parser.add_argument('--queue-size', type=int, default=200)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    corpus = {str(i): build_raw(rng, i, args.body_size) for i in range(1, args.messages + 1)}
+
+    setup_test_environment()
+    old_name = connection.creation.create_test_db(verbosity=0)
+    try:
+        results = [
+            run_serial(corpus, args.latency, args.batch_size),
+            run_pipeline(corpus, args.latency, args.batch_size, args),
+        ]
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        teardown_test_environment()
+
+    for result in results:
+        result['messages_per_second'] = round(args.messages / result['seconds'], 1)
+    print(json.dumps({
+        'benchmark': 'pipeline',
+        'parameters': vars(args),
+        'results': results,
+        'speedup': round(results[0]['seconds'] / results[1]['seconds'], 2),
+    }, indent=2))
+
+if __name__ == '__main__':
+    main()
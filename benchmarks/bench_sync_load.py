@@ -0,0 +1,154 @@
+"""
+Load test the real sync path against the local fake IMAP and Gmail servers.
+
+Starts FakeImapServer and FakeGmailServer in-process, creates --accounts
+accounts (a mix of IMAP and Gmail, see --gmail-share) and runs
+EmailSyncService.sync_account for each, --concurrency accounts at a time,
+through the real provider clients, session pool, token lookup and rate
+limiter. Prints per-provider throughput, sync durations and how often the
+servers throttled, as JSON.
+
+    python benchmarks/bench_sync_load.py --accounts 20 --messages 500 --latency 0.01
+    python benchmarks/bench_sync_load.py --accounts 200 --rate 20 --concurrency 8   # PostgreSQL recommended
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings.development')
+
+import django
+
+django.setup()
+logging.disable(logging.INFO)
+
+from django import db
+from django.core.files.storage import InMemoryStorage
+from django.db import connection
+from django.test.utils import override_settings, setup_test_environment, teardown_test_environment
+
+from fake_providers import FakeGmailServer, FakeImapServer, FakeProviderState
+from sync.storage import AttachmentStore
+
+def percentile(samples, q):
+    samples = sorted(samples)
+    return round(samples[min(len(samples) - 1, int(q * len(samples)))], 3) if samples else None
+
+def create_accounts(count, gmail_share, imap_port):
+    from emails.models import EmailAccount, User
+
+    accounts = []
+    gmail_every = round(1 / gmail_share) if gmail_share else 0
+    for i in range(count):
+        user = User.objects.create_user(username=f'load{i}', email=f'load{i}@example.com', password='load')
+        address = f'load{i}@fake.example'
+        if gmail_every and i % gmail_every == 0:
+            # The fake Gmail server takes the bearer token as the account name
+            accounts.append(EmailAccount.objects.create(
+                user=user, email_address=address, provider='google', oauth_token=address,
+                imap_server='imap.gmail.com', smtp_server='smtp.gmail.com',
+            ))
+        else:
+            accounts.append(EmailAccount.objects.create(
+                user=user, email_address=address, provider='imap', password='secret',
+                imap_server='127.0.0.1', imap_port=imap_port, smtp_server='127.0.0.1',
+            ))
+    return accounts
+
+def sync_one(account, args, store):
+    from sync.models import EmailMessage
+    from sync.services import EmailSyncService
+
+    try:
+        started = time.perf_counter()
+        sync_log, _ = EmailSyncService.sync_account(
+            account.id,
+            store=store,
+            fetch_workers=args.fetch_workers,
+            fetch_batch_size=args.fetch_batch_size,
+            parse_processes=0,
+        )
+        elapsed = time.perf_counter() - started
+        stored = EmailMessage.objects.filter(email_account=account).count()
+        return {
+            'provider': account.provider,
+            'status': sync_log.status,
+            'error': sync_log.error_message,
+            'messages': stored,
+            'seconds': elapsed,
+        }
+    finally:
+        db.connections.close_all()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--accounts', type=int, default=10)
+    parser.add_argument('--messages', type=int, default=500, help="Synthetic messages per account")
+    parser.add_argument('--gmail-share', type=float, default=0.5, help="Share of accounts synced over the Gmail API")
+    parser.add_argument('--concurrency', type=int, default=1, help="Accounts synced at once")
+    parser.add_argument('--fetch-workers', type=int, default=4)
+    parser.add_argument('--fetch-batch-size', type=int, default=50)
+    parser.add_argument('--latency', type=float, default=0.0, help="Fake server delay per response, seconds")
+    parser.add_argument('--jitter', type=float, default=0.0)
+    parser.add_argument('--rate', type=float, default=None, help="Fake server commands per second per account")
+    parser.add_argument('--mbox', default=None, help="Serve this mbox file to every account")
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+    if args.concurrency > 1 and connection.vendor == 'sqlite':
+        # Concurrent account syncs lock each other out of a shared sqlite database
+        parser.error('--concurrency above 1 needs PostgreSQL (DJANGO_SETTINGS_MODULE=config.settings.production)')
+
+    state = FakeProviderState(args.messages, seed=args.seed, mbox=args.mbox, latency=args.latency,
+                              jitter=args.jitter, rate=args.rate)
+    imap = FakeImapServer(state).start()
+    gmail = FakeGmailServer(state).start()
+    store = AttachmentStore(storage=InMemoryStorage())
+
+    setup_test_environment()
+    old_name = connection.creation.create_test_db(verbosity=0)
+    try:
+        with override_settings(IMAP_USE_SSL=False, GMAIL_API_BASE=gmail.api_base):
+            accounts = create_accounts(args.accounts, args.gmail_share, imap.port)
+            started = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+                syncs = list(executor.map(lambda account: sync_one(account, args, store), accounts))
+            elapsed = time.perf_counter() - started
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        teardown_test_environment()
+        imap.stop()
+        gmail.stop()
+
+    failed = [sync for sync in syncs if sync['status'] != 'completed']
+    if failed:
+        raise SystemExit(f"{len(failed)} of {len(syncs)} syncs did not complete, e.g. {failed[0]['error']}")
+    results = {}
+    for provider in sorted({sync['provider'] for sync in syncs}):
+        runs = [sync for sync in syncs if sync['provider'] == provider]
+        messages = sum(sync['messages'] for sync in runs)
+        results[provider] = {
+            'accounts': len(runs),
+            'messages': messages,
+            'sync_seconds_p50': percentile([sync['seconds'] for sync in runs], 0.5),
+            'sync_seconds_p95': percentile([sync['seconds'] for sync in runs], 0.95),
+            'messages_per_second_per_account': round(messages / sum(sync['seconds'] for sync in runs), 1),
+        }
+    total = sum(sync['messages'] for sync in syncs)
+    print(json.dumps({
+        'benchmark': 'sync_load',
+        'database': connection.vendor,
+        'parameters': vars(args),
+        'seconds': round(elapsed, 3),
+        'messages': total,
+        'messages_per_second': round(total / elapsed, 1),
+        'providers': results,
+        'server': state.stats(),
+    }, indent=2))
+
+if __name__ == '__main__':
+    main()
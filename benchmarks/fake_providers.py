@@ -0,0 +1,1167 @@
+"""
+Local stand-ins for an IMAP server and the Gmail REST API, for load testing sync offline.
+
+FakeImapServer is an asyncio IMAP4rev1 server with UID FETCH/STORE/SEARCH/
+EXPUNGE, IDLE, CONDSTORE (MODSEQ, CHANGEDSINCE, UNCHANGEDSINCE) and UIDPLUS.
+FakeGmailServer serves the Gmail endpoints the sync engine uses
+(messages.list/get, batchDelete, batchModify, modify), history.list, the
+profile and the multipart /batch endpoint. Both share one FakeProviderState,
+so a flag changed over IMAP shows up in Gmail history and in IDLE pushes.
+
+Accounts are created on first use: any IMAP login, XOAUTH2 user or Gmail
+bearer token names an account, whose mailbox is a SyntheticMailbox seeded
+from the name (or a shared mbox file). Only mutations are kept in memory,
+so thousands of accounts with large mailboxes are cheap. Every response can
+be delayed (latency, jitter) and each account is limited to a command rate,
+beyond which IMAP answers NO [THROTTLED] and Gmail answers 429.
+
+    python benchmarks/fake_providers.py --messages 5000 --latency 0.02 --rate 50
+
+Point the app at them with IMAP_USE_SSL = False, the accounts' imap_server
+and imap_port set to the IMAP address, and GMAIL_API_BASE set to
+http://127.0.0.1:<gmail-port>/gmail/v1/users/me. bench_sync_load.py starts
+both servers in-process.
+"""
+import argparse
+import asyncio
+import base64
+import binascii
+import bisect
+import json
+import logging
+import mailbox
+import random
+import re
+import threading
+import time
+import urllib.parse
+import zlib
+from collections import deque
+from datetime import datetime, timezone as dt_timezone
+from email.utils import parsedate_to_datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from synthetic_mailbox import SyntheticMailbox, SyntheticMessage
+
+logger = logging.getLogger(__name__)
+
+SEEN = '\\Seen'
+FLAGGED = '\\Flagged'
+DELETED = '\\Deleted'
+DRAFT = '\\Draft'
+SYSTEM_FLAGS = (SEEN, '\\Answered', FLAGGED, DELETED, DRAFT)
+SYSTEM_FLAG_NAMES = {flag.upper(): flag for flag in SYSTEM_FLAGS}
+MONTHS = ('Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec')
+HISTORY_LIMIT = 10000
+GMAIL_BATCH_LIMIT = 100
+
+class MboxMailbox:
+    """
+    An mbox file served through the SyntheticMailbox interface (UIDs 1..n in file order)
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._mbox = mailbox.mbox(path, create=False)
+        self._keys = list(self._mbox.keys())
+        # mailbox.mbox shares one file handle between readers
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __iter__(self):
+        for uid in self.uids():
+            yield self.message(uid)
+
+    def uids(self):
+        return range(1, len(self._keys) + 1)
+
+    def thread_root(self, uid):
+        return uid
+
+    def flags(self, uid):
+        return self.message(uid).flags
+
+    def message(self, uid):
+        if not 1 <= uid <= len(self._keys):
+            # New mail beyond the file repeats it from the start
+            uid_in_file = (uid - 1) % len(self._keys) + 1
+        else:
+            uid_in_file = uid
+        with self._lock:
+            message = self._mbox.get_message(self._keys[uid_in_file - 1])
+            raw = self._mbox.get_bytes(self._keys[uid_in_file - 1])
+        # mbox files use bare newlines; IMAP and the Gmail raw format use CRLF
+        raw = re.sub(rb'\r?\n', b'\r\n', raw)
+        status = (message.get('Status', '') or '') + (message.get('X-Status', '') or '')
+        flags = []
+        if 'R' in status:
+            flags.append(SEEN)
+        if 'F' in status:
+            flags.append(FLAGGED)
+        received_at = self._received_at(message)
+        return SyntheticMessage(
+            uid, raw, 'mbox', message.get('From', ''), message.get('Subject', ''),
+            (message.get('Message-ID', '') or '').strip('<> '), uid, tuple(flags), received_at, 0,
+        )
+
+    @staticmethod
+    def _received_at(message):
+        # The From_ line carries the delivery time, "sender Tue Apr  1 10:00:00 2025"
+        parts = message.get_from().split(None, 1)
+        if len(parts) == 2:
+            try:
+                return datetime.strptime(' '.join(parts[1].split()), '%a %b %d %H:%M:%S %Y').replace(tzinfo=dt_timezone.utc)
+            except ValueError:
+                pass
+        try:
+            return parsedate_to_datetime(message.get('Date', '')).astimezone(dt_timezone.utc)
+        except (TypeError, ValueError):
+            return datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+
+class TokenBucket:
+    """
+    Per-account command budget of rate per second with a burst of the same size
+    """
+
+    def __init__(self, rate):
+        self.rate = rate
+        self.tokens = rate
+        self.updated = time.monotonic()
+
+    def take(self):
+        now = time.monotonic()
+        self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+class FakeAccount:
+    """
+    One account's mailbox plus every change made to it since the server started.
+
+    UIDs 1..exists come from the mailbox generator; expunged UIDs and flag
+    overrides are the only per-message state. The modification sequence
+    doubles as the Gmail history ID.
+    """
+
+    def __init__(self, name, mailbox, uid_validity):
+        self.name = name
+        self.mailbox = mailbox
+        self.uid_validity = uid_validity
+        self.exists = len(mailbox)
+        self.expunged = []
+        self.flags = {}
+        self.modseqs = {}
+        self.highest_modseq = 1
+        self.history = deque(maxlen=HISTORY_LIMIT)
+        self.listeners = set()
+        self.lock = threading.RLock()
+
+    @property
+    def count(self):
+        return self.exists - len(self.expunged)
+
+    @property
+    def uid_next(self):
+        return self.exists + 1
+
+    def is_live(self, uid):
+        if not 1 <= uid <= self.exists:
+            return False
+        index = bisect.bisect_left(self.expunged, uid)
+        return index == len(self.expunged) or self.expunged[index] != uid
+
+    def live_uids(self, candidates=None):
+        if candidates is None:
+            candidates = range(1, self.exists + 1)
+        return [uid for uid in candidates if self.is_live(uid)]
+
+    def seq(self, uid):
+        return uid - bisect.bisect_left(self.expunged, uid)
+
+    def message(self, uid):
+        return self.mailbox.message(uid)
+
+    def flags_of(self, uid, message=None):
+        if uid in self.flags:
+            return self.flags[uid]
+        return frozenset(message.flags if message else self.mailbox.flags(uid))
+
+    def modseq_of(self, uid):
+        return self.modseqs.get(uid, 1)
+
+    def _record(self, kind, uid, labels=None):
+        self.highest_modseq += 1
+        self.modseqs[uid] = self.highest_modseq
+        self.history.append((self.highest_modseq, kind, uid, labels))
+        return self.highest_modseq
+
+    def store(self, uids, operation, flags, unchanged_since=None, origin=None):
+        """
+        Apply +FLAGS/-FLAGS/FLAGS to live UIDs; returns (changed, modified) UID lists
+        """
+        flags = frozenset(flags)
+        changed, modified = [], []
+        with self.lock:
+            for uid in uids:
+                if not self.is_live(uid):
+                    continue
+                if unchanged_since is not None and self.modseq_of(uid) > unchanged_since:
+                    modified.append(uid)
+                    continue
+                current = self.flags_of(uid)
+                if operation == '+':
+                    updated = current | flags
+                elif operation == '-':
+                    updated = current - flags
+                else:
+                    updated = flags
+                if updated == current:
+                    continue
+                self.flags[uid] = updated
+                added, removed = updated - current, current - updated
+                if added:
+                    self._record('labelsAdded', uid, added)
+                if removed:
+                    self._record('labelsRemoved', uid, removed)
+                changed.append(uid)
+                self._notify(('fetch', uid), origin)
+        return changed, modified
+
+    def expunge(self, uids=None, origin=None, require_deleted=True):
+        """
+        Remove messages (by default only those flagged \\Deleted); returns their sequence numbers in order
+        """
+        with self.lock:
+            candidates = self.live_uids(uids)
+            seqs = []
+            for uid in candidates:
+                if require_deleted and DELETED not in self.flags_of(uid):
+                    continue
+                seqs.append(self.seq(uid))
+                bisect.insort(self.expunged, uid)
+                self.flags.pop(uid, None)
+                self._record('messagesDeleted', uid)
+                self._notify(('expunge', seqs[-1]), origin)
+            return seqs
+
+    def deliver(self):
+        """
+        Simulate new mail arriving; returns its UID
+        """
+        with self.lock:
+            self.exists += 1
+            self._record('messagesAdded', self.exists)
+            self._notify(('exists', self.count), None)
+            return self.exists
+
+    def _notify(self, event, origin):
+        for listener in list(self.listeners):
+            if listener is not origin:
+                listener.push(event)
+
+class FakeProviderState:
+    """
+    Accounts, latency and throttling shared by the fake servers
+    """
+
+    def __init__(self, messages=1000, seed=1, mbox=None, latency=0.0, jitter=0.0, rate=None):
+        self.messages = messages
+        self.seed = seed
+        self.mbox = MboxMailbox(mbox) if mbox else None
+        self.latency = latency
+        self.jitter = jitter
+        self.rate = rate
+        self.accounts = {}
+        self.buckets = {}
+        self.lock = threading.Lock()
+        self.commands = 0
+        self.throttled = 0
+
+    def account(self, name):
+        name = name.lower()
+        with self.lock:
+            account = self.accounts.get(name)
+            if account is None:
+                key = zlib.crc32(name.encode())
+                mailbox = self.mbox or SyntheticMailbox(self.messages, seed=self.seed ^ key, owner=name)
+                account = self.accounts[name] = FakeAccount(name, mailbox, uid_validity=key % 0x7fffffff + 1)
+            return account
+
+    def delay(self):
+        if not self.latency and not self.jitter:
+            return 0.0
+        return self.latency + random.uniform(0, self.jitter)
+
+    def allow(self, name):
+        """
+        Count one command for an account; False when it is over its rate
+        """
+        with self.lock:
+            self.commands += 1
+            if not self.rate:
+                return True
+            bucket = self.buckets.get(name)
+            if bucket is None:
+                bucket = self.buckets[name] = TokenBucket(self.rate)
+            if bucket.take():
+                return True
+            self.throttled += 1
+            return False
+
+    def stats(self):
+        return {'accounts': len(self.accounts), 'commands': self.commands, 'throttled': self.throttled}
+
+def internal_date(value):
+    return f"{value.day:02d}-{MONTHS[value.month - 1]}-{value.year} {value.strftime('%H:%M:%S')} +0000"
+
+def parse_uid_set(text, highest):
+    """
+    Expand an IMAP sequence set such as 1:5,9,12:* into UIDs
+    """
+    uids = set()
+    for part in text.split(','):
+        if ':' in part:
+            start, end = (highest if bound == '*' else int(bound) for bound in part.split(':', 1))
+            uids.update(range(min(start, end), max(start, end) + 1))
+        else:
+            uids.add(highest if part == '*' else int(part))
+    return sorted(uid for uid in uids if uid >= 1)
+
+def tokenize(line):
+    """
+    Split an IMAP command line into atoms, quoted strings and parenthesized lists
+    """
+    tokens = []
+    stack = [tokens]
+    i = 0
+    while i < len(line):
+        char = line[i]
+        if char == ' ':
+            i += 1
+        elif char == '(':
+            group = []
+            stack[-1].append(group)
+            stack.append(group)
+            i += 1
+        elif char == ')':
+            if len(stack) == 1:
+                raise ValueError('Unbalanced parentheses')
+            stack.pop()
+            i += 1
+        elif char == '"':
+            value = []
+            i += 1
+            while i < len(line) and line[i] != '"':
+                if line[i] == '\\' and i + 1 < len(line):
+                    i += 1
+                value.append(line[i])
+                i += 1
+            stack[-1].append(''.join(value))
+            i += 1
+        else:
+            # Atoms keep bracketed sections whole, e.g. BODY.PEEK[HEADER.FIELDS (FROM TO)]
+            start, depth = i, 0
+            while i < len(line) and (depth or line[i] not in ' ()'):
+                if line[i] == '[':
+                    depth += 1
+                elif line[i] == ']':
+                    depth -= 1
+                i += 1
+            stack[-1].append(line[start:i])
+    if len(stack) != 1:
+        raise ValueError('Unbalanced parentheses')
+    return tokens
+
+class ImapBad(Exception):
+    """A malformed or unsupported command, answered with BAD"""
+
+class ImapNo(Exception):
+    """A command that cannot be carried out, answered with NO"""
+
+class ImapConnection:
+    """
+    One client connection to FakeImapServer
+    """
+    CAPABILITIES = 'IMAP4rev1 LITERAL+ IDLE UIDPLUS CONDSTORE ENABLE UNSELECT AUTH=PLAIN AUTH=XOAUTH2'
+
+    def __init__(self, server, reader, writer):
+        self.server = server
+        self.state = server.state
+        self.reader = reader
+        self.writer = writer
+        self.loop = asyncio.get_running_loop()
+        self.account = None
+        self.selected = False
+        self.read_only = False
+        self.events = asyncio.Queue()
+
+    def push(self, event):
+        # Called from whichever thread mutated the account
+        self.loop.call_soon_threadsafe(self.events.put_nowait, event)
+
+    async def send(self, data):
+        self.writer.write(data if isinstance(data, bytes) else data.encode())
+        await self.writer.drain()
+
+    async def read_command(self):
+        """
+        Read one command line, resolving synchronizing and non-synchronizing literals
+        """
+        parts = []
+        while True:
+            line = await self.reader.readline()
+            if not line:
+                return None
+            line = line.rstrip(b'\r\n')
+            match = re.search(rb'\{(\d+)(\+?)\}$', line)
+            if not match:
+                parts.append(line.decode('utf-8', 'replace'))
+                return ''.join(parts)
+            if not match.group(2):
+                await self.send('+ Ready for literal\r\n')
+            literal = await self.reader.readexactly(int(match.group(1)))
+            quoted = literal.decode('utf-8', 'replace').replace('\\', '\\\\').replace('"', '\\"')
+            parts.append(line[:match.start()].decode('utf-8', 'replace') + f'"{quoted}"')
+
+    async def run(self):
+        await self.send(f'* OK [CAPABILITY {self.CAPABILITIES}] Fake IMAP4rev1 server ready\r\n')
+        try:
+            while True:
+                line = await self.read_command()
+                if line is None:
+                    return
+                tag, _, rest = line.partition(' ')
+                if not rest:
+                    await self.send(f'{tag or "*"} BAD Missing command\r\n')
+                    continue
+                command, _, arguments = rest.partition(' ')
+                if not await self.dispatch(tag, command.upper(), arguments):
+                    return
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.CancelledError):
+            # Cancelled when the server shuts down with the client still connected
+            return
+        finally:
+            if self.account is not None:
+                self.account.listeners.discard(self)
+            self.writer.close()
+
+    async def dispatch(self, tag, command, arguments):
+        """
+        Run one command and send its tagged response; False ends the connection
+        """
+        delay = self.state.delay()
+        if delay:
+            await asyncio.sleep(delay)
+        if self.account is not None and command not in ('LOGOUT', 'DONE') and not self.state.allow(self.account.name):
+            await self.send(f'{tag} NO [THROTTLED] Command rate exceeded, slow down\r\n')
+            return True
+        handler = getattr(self, f'cmd_{command.lower()}', None)
+        if handler is None:
+            await self.send(f'{tag} BAD Unknown command {command}\r\n')
+            return True
+        try:
+            tokens = tokenize(arguments)
+            message = await handler(tag, tokens)
+        except ImapBad as e:
+            await self.send(f'{tag} BAD {e}\r\n')
+            return True
+        except ImapNo as e:
+            await self.send(f'{tag} NO {e}\r\n')
+            return True
+        except (ValueError, IndexError) as e:
+            await self.send(f'{tag} BAD Invalid arguments: {e}\r\n')
+            return True
+        if message is False:
+            return False
+        await self.send(f'{tag} OK {message or command + " completed"}\r\n')
+        return True
+
+    def require_auth(self):
+        if self.account is None:
+            raise ImapBad('Not authenticated')
+
+    def require_selected(self):
+        self.require_auth()
+        if not self.selected:
+            raise ImapBad('No mailbox selected')
+
+    def login(self, name):
+        self.account = self.state.account(name)
+
+    async def flush_events(self):
+        """
+        Send changes other sessions made to the selected mailbox
+        """
+        while not self.events.empty():
+            await self.send(self.render_event(self.events.get_nowait()))
+
+    def render_event(self, event):
+        kind, value = event
+        if kind == 'exists':
+            return f'* {value} EXISTS\r\n'
+        if kind == 'expunge':
+            return f'* {value} EXPUNGE\r\n'
+        uid = value
+        with self.account.lock:
+            if not self.account.is_live(uid):
+                return ''
+            flags = ' '.join(sorted(self.account.flags_of(uid)))
+            return f'* {self.account.seq(uid)} FETCH (UID {uid} FLAGS ({flags}) MODSEQ ({self.account.modseq_of(uid)}))\r\n'
+
+    async def cmd_capability(self, tag, tokens):
+        await self.send(f'* CAPABILITY {self.CAPABILITIES}\r\n')
+
+    async def cmd_noop(self, tag, tokens):
+        if self.selected:
+            await self.flush_events()
+
+    cmd_check = cmd_noop
+
+    async def cmd_logout(self, tag, tokens):
+        await self.send(f'* BYE Fake IMAP server logging out\r\n{tag} OK LOGOUT completed\r\n')
+        return False
+
+    async def cmd_login(self, tag, tokens):
+        if len(tokens) != 2:
+            raise ImapBad('LOGIN expects a user name and password')
+        self.login(tokens[0])
+        return f'[CAPABILITY {self.CAPABILITIES}] LOGIN completed'
+
+    async def cmd_authenticate(self, tag, tokens):
+        mechanism = tokens[0].upper()
+        if mechanism not in ('XOAUTH2', 'PLAIN'):
+            raise ImapNo(f'Unsupported mechanism {mechanism}')
+        if len(tokens) > 1:
+            response = tokens[1]
+        else:
+            await self.send('+ \r\n')
+            response = (await self.reader.readline()).strip().decode()
+        try:
+            decoded = base64.b64decode(response).decode('utf-8', 'replace')
+        except (binascii.Error, ValueError):
+            raise ImapBad('Invalid base64 response')
+        if mechanism == 'XOAUTH2':
+            fields = dict(item.split('=', 1) for item in decoded.split('\x01') if '=' in item)
+            user = fields.get('user', '')
+        else:
+            user = (decoded.split('\x00') + ['', ''])[1]
+        if not user:
+            raise ImapNo('[AUTHENTICATIONFAILED] No user name given')
+        self.login(user)
+        return f'[CAPABILITY {self.CAPABILITIES}] AUTHENTICATE completed'
+
+    async def cmd_enable(self, tag, tokens):
+        self.require_auth()
+        enabled = [token.upper() for token in tokens if token.upper() == 'CONDSTORE']
+        await self.send(f'* ENABLED {" ".join(enabled)}\r\n')
+
+    async def cmd_list(self, tag, tokens):
+        self.require_auth()
+        await self.send('* LIST (\\HasNoChildren) "/" INBOX\r\n')
+
+    async def cmd_status(self, tag, tokens):
+        self.require_auth()
+        folder, items = tokens[0], tokens[1]
+        if folder.upper() != 'INBOX':
+            raise ImapNo('[NONEXISTENT] No such mailbox')
+        account = self.account
+        values = {
+            'MESSAGES': account.count, 'RECENT': 0, 'UIDNEXT': account.uid_next,
+            'UIDVALIDITY': account.uid_validity, 'HIGHESTMODSEQ': account.highest_modseq,
+        }
+        status = ' '.join(f'{item.upper()} {values[item.upper()]}' for item in items if item.upper() in values)
+        await self.send(f'* STATUS INBOX ({status})\r\n')
+
+    async def cmd_select(self, tag, tokens, read_only=False):
+        self.require_auth()
+        if not tokens or tokens[0].upper() != 'INBOX':
+            self.selected = False
+            raise ImapNo('[NONEXISTENT] No such mailbox')
+        account = self.account
+        account.listeners.add(self)
+        while not self.events.empty():
+            self.events.get_nowait()
+        self.selected = True
+        self.read_only = read_only
+        flags = ' '.join(SYSTEM_FLAGS)
+        await self.send(
+            f'* FLAGS ({flags})\r\n'
+            f'* OK [PERMANENTFLAGS ({flags} \\*)] Flags permitted\r\n'
+            f'* {account.count} EXISTS\r\n'
+            f'* 0 RECENT\r\n'
+            f'* OK [UIDVALIDITY {account.uid_validity}] UIDs valid\r\n'
+            f'* OK [UIDNEXT {account.uid_next}] Predicted next UID\r\n'
+            f'* OK [HIGHESTMODSEQ {account.highest_modseq}] Highest\r\n'
+        )
+        return f'[READ-{"ONLY" if read_only else "WRITE"}] {"EXAMINE" if read_only else "SELECT"} completed'
+
+    async def cmd_examine(self, tag, tokens):
+        return await self.cmd_select(tag, tokens, read_only=True)
+
+    async def cmd_unselect(self, tag, tokens):
+        self.require_selected()
+        self.selected = False
+        self.account.listeners.discard(self)
+
+    async def cmd_close(self, tag, tokens):
+        self.require_selected()
+        if not self.read_only:
+            self.account.expunge(origin=self)
+        await self.cmd_unselect(tag, tokens)
+
+    async def cmd_expunge(self, tag, tokens, uids=None):
+        self.require_selected()
+        if self.read_only:
+            raise ImapNo('Mailbox is read-only')
+        for seq in self.account.expunge(uids, origin=self):
+            await self.send(f'* {seq} EXPUNGE\r\n')
+
+    async def cmd_idle(self, tag, tokens):
+        self.require_selected()
+        await self.send('+ idling\r\n')
+        done = asyncio.ensure_future(self.reader.readline())
+        try:
+            while True:
+                event = asyncio.ensure_future(self.events.get())
+                finished, _ = await asyncio.wait({done, event}, return_when=asyncio.FIRST_COMPLETED)
+                if event in finished:
+                    await self.send(self.render_event(event.result()))
+                else:
+                    event.cancel()
+                    break
+        finally:
+            if not done.done():
+                done.cancel()
+        if not done.result():
+            return False
+        if done.result().strip().upper() != b'DONE':
+            raise ImapBad('Expected DONE')
+        return 'IDLE terminated'
+
+    async def cmd_uid(self, tag, tokens):
+        self.require_selected()
+        if not tokens:
+            raise ImapBad('UID expects a command')
+        subcommand, arguments = tokens[0].upper(), tokens[1:]
+        if subcommand == 'FETCH':
+            return await self.uid_fetch(arguments)
+        if subcommand == 'STORE':
+            return await self.uid_store(arguments)
+        if subcommand == 'SEARCH':
+            return await self.uid_search(arguments)
+        if subcommand == 'EXPUNGE':
+            return await self.cmd_expunge(tag, [], uids=parse_uid_set(arguments[0], self.account.exists))
+        raise ImapBad(f'Unsupported UID {subcommand}')
+
+    async def uid_search(self, criteria):
+        account = self.account
+        criteria = list(criteria)
+        if criteria and criteria[0].upper() == 'CHARSET':
+            criteria = criteria[2:]
+        uids = None
+        min_modseq = None
+        while criteria:
+            key = criteria.pop(0)
+            key = key.upper() if isinstance(key, str) else key
+            if key == 'ALL':
+                continue
+            elif key == 'UID':
+                selected = parse_uid_set(criteria.pop(0), account.exists)
+                uids = selected if uids is None else sorted(set(uids) & set(selected))
+            elif key == 'MODSEQ':
+                min_modseq = int(criteria.pop(0))
+            elif isinstance(key, str) and re.fullmatch(r'[\d:*,]+', key):
+                selected = parse_uid_set(key, account.exists)
+                uids = selected if uids is None else sorted(set(uids) & set(selected))
+            else:
+                raise ImapBad(f'Unsupported search key {key}')
+        with account.lock:
+            if min_modseq is not None:
+                # Only changed messages can have a modseq above the initial one
+                if min_modseq <= 1:
+                    candidates = uids
+                else:
+                    changed = sorted(uid for uid, modseq in account.modseqs.items() if modseq >= min_modseq)
+                    candidates = changed if uids is None else sorted(set(changed) & set(uids))
+                found = account.live_uids(candidates)
+            else:
+                found = account.live_uids(uids)
+            highest = max((account.modseq_of(uid) for uid in found), default=0) if min_modseq is not None else None
+        response = ['* SEARCH'] + [str(uid) for uid in found]
+        if highest:
+            response.append(f'(MODSEQ {highest})')
+        await self.send(' '.join(response) + '\r\n')
+
+    async def uid_fetch(self, arguments):
+        account = self.account
+        uid_set, items = arguments[0], arguments[1]
+        items = [items] if isinstance(items, str) else list(items)
+        items = [item.upper() for item in items]
+        changed_since = None
+        if len(arguments) > 2 and isinstance(arguments[2], list):
+            modifiers = arguments[2]
+            if len(modifiers) == 2 and modifiers[0].upper() == 'CHANGEDSINCE':
+                changed_since = int(modifiers[1])
+                items.append('MODSEQ')
+        if 'UID' not in items:
+            items.insert(0, 'UID')
+        needs_message = any(item.startswith(('BODY', 'RFC822', 'INTERNALDATE')) or item in ('FAST', 'ALL', 'FULL')
+                            for item in items)
+
+        candidates = parse_uid_set(uid_set, account.exists)
+        if changed_since is not None:
+            with account.lock:
+                candidates = [uid for uid in candidates if account.modseq_of(uid) > changed_since]
+        for uid in candidates:
+            with account.lock:
+                if not account.is_live(uid):
+                    continue
+                seq = account.seq(uid)
+            message = account.message(uid) if needs_message else None
+            marks_seen = any(item in ('RFC822', 'RFC822.TEXT') or item.startswith('BODY[') for item in items)
+            if marks_seen and not self.read_only:
+                account.store([uid], '+', [SEEN], origin=self)
+            with account.lock:
+                flags = account.flags_of(uid, message)
+                modseq = account.modseq_of(uid)
+            chunks = [f'* {seq} FETCH ('.encode()]
+            fields = []
+            for item in items:
+                fields.extend(self.fetch_item(item, uid, message, flags, modseq))
+            # Literals go last so the attributes imaplib reports as metadata are complete
+            plain = [field for field in fields if isinstance(field, str)]
+            literals = [field for field in fields if isinstance(field, tuple)]
+            chunks.append(' '.join(plain).encode())
+            for name, payload in literals:
+                chunks.append(f' {name} {{{len(payload)}}}\r\n'.encode())
+                chunks.append(payload)
+            chunks.append(b')\r\n')
+            await self.send(b''.join(chunks))
+
+    @staticmethod
+    def fetch_item(item, uid, message, flags, modseq):
+        if item == 'UID':
+            return [f'UID {uid}']
+        if item == 'FLAGS':
+            return [f'FLAGS ({" ".join(sorted(flags))})']
+        if item == 'MODSEQ':
+            return [f'MODSEQ ({modseq})']
+        if item == 'INTERNALDATE':
+            return [f'INTERNALDATE "{internal_date(message.received_at)}"']
+        if item == 'RFC822.SIZE':
+            return [f'RFC822.SIZE {len(message.raw)}']
+        if item in ('FAST', 'ALL', 'FULL'):
+            return [f'FLAGS ({" ".join(sorted(flags))})', f'INTERNALDATE "{internal_date(message.received_at)}"',
+                    f'RFC822.SIZE {len(message.raw)}']
+        header, _, body = message.raw.partition(b'\r\n\r\n')
+        if item in ('RFC822', 'BODY[]', 'BODY.PEEK[]'):
+            return [(item.replace('.PEEK', ''), message.raw)]
+        if item in ('RFC822.HEADER', 'BODY[HEADER]', 'BODY.PEEK[HEADER]'):
+            return [(item.replace('.PEEK', ''), header + b'\r\n\r\n')]
+        if item in ('RFC822.TEXT', 'BODY[TEXT]', 'BODY.PEEK[TEXT]'):
+            return [(item.replace('.PEEK', ''), body)]
+        raise ImapBad(f'Unsupported fetch item {item}')
+
+    async def uid_store(self, arguments):
+        if self.read_only:
+            raise ImapNo('Mailbox is read-only')
+        account = self.account
+        arguments = list(arguments)
+        uid_set = arguments.pop(0)
+        unchanged_since = None
+        if isinstance(arguments[0], list):
+            modifier = arguments.pop(0)
+            if len(modifier) != 2 or modifier[0].upper() != 'UNCHANGEDSINCE':
+                raise ImapBad('Unsupported STORE modifier')
+            unchanged_since = int(modifier[1])
+        operation, flags = arguments[0].upper(), arguments[1]
+        flags = [flags] if isinstance(flags, str) else flags
+        match = re.fullmatch(r'([+-]?)FLAGS(\.SILENT)?', operation)
+        if not match:
+            raise ImapBad(f'Unsupported STORE operation {operation}')
+        flags = [SYSTEM_FLAG_NAMES.get(flag.upper(), flag) for flag in flags]
+        uids = parse_uid_set(uid_set, account.exists)
+        changed, modified = account.store(uids, match.group(1) or '=', flags, unchanged_since, origin=self)
+        if not match.group(2):
+            for uid in changed:
+                await self.send(self.render_event(('fetch', uid)))
+        if modified:
+            return f'[MODIFIED {",".join(map(str, modified))}] Conditional STORE failed'
+
+class FakeImapServer:
+    """
+    asyncio IMAP server; start() runs it on a background thread
+    """
+
+    def __init__(self, state, host='127.0.0.1', port=0, arrival_rate=0.0):
+        self.state = state
+        self.host = host
+        self.port = port
+        self.arrival_rate = arrival_rate
+        self.loop = None
+        self._server = None
+        self._thread = None
+        self._ready = threading.Event()
+
+    async def _handle(self, reader, writer):
+        await ImapConnection(self, reader, writer).run()
+
+    async def _deliver_new_mail(self):
+        """
+        Drop new messages into random known accounts, arrival_rate per second overall
+        """
+        while True:
+            await asyncio.sleep(random.expovariate(self.arrival_rate))
+            with self.state.lock:
+                accounts = list(self.state.accounts.values())
+            if accounts:
+                random.choice(accounts).deliver()
+
+    async def serve(self):
+        self.loop = asyncio.get_running_loop()
+        self._server = await asyncio.start_server(self._handle, self.host, self.port, limit=1024 * 1024)
+        self.port = self._server.sockets[0].getsockname()[1]
+        if self.arrival_rate:
+            asyncio.ensure_future(self._deliver_new_mail())
+        self._ready.set()
+        try:
+            async with self._server:
+                await self._server.serve_forever()
+        except asyncio.CancelledError:
+            pass
+
+    def start(self):
+        self._thread = threading.Thread(target=lambda: asyncio.run(self.serve()), daemon=True)
+        self._thread.start()
+        self._ready.wait()
+        return self
+
+    def stop(self):
+        if self.loop is not None and self._server is not None:
+            self.loop.call_soon_threadsafe(self._server.close)
+
+class GmailHandler(BaseHTTPRequestHandler):
+    """
+    The Gmail REST endpoints used by the sync engine, under /gmail/v1/users/me
+    """
+    protocol_version = 'HTTP/1.1'
+    PREFIX = '/gmail/v1/users/me'
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+    @property
+    def state(self):
+        return self.server.state
+
+    def do_GET(self):
+        self.handle_request('GET')
+
+    def do_POST(self):
+        self.handle_request('POST')
+
+    def handle_request(self, method):
+        body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        delay = self.state.delay()
+        if delay:
+            time.sleep(delay)
+        token = (self.headers.get('Authorization') or '').partition('Bearer ')[2].strip()
+        if not token:
+            return self.reply(401, {'error': {'code': 401, 'message': 'Login Required'}})
+        if not self.state.allow(token.lower()):
+            return self.reply(429, {'error': {'code': 429, 'errors': [{'reason': 'userRateLimitExceeded'}]}},
+                              headers={'Retry-After': '1'})
+        account = self.state.account(token)
+        if self.path.startswith('/batch/gmail/v1'):
+            return self.batch(account, body)
+        status, payload = self.route(account, method, self.path, body)
+        self.reply(status, payload)
+
+    def reply(self, status, payload, headers=None, content_type='application/json'):
+        data = payload if isinstance(payload, bytes) else json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def route(self, account, method, path, body):
+        """
+        Dispatch one API call; returns (status, JSON payload)
+        """
+        parsed = urllib.parse.urlsplit(path)
+        query = urllib.parse.parse_qs(parsed.query)
+        if not parsed.path.startswith(self.PREFIX):
+            return 404, {'error': {'code': 404, 'message': 'Not Found'}}
+        parts = parsed.path[len(self.PREFIX):].strip('/').split('/')
+        try:
+            data = json.loads(body) if body else {}
+        except ValueError:
+            return 400, {'error': {'code': 400, 'message': 'Invalid JSON'}}
+
+        if parts == ['profile'] and method == 'GET':
+            return 200, {'emailAddress': account.name, 'messagesTotal': account.count,
+                         'historyId': str(account.highest_modseq)}
+        if parts == ['history'] and method == 'GET':
+            return self.history(account, query)
+        if parts == ['messages'] and method == 'GET':
+            return self.list_messages(account, query)
+        if parts == ['messages', 'batchDelete'] and method == 'POST':
+            account.expunge(self.uids(data.get('ids', [])), require_deleted=False)
+            return 204, b''
+        if parts == ['messages', 'batchModify'] and method == 'POST':
+            self.modify(account, self.uids(data.get('ids', [])), data)
+            return 204, b''
+        if len(parts) == 2 and parts[0] == 'messages' and method == 'GET':
+            return self.get_message(account, parts[1], query.get('format', ['full'])[0])
+        if len(parts) == 3 and parts[0] == 'messages' and parts[2] in ('modify', 'trash') and method == 'POST':
+            uids = self.uids([parts[1]])
+            if not uids:
+                return 404, {'error': {'code': 404, 'message': 'Requested entity was not found.'}}
+            if parts[2] == 'trash':
+                data = {'addLabelIds': ['TRASH']}
+            self.modify(account, uids, data)
+            return self.get_message(account, parts[1], 'minimal')
+        return 404, {'error': {'code': 404, 'message': 'Not Found'}}
+
+    @staticmethod
+    def message_id(uid):
+        return f'{uid:016x}'
+
+    @staticmethod
+    def uids(message_ids):
+        uids = []
+        for message_id in message_ids:
+            try:
+                uids.append(int(message_id, 16))
+            except (TypeError, ValueError):
+                continue
+        return uids
+
+    @staticmethod
+    def labels(flags):
+        labels = ['INBOX']
+        if SEEN not in flags:
+            labels.append('UNREAD')
+        if FLAGGED in flags:
+            labels.append('STARRED')
+        if DRAFT in flags:
+            labels.append('DRAFT')
+        labels.extend(sorted(flag for flag in flags if not flag.startswith('\\')))
+        return labels
+
+    @staticmethod
+    def label_changes(kind, flags):
+        """
+        Gmail label edits for an IMAP flag change; adding \\Seen removes UNREAD and vice versa
+        """
+        same = 'labelsAdded' if kind == 'labelsAdded' else 'labelsRemoved'
+        opposite = 'labelsRemoved' if kind == 'labelsAdded' else 'labelsAdded'
+        changes = {}
+        for flag in sorted(flags):
+            if flag == SEEN:
+                changes.setdefault(opposite, []).append('UNREAD')
+            elif flag == FLAGGED:
+                changes.setdefault(same, []).append('STARRED')
+            elif flag == DRAFT:
+                changes.setdefault(same, []).append('DRAFT')
+            elif not flag.startswith('\\'):
+                changes.setdefault(same, []).append(flag)
+        return changes
+
+    def modify(self, account, uids, data):
+        add = set(data.get('addLabelIds', []))
+        remove = set(data.get('removeLabelIds', []))
+        # UNREAD is the inverse of \Seen
+        to_add = {FLAGGED if label == 'STARRED' else label for label in add if label != 'UNREAD'}
+        to_remove = {FLAGGED if label == 'STARRED' else label for label in remove if label != 'UNREAD'}
+        if 'UNREAD' in remove:
+            to_add.add(SEEN)
+        if 'UNREAD' in add:
+            to_remove.add(SEEN)
+        if to_add:
+            account.store(uids, '+', to_add)
+        if to_remove:
+            account.store(uids, '-', to_remove)
+
+    def list_messages(self, account, query):
+        limit = min(int(query.get('maxResults', ['100'])[0]), 500)
+        offset = int(query.get('pageToken', ['0'])[0] or 0)
+        uids = []
+        with account.lock:
+            # Newest first, like Gmail
+            uid = account.exists - offset
+            scanned = 0
+            while uid >= 1 and len(uids) < limit:
+                if account.is_live(uid):
+                    uids.append(uid)
+                uid -= 1
+                scanned += 1
+            count = account.count
+        payload = {
+            'messages': [
+                {'id': self.message_id(uid), 'threadId': self.message_id(account.mailbox.thread_root(uid))}
+                for uid in uids
+            ],
+            'resultSizeEstimate': count,
+        }
+        if uid >= 1:
+            payload['nextPageToken'] = str(offset + scanned)
+        return 200, payload
+
+    def get_message(self, account, message_id, format):
+        uids = self.uids([message_id])
+        if not uids or not account.is_live(uids[0]):
+            return 404, {'error': {'code': 404, 'message': 'Requested entity was not found.'}}
+        uid = uids[0]
+        message = account.message(uid)
+        with account.lock:
+            flags = account.flags_of(uid, message)
+        payload = {
+            'id': message_id,
+            'threadId': self.message_id(message.thread_root),
+            'labelIds': self.labels(flags),
+            'historyId': str(account.modseq_of(uid)),
+            'internalDate': str(int(message.received_at.timestamp() * 1000)),
+            'sizeEstimate': len(message.raw),
+            'snippet': message.subject[:100],
+        }
+        if format == 'raw':
+            payload['raw'] = base64.urlsafe_b64encode(message.raw).decode().rstrip('=')
+        elif format in ('full', 'metadata'):
+            header = message.raw.partition(b'\r\n\r\n')[0].decode('utf-8', 'replace')
+            payload['payload'] = {'headers': [
+                {'name': name.strip(), 'value': value.strip()}
+                for name, _, value in (line.partition(':') for line in re.split(r'\r\n(?![ \t])', header))
+            ]}
+        return 200, payload
+
+    def history(self, account, query):
+        try:
+            start = int(query['startHistoryId'][0])
+        except (KeyError, ValueError):
+            return 400, {'error': {'code': 400, 'message': 'Invalid startHistoryId'}}
+        limit = min(int(query.get('maxResults', ['100'])[0]), 500)
+        types = set(query.get('historyTypes', []))
+        with account.lock:
+            if account.history and start < account.history[0][0] - 1:
+                # Like Gmail, an expired start point means a full sync is needed
+                return 404, {'error': {'code': 404, 'message': 'Requested entity was not found.'}}
+            start = max(start, int(query.get('pageToken', ['0'])[0] or 0))
+            records = [record for record in account.history if record[0] > start]
+            highest = account.highest_modseq
+        history = []
+        for history_id, kind, uid, flags in records[:limit]:
+            message = {'id': self.message_id(uid)}
+            record = {'id': str(history_id), 'messages': [message]}
+            changes = self.label_changes(kind, flags) if flags is not None else {kind: []}
+            for change, labels in changes.items():
+                if types and change not in types:
+                    continue
+                record[change] = [dict({'message': message}, **({'labelIds': labels} if labels else {}))]
+            if len(record) > 2:
+                history.append(record)
+        payload = {'history': history, 'historyId': str(highest)}
+        if len(records) > limit:
+            payload['nextPageToken'] = str(records[limit - 1][0])
+        return 200, payload
+
+    def batch(self, account, body):
+        """
+        Multipart/mixed batch of up to 100 embedded API requests
+        """
+        match = re.search(r'boundary="?([^";]+)"?', self.headers.get('Content-Type', ''))
+        if not match:
+            return self.reply(400, {'error': {'code': 400, 'message': 'Missing multipart boundary'}})
+        boundary = match.group(1).encode()
+        parts = [part.strip(b'\r\n') for part in body.split(b'--' + boundary)[1:]]
+        parts = [part for part in parts if part and part != b'--']
+        if len(parts) > GMAIL_BATCH_LIMIT:
+            return self.reply(400, {'error': {'code': 400, 'message': 'Too many requests in batch'}})
+
+        response_boundary = f'batch_{random.getrandbits(64):016x}'
+        chunks = []
+        for part in parts:
+            outer, _, request = part.partition(b'\r\n\r\n')
+            content_id = re.search(rb'Content-ID:\s*<?([^>\r\n]+)>?', outer, re.IGNORECASE)
+            request_line, _, rest = request.partition(b'\r\n')
+            request_headers, _, request_body = rest.partition(b'\r\n\r\n')
+            method, path = request_line.decode().split()[:2]
+            if path.startswith('https://') or path.startswith('http://'):
+                path = urllib.parse.urlsplit(path)._replace(scheme='', netloc='').geturl()
+            status, payload = self.route(account, method, path, request_body.strip())
+            data = payload if isinstance(payload, bytes) else json.dumps(payload).encode()
+            header = f'--{response_boundary}\r\nContent-Type: application/http\r\n'
+            if content_id:
+                header += f'Content-ID: <response-{content_id.group(1).decode()}>\r\n'
+            chunks.append(
+                header.encode() + f'\r\nHTTP/1.1 {status} {"OK" if status < 300 else "Error"}\r\n'
+                f'Content-Type: application/json\r\nContent-Length: {len(data)}\r\n\r\n'.encode() + data + b'\r\n'
+            )
+        chunks.append(f'--{response_boundary}--\r\n'.encode())
+        self.reply(200, b''.join(chunks), content_type=f'multipart/mixed; boundary={response_boundary}')
+
+class FakeGmailServer:
+    """
+    Threaded HTTP stub of the Gmail API; start() serves it on a background thread
+    """
+
+    def __init__(self, state, host='127.0.0.1', port=0):
+        self.state = state
+        self.httpd = ThreadingHTTPServer((host, port), GmailHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.state = state
+        self.port = self.httpd.server_address[1]
+        self._thread = None
+
+    @property
+    def api_base(self):
+        return f'http://{self.httpd.server_address[0]}:{self.port}{GmailHandler.PREFIX}'
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--imap-port', type=int, default=1143)
+    parser.add_argument('--gmail-port', type=int, default=8089)
+    parser.add_argument('--messages', type=int, default=1000, help="Synthetic messages per account")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--mbox', default=None, help="Serve this mbox file to every account instead")
+    parser.add_argument('--latency', type=float, default=0.0, help="Seconds added to every response")
+    parser.add_argument('--jitter', type=float, default=0.0, help="Extra random delay of up to this many seconds")
+    parser.add_argument('--rate', type=float, default=None, help="Commands per second per account before throttling")
+    parser.add_argument('--arrival-rate', type=float, default=0.0, help="New messages per second across accounts")
+    parser.add_argument('--stats-interval', type=float, default=10.0)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(message)s')
+
+    state = FakeProviderState(args.messages, seed=args.seed, mbox=args.mbox, latency=args.latency,
+                              jitter=args.jitter, rate=args.rate)
+    imap = FakeImapServer(state, args.host, args.imap_port, arrival_rate=args.arrival_rate).start()
+    gmail = FakeGmailServer(state, args.host, args.gmail_port).start()
+    logger.info(f"IMAP on {args.host}:{imap.port}, Gmail API at {gmail.api_base}")
+    try:
+        while True:
+            time.sleep(args.stats_interval)
+            logger.info(json.dumps(state.stats()))
+    except KeyboardInterrupt:
+        imap.stop()
+        gmail.stop()
+
+if __name__ == '__main__':
+    main()
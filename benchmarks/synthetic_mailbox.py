@@ -0,0 +1,272 @@
+"""
+Deterministic synthetic mailbox generator for benchmarks and fake provider servers.
+
+Every message is derived from (seed, uid) alone, so a mailbox of a million
+messages never has to be held in memory and any UID can be produced on
+demand (the fake IMAP/Gmail servers rely on this). Distributions roughly
+follow a real consumer inbox:
+
+- kinds: newsletters (HTML heavy), notifications, receipts, personal mail
+- senders: Zipf-like popularity over a pool that grows with the mailbox
+- sizes: log-normal bodies per kind, log-normal attachments
+- threads: personal mail replies to recent messages (In-Reply-To/References)
+- flags: older and personal mail is more likely to be read
+
+    from synthetic_mailbox import SyntheticMailbox
+    mailbox = SyntheticMailbox(100000, seed=7)
+    for message in mailbox:
+        message.raw, message.flags, message.received_at
+"""
+import base64
+import math
+import random
+from datetime import datetime, timedelta, timezone as dt_timezone
+from functools import lru_cache
+from typing import NamedTuple
+
+SCALES = {'10k': 10000, '100k': 100000, '1m': 1000000}
+
+KINDS = (
+    # kind, share, (median body bytes, sigma), attachment rate, read rate
+    ('newsletter', 0.35, (30000, 0.6), 0.0, 0.3),
+    ('notification', 0.25, (2500, 0.5), 0.0, 0.6),
+    ('receipt', 0.10, (6000, 0.4), 0.3, 0.8),
+    ('personal', 0.30, (700, 0.9), 0.12, 0.95),
+)
+
+WORDS = (
+    'update', 'meeting', 'invoice', 'weekend', 'project', 'offer', 'summer', 'report', 'order', 'shipping',
+    'account', 'review', 'photos', 'dinner', 'deadline', 'release', 'members', 'exclusive', 'travel', 'budget',
+)
+ATTACHMENT_TYPES = (
+    ('application/pdf', 'pdf'),
+    ('image/jpeg', 'jpg'),
+    ('image/png', 'png'),
+    ('application/vnd.openxmlformats-officedocument.spreadsheetml.sheet', 'xlsx'),
+)
+MAX_ATTACHMENT_BYTES = 10 * 1024 * 1024
+REPLY_RATE = 0.4
+REPLY_WINDOW = 200
+
+class SyntheticMessage(NamedTuple):
+    uid: int
+    raw: bytes
+    kind: str
+    from_address: str
+    subject: str
+    message_id: str
+    thread_root: int
+    flags: tuple
+    received_at: datetime
+    attachment_bytes: int
+
+class SyntheticMailbox:
+    """
+    A reproducible mailbox of messages UIDs 1..messages
+    """
+
+    def __init__(self, messages, seed=1, owner='me@example.com', start=None, days=3 * 365):
+        self.messages = messages
+        self.seed = seed
+        self.owner = owner
+        self.start = start or datetime(2023, 1, 1, tzinfo=dt_timezone.utc)
+        self.span = timedelta(days=days)
+        # Popularity ranks are drawn log-uniformly, i.e. Zipf(1)-like
+        self.senders = max(50, messages // 40)
+        # Header fields are needed again for every reply in a thread
+        self._headers = lru_cache(maxsize=8192)(self._headers)
+
+    def __len__(self):
+        return self.messages
+
+    def __iter__(self):
+        for uid in self.uids():
+            yield self.message(uid)
+
+    def uids(self):
+        return range(1, self.messages + 1)
+
+    def _rng(self, uid, part):
+        return random.Random(f"{self.seed}:{uid}:{part}")
+
+    def _headers(self, uid):
+        """
+        (kind, from_address, base_subject, parent_uid) for a UID
+        """
+        rng = self._rng(uid, 'headers')
+        roll = rng.random()
+        for kind, share, *_ in KINDS:
+            roll -= share
+            if roll < 0:
+                break
+        rank = int(self.senders ** rng.random()) - 1
+        if kind == 'personal':
+            from_address = f"friend{rank}@mail{rank % 7}.example"
+        elif kind == 'receipt':
+            from_address = f"orders@shop{rank % 97}.example"
+        else:
+            from_address = f"{kind}s@brand{rank}.example"
+
+        parent = None
+        if kind == 'personal' and uid > 1 and rng.random() < REPLY_RATE:
+            parent = uid - rng.randint(1, min(REPLY_WINDOW, uid - 1))
+        subject = f"{rng.choice(WORDS).title()} {rng.choice(WORDS)} #{uid}"
+        return kind, from_address, subject, parent
+
+    def thread_root(self, uid):
+        """
+        Follow In-Reply-To links back to the message that started the thread
+        """
+        while True:
+            parent = self._headers(uid)[3]
+            if parent is None:
+                return uid
+            uid = parent
+
+    def message_id(self, uid):
+        return f"<{uid}.{self.seed}@synthetic.example>"
+
+    def received_at(self, uid):
+        offset = self.span * ((uid - 1) / max(self.messages, 1))
+        jitter = timedelta(seconds=self._rng(uid, 'time').randint(0, 600))
+        return self.start + offset + jitter
+
+    def message(self, uid):
+        kind, from_address, subject, parent = self._headers(uid)
+        _, _, (median, sigma), attachment_rate, _ = next(k for k in KINDS if k[0] == kind)
+        rng = self._rng(uid, 'body')
+        root = self.thread_root(uid)
+        if parent is not None:
+            subject = f"Re: {self._headers(root)[2]}"
+
+        received_at = self.received_at(uid)
+        body_size = int(rng.lognormvariate(math.log(median), sigma))
+        headers = [
+            f"From: {from_address}",
+            f"To: {self.owner}",
+            f"Subject: {subject}",
+            f"Date: {received_at.strftime('%a, %d %b %Y %H:%M:%S +0000')}",
+            f"Message-ID: {self.message_id(uid)}",
+            "MIME-Version: 1.0",
+        ]
+        if parent is not None:
+            headers.append(f"In-Reply-To: {self.message_id(parent)}")
+            ancestors = []
+            current = parent
+            while current is not None and len(ancestors) < 20:
+                ancestors.append(self.message_id(current))
+                current = self._headers(current)[3]
+            headers.append(f"References: {' '.join(reversed(ancestors))}")
+        if kind == 'newsletter':
+            headers.append(f"List-Unsubscribe: <https://{from_address.split('@')[1]}/unsubscribe?u={uid}>")
+
+        if kind in ('newsletter', 'notification'):
+            body_part = self._html_part(rng, body_size)
+        else:
+            body_part = self._text_part(rng, body_size)
+
+        attachment_bytes = 0
+        parts = [body_part]
+        if rng.random() < attachment_rate:
+            attachment_bytes = min(int(rng.lognormvariate(math.log(150000), 1.2)), MAX_ATTACHMENT_BYTES)
+            parts.append(self._attachment_part(rng, uid, attachment_bytes))
+
+        if len(parts) == 1:
+            raw = '\r\n'.join(headers) + '\r\n' + parts[0]
+        else:
+            boundary = f"=_synthetic_{uid}"
+            headers.append(f'Content-Type: multipart/mixed; boundary="{boundary}"')
+            raw = '\r\n'.join(headers) + '\r\n\r\n' + ''.join(
+                f"--{boundary}\r\n{part}\r\n" for part in parts
+            ) + f"--{boundary}--\r\n"
+
+        return SyntheticMessage(
+            uid, raw.encode(), kind, from_address, subject, self.message_id(uid).strip('<>'),
+            root, self.flags(uid), received_at, attachment_bytes,
+        )
+
+    def flags(self, uid):
+        """
+        IMAP flags of a message, without building its body
+        """
+        kind = self._headers(uid)[0]
+        read_rate = next(k for k in KINDS if k[0] == kind)[4]
+        rng = self._rng(uid, 'flags')
+        age = 1 - (uid - 1) / max(self.messages, 1)
+        flags = []
+        if rng.random() < min(1.0, read_rate + 0.3 * age):
+            flags.append('\\Seen')
+        if rng.random() < 0.03:
+            flags.append('\\Flagged')
+        return tuple(flags)
+
+    @staticmethod
+    def _words(rng, size):
+        text = []
+        length = 0
+        while length < size:
+            word = rng.choice(WORDS)
+            text.append(word)
+            length += len(word) + 1
+        return ' '.join(text)
+
+    def _text_part(self, rng, size):
+        text = self._words(rng, size)
+        lines = [text[i:i + 76] for i in range(0, len(text), 76)]
+        return 'Content-Type: text/plain; charset="utf-8"\r\n\r\n' + '\r\n'.join(lines) + '\r\n'
+
+    def _html_part(self, rng, size):
+        blocks = [
+            '<html><head><style>',
+            ' '.join(f".c{i} {{ color: #{rng.randrange(0xffffff):06x}; padding: {i}px }}" for i in range(20)),
+            '</style></head><body><table width="100%">',
+        ]
+        length = sum(map(len, blocks))
+        while length < size:
+            block = (
+                f'<tr><td class="c{rng.randrange(20)}" style="font-family:Arial;font-size:14px">'
+                f'<a href="https://example.com/t?id={rng.randrange(10 ** 9)}">{self._words(rng, rng.randint(40, 240))}</a>'
+                f'</td></tr>\r\n'
+            )
+            blocks.append(block)
+            length += len(block)
+        blocks.append('</table></body></html>')
+        return 'Content-Type: text/html; charset="utf-8"\r\n\r\n' + ''.join(blocks) + '\r\n'
+
+    def _attachment_part(self, rng, uid, size):
+        content_type, extension = rng.choice(ATTACHMENT_TYPES)
+        # A repeated random block keeps generation cheap for large attachments
+        block = rng.randbytes(1024)
+        payload = base64.encodebytes((block * (size // 1024 + 1))[:size]).decode().replace('\n', '\r\n')
+        return (
+            f'Content-Type: {content_type}; name="file{uid}.{extension}"\r\n'
+            f'Content-Disposition: attachment; filename="file{uid}.{extension}"\r\n'
+            f'Content-Transfer-Encoding: base64\r\n\r\n{payload}'
+        )
+
+    def summary(self, sample=None):
+        """
+        Distribution summary over the first sample messages (all by default)
+        """
+        kinds = {}
+        raw_bytes = attachments = replies = 0
+        roots = set()
+        count = 0
+        for uid in self.uids()[:sample]:
+            message = self.message(uid)
+            kinds[message.kind] = kinds.get(message.kind, 0) + 1
+            raw_bytes += len(message.raw)
+            attachments += bool(message.attachment_bytes)
+            replies += message.thread_root != uid
+            roots.add(message.thread_root)
+            count += 1
+        return {
+            'messages': count,
+            'kinds': kinds,
+            'raw_megabytes': round(raw_bytes / 1e6, 2),
+            'average_raw_bytes': raw_bytes // max(count, 1),
+            'with_attachments': attachments,
+            'replies': replies,
+            'threads': len(roots),
+            'sender_pool': self.senders,
+        }
@@ -30,6 +30,9 @@ INSTALLED_APPS = [
     'emails',
     'oauth',
     'sync',
+    'spam',
+    'review',
+    'analytics',
 ]
 
 # Templates configuration
@@ -51,11 +54,13 @@ TEMPLATES = [
 ]
 
 MIDDLEWARE = [
+    'core.instrumentation.RequestInstrumentationMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'core.routers.ReplicaRoutingMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -97,4 +102,109 @@ STATIC_URL = 'static/'
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/6.0/ref/settings/#default-auto-field
-DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
\ No newline at end of file
+DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+# Request instrumentation (core.instrumentation.RequestInstrumentationMiddleware)
+REQUEST_METRICS_SAMPLE_RATE = 1.0  # share of requests measured
+REQUEST_METRICS_WINDOW = 1000  # recent requests per view kept for latency percentiles
+REQUEST_METRICS_QUERY_WARNING = 50  # log requests running more queries than this
+
+# Sender reputation
+# Global per-sender counters are read through an in-process LRU cache
+SENDER_REPUTATION_CACHE_SIZE = 100000
+SENDER_REPUTATION_CACHE_TTL = 300  # seconds
+SENDER_REPUTATION_MAX_PENDING = 500  # buffered senders before an automatic flush
+
+# Bulk deletion and other bulk selection actions
+BULK_DELETE_CHUNK_SIZE = 500  # messages per transaction
+BULK_DELETE_CHUNK_PAUSE = 0.05  # seconds to yield between chunks
+SELECTION_MAX_IN_SIZE = 500  # explicitly selected IDs per SQL IN list
+
+# Soft deletion
+SOFT_DELETE_UNDO_WINDOW = 7 * 24 * 60 * 60  # seconds a deletion can be undone
+TOMBSTONE_PURGE_BATCH_SIZE = 200  # tombstones hard-deleted per transaction
+TOMBSTONE_PURGE_PAUSE = 0.1  # seconds to yield between purge batches
+TOMBSTONE_PURGE_MAX_ACTIVE_SYNCS = 2  # only purge while at most this many syncs run
+
+# Cross-account deduplication
+MESSAGE_DEDUP_ENABLED = True  # share bodies between copies of a message in several accounts
+
+# MIME parsing and attachment storage
+MESSAGE_BODY_PLAIN_MAX_CHARS = 1000000  # longer text/plain bodies are truncated
+MESSAGE_BODY_HTML_MAX_CHARS = 2000000  # longer text/html bodies are truncated
+MESSAGE_SNIPPET_LENGTH = 200
+MIME_MAX_HEADER_BYTES = 256 * 1024  # per header block; the excess is ignored
+ATTACHMENT_STORE_ROOT = BASE_DIR / 'attachments'  # content-addressed attachment payloads
+ATTACHMENT_GC_GRACE_SECONDS = 3600  # unreferenced payloads written or reused more recently are kept for now
+
+# Sync pipeline
+SYNC_FETCH_WORKERS = 4  # threads fetching raw messages from the provider
+SYNC_FETCH_BATCH_SIZE = 50  # message IDs per fetch request
+SYNC_PARSE_WORKERS = 2  # threads parsing and classifying fetched messages
+SYNC_PARSE_PROCESSES = 0  # forkserver worker processes behind the parse threads; 0 parses in-thread
+SYNC_PERSIST_BATCH_SIZE = 100  # messages written per transaction
+SYNC_QUEUE_SIZE = 200  # capacity of each queue between stages
+
+# Provider rate limiting (quotas default to sync.ratelimit.DEFAULT_PROVIDER_RATE_LIMITS)
+RATE_LIMIT_BACKEND = 'memory'  # 'redis' shares token buckets between all workers
+RATE_LIMIT_INCREASE = 0.02  # share of the quota restored per successful request
+RATE_LIMIT_DECREASE = 0.5  # rate multiplier after a throttling response
+RATE_LIMIT_MIN_RATE = 0.05  # the rate never drops below this share of the quota
+RATE_LIMIT_DEFAULT_BACKOFF = 1.0  # seconds to pause when no Retry-After is given
+
+# IMAP session pool
+IMAP_POOL_MAX_SESSIONS_PER_ACCOUNT = 4  # providers cap concurrent connections per mailbox
+IMAP_POOL_IDLE_TIMEOUT = 300  # seconds before an unused session is logged out
+IMAP_POOL_CHECK_AFTER = 10  # sessions idle longer than this are checked with NOOP before reuse
+IMAP_POOL_ACQUIRE_TIMEOUT = 60  # seconds to wait for a free session
+
+# Provider endpoints; override to sync against local fake servers (benchmarks/fake_providers.py)
+IMAP_USE_SSL = True  # plain-text IMAP is only meant for local test servers
+GMAIL_API_BASE = 'https://gmail.googleapis.com/gmail/v1/users/me'
+
+# OAuth token refresh
+OAUTH_CLIENTS = {
+    provider: {
+        'client_id': os.environ.get(f'{provider.upper()}_OAUTH_CLIENT_ID', ''),
+        'client_secret': os.environ.get(f'{provider.upper()}_OAUTH_CLIENT_SECRET', ''),
+    }
+    for provider in ('google', 'microsoft', 'yahoo')
+}
+OAUTH_TOKEN_ENDPOINTS = {}  # per-provider overrides, e.g. a local stub endpoint
+OAUTH_REFRESH_MARGIN = 300  # seconds before expiry at which tokens are refreshed
+OAUTH_TOKEN_CACHE_TTL = 60  # seconds a valid token is served from the in-process cache
+OAUTH_REFRESH_BATCH_SIZE = 100  # connections refreshed per sweep
+OAUTH_REFRESH_CONCURRENCY = 4  # refreshes in flight at once during a sweep
+OAUTH_REFRESH_TIMEOUT = 10  # seconds per token endpoint request
+
+# Prometheus metrics (served at /metrics/)
+METRICS_MULTIPROC_DIR = os.environ.get('METRICS_MULTIPROC_DIR')  # shared directory so one scrape covers every worker process
+METRICS_FLUSH_INTERVAL = 5  # seconds between writes of a process's values to METRICS_MULTIPROC_DIR
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')  # bearer token for scrapers; without it only staff can read /metrics/
+
+# Sampling profiler for syncs (enable per account/worker with `manage.py sync_profiler enable`)
+SYNC_PROFILER_INTERVAL = 0.01  # default seconds between stack samples
+SYNC_PROFILER_MIN_INTERVAL = 0.005  # faster sampling requests are slowed to this
+SYNC_PROFILER_MAX_DEPTH = 64  # frames kept per stack
+SYNC_PROFILER_MAX_STACKS = 10000  # distinct stacks kept per sync, bounding memory
+SYNC_PROFILER_DIR = BASE_DIR / 'profiles'  # <sync>.collapsed and <sync>.speedscope.json files
+
+# Mailbox import (manage.py import_mailbox); parse processes and batch size follow the sync pipeline settings
+IMPORT_MAX_BATCH_BYTES = 16 * 1024 * 1024  # raw bytes per parse task, bounding memory for huge messages
+
+# Streaming exports (mbox, Parquet, Arrow)
+EXPORT_MBOX_CHUNK_SIZE = 200  # messages with bodies fetched per database round trip
+EXPORT_ROW_GROUP_SIZE = 10000  # metadata rows per Parquet row group / Arrow batch
+
+# Archive tiering (RetentionPolicy, manage.py archive_messages)
+ARCHIVE_STORE_ROOT = BASE_DIR / 'archive'  # compressed archive packs, <user>/<month>/<pack>
+ARCHIVE_PACK_MAX_BYTES = 64 * 1024 * 1024  # bigger months are split over several packs
+ARCHIVE_COMPRESSION_LEVEL = 6  # zlib level for bodies and compressible attachments
+ARCHIVE_CHUNK_SIZE = 200  # messages read per database round trip while archiving
+
+# Read replicas (core.routers); views with ReplicaReadMixin read from a replica
+DATABASE_ROUTERS = ['core.routers.ReplicaRouter']
+DATABASE_REPLICAS = []  # DATABASES aliases of the replicas; empty reads everything from default
+REPLICA_MAX_LAG = 5  # seconds; lagging or unreachable replicas are skipped
+REPLICA_LAG_CHECK_INTERVAL = 2  # seconds between lag checks per replica and process
+REPLICA_PIN_SECONDS = 10  # read-your-writes: reads stay on primary this long after a write
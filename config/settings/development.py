@@ -11,8 +11,16 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
-    }
+    },
+    # A second alias on the same file for trying replica routing locally
+    # (DB_REPLICA=1); tests mirror it onto the test database
+    'replica': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': BASE_DIR / 'db.sqlite3',
+        'TEST': {'MIRROR': 'default'},
+    },
 }
+DATABASE_REPLICAS = ['replica'] if os.environ.get('DB_REPLICA') else []
 
 # Email backend for development
 EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'
@@ -18,6 +18,13 @@ DATABASES = {
     }
 }
 
+# Read replicas: comma-separated hosts sharing the primary's credentials
+DATABASE_REPLICAS = []
+for _index, _host in enumerate(filter(None, os.environ.get('DB_REPLICA_HOSTS', '').split(',')), 1):
+    DATABASES[f'replica_{_index}'] = dict(DATABASES['default'], HOST=_host.strip(), TEST={'MIRROR': 'default'})
+    DATABASE_REPLICAS.append(f'replica_{_index}')
+REPLICA_MAX_LAG = float(os.environ.get('REPLICA_MAX_LAG', 5))
+
 # Redis configuration
 REDIS_URL = os.environ.get('REDIS_URL', 'redis://localhost:6379/0')
 
@@ -25,6 +32,17 @@ REDIS_URL = os.environ.get('REDIS_URL', 'redis://localhost:6379/0')
 CELERY_BROKER_URL = REDIS_URL
 CELERY_RESULT_BACKEND = REDIS_URL
 
+# Provider quotas are shared by every sync worker
+RATE_LIMIT_BACKEND = 'redis'
+RATE_LIMIT_REDIS_URL = REDIS_URL
+
+# Measure a sample of requests only
+REQUEST_METRICS_SAMPLE_RATE = float(os.environ.get('REQUEST_METRICS_SAMPLE_RATE', 0.05))
+
+# Sample sync stacks at 10 Hz when profiling is switched on for a worker or account
+SYNC_PROFILER_INTERVAL = float(os.environ.get('SYNC_PROFILER_INTERVAL', 0.1))
+SYNC_PROFILER_DIR = os.environ.get('SYNC_PROFILER_DIR', '/var/tmp/inboxsweep-profiles')
+
 # Security settings
 SECURE_BROWSER_XSS_FILTER = True
 SECURE_CONTENT_TYPE_NOSNIFF = True
@@ -0,0 +1,178 @@
+import logging
+import random
+import threading
+import time
+from collections import deque
+from contextlib import ExitStack
+from django.conf import settings
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+_local = threading.local()
+
+def current_request_metrics():
+    """
+    Metrics of the sampled request being handled on this thread, if any
+    """
+    return getattr(_local, 'metrics', None)
+
+class RequestMetrics:
+    """
+    Counters for one request; doubles as the database execute wrapper
+    """
+    __slots__ = ('queries', 'db_time', 'cache_hits', 'cache_misses', 'latency')
+
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.latency = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_time += time.perf_counter() - started
+            self.queries += 1
+
+    def as_dict(self):
+        return {
+            'queries': self.queries,
+            'db_ms': round(self.db_time * 1000, 2),
+            'cache_hits': self.cache_hits,
+            'cache_misses': self.cache_misses,
+            'latency_ms': round(self.latency * 1000, 2),
+        }
+
+class ViewStats:
+    """
+    Running totals for one view plus a window of recent latencies for percentiles
+    """
+
+    def __init__(self, window):
+        self.requests = 0
+        self.errors = 0
+        self.latency = 0.0
+        self.max_latency = 0.0
+        self.queries = 0
+        self.max_queries = 0
+        self.db_time = 0.0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.recent = deque(maxlen=window)
+
+    def add(self, metrics, status_code):
+        self.requests += 1
+        self.errors += status_code >= 500
+        self.latency += metrics.latency
+        self.max_latency = max(self.max_latency, metrics.latency)
+        self.queries += metrics.queries
+        self.max_queries = max(self.max_queries, metrics.queries)
+        self.db_time += metrics.db_time
+        self.cache_hits += metrics.cache_hits
+        self.cache_misses += metrics.cache_misses
+        self.recent.append(metrics.latency)
+
+    def as_dict(self):
+        recent = sorted(self.recent)
+
+        def percentile(q):
+            return round(recent[min(len(recent) - 1, int(q * len(recent)))] * 1000, 2) if recent else None
+
+        return {
+            'requests': self.requests,
+            'errors': self.errors,
+            'latency_avg_ms': round(self.latency / self.requests * 1000, 2),
+            'latency_p50_ms': percentile(0.5),
+            'latency_p95_ms': percentile(0.95),
+            'latency_max_ms': round(self.max_latency * 1000, 2),
+            'queries_avg': round(self.queries / self.requests, 2),
+            'queries_max': self.max_queries,
+            'db_avg_ms': round(self.db_time / self.requests * 1000, 2),
+            'cache_hits': self.cache_hits,
+            'cache_misses': self.cache_misses,
+        }
+
+class RequestMetricsRegistry:
+    """
+    Per-view request metrics of this process
+    """
+
+    def __init__(self, window=None):
+        self.window = window or getattr(settings, 'REQUEST_METRICS_WINDOW', 1000)
+        self._views = {}
+        self._lock = threading.Lock()
+
+    def record(self, view, metrics, status_code):
+        with self._lock:
+            stats = self._views.get(view)
+            if stats is None:
+                stats = self._views[view] = ViewStats(self.window)
+            stats.add(metrics, status_code)
+
+    def snapshot(self):
+        with self._lock:
+            return {view: stats.as_dict() for view, stats in sorted(self._views.items())}
+
+    def reset(self):
+        with self._lock:
+            self._views.clear()
+
+_default_registry = None
+
+def get_request_metrics():
+    """
+    Return the process-wide request metrics registry
+    """
+    global _default_registry
+    if _default_registry is None:
+        _default_registry = RequestMetricsRegistry()
+    return _default_registry
+
+class RequestInstrumentationMiddleware:
+    """
+    Record query count, DB time, cache hits/misses and latency per view.
+
+    Only a REQUEST_METRICS_SAMPLE_RATE share of requests is measured;
+    unsampled requests pay for one random() call. Sampled responses carry
+    their RequestMetrics as response.request_metrics (used by the query
+    budget test helpers) and, with DEBUG on, a Server-Timing header.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.sample_rate = getattr(settings, 'REQUEST_METRICS_SAMPLE_RATE', 1.0)
+        self.query_warning = getattr(settings, 'REQUEST_METRICS_QUERY_WARNING', 50)
+        self.registry = get_request_metrics()
+
+    def __call__(self, request):
+        if self.sample_rate <= 0 or (self.sample_rate < 1 and random.random() >= self.sample_rate):
+            return self.get_response(request)
+
+        metrics = RequestMetrics()
+        _local.metrics = metrics
+        started = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for alias in connections:
+                    stack.enter_context(connections[alias].execute_wrapper(metrics))
+                response = self.get_response(request)
+        finally:
+            _local.metrics = None
+        metrics.latency = time.perf_counter() - started
+
+        match = getattr(request, 'resolver_match', None)
+        view = match.view_name if match is not None else 'unresolved'
+        self.registry.record(view, metrics, response.status_code)
+        response.request_metrics = metrics
+        if settings.DEBUG:
+            response['Server-Timing'] = (
+                f'db;dur={metrics.db_time * 1000:.1f};desc="{metrics.queries} queries", '
+                f'total;dur={metrics.latency * 1000:.1f}'
+            )
+        if metrics.queries > self.query_warning:
+            logger.warning(f"{request.method} {request.path} ({view}) ran {metrics.queries} queries")
+        return response
@@ -0,0 +1,338 @@
+import atexit
+import bisect
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+import uuid
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _format_labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    pairs.extend(f'{name}="{_escape(value)}"' for name, value in extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+class BoundMetric:
+    """
+    A metric with its label values filled in
+    """
+    __slots__ = ('metric', 'key')
+
+    def __init__(self, metric, key):
+        self.metric = metric
+        self.key = key
+
+    def inc(self, amount=1):
+        self.metric._inc(self.key, amount)
+
+    def dec(self, amount=1):
+        self.metric._inc(self.key, -amount)
+
+    def set(self, value):
+        self.metric._set(self.key, value)
+
+    def observe(self, value):
+        self.metric._observe(self.key, value)
+
+class Metric:
+    """
+    Base for counters, gauges and histograms; values are kept per label tuple
+    """
+    type = None
+
+    def __init__(self, registry, name, documentation, labelnames=()):
+        self.registry = registry
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+
+    def labels(self, *values, **labels):
+        if labels:
+            values = tuple(labels[name] for name in self.labelnames)
+        if len(values) != len(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}")
+        return BoundMetric(self, tuple(str(value) for value in values))
+
+    def _inc(self, key, amount):
+        with self.registry.lock:
+            self.registry._check_fork()
+            self.values[key] = self.values.get(key, 0) + amount
+        self.registry._changed()
+
+    def _set(self, key, value):
+        raise TypeError(f"{self.name} is a {self.type}")
+
+    def _observe(self, key, value):
+        raise TypeError(f"{self.name} is a {self.type}")
+
+    # Unlabelled metrics can be updated directly
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+    def dec(self, amount=1):
+        self.labels().dec(amount)
+
+    def set(self, value):
+        self.labels().set(value)
+
+    def observe(self, value):
+        self.labels().observe(value)
+
+    def dump(self):
+        return [[list(key), value] for key, value in self.values.items()]
+
+    @staticmethod
+    def merge(values, other):
+        """
+        Combine one process's value into the running total for a label tuple
+        """
+        return (values or 0) + other
+
+    def samples(self, values):
+        for key, value in sorted(values.items()):
+            yield self.name, key, (), value
+
+class Counter(Metric):
+    type = 'counter'
+
+    def _inc(self, key, amount):
+        if amount < 0:
+            raise ValueError('Counters can only go up')
+        super()._inc(key, amount)
+
+class Gauge(Metric):
+    """
+    A value that goes up and down; across processes the values of live processes are summed
+    """
+    type = 'gauge'
+
+    def _set(self, key, value):
+        with self.registry.lock:
+            self.registry._check_fork()
+            self.values[key] = value
+        self.registry._changed()
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, registry, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(registry, name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def _inc(self, key, amount):
+        raise TypeError(f"{self.name} is a histogram")
+
+    def _observe(self, key, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.registry.lock:
+            self.registry._check_fork()
+            entry = self.values.get(key)
+            if entry is None:
+                # Per-bucket (non-cumulative) counts, the last one is +Inf; then sum and count
+                entry = self.values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+        self.registry._changed()
+
+    def dump(self):
+        return [[list(key), [list(counts), total, count]] for key, (counts, total, count) in self.values.items()]
+
+    @staticmethod
+    def merge(values, other):
+        if values is None:
+            return [list(other[0]), other[1], other[2]]
+        values[0] = [a + b for a, b in zip(values[0], other[0])]
+        values[1] += other[1]
+        values[2] += other[2]
+        return values
+
+    def samples(self, values):
+        for key, (counts, total, count) in sorted(values.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                yield f'{self.name}_bucket', key, (('le', _format_value(bound)),), cumulative
+            yield f'{self.name}_sum', key, (), total
+            yield f'{self.name}_count', key, (), count
+
+class MetricsRegistry:
+    """
+    Counters, gauges and histograms rendered in the Prometheus text format.
+
+    With a multiprocess_dir (METRICS_MULTIPROC_DIR) every process writes its
+    values to its own file there at most every flush_interval seconds and on
+    exit, and render() adds up the files of all processes, so one scrape of
+    any gunicorn or Celery worker reports the whole host. Counters and
+    histograms of exited processes keep counting towards the totals; their
+    gauges are dropped. A process forked after metrics were recorded starts
+    from zero rather than double counting its parent's values.
+    """
+
+    def __init__(self, multiprocess_dir=None, flush_interval=None):
+        self.multiprocess_dir = multiprocess_dir
+        self.flush_interval = flush_interval if flush_interval is not None else 5.0
+        self.metrics = {}
+        self.lock = threading.RLock()
+        self._pid = os.getpid()
+        self._token = uuid.uuid4().hex[:12]
+        self._last_flush = 0.0
+        if multiprocess_dir:
+            os.makedirs(multiprocess_dir, exist_ok=True)
+            atexit.register(self.flush)
+
+    def _register(self, cls, name, *args, **kwargs):
+        with self.lock:
+            metric = self.metrics.get(name)
+            if metric is None:
+                metric = self.metrics[name] = cls(self, name, *args, **kwargs)
+            elif not isinstance(metric, cls):
+                raise ValueError(f"Metric {name} is already registered as a {metric.type}")
+            return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter, name, documentation, labelnames)
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self._register(Gauge, name, documentation, labelnames)
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram, name, documentation, labelnames, buckets=buckets)
+
+    def _check_fork(self):
+        # Called with the lock held
+        if os.getpid() != self._pid:
+            self._pid = os.getpid()
+            self._token = uuid.uuid4().hex[:12]
+            self._last_flush = 0.0
+            for metric in self.metrics.values():
+                metric.values = {}
+
+    def _changed(self):
+        if self.multiprocess_dir and time.monotonic() - self._last_flush >= self.flush_interval:
+            self.flush()
+
+    @property
+    def _path(self):
+        return os.path.join(self.multiprocess_dir, f"{self._pid}-{self._token}.json")
+
+    def _dump(self):
+        with self.lock:
+            self._check_fork()
+            return {name: metric.dump() for name, metric in self.metrics.items()}
+
+    def flush(self):
+        """
+        Write this process's values to its file in the multiprocess directory
+        """
+        if not self.multiprocess_dir:
+            return
+        self._last_flush = time.monotonic()
+        data = json.dumps({'pid': self._pid, 'metrics': self._dump()})
+        try:
+            fd, temp_path = tempfile.mkstemp(dir=self.multiprocess_dir, suffix='.tmp')
+            with os.fdopen(fd, 'w') as f:
+                f.write(data)
+            os.replace(temp_path, self._path)
+        except OSError as e:
+            logger.warning(f"Could not write metrics to {self.multiprocess_dir}: {e}")
+
+    @staticmethod
+    def _is_alive(pid):
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            return True
+        return True
+
+    def _other_processes(self):
+        """
+        (pid, metrics) from the files other processes wrote
+        """
+        own = os.path.basename(self._path)
+        for filename in sorted(os.listdir(self.multiprocess_dir)):
+            if not filename.endswith('.json') or filename == own:
+                continue
+            try:
+                with open(os.path.join(self.multiprocess_dir, filename)) as f:
+                    data = json.load(f)
+            except (OSError, ValueError):
+                continue
+            yield data.get('pid'), data.get('metrics', {})
+
+    def collect(self):
+        """
+        Values per metric and label tuple, summed over processes when running multiprocess
+        """
+        collected = {}
+        sources = [(self._pid, self._dump())]
+        if self.multiprocess_dir:
+            sources.extend(self._other_processes())
+        for pid, metrics in sources:
+            alive = None
+            for name, values in metrics.items():
+                metric = self.metrics.get(name)
+                if metric is None:
+                    continue
+                if metric.type == 'gauge':
+                    if alive is None:
+                        alive = pid == self._pid or self._is_alive(pid)
+                    if not alive:
+                        continue
+                totals = collected.setdefault(name, {})
+                for key, value in values:
+                    key = tuple(key)
+                    totals[key] = metric.merge(totals.get(key), value)
+        return collected
+
+    def render(self):
+        """
+        Every metric in the Prometheus text exposition format
+        """
+        collected = self.collect()
+        lines = []
+        for name, metric in sorted(self.metrics.items()):
+            lines.append(f"# HELP {name} {metric.documentation}")
+            lines.append(f"# TYPE {name} {metric.type}")
+            for sample, key, extra, value in metric.samples(collected.get(name, {})):
+                lines.append(f"{sample}{_format_labels(metric.labelnames, key, extra)} {_format_value(value)}")
+        return '\n'.join(lines) + '\n'
+
+    def reset(self):
+        """
+        Zero every metric of this process (tests)
+        """
+        with self.lock:
+            for metric in self.metrics.values():
+                metric.values = {}
+
+_default_registry = None
+
+def get_metrics_registry():
+    """
+    Return the process-wide metrics registry
+    """
+    global _default_registry
+    if _default_registry is None:
+        _default_registry = MetricsRegistry(
+            multiprocess_dir=getattr(settings, 'METRICS_MULTIPROC_DIR', None),
+            flush_interval=getattr(settings, 'METRICS_FLUSH_INTERVAL', 5.0),
+        )
+    return _default_registry
@@ -16,6 +16,11 @@ class AjaxResponseMixin:
         return JsonResponse(context, **response_kwargs)
 
 
+class ReplicaReadMixin:
+    """Mixin letting safe requests read from a database replica (see core.routers)"""
+    replica_reads = True
+
+
 class CsrfExemptMixin:
     """Mixin to exempt CSRF protection"""
     @method_decorator(csrf_exempt)
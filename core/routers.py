@@ -0,0 +1,184 @@
+import logging
+import random
+import threading
+import time
+from contextlib import contextmanager
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+
+logger = logging.getLogger(__name__)
+
+_local = threading.local()
+
+# Apps whose reads never go to a replica: a session written by a login must be
+# readable on the very next request
+PRIMARY_ONLY_APPS = ('sessions',)
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+POSTGRESQL_LAG_SQL = (
+    "SELECT CASE WHEN NOT pg_is_in_recovery() OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+    "ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) END"
+)
+
+@contextmanager
+def replica_reads():
+    """
+    Let reads in the block go to a replica; a write in the block sends later reads back to primary
+    """
+    previous = getattr(_local, 'replica_reads', False), getattr(_local, 'wrote', False)
+    _local.replica_reads, _local.wrote = True, False
+    try:
+        yield
+    finally:
+        _local.replica_reads, _local.wrote = previous
+
+class ReplicaMonitor:
+    """
+    Replication lag of the read replicas, measured at most once per interval per replica and process.
+
+    Lag is read from pg_last_xact_replay_timestamp() on PostgreSQL and is
+    0 on other backends (e.g. a SQLite replica alias reading the primary's
+    file). Replicas lagging more than max_lag seconds, or failing the
+    check, are left out until a later check finds them healthy again.
+    """
+
+    def __init__(self, max_lag=None, interval=None, clock=time.monotonic):
+        self.max_lag = getattr(settings, 'REPLICA_MAX_LAG', 5) if max_lag is None else max_lag
+        self.interval = getattr(settings, 'REPLICA_LAG_CHECK_INTERVAL', 2) if interval is None else interval
+        self._clock = clock
+        self._checked = {}
+        self._lock = threading.Lock()
+
+    def measure(self, alias):
+        """
+        Seconds alias is behind the primary, or None if it cannot be reached
+        """
+        connection = connections[alias]
+        if connection.vendor != 'postgresql':
+            return 0.0
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute(POSTGRESQL_LAG_SQL)
+                return float(cursor.fetchone()[0])
+        except DatabaseError as e:
+            logger.warning(f"Replica {alias} lag check failed: {e}")
+            return None
+
+    def lag(self, alias):
+        """
+        The last measured lag of alias, measuring again when it is older than interval
+        """
+        now = self._clock()
+        checked = self._checked.get(alias)
+        if checked is not None and checked[0] > now:
+            return checked[1]
+        with self._lock:
+            checked = self._checked.get(alias)
+            if checked is None or checked[0] <= now:
+                lag = self.measure(alias)
+                if lag is None or lag > self.max_lag:
+                    logger.info(f"Reading from primary instead of replica {alias} (lag {lag})")
+                checked = self._checked[alias] = (now + self.interval, lag)
+        return checked[1]
+
+    def is_healthy(self, alias):
+        lag = self.lag(alias)
+        return lag is not None and lag <= self.max_lag
+
+    def healthy(self, aliases):
+        return [alias for alias in aliases if self.is_healthy(alias)]
+
+_default_monitor = None
+
+def get_replica_monitor():
+    """
+    Return the process-wide replica monitor
+    """
+    global _default_monitor
+    if _default_monitor is None:
+        _default_monitor = ReplicaMonitor()
+    return _default_monitor
+
+class ReplicaRouter:
+    """
+    Route reads to the DATABASE_REPLICAS aliases where that is safe.
+
+    Reads only go to a replica inside replica_reads(), which
+    ReplicaRoutingMiddleware enters for views marked with ReplicaReadMixin,
+    and then not inside a transaction on primary, after a write on this
+    thread, or when every replica lags. Everything else, including writes
+    and all reads of sync workers, uses the default database.
+    """
+
+    def db_for_read(self, model, **hints):
+        if not getattr(_local, 'replica_reads', False) or getattr(_local, 'wrote', False):
+            return DEFAULT_DB_ALIAS
+        instance = hints.get('instance')
+        if instance is not None and instance._state.db:
+            return instance._state.db
+        if model._meta.app_label in PRIMARY_ONLY_APPS or connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        replicas = get_replica_monitor().healthy(getattr(settings, 'DATABASE_REPLICAS', []))
+        return random.choice(replicas) if replicas else DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        _local.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same data as primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db in getattr(settings, 'DATABASE_REPLICAS', []):
+            return False
+        return None
+
+def _replica_stream(content):
+    with replica_reads():
+        yield from content
+
+class ReplicaRoutingMiddleware:
+    """
+    Read-your-writes for replica routing.
+
+    Safe requests to views marked with ReplicaReadMixin read from a replica.
+    After a request that wrote to the database, or used an unsafe method,
+    the client gets a cookie pinning its reads to primary for
+    REPLICA_PIN_SECONDS, longer than replicas are allowed to lag. Must come
+    after SessionMiddleware so session saves do not count as writes.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.cookie_name = getattr(settings, 'REPLICA_PIN_COOKIE', 'primary_until')
+        self.pin_seconds = getattr(settings, 'REPLICA_PIN_SECONDS', 10)
+
+    def __call__(self, request):
+        _local.replica_reads, _local.wrote = False, False
+        try:
+            response = self.get_response(request)
+            replica, wrote = _local.replica_reads, _local.wrote
+        finally:
+            _local.replica_reads, _local.wrote = False, False
+        if replica and not wrote and response.streaming:
+            # Streaming exports run their queries after the view has returned
+            response.streaming_content = _replica_stream(response.streaming_content)
+        if wrote or request.method not in SAFE_METHODS:
+            response.set_cookie(
+                self.cookie_name, str(int(time.time() + self.pin_seconds)),
+                max_age=self.pin_seconds, httponly=True, samesite='Lax',
+            )
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        view = getattr(view_func, 'view_class', view_func)
+        if getattr(view, 'replica_reads', False) and request.method in SAFE_METHODS and not self.is_pinned(request):
+            _local.replica_reads = True
+
+    def is_pinned(self, request):
+        try:
+            return float(request.COOKIES.get(self.cookie_name, 0)) > time.time()
+        except ValueError:
+            return False
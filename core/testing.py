@@ -0,0 +1,32 @@
+from contextlib import contextmanager
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.test.utils import CaptureQueriesContext
+
+
+@contextmanager
+def assert_max_queries(max_queries, using=DEFAULT_DB_ALIAS):
+    """Fail if the block runs more than max_queries queries on one database"""
+    with CaptureQueriesContext(connections[using]) as context:
+        yield context
+    if len(context) > max_queries:
+        queries = '\n'.join(f"{i}. {query['sql']}" for i, query in enumerate(context.captured_queries, 1))
+        raise AssertionError(f"{len(context)} queries exceed the budget of {max_queries}:\n{queries}")
+
+
+def assert_view_queries(client, url, max_queries, method='get', **kwargs):
+    """
+    Request url and fail if its view ran more than max_queries queries.
+
+    Counts come from RequestInstrumentationMiddleware, so they cover every
+    database and the whole middleware stack; returns the response.
+    """
+    response = getattr(client, method)(url, **kwargs)
+    metrics = getattr(response, 'request_metrics', None)
+    if metrics is None:
+        raise AssertionError(
+            "No request metrics on the response; RequestInstrumentationMiddleware must be installed "
+            "with REQUEST_METRICS_SAMPLE_RATE = 1"
+        )
+    if metrics.queries > max_queries:
+        raise AssertionError(f"{method.upper()} {url} ran {metrics.queries} queries, the budget is {max_queries}")
+    return response
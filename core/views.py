@@ -0,0 +1,40 @@
+import hmac
+from django.conf import settings
+from django.http import HttpResponse
+from django.views import View
+from .instrumentation import get_request_metrics
+from .metrics import get_metrics_registry
+from .mixins import AuthRequiredMixin, AjaxResponseMixin
+
+
+class RequestMetricsView(AuthRequiredMixin, AjaxResponseMixin, View):
+    """Per-view request metrics of this process, for staff"""
+
+    def get(self, request):
+        if not request.user.is_staff:
+            return self.render_to_json_response({'status': 'error', 'message': 'Staff only'}, status=403)
+        return self.render_to_json_response({
+            'sample_rate': getattr(settings, 'REQUEST_METRICS_SAMPLE_RATE', 1.0),
+            'views': get_request_metrics().snapshot(),
+        })
+
+
+class MetricsView(View):
+    """
+    Prometheus scrape endpoint.
+
+    With METRICS_TOKEN set the scraper must send it as a bearer token;
+    without one only logged-in staff can read the metrics.
+    """
+
+    def get(self, request):
+        token = getattr(settings, 'METRICS_TOKEN', '')
+        if token:
+            header = request.headers.get('Authorization', '')
+            if not hmac.compare_digest(header.encode(), f'Bearer {token}'.encode()):
+                return HttpResponse('Unauthorized\n', status=401, content_type='text/plain')
+        elif not (request.user.is_authenticated and request.user.is_staff):
+            return HttpResponse('Forbidden\n', status=403, content_type='text/plain')
+        # Importing the sync metrics registers them, so they render before the first sync
+        import sync.metrics  # noqa: F401
+        return HttpResponse(get_metrics_registry().render(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -17,12 +17,17 @@ Including another URLconf
 from django.contrib import admin
 from django.urls import path, include
 from django.views.generic import RedirectView
+from core.views import MetricsView, RequestMetricsView
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('oauth/', include('oauth.urls')),
     path('emails/', include('emails.urls')),
     path('sync/', include('sync.urls')),
+    path('review/', include('review.urls')),
+    path('analytics/', include('analytics.urls')),
     path('accounts/', include('django.contrib.auth.urls')),
+    path('metrics/', MetricsView.as_view(), name='metrics'),
+    path('metrics/requests/', RequestMetricsView.as_view(), name='request_metrics'),
     path('', RedirectView.as_view(url='/emails/', permanent=False)),
 ]
@@ -0,0 +1,22 @@
+import time
+from django.core.management.base import BaseCommand
+from oauth.tokens import get_token_manager
+
+class Command(BaseCommand):
+    help = "Refresh OAuth access tokens that expire within the refresh margin, soonest first"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limit', type=int, default=None, help="Connections to refresh per sweep")
+        parser.add_argument('--concurrency', type=int, default=None, help="Refreshes in flight at once")
+        parser.add_argument('--loop', action='store_true', help="Keep sweeping")
+        parser.add_argument('--interval', type=float, default=60.0, help="Seconds between sweeps with --loop")
+
+    def handle(self, *args, **options):
+        manager = get_token_manager()
+        while True:
+            refreshed, failed = manager.refresh_due(limit=options['limit'], concurrency=options['concurrency'])
+            self.stdout.write(f"Refreshed {refreshed} tokens, {failed} failed")
+
+            if not options['loop']:
+                return
+            time.sleep(options['interval'])
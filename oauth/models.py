@@ -1,6 +1,7 @@
 from django.db import models
 from emails.models import User, EmailAccount
 from django.utils import timezone
+from datetime import timedelta
 import json
 
 class OAuthConnection(models.Model):
@@ -33,11 +34,15 @@ class OAuthConnection(models.Model):
     def __str__(self):
         return f"{self.user.email} - {self.provider} OAuth"
     
-    def is_expired(self):
-        """Check if the access token has expired"""
+    def is_expired(self, margin=None):
+        """
+        Check if the access token has expired, or will within margin (a timedelta).
+
+        A token without a known expiry counts as expired, so it gets refreshed.
+        """
         if not self.token_expiry:
             return True
-        return timezone.now() >= self.token_expiry
+        return timezone.now() + (margin or timedelta()) >= self.token_expiry
     
     def get_scopes(self):
         """Get scopes as a list"""
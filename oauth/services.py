@@ -3,6 +3,7 @@ from datetime import datetime, timedelta
 from django.utils import timezone
 from django.conf import settings
 from .models import OAuthConnection
+from .tokens import get_token_manager
 from emails.models import EmailAccount
 
 logger = logging.getLogger(__name__)
@@ -70,25 +71,18 @@ class OAuthService:
             raise
     
     @staticmethod
-    def refresh_access_token(connection):
+    def refresh_access_token(connection, force=True):
         """
-        Refresh the access token for an OAuth connection
+        Refresh the access token for an OAuth connection now and return the updated connection
         """
-        # In a real implementation, this would make an API call to refresh the token
-        # For now, we'll just log the action
-        logger.info(f"Refreshing access token for {connection.user.email} - {connection.provider}")
-        # This is where you would implement the actual token refresh logic
-        # using the refresh_token and provider-specific APIs
-        pass
+        return get_token_manager().refresh(connection.pk, force=force)
     
     @staticmethod
     def is_token_expired(connection):
         """
-        Check if the OAuth token is expired
+        Check if the OAuth token is expired; a token without a known expiry counts as expired
         """
-        if not connection.token_expiry:
-            return False
-        return timezone.now() >= connection.token_expiry
+        return connection.is_expired()
     
     @staticmethod
     def get_active_connections(user):
@@ -1,10 +1,17 @@
-from django.test import TestCase
+from django.test import TestCase, TransactionTestCase
 from django.contrib.auth import get_user_model
+from django.db import connections
 from django.utils import timezone
 from datetime import timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
 from .models import OAuthConnection
 from emails.models import EmailAccount
 from .services import OAuthService
+from .tokens import TokenManager
+import json
+import threading
+import time
 
 User = get_user_model()
 
@@ -117,4 +124,131 @@ class OAuthServiceTest(TestCase):
         self.assertTrue(result)
         
         connection.refresh_from_db()
-        self.assertFalse(connection.is_active)
\ No newline at end of file
+        self.assertFalse(connection.is_active)
+
+class StubTokenEndpoint:
+    """Local OAuth token endpoint issuing numbered tokens, or a fixed error"""
+    
+    def __init__(self, delay=0.0, error=None):
+        self.requests = []
+        self.delay = delay
+        self.error = error
+        endpoint = self
+        
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                form = parse_qs(self.rfile.read(int(self.headers['Content-Length'])).decode())
+                endpoint.requests.append(form['refresh_token'][0])
+                time.sleep(endpoint.delay)
+                if endpoint.error:
+                    status, body = 400, {'error': endpoint.error}
+                else:
+                    status, body = 200, {'access_token': f"access-{len(endpoint.requests)}", 'expires_in': 3600}
+                payload = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+            
+            def log_message(self, *args):
+                pass
+        
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_port}/token"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+    
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+class TokenManagerTest(TestCase):
+    def setUp(self):
+        self.endpoint = StubTokenEndpoint()
+        self.addCleanup(self.endpoint.close)
+        override = self.settings(OAUTH_TOKEN_ENDPOINTS={'google': self.endpoint.url})
+        override.enable()
+        self.addCleanup(override.disable)
+        self.manager = TokenManager(refresh_margin=300, cache_ttl=60)
+    
+    def create_connection(self, name, expires_in, refresh_token='refresh'):
+        user = User.objects.create_user(username=name, email=f'{name}@example.com', password='testpass123')
+        account = EmailAccount.objects.create(user=user, email_address=f'{name}@example.com', provider='google', oauth_token='old')
+        return OAuthConnection.objects.create(
+            user=user,
+            email_account=account,
+            provider='google',
+            access_token='old',
+            refresh_token=f'{refresh_token}-{name}',
+            token_expiry=timezone.now() + timedelta(seconds=expires_in) if expires_in is not None else None,
+        )
+    
+    def test_missing_expiry_counts_as_expired_everywhere(self):
+        """Test that the model and the service agree on tokens without an expiry"""
+        connection = self.create_connection('noexpiry', None)
+        self.assertTrue(connection.is_expired())
+        self.assertTrue(OAuthService.is_token_expired(connection))
+    
+    def test_sweep_refreshes_due_tokens_soonest_first(self):
+        """Test that the background sweep only refreshes tokens inside the margin, in expiry order"""
+        soon = self.create_connection('soon', 120)
+        expired = self.create_connection('expired', -60)
+        self.create_connection('fresh', 3600)
+        
+        self.assertEqual(self.manager.refresh_due(concurrency=1), (2, 0))
+        self.assertEqual(self.endpoint.requests, ['refresh-expired', 'refresh-soon'])
+        
+        soon.refresh_from_db()
+        self.assertEqual(soon.access_token, 'access-2')
+        self.assertFalse(soon.is_expired(margin=timedelta(seconds=300)))
+        self.assertEqual(soon.email_account.oauth_token, 'access-2')
+        self.assertEqual(self.manager.token_for_account(expired.email_account), 'access-1')
+        self.assertEqual(self.manager.refresh_due(concurrency=1), (0, 0))
+    
+    def test_valid_tokens_are_served_from_cache(self):
+        """Test that workers get valid tokens without touching the token endpoint"""
+        connection = self.create_connection('valid', 3600)
+        for _ in range(3):
+            self.assertEqual(self.manager.get_access_token(connection), 'old')
+        self.assertEqual(self.manager.cache.hits, 2)
+        self.assertEqual(self.endpoint.requests, [])
+    
+    def test_revoked_grant_deactivates_connection(self):
+        """Test that an invalid_grant answer stops further refresh attempts"""
+        self.endpoint.error = 'invalid_grant'
+        connection = self.create_connection('revoked', -60)
+        
+        self.assertEqual(self.manager.refresh_due(concurrency=1), (0, 1))
+        connection.refresh_from_db()
+        self.assertFalse(connection.is_active)
+        self.assertEqual(self.manager.due_connections(), [])
+
+class TokenSingleFlightTest(TransactionTestCase):
+    def test_concurrent_refreshes_hit_the_endpoint_once(self):
+        """Test that workers racing on an expired token share a single refresh"""
+        endpoint = StubTokenEndpoint(delay=0.05)
+        self.addCleanup(endpoint.close)
+        user = User.objects.create_user(username='racer', email='racer@example.com', password='testpass123')
+        connection = OAuthConnection.objects.create(
+            user=user, provider='google', access_token='old', refresh_token='refresh',
+            token_expiry=timezone.now() - timedelta(seconds=1),
+        )
+        manager = TokenManager(refresh_margin=300)
+        tokens = []
+        
+        def worker():
+            try:
+                tokens.append(manager.get_access_token(connection))
+            finally:
+                connections.close_all()
+        
+        with self.settings(OAUTH_TOKEN_ENDPOINTS={'google': endpoint.url}):
+            threads = [threading.Thread(target=worker) for _ in range(6)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        
+        self.assertEqual(tokens, ['access-1'] * 6)
+        self.assertEqual(endpoint.requests, ['refresh'])
+        self.assertEqual(manager.refreshes, 1)
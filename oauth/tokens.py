@@ -0,0 +1,231 @@
+import json
+import logging
+import threading
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from django.conf import settings
+from django import db
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+from core.cache import TTLCache
+from .models import OAuthConnection
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TOKEN_ENDPOINTS = {
+    'google': 'https://oauth2.googleapis.com/token',
+    'microsoft': 'https://login.microsoftonline.com/common/oauth2/v2.0/token',
+    'yahoo': 'https://api.login.yahoo.com/oauth2/get_token',
+}
+
+class TokenRefreshError(Exception):
+    """
+    Raised when a provider does not issue a new access token.
+
+    permanent is True when retrying cannot help (revoked or invalid grant).
+    """
+
+    def __init__(self, message, permanent=False):
+        super().__init__(message)
+        self.permanent = permanent
+
+def request_token_refresh(connection, timeout=None):
+    """
+    Exchange a connection's refresh token at the provider's token endpoint.
+
+    Returns the decoded token response (access_token, expires_in and an
+    optional rotated refresh_token).
+    """
+    endpoints = dict(DEFAULT_TOKEN_ENDPOINTS, **getattr(settings, 'OAUTH_TOKEN_ENDPOINTS', {}))
+    endpoint = endpoints.get(connection.provider)
+    if not endpoint:
+        raise TokenRefreshError(f"No token endpoint for provider {connection.provider}", permanent=True)
+    client = getattr(settings, 'OAUTH_CLIENTS', {}).get(connection.provider, {})
+    body = urllib.parse.urlencode({
+        'grant_type': 'refresh_token',
+        'refresh_token': connection.refresh_token,
+        'client_id': client.get('client_id', ''),
+        'client_secret': client.get('client_secret', ''),
+    }).encode()
+    request = urllib.request.Request(
+        endpoint, data=body, method='POST',
+        headers={'Content-Type': 'application/x-www-form-urlencoded', 'Accept': 'application/json'},
+    )
+    timeout = timeout or getattr(settings, 'OAUTH_REFRESH_TIMEOUT', 10)
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            payload = json.loads(response.read() or b'{}')
+    except urllib.error.HTTPError as e:
+        try:
+            error = json.loads(e.read() or b'{}').get('error', '')
+        except ValueError:
+            error = ''
+        raise TokenRefreshError(
+            f"Token refresh for {connection} failed with {e.code} {error}".rstrip(),
+            permanent=error in ('invalid_grant', 'unauthorized_client', 'invalid_client'),
+        ) from e
+    except (urllib.error.URLError, OSError, ValueError) as e:
+        raise TokenRefreshError(f"Token refresh for {connection} failed: {e}") from e
+    if not payload.get('access_token'):
+        raise TokenRefreshError(f"Token endpoint returned no access token for {connection}")
+    return payload
+
+class TokenManager:
+    """
+    Hands out access tokens and refreshes them ahead of expiry.
+
+    Tokens still valid for longer than refresh_margin seconds are served
+    from an in-process cache, so sync workers never wait on the token
+    endpoint; the background sweep (refresh_due) renews tokens entering the
+    margin in expiry order. A refresh is single-flight: threads share a
+    per-connection lock and processes serialize on the connection's row
+    lock, and whoever comes second reuses the token the first one stored.
+    """
+
+    def __init__(self, refresh=request_token_refresh, refresh_margin=None, cache_ttl=None):
+        self.refresh_token_request = refresh
+        self.refresh_margin = timedelta(seconds=refresh_margin or getattr(settings, 'OAUTH_REFRESH_MARGIN', 300))
+        self.cache = TTLCache(maxsize=100000, ttl=cache_ttl or getattr(settings, 'OAUTH_TOKEN_CACHE_TTL', 60))
+        self._locks = {}
+        self._locks_lock = threading.Lock()
+        self.refreshes = 0
+
+    def _lock_for(self, connection_id):
+        with self._locks_lock:
+            return self._locks.setdefault(connection_id, threading.Lock())
+
+    def get_access_token(self, connection):
+        """
+        Return a usable access token, refreshing inline only if it already expired
+        """
+        cached = self.cache.get(connection.pk)
+        if cached is not None:
+            return cached
+        if connection.is_expired() and connection.refresh_token:
+            connection = self.refresh(connection.pk)
+        elif not connection.is_expired():
+            self._cache_token(connection)
+        return connection.access_token
+
+    def _cache_token(self, connection):
+        """
+        Cache a token until it enters the refresh margin (and at most for the cache TTL)
+        """
+        if connection.token_expiry is None:
+            return
+        remaining = (connection.token_expiry - self.refresh_margin - timezone.now()).total_seconds()
+        if remaining > 0:
+            ttl = min(remaining, self.cache.ttl)
+            self.cache.set(connection.pk, connection.access_token, ttl=ttl)
+            if connection.email_account_id:
+                self.cache.set(('account', connection.email_account_id), connection.access_token, ttl=ttl)
+
+    def refresh(self, connection_id, force=False):
+        """
+        Refresh one connection's token unless someone else just did; returns the connection
+        """
+        with self._lock_for(connection_id):
+            with transaction.atomic():
+                connection = OAuthConnection.objects.select_for_update().get(pk=connection_id)
+                if not force and not connection.is_expired(margin=self.refresh_margin):
+                    self._cache_token(connection)
+                    return connection
+                if not connection.refresh_token:
+                    raise TokenRefreshError(f"{connection} has no refresh token", permanent=True)
+
+                payload = self.refresh_token_request(connection)
+                connection.access_token = payload['access_token']
+                if payload.get('refresh_token'):
+                    connection.refresh_token = payload['refresh_token']
+                expires_in = payload.get('expires_in')
+                connection.token_expiry = timezone.now() + timedelta(seconds=int(expires_in)) if expires_in else None
+                connection.save(update_fields=['access_token', 'refresh_token', 'token_expiry', 'updated_at'])
+                if connection.email_account_id:
+                    connection.email_account.oauth_token = connection.access_token
+                    connection.email_account.save(update_fields=['oauth_token'])
+            self.refreshes += 1
+            self.cache.delete(connection.pk)
+            self.cache.delete(('account', connection.email_account_id))
+            self._cache_token(connection)
+        logger.info(f"Refreshed access token for {connection}")
+        return connection
+
+    def due_connections(self, limit=None):
+        """
+        IDs of active connections whose tokens expire within the margin, soonest first
+        """
+        limit = limit or getattr(settings, 'OAUTH_REFRESH_BATCH_SIZE', 100)
+        return list(
+            OAuthConnection.objects.filter(is_active=True)
+            .exclude(refresh_token='')
+            .filter(Q(token_expiry__isnull=True) | Q(token_expiry__lte=timezone.now() + self.refresh_margin))
+            .order_by(F('token_expiry').asc(nulls_first=True))
+            .values_list('pk', flat=True)[:limit]
+        )
+
+    def refresh_due(self, limit=None, concurrency=None):
+        """
+        Background sweep: refresh every token due within the margin.
+
+        Refreshes run on a small thread pool; returns (refreshed, failed).
+        """
+        connection_ids = self.due_connections(limit)
+        if not connection_ids:
+            return 0, 0
+        concurrency = concurrency or getattr(settings, 'OAUTH_REFRESH_CONCURRENCY', 4)
+
+        def refresh_one(connection_id):
+            try:
+                self.refresh(connection_id)
+                return True
+            except TokenRefreshError as e:
+                logger.error(f"Could not refresh OAuth connection {connection_id}: {e}")
+                if e.permanent:
+                    OAuthConnection.objects.filter(pk=connection_id).update(is_active=False)
+                return False
+            except OAuthConnection.DoesNotExist:
+                return False
+
+        def refresh_in_thread(connection_id):
+            try:
+                return refresh_one(connection_id)
+            finally:
+                db.connections.close_all()
+
+        if concurrency > 1 and len(connection_ids) > 1:
+            with ThreadPoolExecutor(max_workers=concurrency) as executor:
+                results = list(executor.map(refresh_in_thread, connection_ids))
+        else:
+            results = [refresh_one(connection_id) for connection_id in connection_ids]
+        refreshed = sum(results)
+        logger.info(f"Token sweep refreshed {refreshed} of {len(results)} due OAuth connections")
+        return refreshed, len(results) - refreshed
+
+    def token_for_account(self, email_account):
+        """
+        Access token for an EmailAccount, via its OAuth connection when it has one
+        """
+        cached = self.cache.get(('account', email_account.pk))
+        if cached is not None:
+            return cached
+        connection = OAuthConnection.objects.filter(email_account=email_account, is_active=True).first()
+        if connection is None:
+            # Nothing will refresh this token; remember that for the cache TTL
+            self.cache.set(('account', email_account.pk), email_account.oauth_token)
+            return email_account.oauth_token
+        return self.get_access_token(connection)
+
+_default_manager = None
+
+def get_token_manager():
+    """
+    Return the process-wide token manager
+    """
+    global _default_manager
+    if _default_manager is None:
+        _default_manager = TokenManager()
+    return _default_manager
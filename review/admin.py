@@ -0,0 +1,15 @@
+from django.contrib import admin
+from .models import BulkDeleteJob, SelectionSet
+
+@admin.register(BulkDeleteJob)
+class BulkDeleteJobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'user', 'email_account', 'status', 'progress_percentage', 'created_at')
+    list_filter = ('status', 'created_at')
+    search_fields = ('user__email', 'email_account__email_address')
+    readonly_fields = ('created_at', 'started_at', 'completed_at', 'updated_at', 'progress_percentage')
+
+@admin.register(SelectionSet)
+class SelectionSetAdmin(admin.ModelAdmin):
+    list_display = ('id', 'user', 'email_account', 'created_at', 'updated_at')
+    search_fields = ('user__email', 'email_account__email_address')
+    readonly_fields = ('created_at', 'updated_at')
@@ -0,0 +1,42 @@
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+
+def _boolean(value):
+    if isinstance(value, str):
+        return value.lower() in ('1', 'true', 'yes')
+    return bool(value)
+
+def _datetime(value):
+    parsed = parse_datetime(value) if isinstance(value, str) else value
+    if parsed is None:
+        raise ValueError(f"Invalid datetime: {value!r}")
+    return parsed
+
+# Filter key -> (EmailMessage lookup, value converter)
+FILTER_LOOKUPS = {
+    'from_address': ('from_address__iexact', str),
+    'from_domain': ('from_address__iendswith', lambda value: f"@{value}"),
+    'subject_contains': ('subject__icontains', str),
+    'is_read': ('is_read', _boolean),
+    'is_starred': ('is_starred', _boolean),
+    'is_spam': ('is_spam', _boolean),
+    'is_important': ('is_important', _boolean),
+    'received_after': ('received_at__gte', _datetime),
+    'received_before': ('received_at__lt', _datetime),
+    'min_size': ('size__gte', int),
+    'max_size': ('size__lte', int),
+    'label': ('labels__contains', lambda value: f'"{value}"'),
+    'thread': ('conversation_id__in', lambda value: [int(pk) for pk in (value if isinstance(value, list) else [value])]),
+}
+
+def build_filter_q(filters):
+    """
+    Translate a saved query (a dict of filter keys) into a Q object for EmailMessage
+    """
+    q = Q()
+    for key, value in (filters or {}).items():
+        if key not in FILTER_LOOKUPS:
+            raise ValueError(f"Unknown filter: {key}")
+        lookup, convert = FILTER_LOOKUPS[key]
+        q &= Q(**{lookup: convert(value)})
+    return q
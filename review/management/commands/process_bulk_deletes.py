@@ -0,0 +1,24 @@
+import time
+from django.core.management.base import BaseCommand
+from review.services import BulkDeleteService
+
+class Command(BaseCommand):
+    help = "Run queued bulk delete and bulk action jobs in the background"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help="Exit when the queue is empty")
+        parser.add_argument('--poll-interval', type=float, default=2.0, help="Seconds to wait when the queue is empty")
+        parser.add_argument('--pause', type=float, default=None, help="Seconds to sleep between chunks")
+
+    def handle(self, *args, **options):
+        while True:
+            job = BulkDeleteService.claim_next_job()
+            if job is None:
+                if options['once']:
+                    return
+                time.sleep(options['poll_interval'])
+                continue
+
+            self.stdout.write(f"Running bulk {job.action} #{job.pk} ({job.total_messages} messages)")
+            job = BulkDeleteService.run_job(job, pause=options['pause'])
+            self.stdout.write(f"Bulk {job.action} #{job.pk} {job.status}: {job.deleted_messages} changed")
@@ -0,0 +1,30 @@
+import time
+from django.core.management.base import BaseCommand
+from review.services import TombstoneService
+
+class Command(BaseCommand):
+    help = "Hard-delete soft-deleted messages whose undo window has expired"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=None, help="Tombstones per batch")
+        parser.add_argument('--pause', type=float, default=None, help="Seconds to sleep between batches")
+        parser.add_argument('--max-batches', type=int, default=None, help="Stop after this many batches")
+        parser.add_argument('--loop', action='store_true', help="Keep purging, waiting for low load between runs")
+        parser.add_argument('--interval', type=float, default=300.0, help="Seconds between runs with --loop")
+        parser.add_argument('--force', action='store_true', help="Purge even when the system is busy")
+
+    def handle(self, *args, **options):
+        while True:
+            if options['force'] or TombstoneService.is_low_load():
+                purged = TombstoneService.purge_expired(
+                    batch_size=options['batch_size'],
+                    pause=options['pause'],
+                    max_batches=options['max_batches'],
+                )
+                self.stdout.write(f"Purged {purged} tombstones")
+            else:
+                self.stdout.write("System busy, skipping purge")
+
+            if not options['loop']:
+                return
+            time.sleep(options['interval'])
@@ -0,0 +1,43 @@
+# Generated by Django 5.2.18 on 2026-10-19 04:28
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        ('emails', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BulkDeleteJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('queued', 'Queued'), ('running', 'Running'), ('completed', 'Completed'), ('failed', 'Failed'), ('cancelled', 'Cancelled')], default='queued', max_length=20)),
+                ('message_ids', models.TextField(blank=True, help_text='JSON list of EmailMessage primary keys')),
+                ('filters', models.TextField(blank=True, help_text='JSON saved query')),
+                ('push_to_provider', models.BooleanField(default=True)),
+                ('chunk_size', models.IntegerField(default=500)),
+                ('total_messages', models.IntegerField(default=0)),
+                ('deleted_messages', models.IntegerField(default=0)),
+                ('provider_deleted', models.IntegerField(default=0)),
+                ('last_processed_id', models.BigIntegerField(default=0, help_text='Highest message primary key processed')),
+                ('error_message', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('completed_at', models.DateTimeField(blank=True, null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('email_account', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='emails.emailaccount')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['status', 'created_at'], name='review_bulk_status_daf44d_idx'), models.Index(fields=['user', '-created_at'], name='review_bulk_user_id_f33649_idx')],
+            },
+        ),
+    ]
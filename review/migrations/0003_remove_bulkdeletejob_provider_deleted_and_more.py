@@ -0,0 +1,21 @@
+# Generated by Django 5.2.18 on 2026-10-19 04:34
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('review', '0002_selectionset_bulkdeletejob_selection'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='bulkdeletejob',
+            name='provider_deleted',
+        ),
+        migrations.RemoveField(
+            model_name='bulkdeletejob',
+            name='push_to_provider',
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-19 05:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('review', '0003_remove_bulkdeletejob_provider_deleted_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='bulkdeletejob',
+            name='action',
+            field=models.CharField(choices=[('delete', 'Delete'), ('mark_read', 'Mark read'), ('mark_unread', 'Mark unread'), ('mark_spam', 'Mark spam'), ('mark_not_spam', 'Mark not spam'), ('add_label', 'Add label'), ('remove_label', 'Remove label')], default='delete', max_length=20),
+        ),
+        migrations.AddField(
+            model_name='bulkdeletejob',
+            name='label',
+            field=models.CharField(blank=True, help_text='Label for add_label/remove_label', max_length=255),
+        ),
+        migrations.AlterField(
+            model_name='bulkdeletejob',
+            name='deleted_messages',
+            field=models.IntegerField(default=0, help_text='Messages deleted, or changed for other actions'),
+        ),
+    ]
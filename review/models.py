@@ -0,0 +1,112 @@
+from django.db import models
+from emails.models import User, EmailAccount
+import json
+
+class SelectionSet(models.Model):
+    """
+    Server-side selection of email messages for "select all N matching" actions.
+
+    Membership is the saved query, plus explicitly included IDs, minus
+    explicitly excluded IDs. ID deltas are stored as sorted ranges.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    email_account = models.ForeignKey(EmailAccount, on_delete=models.CASCADE)
+    
+    filters = models.TextField(blank=True, help_text="JSON saved query")
+    included_ids = models.TextField(blank=True, help_text="Sorted ID ranges added to the query, e.g. 1-5,9")
+    excluded_ids = models.TextField(blank=True, help_text="Sorted ID ranges removed from the query")
+    
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    def __str__(self):
+        return f"Selection #{self.pk} for {self.email_account}"
+    
+    def get_filters(self):
+        """Get the saved query as a dict"""
+        if self.filters:
+            return json.loads(self.filters)
+        return {}
+
+class BulkDeleteJob(models.Model):
+    """
+    Model to track a background bulk action, usually a deletion, over email messages
+    """
+    ACTIONS = [
+        ('delete', 'Delete'),
+        ('mark_read', 'Mark read'),
+        ('mark_unread', 'Mark unread'),
+        ('mark_spam', 'Mark spam'),
+        ('mark_not_spam', 'Mark not spam'),
+        ('add_label', 'Add label'),
+        ('remove_label', 'Remove label'),
+    ]
+    
+    JOB_STATUSES = [
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('completed', 'Completed'),
+        ('failed', 'Failed'),
+        ('cancelled', 'Cancelled'),
+    ]
+    
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    email_account = models.ForeignKey(EmailAccount, on_delete=models.CASCADE)
+    status = models.CharField(max_length=20, choices=JOB_STATUSES, default='queued')
+    
+    # Selection
+    message_ids = models.TextField(blank=True, help_text="JSON list of EmailMessage primary keys")
+    filters = models.TextField(blank=True, help_text="JSON saved query")
+    selection = models.ForeignKey(SelectionSet, on_delete=models.SET_NULL, null=True, blank=True)
+    
+    # Options
+    action = models.CharField(max_length=20, choices=ACTIONS, default='delete')
+    label = models.CharField(max_length=255, blank=True, help_text="Label for add_label/remove_label")
+    chunk_size = models.IntegerField(default=500)
+    
+    # Progress tracking
+    total_messages = models.IntegerField(default=0)
+    deleted_messages = models.IntegerField(default=0, help_text="Messages deleted, or changed for other actions")
+    last_processed_id = models.BigIntegerField(default=0, help_text="Highest message primary key processed")
+    
+    # Error tracking
+    error_message = models.TextField(blank=True)
+    
+    # Timing
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    completed_at = models.DateTimeField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'created_at']),
+            models.Index(fields=['user', '-created_at']),
+        ]
+    
+    def __str__(self):
+        return f"Bulk {self.action} #{self.pk} for {self.email_account} ({self.status})"
+    
+    @property
+    def progress_percentage(self):
+        """Calculate deletion progress percentage"""
+        if self.total_messages > 0:
+            return min(100, int((self.deleted_messages / self.total_messages) * 100))
+        return 0
+    
+    @property
+    def is_finished(self):
+        """Check if the job has reached a final state"""
+        return self.status in ('completed', 'failed', 'cancelled')
+    
+    def get_message_ids(self):
+        """Get selected message IDs as a list"""
+        if self.message_ids:
+            return json.loads(self.message_ids)
+        return []
+    
+    def get_filters(self):
+        """Get the saved query as a dict"""
+        if self.filters:
+            return json.loads(self.filters)
+        return {}
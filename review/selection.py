@@ -0,0 +1,159 @@
+import heapq
+from bisect import bisect_left, bisect_right
+from django.conf import settings
+from django.db.models import Q
+
+class IdRangeSet:
+    """
+    Set of integer IDs stored as sorted, non-overlapping inclusive ranges.
+
+    Serializes to a compact string such as '1-5,9,12-40', so a selection of
+    hundreds of thousands of mostly contiguous IDs stays a few bytes long.
+    """
+
+    def __init__(self, ranges=None):
+        self._ranges = _union([], sorted([start, end] for start, end in ranges or []))
+
+    @classmethod
+    def from_ids(cls, ids):
+        """Build a set from an iterable of IDs"""
+        id_set = cls()
+        id_set._ranges = [list(run) for run in _runs(sorted(set(int(i) for i in ids)))]
+        return id_set
+
+    @classmethod
+    def parse(cls, value):
+        """Parse the serialized form produced by str()"""
+        ranges = []
+        for part in filter(None, (value or '').split(',')):
+            start, _, end = part.partition('-')
+            ranges.append((int(start), int(end or start)))
+        return cls(ranges)
+
+    def __str__(self):
+        return ','.join(
+            str(start) if start == end else f"{start}-{end}"
+            for start, end in self._ranges
+        )
+
+    def __len__(self):
+        return sum(end - start + 1 for start, end in self._ranges)
+
+    def __bool__(self):
+        return bool(self._ranges)
+
+    def __contains__(self, value):
+        index = bisect_right(self._ranges, [value, float('inf')]) - 1
+        return index >= 0 and self._ranges[index][0] <= value <= self._ranges[index][1]
+
+    def __iter__(self):
+        for start, end in self._ranges:
+            yield from range(start, end + 1)
+
+    @property
+    def ranges(self):
+        return [tuple(r) for r in self._ranges]
+
+    def add(self, value):
+        self.add_range(value, value)
+
+    def add_range(self, start, end):
+        """Add every ID in [start, end], merging with adjacent ranges"""
+        ranges = self._ranges
+        # Ranges touching [start, end] are the contiguous slice lo:hi
+        lo = bisect_left(ranges, start - 1, key=_end)
+        hi = bisect_right(ranges, end + 1, key=_start)
+        if lo < hi:
+            start = min(start, ranges[lo][0])
+            end = max(end, ranges[hi - 1][1])
+        ranges[lo:hi] = [[start, end]]
+
+    def discard(self, value):
+        self.discard_range(value, value)
+
+    def discard_range(self, start, end):
+        """Remove every ID in [start, end]"""
+        ranges = self._ranges
+        lo = bisect_left(ranges, start, key=_end)
+        hi = bisect_right(ranges, end, key=_start)
+        if lo >= hi:
+            return
+        remaining = []
+        if ranges[lo][0] < start:
+            remaining.append([ranges[lo][0], start - 1])
+        if ranges[hi - 1][1] > end:
+            remaining.append([end + 1, ranges[hi - 1][1]])
+        ranges[lo:hi] = remaining
+
+    def update(self, ids):
+        """Add many IDs in a single pass over the existing ranges"""
+        self._ranges = _union(self._ranges, _runs(sorted(set(int(i) for i in ids))))
+
+    def difference_update(self, ids):
+        """Remove many IDs in a single pass over the existing ranges"""
+        self._ranges = _difference(self._ranges, list(_runs(sorted(set(int(i) for i in ids)))))
+
+    def as_q(self, field='pk', max_in=None):
+        """
+        Return a Q object matching the IDs, using range lookups for runs.
+
+        Single IDs are split over IN lists of at most max_in values, which
+        keeps each list under the backends' parameter and list size limits.
+        """
+        max_in = max_in or getattr(settings, 'SELECTION_MAX_IN_SIZE', 500)
+        singles = [start for start, end in self._ranges if start == end]
+        q = Q(**{f"{field}__in": []})
+        for i in range(0, len(singles), max_in):
+            q |= Q(**{f"{field}__in": singles[i:i + max_in]})
+        for start, end in self._ranges:
+            if start != end:
+                q |= Q(**{f"{field}__range": (start, end)})
+        return q
+
+def _start(r):
+    return r[0]
+
+def _end(r):
+    return r[1]
+
+def _union(ranges, runs):
+    """Merge two sorted range sequences into one list of disjoint ranges"""
+    merged = []
+    for start, end in heapq.merge(ranges, runs, key=_start):
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return merged
+
+def _difference(ranges, removed):
+    """Subtract sorted disjoint ranges removed from sorted disjoint ranges"""
+    remaining = []
+    j = 0
+    for start, end in ranges:
+        while j < len(removed) and removed[j][1] < start:
+            j += 1
+        k = j
+        while k < len(removed) and removed[k][0] <= end and start <= end:
+            removed_start, removed_end = removed[k]
+            if removed_start > start:
+                remaining.append([start, removed_start - 1])
+            start = max(start, removed_end + 1)
+            k += 1
+        if start <= end:
+            remaining.append([start, end])
+    return remaining
+
+def _runs(sorted_ids):
+    """Yield (start, end) runs of consecutive IDs from a sorted list"""
+    start = end = None
+    for value in sorted_ids:
+        if start is None:
+            start = end = value
+        elif value == end + 1:
+            end = value
+        else:
+            yield start, end
+            start = end = value
+    if start is not None:
+        yield start, end
@@ -0,0 +1,503 @@
+import logging
+import json
+import time
+from collections import Counter
+from datetime import timedelta
+from django.conf import settings
+from django.utils import timezone
+from django.db import transaction
+from django.db.models import Q
+from emails.models import EmailAccount
+from sync.models import EmailMessage, EmailAttachment, SyncStatus
+from sync.providers import UidValidityMismatch, get_provider_client
+from sync.services import FlagSyncService
+from sync.threads import ThreadService
+from sync.dedup import DedupService
+from sync.storage import get_attachment_store
+from spam.services import SenderReputationService
+from analytics.services import ROLLUP_FIELDS, RollupService, StorageService
+from .filters import build_filter_q
+from .models import BulkDeleteJob, SelectionSet
+from .selection import IdRangeSet
+
+logger = logging.getLogger(__name__)
+
+class SelectionService:
+    """
+    Service class for server-side selection sets
+    """
+    
+    ACTIONS = ('delete', 'mark_read', 'mark_unread', 'mark_spam', 'mark_not_spam', 'add_label', 'remove_label')
+
+    @staticmethod
+    def create_selection(user, email_account, filters=None, include=None, exclude=None):
+        """
+        Create a selection from a saved query plus explicit ID deltas
+        """
+        build_filter_q(filters)
+        selection = SelectionSet(
+            user=user,
+            email_account=email_account,
+            filters=json.dumps(filters) if filters else '',
+        )
+        SelectionService._apply_deltas(selection, include, exclude)
+        selection.save()
+        return selection
+
+    @staticmethod
+    def update_selection(selection, include=None, exclude=None):
+        """
+        Add or remove explicit IDs; the latest delta for an ID wins
+        """
+        SelectionService._apply_deltas(selection, include, exclude)
+        selection.save(update_fields=['included_ids', 'excluded_ids', 'updated_at'])
+        return selection
+
+    @staticmethod
+    def _apply_deltas(selection, include, exclude):
+        included = IdRangeSet.parse(selection.included_ids)
+        excluded = IdRangeSet.parse(selection.excluded_ids)
+        if include:
+            excluded.difference_update(include)
+            included.update(include)
+        if exclude:
+            included.difference_update(exclude)
+            excluded.update(exclude)
+        selection.included_ids = str(included)
+        selection.excluded_ids = str(excluded)
+
+    @staticmethod
+    def get_queryset(selection):
+        """
+        Get the messages in a selection, always scoped to its user and account
+        """
+        filters = selection.get_filters()
+        included = IdRangeSet.parse(selection.included_ids)
+        excluded = IdRangeSet.parse(selection.excluded_ids)
+        
+        q = build_filter_q(filters) if filters else Q(pk__in=[])
+        if included:
+            q |= included.as_q()
+        queryset = EmailMessage.objects.live().filter(
+            user=selection.user,
+            email_account=selection.email_account,
+        ).filter(q)
+        if excluded:
+            queryset = queryset.exclude(excluded.as_q())
+        return queryset
+
+    @staticmethod
+    def count(selection):
+        """
+        Count the messages in a selection
+        """
+        return SelectionService.get_queryset(selection).count()
+
+    @staticmethod
+    def preview(selection, limit=50):
+        """
+        Get the newest messages in a selection for display
+        """
+        return SelectionService.get_queryset(selection).order_by('-received_at')[:limit]
+
+    @staticmethod
+    def iter_id_chunks(selection, chunk_size=1000):
+        """
+        Yield lists of message primary keys in ascending order using keyset pagination
+        """
+        queryset = SelectionService.get_queryset(selection).order_by('pk')
+        last_pk = 0
+        while True:
+            chunk = list(queryset.filter(pk__gt=last_pk).values_list('pk', flat=True)[:chunk_size])
+            if not chunk:
+                return
+            yield chunk
+            last_pk = chunk[-1]
+
+    @staticmethod
+    def apply_action(selection, action, label=None):
+        """
+        Queue a bulk action over every message in a selection and return the job.
+
+        Every action runs in the background worker in bounded chunks, so a
+        selection of any size never holds a web request or a long transaction.
+        """
+        if action not in SelectionService.ACTIONS:
+            raise ValueError(f"Unknown action: {action}")
+        if action in ('add_label', 'remove_label') and not label:
+            raise ValueError("A label is required")
+        return BulkDeleteService.create_job(
+            selection.user,
+            selection.email_account,
+            selection=selection,
+            action=action,
+            label=label or '',
+        )
+
+    @staticmethod
+    def apply_chunk(pks, action, label=None):
+        """
+        Apply a non-delete action to one chunk of messages, returning the number changed
+        """
+        if action in ('mark_read', 'mark_unread'):
+            is_read = action == 'mark_read'
+            FlagSyncService.record_changes(pks, ['is_read'])
+            flipped = list(EmailMessage.objects.filter(pk__in=pks, is_read=not is_read).values(*ROLLUP_FIELDS))
+            changed = EmailMessage.objects.filter(pk__in=pks).update(
+                is_read=is_read,
+                updated_at=timezone.now(),
+            )
+            RollupService.record(before=flipped, after=[dict(row, is_read=is_read) for row in flipped])
+            return changed
+        if action in ('mark_spam', 'mark_not_spam'):
+            return SelectionService._update_spam(pks, action == 'mark_spam')
+        FlagSyncService.record_changes(pks, ['labels'])
+        return SelectionService._update_labels(pks, label, add=(action == 'add_label'))
+
+    @staticmethod
+    def _update_spam(pks, is_spam):
+        """
+        Flip is_spam and feed the user's verdict into sender reputation
+        """
+        flipped = list(EmailMessage.objects.filter(pk__in=pks, is_spam=not is_spam).values('id', *ROLLUP_FIELDS))
+        EmailMessage.objects.filter(pk__in=[row['id'] for row in flipped]).update(
+            is_spam=is_spam,
+            updated_at=timezone.now(),
+        )
+        RollupService.record(before=flipped, after=[dict(row, is_spam=is_spam) for row in flipped])
+        senders = Counter(row['from_address'] for row in flipped)
+        for from_address, sender_count in senders.items():
+            SenderReputationService.record_spam(from_address, sender_count if is_spam else -sender_count)
+        SenderReputationService.flush_on_commit()
+        return len(flipped)
+
+    @staticmethod
+    def _update_labels(pks, label, add):
+        messages = list(EmailMessage.objects.filter(pk__in=pks).only('pk', 'labels'))
+        changed = []
+        for message in messages:
+            labels = json.loads(message.labels) if message.labels else []
+            if add and label not in labels:
+                labels.append(label)
+            elif not add and label in labels:
+                labels.remove(label)
+            else:
+                continue
+            message.labels = json.dumps(labels)
+            changed.append(message)
+        EmailMessage.objects.bulk_update(changed, ['labels'])
+        return len(changed)
+
+class TombstoneService:
+    """
+    Service class for soft deletion, undo and purging of expired tombstones
+    """
+
+    @staticmethod
+    def get_undo_window():
+        """
+        How long soft-deleted messages can be restored before they are purged
+        """
+        return timedelta(seconds=getattr(settings, 'SOFT_DELETE_UNDO_WINDOW', 7 * 24 * 60 * 60))
+
+    @staticmethod
+    def soft_delete(user, message_ids, deleted_at=None):
+        """
+        Tombstone live messages belonging to a user.
+
+        Returns (count, deleted_at); deleted_at doubles as the undo token.
+        """
+        deleted_at = deleted_at or timezone.now()
+        with transaction.atomic():
+            queryset = EmailMessage.objects.live().filter(user=user, pk__in=message_ids)
+            rows = list(queryset.values('id', 'conversation_id', *ROLLUP_FIELDS))
+            count = queryset.update(is_deleted=True, deleted_at=deleted_at, updated_at=timezone.now())
+            RollupService.record(before=rows)
+            StorageService.record_message_attachments([row['id'] for row in rows], -1)
+            ThreadService.refresh_threads(row['conversation_id'] for row in rows)
+        senders = Counter(row['from_address'] for row in rows)
+        for from_address, sender_count in senders.items():
+            SenderReputationService.record_deleted(from_address, sender_count)
+        # Web processes have no sync to flush for them; never flush inside a job's chunk transaction
+        SenderReputationService.flush_on_commit()
+        return count, deleted_at
+
+    @staticmethod
+    def soft_delete_threads(user, thread_ids, deleted_at=None):
+        """
+        Tombstone every live message in the given threads
+        """
+        message_ids = list(EmailMessage.objects.live().filter(
+            user=user,
+            conversation_id__in=thread_ids,
+        ).values_list('id', flat=True))
+        return TombstoneService.soft_delete(user, message_ids, deleted_at=deleted_at)
+
+    @staticmethod
+    def undo(user, deleted_at=None, message_ids=None):
+        """
+        Restore tombstones that are still inside the undo window.
+
+        Either deleted_at (the token returned by soft_delete) or explicit
+        message_ids selects what to restore. Returns the number restored.
+        """
+        if deleted_at is None and not message_ids:
+            raise ValueError("Undo needs a deletion token or message_ids")
+
+        queryset = EmailMessage.objects.tombstones().filter(
+            user=user,
+            deleted_at__gte=timezone.now() - TombstoneService.get_undo_window(),
+        )
+        if deleted_at is not None:
+            queryset = queryset.filter(deleted_at=deleted_at)
+        if message_ids:
+            queryset = queryset.filter(pk__in=message_ids)
+
+        with transaction.atomic():
+            rows = list(queryset.values('id', 'conversation_id', *ROLLUP_FIELDS))
+            restored = queryset.update(is_deleted=False, deleted_at=None, updated_at=timezone.now())
+            RollupService.record(after=[dict(row, is_deleted=False) for row in rows])
+            StorageService.record_message_attachments([row['id'] for row in rows], 1)
+            ThreadService.refresh_threads(row['conversation_id'] for row in rows)
+        senders = Counter(row['from_address'] for row in rows)
+        for from_address, sender_count in senders.items():
+            SenderReputationService.record_deleted(from_address, -sender_count)
+        SenderReputationService.flush_on_commit()
+
+        logger.info(f"Restored {restored} messages for {user.email}")
+        return restored
+
+    @staticmethod
+    def is_low_load():
+        """
+        Check whether the system is quiet enough to purge
+        """
+        max_active = getattr(settings, 'TOMBSTONE_PURGE_MAX_ACTIVE_SYNCS', 2)
+        active_syncs = SyncStatus.objects.filter(is_syncing=True).count()
+        running_jobs = BulkDeleteJob.objects.filter(status='running').count()
+        return active_syncs <= max_active and running_jobs == 0
+
+    @staticmethod
+    def purge_expired(batch_size=None, pause=None, max_batches=None, client_factory=get_provider_client):
+        """
+        Hard-delete expired tombstones in small batches, pushing each batch to the provider first.
+
+        Accounts whose provider push fails are skipped for the rest of the run
+        so their tombstones are retried later. Tombstones whose folder's
+        UIDVALIDITY changed are purged locally only: their UIDs may name
+        other messages now and can never be pushed. Returns the number purged.
+        """
+        batch_size = batch_size or getattr(settings, 'TOMBSTONE_PURGE_BATCH_SIZE', 200)
+        if pause is None:
+            pause = getattr(settings, 'TOMBSTONE_PURGE_PAUSE', 0.1)
+        cutoff = timezone.now() - TombstoneService.get_undo_window()
+
+        purged = 0
+        batches = 0
+        failed_accounts = set()
+        while max_batches is None or batches < max_batches:
+            batch = list(
+                EmailMessage.objects.tombstones()
+                .filter(deleted_at__lt=cutoff)
+                .exclude(email_account_id__in=failed_accounts)
+                .order_by('deleted_at')
+                .values_list('pk', 'email_account_id', 'folder', 'uid_validity', 'message_id', 'shared_body_id')[:batch_size]
+            )
+            if not batch:
+                break
+            batches += 1
+
+            by_folder = {}
+            for pk, account_id, folder, uid_validity, message_id, _ in batch:
+                by_folder.setdefault((account_id, folder, uid_validity), []).append((pk, message_id))
+
+            for (account_id, folder, uid_validity), rows in by_folder.items():
+                if account_id in failed_accounts:
+                    continue
+                email_account = EmailAccount.objects.get(pk=account_id)
+                try:
+                    with client_factory(email_account) as client:
+                        client.delete_messages(
+                            [message_id for _, message_id in rows], folder=folder or None, uid_validity=uid_validity,
+                        )
+                except UidValidityMismatch as e:
+                    # A resync sees the folder's messages under new UIDs and new rows, so
+                    # these tombstones would be retried and skipped forever
+                    logger.warning(f"Purging {len(rows)} tombstones for {email_account} without deleting them on the provider: {e}")
+                except Exception as e:
+                    logger.error(f"Error deleting tombstones on provider for {email_account}: {e}")
+                    failed_accounts.add(account_id)
+                    continue
+
+                pks = [pk for pk, _ in rows]
+                storage_keys = set(EmailAttachment.objects.filter(email_message_id__in=pks).exclude(
+                    storage_key='',
+                ).values_list('storage_key', flat=True))
+                with transaction.atomic():
+                    _, deleted = EmailMessage.objects.filter(pk__in=pks).delete()
+                purged += deleted.get(EmailMessage._meta.label, 0)
+                if storage_keys:
+                    get_attachment_store().delete_unreferenced(storage_keys)
+
+            # Drop shared bodies whose last copy was just purged
+            DedupService.delete_orphans({body_id for *_, body_id in batch if body_id})
+
+            # Yield the database between batches
+            if pause:
+                time.sleep(pause)
+
+        if purged:
+            logger.info(f"Purged {purged} expired tombstones")
+        return purged
+
+class BulkDeleteService:
+    """
+    Service class for queueing and running chunked bulk deletions.
+
+    Jobs only tombstone messages; provider deletion and the hard delete happen
+    in TombstoneService.purge_expired once the undo window has passed.
+    """
+
+    @staticmethod
+    def create_job(user, email_account, message_ids=None, filters=None, selection=None, action='delete', label=''):
+        """
+        Queue a bulk action (deletion by default) for an explicit ID set, a saved query or a selection
+        """
+        if not message_ids and not filters and selection is None:
+            raise ValueError("A bulk delete needs message_ids, filters or a selection")
+
+        # Validate the saved query up front so the worker never sees a bad one
+        build_filter_q(filters)
+
+        job = BulkDeleteJob(
+            user=user,
+            email_account=email_account,
+            message_ids=json.dumps(sorted(int(pk) for pk in message_ids)) if message_ids else '',
+            filters=json.dumps(filters) if filters else '',
+            selection=selection,
+            action=action,
+            label=label,
+            chunk_size=getattr(settings, 'BULK_DELETE_CHUNK_SIZE', 500),
+        )
+        job.total_messages = BulkDeleteService.get_queryset(job).count()
+        job.save()
+
+        logger.info(f"Queued bulk {action} #{job.pk} of {job.total_messages} messages for {email_account}")
+        return job
+
+    @staticmethod
+    def get_queryset(job):
+        """
+        Get the live messages selected by a job, always scoped to its user and account
+        """
+        if job.selection_id:
+            queryset = SelectionService.get_queryset(job.selection)
+        else:
+            queryset = EmailMessage.objects.live().filter(
+                user=job.user,
+                email_account=job.email_account,
+            )
+        message_ids = job.get_message_ids()
+        if message_ids:
+            queryset = queryset.filter(pk__in=message_ids)
+        filters = job.get_filters()
+        if filters:
+            queryset = queryset.filter(build_filter_q(filters))
+        return queryset
+
+    @staticmethod
+    def claim_next_job():
+        """
+        Atomically claim the oldest queued job, returning None if there is none
+        """
+        for job_id in BulkDeleteJob.objects.filter(status='queued').order_by('created_at').values_list('id', flat=True)[:10]:
+            claimed = BulkDeleteJob.objects.filter(id=job_id, status='queued').update(
+                status='running',
+                started_at=timezone.now(),
+            )
+            if claimed:
+                return BulkDeleteJob.objects.get(id=job_id)
+        return None
+
+    @staticmethod
+    def run_job(job, pause=None):
+        """
+        Apply a job's action to its messages in bounded chunks, each in its own short transaction.
+
+        Deletions tombstone every chunk with the job's start time as
+        deleted_at, which makes the whole job undoable in one step.
+        """
+        if pause is None:
+            pause = getattr(settings, 'BULK_DELETE_CHUNK_PAUSE', 0.05)
+        if job.status == 'queued':
+            job.started_at = timezone.now()
+            BulkDeleteJob.objects.filter(pk=job.pk, status='queued').update(
+                status='running',
+                started_at=job.started_at,
+            )
+
+        queryset = BulkDeleteService.get_queryset(job)
+
+        try:
+            while True:
+                # Pick up cancellations made while we were working
+                job.status = BulkDeleteJob.objects.values_list('status', flat=True).get(pk=job.pk)
+                if job.status == 'cancelled':
+                    break
+
+                pks = list(
+                    queryset.filter(pk__gt=job.last_processed_id)
+                    .order_by('pk')
+                    .values_list('pk', flat=True)[:job.chunk_size]
+                )
+                if not pks:
+                    job.status = 'completed'
+                    break
+
+                with transaction.atomic():
+                    if job.action == 'delete':
+                        changed, _ = TombstoneService.soft_delete(job.user, pks, deleted_at=job.started_at)
+                    else:
+                        changed = SelectionService.apply_chunk(pks, job.action, job.label)
+                job.deleted_messages += changed
+                job.last_processed_id = pks[-1]
+                job.save(update_fields=['deleted_messages', 'last_processed_id', 'updated_at'])
+
+                # Yield the database to other users between chunks
+                if pause:
+                    time.sleep(pause)
+
+            job.completed_at = timezone.now()
+            job.save(update_fields=['status', 'completed_at', 'updated_at'])
+            logger.info(f"Bulk {job.action} #{job.pk} finished with status {job.status}: {job.deleted_messages} changed")
+
+        except Exception as e:
+            logger.error(f"Error running bulk {job.action} #{job.pk}: {e}")
+            job.status = 'failed'
+            job.error_message = str(e)
+            job.completed_at = timezone.now()
+            job.save(update_fields=['status', 'error_message', 'completed_at', 'updated_at'])
+        finally:
+            SenderReputationService.flush()
+
+        return job
+
+    @staticmethod
+    def cancel_job(job):
+        """
+        Cancel a job that has not finished yet
+        """
+        return BulkDeleteJob.objects.filter(
+            pk=job.pk,
+            status__in=['queued', 'running'],
+        ).update(status='cancelled', completed_at=timezone.now()) > 0
+
+    @staticmethod
+    def undo_job(job):
+        """
+        Restore every message a job tombstoned, if still inside the undo window
+        """
+        if job.action != 'delete' or job.started_at is None:
+            return 0
+        BulkDeleteService.cancel_job(job)
+        return TombstoneService.undo(job.user, deleted_at=job.started_at)
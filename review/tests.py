@@ -0,0 +1,408 @@
+from django.test import TestCase
+from django.contrib.auth import get_user_model
+from django.urls import reverse
+from django.utils import timezone
+from emails.models import EmailAccount
+from sync.models import EmailMessage, EmailAttachment
+from spam.services import SenderReputationService
+from .models import BulkDeleteJob
+from .selection import IdRangeSet
+from .services import BulkDeleteService, SelectionService, TombstoneService
+from datetime import timedelta
+import json
+
+User = get_user_model()
+
+class RecordingProviderClient:
+    """Provider client double that records the message IDs it was asked to delete"""
+    def __init__(self):
+        self.batches = []
+        self.closed = False
+    
+    def delete_messages(self, message_ids, **kwargs):
+        self.batches.append(list(message_ids))
+        return len(message_ids)
+    
+    def close(self):
+        self.closed = True
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc_info):
+        self.close()
+
+class ReviewTestCase(TestCase):
+    def setUp(self):
+        # Reputation events buffered by earlier tests belong to rolled back data
+        SenderReputationService.buffer._pending.clear()
+        self.user = User.objects.create_user(
+            username='testuser',
+            email='test@example.com',
+            password='testpass123'
+        )
+        self.email_account = EmailAccount.objects.create(
+            user=self.user,
+            email_address='test@example.com',
+            provider='imap',
+            imap_server='imap.example.com',
+            smtp_server='smtp.example.com',
+        )
+    
+    def create_messages(self, count, from_address='news@bulk.example', **extra):
+        now = timezone.now()
+        start = EmailMessage.objects.count()
+        EmailMessage.objects.bulk_create([
+            EmailMessage(
+                email_account=self.email_account,
+                user=self.user,
+                message_id=str(start + i + 1),
+                subject=f'Message {i}',
+                from_address=from_address,
+                to_addresses='[]',
+                sent_at=now,
+                received_at=now,
+                size=1024,
+                **extra
+            )
+            for i in range(count)
+        ])
+
+class BulkDeleteServiceTest(ReviewTestCase):
+    def test_run_job_tombstones_in_chunks(self):
+        """Test that a job tombstones its selection chunk by chunk"""
+        self.create_messages(7)
+        self.create_messages(1, from_address='friend@home.example')
+        
+        job = BulkDeleteService.create_job(self.user, self.email_account, filters={'from_domain': 'bulk.example'})
+        job.chunk_size = 3
+        job.save()
+        
+        BulkDeleteService.run_job(job, pause=0)
+        
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'completed')
+        self.assertEqual(job.total_messages, 7)
+        self.assertEqual(job.deleted_messages, 7)
+        self.assertEqual(EmailMessage.objects.tombstones().filter(deleted_at=job.started_at).count(), 7)
+        self.assertEqual(EmailMessage.objects.live().count(), 1)
+    
+    def test_undo_job_restores_messages(self):
+        """Test that a whole bulk deletion can be undone in one step"""
+        self.create_messages(3)
+        job = BulkDeleteService.create_job(self.user, self.email_account, filters={'from_domain': 'bulk.example'})
+        BulkDeleteService.run_job(job, pause=0)
+        
+        self.assertEqual(BulkDeleteService.undo_job(job), 3)
+        self.assertEqual(EmailMessage.objects.live().count(), 3)
+    
+    def test_explicit_ids_are_scoped_to_user(self):
+        """Test that a job only deletes the requested messages belonging to its user"""
+        self.create_messages(3)
+        other = User.objects.create_user(username='other', email='other@example.com', password='testpass123')
+        other_account = EmailAccount.objects.create(
+            user=other, email_address='other@example.com', provider='imap',
+            imap_server='imap.example.com', smtp_server='smtp.example.com',
+        )
+        foreign = EmailMessage.objects.create(
+            email_account=other_account, user=other, message_id='99', subject='Keep',
+            from_address='a@b.example', to_addresses='[]',
+            sent_at=timezone.now(), received_at=timezone.now(), size=1,
+        )
+        keep, *delete = EmailMessage.objects.filter(user=self.user).order_by('pk')
+        
+        job = BulkDeleteService.create_job(
+            self.user, self.email_account,
+            message_ids=[m.pk for m in delete] + [foreign.pk],
+        )
+        BulkDeleteService.run_job(job, pause=0)
+        
+        self.assertEqual(job.total_messages, 2)
+        self.assertEqual(EmailMessage.objects.live().filter(pk__in=[keep.pk, foreign.pk]).count(), 2)
+        self.assertFalse(EmailMessage.objects.live().filter(pk__in=[m.pk for m in delete]).exists())
+    
+    def test_cancelled_job_stops(self):
+        """Test that a cancelled job does not delete anything further"""
+        self.create_messages(2)
+        job = BulkDeleteService.create_job(self.user, self.email_account, filters={'is_read': False})
+        self.assertTrue(BulkDeleteService.cancel_job(job))
+        
+        BulkDeleteService.run_job(job, pause=0)
+        
+        self.assertEqual(job.status, 'cancelled')
+        self.assertEqual(EmailMessage.objects.live().count(), 2)
+    
+    def test_unknown_filter_rejected(self):
+        """Test that saved queries with unknown keys are rejected"""
+        with self.assertRaises(ValueError):
+            BulkDeleteService.create_job(self.user, self.email_account, filters={'body__regex': '.*'})
+    
+    def test_claim_next_job(self):
+        """Test that queued jobs are claimed once"""
+        self.create_messages(1)
+        job = BulkDeleteService.create_job(self.user, self.email_account, filters={'is_read': False})
+        
+        claimed = BulkDeleteService.claim_next_job()
+        self.assertEqual(claimed.pk, job.pk)
+        self.assertEqual(claimed.status, 'running')
+        self.assertIsNone(BulkDeleteService.claim_next_job())
+
+class TombstoneServiceTest(ReviewTestCase):
+    def test_soft_delete_and_undo(self):
+        """Test that soft-deleted messages disappear from list queries until undone"""
+        self.create_messages(3)
+        pks = list(EmailMessage.objects.values_list('pk', flat=True))
+        
+        deleted, token = TombstoneService.soft_delete(self.user, pks[:2])
+        self.assertEqual(deleted, 2)
+        self.assertEqual(EmailMessage.objects.live().count(), 1)
+        
+        self.assertEqual(TombstoneService.undo(self.user, deleted_at=token), 2)
+        self.assertEqual(EmailMessage.objects.live().count(), 3)
+    
+    def test_soft_delete_flushes_reputation_after_commit(self):
+        """Test that user deletions reach sender reputation without waiting for a sync"""
+        from spam.models import SenderReputation
+        self.create_messages(2)
+        pks = list(EmailMessage.objects.values_list('pk', flat=True))
+        
+        with self.captureOnCommitCallbacks(execute=True):
+            TombstoneService.soft_delete(self.user, pks)
+        
+        self.assertEqual(SenderReputation.objects.get(scope='address', key='news@bulk.example').deleted_count, 2)
+    
+    def test_undo_window_expires(self):
+        """Test that tombstones older than the undo window cannot be restored"""
+        self.create_messages(1)
+        pk = EmailMessage.objects.get().pk
+        TombstoneService.soft_delete(self.user, [pk], deleted_at=timezone.now() - timedelta(days=30))
+        
+        with self.settings(SOFT_DELETE_UNDO_WINDOW=60):
+            self.assertEqual(TombstoneService.undo(self.user, message_ids=[pk]), 0)
+    
+    def test_purge_pushes_and_hard_deletes_expired(self):
+        """Test that the purger removes only expired tombstones, provider first"""
+        self.create_messages(3)
+        old, recent, live = EmailMessage.objects.order_by('pk')
+        EmailAttachment.objects.create(
+            email_message=old,
+            filename='a.pdf',
+            content_type='application/pdf',
+            size=10,
+            attachment_id='a1',
+        )
+        TombstoneService.soft_delete(self.user, [old.pk], deleted_at=timezone.now() - timedelta(days=30))
+        TombstoneService.soft_delete(self.user, [recent.pk])
+        client = RecordingProviderClient()
+        
+        with self.settings(SOFT_DELETE_UNDO_WINDOW=60):
+            purged = TombstoneService.purge_expired(pause=0, client_factory=lambda account: client)
+        
+        self.assertEqual(purged, 1)
+        self.assertEqual(client.batches, [[old.message_id]])
+        self.assertEqual(set(EmailMessage.objects.values_list('pk', flat=True)), {recent.pk, live.pk})
+        self.assertFalse(EmailAttachment.objects.exists())
+    
+    def test_purge_keeps_tombstones_when_provider_fails(self):
+        """Test that a provider failure leaves tombstones in place for a later retry"""
+        self.create_messages(1)
+        pk = EmailMessage.objects.get().pk
+        TombstoneService.soft_delete(self.user, [pk], deleted_at=timezone.now() - timedelta(days=30))
+        
+        class FailingClient(RecordingProviderClient):
+            def delete_messages(self, message_ids, **kwargs):
+                raise RuntimeError('provider down')
+        
+        with self.settings(SOFT_DELETE_UNDO_WINDOW=60):
+            self.assertEqual(TombstoneService.purge_expired(pause=0, client_factory=lambda account: FailingClient()), 0)
+        self.assertTrue(EmailMessage.objects.filter(pk=pk).exists())
+    
+    def test_purge_drops_tombstones_whose_uid_validity_changed_locally(self):
+        """Test that tombstones with stale UIDs are purged without a provider delete"""
+        from sync.providers import UidValidityMismatch
+        self.create_messages(2)
+        stale, fresh = EmailMessage.objects.order_by('pk')
+        EmailMessage.objects.filter(pk=stale.pk).update(folder='INBOX', uid_validity=1)
+        EmailMessage.objects.filter(pk=fresh.pk).update(folder='Archive', uid_validity=7)
+        TombstoneService.soft_delete(self.user, [stale.pk, fresh.pk], deleted_at=timezone.now() - timedelta(days=30))
+        
+        class ValidatingClient(RecordingProviderClient):
+            def delete_messages(self, message_ids, folder=None, uid_validity=None):
+                if folder == 'INBOX':
+                    raise UidValidityMismatch('UIDVALIDITY changed')
+                return super().delete_messages(message_ids)
+        
+        client = ValidatingClient()
+        with self.settings(SOFT_DELETE_UNDO_WINDOW=60):
+            self.assertEqual(TombstoneService.purge_expired(pause=0, client_factory=lambda account: client), 2)
+        self.assertFalse(EmailMessage.objects.exists())
+        self.assertEqual(client.batches, [[fresh.message_id]])
+    
+    def test_inbound_sync_does_not_resurrect_tombstones(self):
+        """Test that re-syncing a soft-deleted message keeps it deleted"""
+        from sync.services import EmailSyncService
+        message, _ = EmailSyncService.create_or_update_email_message(self.email_account, {
+            'id': '77', 'subject': 'Hi', 'from': 'a@b.example',
+        })
+        TombstoneService.soft_delete(self.user, [message.pk])
+        EmailSyncService.create_or_update_email_message(self.email_account, {
+            'id': '77', 'subject': 'Hi', 'from': 'a@b.example', 'is_deleted': False,
+        })
+        message.refresh_from_db()
+        self.assertTrue(message.is_deleted)
+
+class IdRangeSetTest(TestCase):
+    def test_round_trip_and_membership(self):
+        """Test that IDs collapse into ranges and serialize compactly"""
+        ids = IdRangeSet.from_ids([5, 1, 2, 3, 9, 10, 11, 20])
+        self.assertEqual(str(ids), '1-3,5,9-11,20')
+        self.assertEqual(len(ids), 8)
+        self.assertIn(10, ids)
+        self.assertNotIn(4, ids)
+        self.assertEqual(list(IdRangeSet.parse(str(ids))), [1, 2, 3, 5, 9, 10, 11, 20])
+    
+    def test_bulk_updates_merge_in_one_pass(self):
+        """Test that adding and removing many IDs splits and joins ranges correctly"""
+        ids = IdRangeSet.from_ids(range(0, 100, 2))
+        ids.update(range(1, 50, 2))
+        self.assertEqual(ids.ranges[0], (0, 50))
+        ids.difference_update([10, 11, 12, 98])
+        self.assertEqual(ids.ranges[:3], [(0, 9), (13, 50), (52, 52)])
+        self.assertEqual(len(ids), 51 + 24 - 4)
+    
+    def test_as_q_splits_large_in_lists(self):
+        """Test that scattered IDs are queried through bounded IN lists"""
+        ids = IdRangeSet.from_ids(range(0, 50, 2))
+        q = ids.as_q(max_in=10)
+        in_lists = [child[1] for child in q.children if child[0] == 'pk__in']
+        self.assertEqual([len(values) for values in in_lists], [0, 10, 10, 5])
+    
+    def test_add_and_discard_merge_ranges(self):
+        """Test that adding bridges ranges and discarding splits them"""
+        ids = IdRangeSet.parse('1-3,5-7')
+        ids.add(4)
+        self.assertEqual(str(ids), '1-7')
+        ids.difference_update([2, 6])
+        self.assertEqual(str(ids), '1,3-5,7')
+        ids.discard_range(0, 100)
+        self.assertFalse(ids)
+
+class SelectionServiceTest(ReviewTestCase):
+    def test_filter_with_include_and_exclude_deltas(self):
+        """Test that selection membership is query + includes - excludes"""
+        self.create_messages(5, from_address='news@bulk.example')
+        self.create_messages(2, from_address='friend@home.example')
+        bulk = list(EmailMessage.objects.filter(from_address='news@bulk.example').order_by('pk'))
+        friend = EmailMessage.objects.filter(from_address='friend@home.example').first()
+        
+        selection = SelectionService.create_selection(
+            self.user, self.email_account,
+            filters={'from_domain': 'bulk.example'},
+            include=[friend.pk],
+            exclude=[bulk[0].pk],
+        )
+        self.assertEqual(SelectionService.count(selection), 5)
+        
+        # Re-including an excluded ID moves it back into the selection
+        SelectionService.update_selection(selection, include=[bulk[0].pk])
+        self.assertEqual(SelectionService.count(selection), 6)
+        self.assertEqual(sum(len(chunk) for chunk in SelectionService.iter_id_chunks(selection, chunk_size=4)), 6)
+    
+    def test_mark_read_and_label_actions(self):
+        """Test that non-destructive bulk actions are queued and applied in chunks by the worker"""
+        self.create_messages(5)
+        selection = SelectionService.create_selection(self.user, self.email_account, filters={'is_read': False})
+        
+        for action, label in (('add_label', 'Newsletters'), ('mark_read', None)):
+            job = SelectionService.apply_action(selection, action, label=label)
+            self.assertEqual((job.status, job.action, job.total_messages), ('queued', action, 5))
+            job.chunk_size = 2
+            BulkDeleteService.run_job(job, pause=0)
+            job.refresh_from_db()
+            self.assertEqual((job.status, job.deleted_messages), ('completed', 5))
+        self.assertEqual(SelectionService.count(selection), 0)
+        self.assertEqual(BulkDeleteService.undo_job(job), 0)
+        self.assertTrue(all(json.loads(m.labels) == ['Newsletters'] for m in EmailMessage.objects.all()))
+    
+    def test_mark_spam_action_reports_senders(self):
+        """Test that marking a selection as spam feeds sender reputation"""
+        from spam.models import SenderReputation
+        from spam.services import SenderReputationService
+        self.create_messages(3)
+        selection = SelectionService.create_selection(self.user, self.email_account, filters={'from_domain': 'bulk.example'})
+        
+        BulkDeleteService.run_job(SelectionService.apply_action(selection, 'mark_spam'), pause=0)
+        SenderReputationService.flush()
+        self.assertEqual(EmailMessage.objects.filter(is_spam=True).count(), 3)
+        self.assertEqual(SenderReputation.objects.get(scope='domain', key='bulk.example').spam_count, 3)
+    
+    def test_delete_action_queues_job(self):
+        """Test that deleting a selection queues a bulk delete job over it"""
+        self.create_messages(4)
+        selection = SelectionService.create_selection(self.user, self.email_account, filters={'from_domain': 'bulk.example'})
+        
+        job = SelectionService.apply_action(selection, 'delete')
+        self.assertEqual(job.total_messages, 4)
+        BulkDeleteService.run_job(job, pause=0)
+        self.assertFalse(EmailMessage.objects.live().exists())
+
+class BulkDeleteViewTest(ReviewTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client.login(username='test@example.com', password='testpass123')
+    
+    def test_create_and_poll_job(self):
+        """Test that the API queues a job and reports its progress"""
+        self.create_messages(2)
+        response = self.client.post(
+            reverse('review:bulk_delete', kwargs={'account_id': self.email_account.id}),
+            data=json.dumps({'filters': {'from_domain': 'bulk.example'}}),
+            content_type='application/json',
+        )
+        self.assertEqual(response.status_code, 202)
+        job_id = response.json()['job_id']
+        self.assertEqual(BulkDeleteJob.objects.get(pk=job_id).status, 'queued')
+        
+        response = self.client.get(reverse('review:bulk_delete_status', kwargs={'job_id': job_id}))
+        self.assertEqual(response.json()['total_messages'], 2)
+    
+    def test_selection_api(self):
+        """Test creating, previewing and acting on a selection over the API"""
+        self.create_messages(3)
+        response = self.client.post(
+            reverse('review:selection_create', kwargs={'account_id': self.email_account.id}),
+            data=json.dumps({'filters': {'from_domain': 'bulk.example'}}),
+            content_type='application/json',
+        )
+        self.assertEqual(response.status_code, 201)
+        selection_id = response.json()['selection_id']
+        
+        response = self.client.get(reverse('review:selection_detail', kwargs={'selection_id': selection_id}), {'preview': 2})
+        self.assertEqual(response.json()['count'], 3)
+        self.assertEqual(len(response.json()['preview']), 2)
+        
+        response = self.client.post(
+            reverse('review:selection_action', kwargs={'selection_id': selection_id}),
+            data=json.dumps({'action': 'mark_read'}),
+            content_type='application/json',
+        )
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual((response.json()['action'], response.json()['total_messages']), ('mark_read', 3))
+    
+    def test_soft_delete_and_undo_api(self):
+        """Test the immediate soft delete endpoint and its undo token"""
+        self.create_messages(2)
+        pks = list(EmailMessage.objects.values_list('pk', flat=True))
+        response = self.client.post(
+            reverse('review:soft_delete'),
+            data=json.dumps({'message_ids': pks}),
+            content_type='application/json',
+        )
+        self.assertEqual(response.json()['deleted'], 2)
+        
+        response = self.client.post(
+            reverse('review:undo_delete'),
+            data=json.dumps({'undo_token': response.json()['undo_token']}),
+            content_type='application/json',
+        )
+        self.assertEqual(response.json()['restored'], 2)
@@ -0,0 +1,17 @@
+from django.urls import path
+from . import views
+
+app_name = 'review'
+
+urlpatterns = [
+    path('account/<int:account_id>/bulk-delete/', views.BulkDeleteCreateView.as_view(), name='bulk_delete'),
+    path('bulk-delete/<int:job_id>/', views.BulkDeleteStatusView.as_view(), name='bulk_delete_status'),
+    path('bulk-delete/<int:job_id>/cancel/', views.BulkDeleteCancelView.as_view(), name='bulk_delete_cancel'),
+    path('bulk-delete/<int:job_id>/undo/', views.BulkDeleteUndoView.as_view(), name='bulk_delete_undo'),
+    path('delete/', views.SoftDeleteView.as_view(), name='soft_delete'),
+    path('undo/', views.UndoDeleteView.as_view(), name='undo_delete'),
+    path('account/<int:account_id>/selections/', views.SelectionCreateView.as_view(), name='selection_create'),
+    path('selections/<int:selection_id>/', views.SelectionDetailView.as_view(), name='selection_detail'),
+    path('selections/<int:selection_id>/action/', views.SelectionActionView.as_view(), name='selection_action'),
+    path('selections/<int:selection_id>/export/<str:export_format>/', views.SelectionExportView.as_view(), name='selection_export'),
+]
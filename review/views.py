@@ -0,0 +1,234 @@
+from django.shortcuts import get_object_or_404
+from django.utils.dateparse import parse_datetime
+from django.views import View
+from core.mixins import AuthRequiredMixin, AjaxResponseMixin
+from emails.models import EmailAccount
+from sync.exports import ExportService, ExportUnavailable
+from .models import BulkDeleteJob, SelectionSet
+from .services import BulkDeleteService, SelectionService, TombstoneService
+import json
+
+def job_to_dict(job):
+    """Serialize a bulk job's progress for JSON responses"""
+    return {
+        'job_id': job.id,
+        'action': job.action,
+        'status': job.status,
+        'total_messages': job.total_messages,
+        'deleted_messages': job.deleted_messages,
+        'progress': job.progress_percentage,
+        'error_message': job.error_message,
+        'undo_until': (job.started_at + TombstoneService.get_undo_window()).isoformat()
+            if job.started_at else None,
+    }
+
+def selection_to_dict(selection, preview_limit=0):
+    """Serialize a selection's size, and optionally a preview, for JSON responses"""
+    data = {
+        'selection_id': selection.id,
+        'count': SelectionService.count(selection),
+    }
+    if preview_limit:
+        data['preview'] = [
+            {
+                'id': email.id,
+                'subject': email.subject,
+                'from_address': email.from_address,
+                'received_at': email.received_at.isoformat(),
+                'size': email.size,
+            }
+            for email in SelectionService.preview(selection, limit=preview_limit)
+        ]
+    return data
+
+class SelectionCreateView(AuthRequiredMixin, AjaxResponseMixin, View):
+    """Create a server-side selection from a filter expression"""
+    
+    def post(self, request, account_id):
+        email_account = get_object_or_404(
+            EmailAccount,
+            id=account_id,
+            user=request.user
+        )
+        
+        try:
+            payload = json.loads(request.body or '{}')
+            selection = SelectionService.create_selection(
+                request.user,
+                email_account,
+                filters=payload.get('filters'),
+                include=payload.get('include'),
+                exclude=payload.get('exclude'),
+            )
+        except (ValueError, TypeError) as e:
+            return self.render_to_json_response({
+                'status': 'error',
+                'message': str(e)
+            }, status=400)
+        
+        return self.render_to_json_response(selection_to_dict(selection), status=201)
+
+class SelectionDetailView(AuthRequiredMixin, AjaxResponseMixin, View):
+    """Count and preview a selection, or apply include/exclude deltas to it"""
+    
+    def get(self, request, selection_id):
+        selection = get_object_or_404(SelectionSet, id=selection_id, user=request.user)
+        try:
+            limit = min(int(request.GET.get('preview', 50)), 200)
+        except ValueError:
+            limit = 50
+        return self.render_to_json_response(selection_to_dict(selection, preview_limit=limit))
+    
+    def post(self, request, selection_id):
+        selection = get_object_or_404(SelectionSet, id=selection_id, user=request.user)
+        try:
+            payload = json.loads(request.body or '{}')
+            SelectionService.update_selection(
+                selection,
+                include=payload.get('include'),
+                exclude=payload.get('exclude'),
+            )
+        except (ValueError, TypeError) as e:
+            return self.render_to_json_response({
+                'status': 'error',
+                'message': str(e)
+            }, status=400)
+        return self.render_to_json_response(selection_to_dict(selection))
+
+class SelectionActionView(AuthRequiredMixin, AjaxResponseMixin, View):
+    """Queue a bulk action over every message in a selection"""
+    
+    def post(self, request, selection_id):
+        selection = get_object_or_404(SelectionSet, id=selection_id, user=request.user)
+        try:
+            payload = json.loads(request.body or '{}')
+            job = SelectionService.apply_action(
+                selection,
+                payload.get('action'),
+                label=payload.get('label'),
+            )
+        except (ValueError, TypeError) as e:
+            return self.render_to_json_response({
+                'status': 'error',
+                'message': str(e)
+            }, status=400)
+        
+        return self.render_to_json_response(job_to_dict(job), status=202)
+
+class SelectionExportView(AuthRequiredMixin, AjaxResponseMixin, View):
+    """Stream the messages of a selection, e.g. to keep a copy before deleting them"""
+    
+    def get(self, request, selection_id, export_format):
+        selection = get_object_or_404(SelectionSet, id=selection_id, user=request.user)
+        try:
+            return ExportService.response(
+                SelectionService.get_queryset(selection), export_format, f"selection-{selection.id}",
+            )
+        except ValueError as e:
+            return self.render_to_json_response({'status': 'error', 'message': str(e)}, status=404)
+        except ExportUnavailable as e:
+            return self.render_to_json_response({'status': 'error', 'message': str(e)}, status=501)
+
+class BulkDeleteCreateView(AuthRequiredMixin, AjaxResponseMixin, View):
+    """Queue a bulk deletion for an email account"""
+    
+    def post(self, request, account_id):
+        email_account = get_object_or_404(
+            EmailAccount,
+            id=account_id,
+            user=request.user
+        )
+        
+        try:
+            payload = json.loads(request.body or '{}')
+            job = BulkDeleteService.create_job(
+                request.user,
+                email_account,
+                message_ids=payload.get('message_ids'),
+                filters=payload.get('filters'),
+            )
+        except (ValueError, TypeError) as e:
+            return self.render_to_json_response({
+                'status': 'error',
+                'message': str(e)
+            }, status=400)
+        
+        return self.render_to_json_response(job_to_dict(job), status=202)
+
+class BulkDeleteStatusView(AuthRequiredMixin, AjaxResponseMixin, View):
+    """Report progress of a bulk deletion"""
+    
+    def get(self, request, job_id):
+        job = get_object_or_404(BulkDeleteJob, id=job_id, user=request.user)
+        return self.render_to_json_response(job_to_dict(job))
+
+class BulkDeleteCancelView(AuthRequiredMixin, AjaxResponseMixin, View):
+    """Cancel a bulk deletion that has not finished"""
+    
+    def post(self, request, job_id):
+        job = get_object_or_404(BulkDeleteJob, id=job_id, user=request.user)
+        BulkDeleteService.cancel_job(job)
+        job.refresh_from_db()
+        return self.render_to_json_response(job_to_dict(job))
+
+class BulkDeleteUndoView(AuthRequiredMixin, AjaxResponseMixin, View):
+    """Restore everything a bulk deletion tombstoned"""
+    
+    def post(self, request, job_id):
+        job = get_object_or_404(BulkDeleteJob, id=job_id, user=request.user)
+        restored = BulkDeleteService.undo_job(job)
+        return self.render_to_json_response({
+            'status': 'success',
+            'restored': restored,
+        })
+
+class SoftDeleteView(AuthRequiredMixin, AjaxResponseMixin, View):
+    """Soft-delete a small set of messages, or whole threads, immediately"""
+    
+    def post(self, request):
+        try:
+            payload = json.loads(request.body or '{}')
+            message_ids = [int(pk) for pk in payload.get('message_ids') or []]
+            thread_ids = [int(pk) for pk in payload.get('thread_ids') or []]
+        except (ValueError, TypeError) as e:
+            return self.render_to_json_response({
+                'status': 'error',
+                'message': str(e)
+            }, status=400)
+        
+        if thread_ids:
+            deleted, deleted_at = TombstoneService.soft_delete_threads(request.user, thread_ids)
+        else:
+            deleted, deleted_at = TombstoneService.soft_delete(request.user, message_ids)
+        return self.render_to_json_response({
+            'status': 'success',
+            'deleted': deleted,
+            'undo_token': deleted_at.isoformat(),
+            'undo_until': (deleted_at + TombstoneService.get_undo_window()).isoformat(),
+        })
+
+class UndoDeleteView(AuthRequiredMixin, AjaxResponseMixin, View):
+    """Restore soft-deleted messages by undo token or explicit IDs"""
+    
+    def post(self, request):
+        try:
+            payload = json.loads(request.body or '{}')
+            token = payload.get('undo_token')
+            deleted_at = parse_datetime(token) if token else None
+            if token and deleted_at is None:
+                raise ValueError("Invalid undo token")
+            restored = TombstoneService.undo(
+                request.user,
+                deleted_at=deleted_at,
+                message_ids=payload.get('message_ids'),
+            )
+        except (ValueError, TypeError) as e:
+            return self.render_to_json_response({
+                'status': 'error',
+                'message': str(e)
+            }, status=400)
+        
+        return self.render_to_json_response({
+            'status': 'success',
+            'restored': restored,
+        })
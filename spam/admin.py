@@ -0,0 +1,9 @@
+from django.contrib import admin
+from .models import SenderReputation
+
+@admin.register(SenderReputation)
+class SenderReputationAdmin(admin.ModelAdmin):
+    list_display = ('key', 'scope', 'message_count', 'delete_rate', 'spam_rate', 'updated_at')
+    list_filter = ('scope',)
+    search_fields = ('key',)
+    readonly_fields = ('updated_at', 'delete_rate', 'spam_rate')
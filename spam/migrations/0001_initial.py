@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-19 04:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SenderReputation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('scope', models.CharField(choices=[('address', 'Sender Address'), ('domain', 'Sender Domain')], max_length=10)),
+                ('key', models.CharField(help_text='Lowercased sender address or domain', max_length=255)),
+                ('message_count', models.BigIntegerField(default=0)),
+                ('deleted_count', models.BigIntegerField(default=0)),
+                ('spam_count', models.BigIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'unique_together': {('scope', 'key')},
+            },
+        ),
+    ]
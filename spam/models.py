@@ -0,0 +1,43 @@
+from django.db import models
+
+class SenderReputation(models.Model):
+    """
+    Global, anonymized reputation counters for a sender address or domain.
+
+    Rows are shared across all users and only ever hold aggregate counts,
+    never references to individual users or messages.
+    """
+    SCOPE_CHOICES = [
+        ('address', 'Sender Address'),
+        ('domain', 'Sender Domain'),
+    ]
+    
+    scope = models.CharField(max_length=10, choices=SCOPE_CHOICES)
+    key = models.CharField(max_length=255, help_text="Lowercased sender address or domain")
+    
+    # Aggregated counts
+    message_count = models.BigIntegerField(default=0)
+    deleted_count = models.BigIntegerField(default=0)
+    spam_count = models.BigIntegerField(default=0)
+    
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        unique_together = ('scope', 'key')
+    
+    def __str__(self):
+        return f"{self.key} ({self.scope})"
+    
+    @property
+    def delete_rate(self):
+        """Fraction of messages from this sender that users deleted"""
+        if self.message_count > 0:
+            return min(1.0, self.deleted_count / self.message_count)
+        return 0.0
+    
+    @property
+    def spam_rate(self):
+        """Fraction of messages from this sender that were marked as spam"""
+        if self.message_count > 0:
+            return min(1.0, self.spam_count / self.message_count)
+        return 0.0
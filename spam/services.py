@@ -0,0 +1,210 @@
+import logging
+import threading
+from collections import defaultdict
+from typing import NamedTuple
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Q
+from core.cache import TTLCache
+from .models import SenderReputation
+
+logger = logging.getLogger(__name__)
+
+class SenderFeatures(NamedTuple):
+    """Reputation features for a sender, as consumed by the spam classifier"""
+    address_volume: int = 0
+    address_delete_rate: float = 0.0
+    address_spam_rate: float = 0.0
+    domain_volume: int = 0
+    domain_delete_rate: float = 0.0
+    domain_spam_rate: float = 0.0
+
+UNKNOWN_SENDER = SenderFeatures()
+
+def split_sender(from_address):
+    """
+    Normalize a sender address and return (address, domain)
+    """
+    address = (from_address or '').strip().lower()
+    _, _, domain = address.rpartition('@')
+    return address, domain
+
+class ReputationBuffer:
+    """
+    In-process accumulator for reputation events.
+
+    Counts are merged per (scope, key) in memory and written to the database
+    in a single batch by flush(), so ingestion never pays a write per message.
+    """
+
+    def __init__(self, max_pending=None):
+        self.max_pending = max_pending or getattr(settings, 'SENDER_REPUTATION_MAX_PENDING', 500)
+        self._pending = defaultdict(lambda: [0, 0, 0])
+        self._lock = threading.Lock()
+
+    def record(self, from_address, received=0, deleted=0, spam=0):
+        """
+        Record events for a sender, flushing automatically when the buffer is full.
+
+        The automatic flush never runs inside the caller's transaction: it
+        would hold locks on hot domain rows for the rest of that transaction.
+        """
+        address, domain = split_sender(from_address)
+        if not domain:
+            return
+        with self._lock:
+            for key in (('address', address), ('domain', domain)):
+                counts = self._pending[key]
+                counts[0] += received
+                counts[1] += deleted
+                counts[2] += spam
+            should_flush = len(self._pending) >= self.max_pending
+        if should_flush:
+            self.flush_on_commit()
+
+    def flush_on_commit(self):
+        """
+        Flush now, or once the current transaction commits if one is open
+        """
+        connection = transaction.get_connection()
+        if not connection.in_atomic_block:
+            return self.flush()
+        # One pending callback per transaction is enough; callbacks of rolled back
+        # savepoints are dropped from run_on_commit, so this reschedules after those
+        if not any(callback == self.flush for _, callback, *_ in connection.run_on_commit):
+            transaction.on_commit(self.flush)
+        return 0
+
+    def flush(self):
+        """
+        Write all pending counts to the database and return the number of keys written.
+
+        A failed write is logged and its counts are kept for the next flush.
+        """
+        with self._lock:
+            pending, self._pending = self._pending, defaultdict(lambda: [0, 0, 0])
+        if not pending:
+            return 0
+
+        try:
+            with transaction.atomic():
+                SenderReputation.objects.bulk_create(
+                    [SenderReputation(scope=scope, key=key) for scope, key in pending],
+                    ignore_conflicts=True,
+                )
+                for (scope, key), (received, deleted, spam) in pending.items():
+                    SenderReputation.objects.filter(scope=scope, key=key).update(
+                        message_count=F('message_count') + received,
+                        deleted_count=F('deleted_count') + deleted,
+                        spam_count=F('spam_count') + spam,
+                    )
+        except Exception as e:
+            logger.error(f"Error flushing sender reputation counts: {e}")
+            # Put the counts back so the next flush retries them
+            with self._lock:
+                for key, (received, deleted, spam) in pending.items():
+                    counts = self._pending[key]
+                    counts[0] += received
+                    counts[1] += deleted
+                    counts[2] += spam
+            # Often an on_commit callback of a sync batch that has committed already;
+            # raising would only turn a reputation hiccup into a failed sync
+            return 0
+
+        for scope_key in pending:
+            SenderReputationService.cache.delete(scope_key)
+
+        logger.debug(f"Flushed reputation counts for {len(pending)} senders")
+        return len(pending)
+
+    def __len__(self):
+        return len(self._pending)
+
+class SenderReputationService:
+    """
+    Service class for reading and updating global sender reputation
+    """
+
+    cache = TTLCache(
+        maxsize=getattr(settings, 'SENDER_REPUTATION_CACHE_SIZE', 100000),
+        ttl=getattr(settings, 'SENDER_REPUTATION_CACHE_TTL', 300),
+    )
+    buffer = ReputationBuffer()
+
+    @staticmethod
+    def record_received(from_address, is_spam=False):
+        """
+        Record that a message from this sender was ingested
+        """
+        SenderReputationService.buffer.record(from_address, received=1, spam=int(bool(is_spam)))
+
+    @staticmethod
+    def record_deleted(from_address, count=1):
+        """
+        Record that a user deleted messages from this sender
+        """
+        SenderReputationService.buffer.record(from_address, deleted=count)
+
+    @staticmethod
+    def record_spam(from_address, count=1):
+        """
+        Record that a user marked messages from this sender as spam
+        """
+        SenderReputationService.buffer.record(from_address, spam=count)
+
+    @staticmethod
+    def flush():
+        """
+        Persist buffered reputation events
+        """
+        return SenderReputationService.buffer.flush()
+
+    @staticmethod
+    def flush_on_commit():
+        """
+        Persist buffered reputation events once the current transaction (if any) commits
+        """
+        return SenderReputationService.buffer.flush_on_commit()
+
+    @staticmethod
+    def get_features(from_address):
+        """
+        Return SenderFeatures for a sender, served from the in-process cache.
+
+        Address and domain features are cached under separate keys, so a
+        flush can invalidate a domain without knowing all of its senders.
+        """
+        address, domain = split_sender(from_address)
+        if not domain:
+            return UNKNOWN_SENDER
+
+        cache = SenderReputationService.cache
+        by_address = cache.get(('address', address))
+        by_domain = cache.get(('domain', domain))
+        if by_address is None or by_domain is None:
+            loaded = SenderReputationService._load_features(
+                address if by_address is None else None,
+                domain if by_domain is None else None,
+            )
+            if by_address is None:
+                by_address = loaded['address']
+                cache.set(('address', address), by_address)
+            if by_domain is None:
+                by_domain = loaded['domain']
+                cache.set(('domain', domain), by_domain)
+        return SenderFeatures(*by_address, *by_domain)
+
+    @staticmethod
+    def _load_features(address, domain):
+        """
+        Load (volume, delete_rate, spam_rate) per scope from the database in one query
+        """
+        q = Q(pk__in=[])
+        if address:
+            q |= Q(scope='address', key=address)
+        if domain:
+            q |= Q(scope='domain', key=domain)
+        features = {'address': (0, 0.0, 0.0), 'domain': (0, 0.0, 0.0)}
+        for row in SenderReputation.objects.filter(q):
+            features[row.scope] = (row.message_count, row.delete_rate, row.spam_rate)
+        return features
@@ -0,0 +1,145 @@
+from unittest import mock
+from django.db import DatabaseError
+from django.test import TestCase
+from django.contrib.auth import get_user_model
+from django.utils import timezone
+from core.cache import TTLCache
+from emails.models import EmailAccount
+from sync.services import EmailSyncService
+from .models import SenderReputation
+from .services import ReputationBuffer, SenderReputationService, UNKNOWN_SENDER
+
+User = get_user_model()
+
+class TTLCacheTest(TestCase):
+    def test_entries_expire_after_ttl(self):
+        """Test that cached values are dropped once their TTL has passed"""
+        now = [0.0]
+        cache = TTLCache(maxsize=10, ttl=5, clock=lambda: now[0])
+        cache.set('a', 1)
+        self.assertEqual(cache.get('a'), 1)
+        now[0] = 6.0
+        self.assertIsNone(cache.get('a'))
+    
+    def test_least_recently_used_entry_is_evicted(self):
+        """Test that the cache evicts the least recently used key when full"""
+        cache = TTLCache(maxsize=2, ttl=60)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        self.assertIn('a', cache)
+        self.assertNotIn('b', cache)
+
+class SenderReputationTest(TestCase):
+    def setUp(self):
+        SenderReputationService.cache.clear()
+    
+    def test_buffer_flush_aggregates_address_and_domain(self):
+        """Test that buffered events are merged and written per address and domain"""
+        buffer = ReputationBuffer(max_pending=100)
+        buffer.record('News@Bulk.example', received=1)
+        buffer.record('news@bulk.example', received=1, deleted=1)
+        buffer.record('promo@bulk.example', received=1, spam=1)
+        
+        self.assertEqual(buffer.flush(), 3)
+        
+        address = SenderReputation.objects.get(scope='address', key='news@bulk.example')
+        self.assertEqual(address.message_count, 2)
+        self.assertEqual(address.delete_rate, 0.5)
+        domain = SenderReputation.objects.get(scope='domain', key='bulk.example')
+        self.assertEqual(domain.message_count, 3)
+        self.assertEqual(domain.spam_count, 1)
+        
+        # A second flush adds to the existing counts
+        buffer.record('news@bulk.example', deleted=1)
+        buffer.flush()
+        address.refresh_from_db()
+        self.assertEqual(address.deleted_count, 2)
+    
+    def test_failed_flush_keeps_counts_for_the_next_one(self):
+        """Test that a failed flush is logged, not raised, and retried by the next flush"""
+        buffer = ReputationBuffer(max_pending=100)
+        buffer.record('news@bulk.example', received=1)
+        with mock.patch.object(SenderReputation.objects, 'bulk_create', side_effect=DatabaseError("deadlock")):
+            self.assertEqual(buffer.flush(), 0)
+        self.assertEqual(len(buffer), 2)
+        
+        self.assertEqual(buffer.flush(), 2)
+        self.assertEqual(SenderReputation.objects.get(scope='address', key='news@bulk.example').message_count, 1)
+    
+    def test_get_features_uses_cache(self):
+        """Test that reputation features are loaded once and then served from cache"""
+        SenderReputation.objects.create(scope='domain', key='bulk.example', message_count=10, spam_count=4)
+        
+        with self.assertNumQueries(1):
+            features = SenderReputationService.get_features('someone@bulk.example')
+            SenderReputationService.get_features('Someone@Bulk.example')
+        
+        self.assertEqual(features.domain_volume, 10)
+        self.assertEqual(features.domain_spam_rate, 0.4)
+        self.assertEqual(features.address_volume, 0)
+    
+    def test_automatic_flush_waits_for_commit(self):
+        """Test that a full buffer is not flushed inside the caller's transaction"""
+        buffer = ReputationBuffer(max_pending=2)
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            buffer.record('news@bulk.example', received=1)
+            buffer.record('news@bulk.example', received=1)
+            self.assertFalse(SenderReputation.objects.exists())
+        self.assertEqual(len(callbacks), 1)
+        self.assertEqual(SenderReputation.objects.get(scope='domain', key='bulk.example').message_count, 2)
+    
+    def test_flush_invalidates_domain_features(self):
+        """Test that flushed domain counts are visible to other senders of the domain"""
+        self.assertEqual(SenderReputationService.get_features('a@bulk.example').domain_volume, 0)
+        SenderReputationService.buffer.record('b@bulk.example', received=1, spam=1)
+        SenderReputationService.flush()
+        
+        features = SenderReputationService.get_features('a@bulk.example')
+        self.assertEqual((features.domain_volume, features.domain_spam_rate), (1, 1.0))
+    
+    def test_unknown_sender(self):
+        """Test that addresses without a domain get neutral features"""
+        self.assertEqual(SenderReputationService.get_features('not-an-address'), UNKNOWN_SENDER)
+    
+    def test_sync_records_received_messages(self):
+        """Test that ingestion feeds reputation counts and completing a sync flushes them"""
+        user = User.objects.create_user(username='testuser', email='test@example.com', password='testpass123')
+        email_account = EmailAccount.objects.create(
+            user=user,
+            email_address='test@example.com',
+            provider='google',
+            imap_server='imap.gmail.com',
+            smtp_server='smtp.gmail.com',
+        )
+        sync_log = EmailSyncService.start_sync(email_account.id, 'full')
+        EmailSyncService.create_or_update_email_message(email_account, {
+            'id': 'msg1',
+            'from': 'deals@shop.example',
+            'received_at': timezone.now(),
+            'is_spam': True,
+        })
+        EmailSyncService.complete_sync(sync_log)
+        
+        reputation = SenderReputation.objects.get(scope='address', key='deals@shop.example')
+        self.assertEqual(reputation.message_count, 1)
+        self.assertEqual(reputation.spam_rate, 1.0)
+    
+    def test_spam_verdict_from_provider_is_recorded(self):
+        """Test that a message moved to spam in the mail client counts as a spam report"""
+        user = User.objects.create_user(username='testuser', email='test@example.com', password='testpass123')
+        email_account = EmailAccount.objects.create(
+            user=user,
+            email_address='test@example.com',
+            provider='google',
+            imap_server='imap.gmail.com',
+            smtp_server='smtp.gmail.com',
+        )
+        message_data = {'id': 'msg1', 'from': 'deals@shop.example', 'received_at': timezone.now()}
+        EmailSyncService.create_or_update_email_message(email_account, message_data)
+        EmailSyncService.create_or_update_email_message(email_account, dict(message_data, is_spam=True))
+        SenderReputationService.flush()
+        
+        reputation = SenderReputation.objects.get(scope='address', key='deals@shop.example')
+        self.assertEqual((reputation.message_count, reputation.spam_count), (1, 1))
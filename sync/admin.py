@@ -1,5 +1,10 @@
 from django.contrib import admin
-from .models import EmailMessage, EmailAttachment, SyncStatus, SyncLog
+from django.utils.html import format_html, format_html_join
+from .models import (
+    EmailMessage, EmailAttachment, SyncStatus, SyncLog, PendingFlagChange, Thread, SyncProfilingTarget,
+    RetentionPolicy, ArchivePack,
+)
+from .profiler import SyncProfilerService
 
 @admin.register(EmailMessage)
 class EmailMessageAdmin(admin.ModelAdmin):
@@ -7,21 +12,22 @@ class EmailMessageAdmin(admin.ModelAdmin):
     list_filter = ('is_read', 'is_spam', 'is_important', 'received_at', 'email_account')
     search_fields = ('subject', 'from_address', 'to_addresses')
     readonly_fields = ('created_at', 'updated_at', 'last_synced_at')
+    raw_id_fields = ('conversation', 'shared_body')
     
     fieldsets = (
         ('Message Info', {
-            'fields': ('email_account', 'user', 'message_id', 'thread_id', 'subject', 
+            'fields': ('email_account', 'user', 'message_id', 'thread_id', 'internet_message_id', 'fingerprint', 'conversation', 'subject', 
                       'from_address', 'to_addresses', 'cc_addresses', 'bcc_addresses')
         }),
         ('Content', {
-            'fields': ('snippet', 'body_plain', 'body_html'),
+            'fields': ('snippet', 'body_plain', 'body_html', 'shared_body', 'is_archived'),
             'classes': ('collapse',)
         }),
         ('Dates', {
             'fields': ('sent_at', 'received_at')
         }),
         ('Flags', {
-            'fields': ('is_read', 'is_starred', 'is_draft', 'is_deleted', 'is_spam', 'is_important')
+            'fields': ('is_read', 'is_starred', 'is_draft', 'is_deleted', 'deleted_at', 'is_spam', 'is_important')
         }),
         ('Metadata', {
             'fields': ('size', 'labels', 'created_at', 'updated_at', 'last_synced_at')
@@ -32,7 +38,7 @@ class EmailMessageAdmin(admin.ModelAdmin):
 class EmailAttachmentAdmin(admin.ModelAdmin):
     list_display = ('filename', 'content_type', 'size', 'email_message')
     list_filter = ('content_type',)
-    search_fields = ('filename',)
+    search_fields = ('filename', 'storage_key')
     readonly_fields = ('created_at',)
 
 @admin.register(SyncStatus)
@@ -40,12 +46,27 @@ class SyncStatusAdmin(admin.ModelAdmin):
     list_display = ('email_account', 'is_syncing', 'progress_percentage', 'last_sync_completed')
     list_filter = ('is_syncing',)
     readonly_fields = ('updated_at', 'progress_percentage')
+    actions = ('enable_profiling', 'disable_profiling')
+    
+    @admin.action(description='Profile syncs of the selected accounts for an hour')
+    def enable_profiling(self, request, queryset):
+        for sync_status in queryset.select_related('email_account'):
+            SyncProfilerService.enable(sync_status.email_account, duration=3600)
+        self.message_user(request, f"Sampling profiler enabled for {queryset.count()} accounts")
+    
+    @admin.action(description='Stop profiling syncs of the selected accounts')
+    def disable_profiling(self, request, queryset):
+        disabled = sum(
+            SyncProfilerService.disable(sync_status.email_account)
+            for sync_status in queryset.select_related('email_account')
+        )
+        self.message_user(request, f"Removed {disabled} profiling targets")
 
 @admin.register(SyncLog)
 class SyncLogAdmin(admin.ModelAdmin):
-    list_display = ('email_account', 'sync_type', 'status', 'messages_processed', 'started_at')
+    list_display = ('email_account', 'sync_type', 'status', 'messages_processed', 'started_at', 'wall_seconds')
     list_filter = ('sync_type', 'status', 'started_at')
-    readonly_fields = ('created_at', 'completed_at')
+    readonly_fields = ('created_at', 'completed_at', 'timing_breakdown')
     
     fieldsets = (
         ('Sync Info', {
@@ -59,6 +80,57 @@ class SyncLogAdmin(admin.ModelAdmin):
             'classes': ('collapse',)
         }),
         ('Timing', {
-            'fields': ('started_at', 'completed_at', 'created_at')
+            'fields': ('started_at', 'completed_at', 'created_at', 'timing_breakdown')
         }),
-    )
\ No newline at end of file
+    )
+    
+    @admin.display(description='Seconds')
+    def wall_seconds(self, obj):
+        return obj.timing.get('wall', '-')
+    
+    @admin.display(description='Timing profile')
+    def timing_breakdown(self, obj):
+        timing = obj.timing
+        if not timing:
+            return '-'
+        phases = format_html_join(
+            '', '<tr><td>{}</td><td>{} s</td><td>{}%</td></tr>', obj.timing_phases,
+        )
+        counters = format_html_join(
+            '', '<tr><td>{}</td><td colspan="2">{}</td></tr>',
+            ((name, value) for name, value in timing.items() if name != 'phases'),
+        )
+        return format_html('<table>{}{}</table>', phases, counters)
+
+@admin.register(PendingFlagChange)
+class PendingFlagChangeAdmin(admin.ModelAdmin):
+    list_display = ('email_message', 'email_account', 'base_is_read', 'base_is_starred', 'version', 'updated_at')
+    list_filter = ('email_account',)
+    readonly_fields = ('created_at', 'updated_at')
+
+@admin.register(Thread)
+class ThreadAdmin(admin.ModelAdmin):
+    list_display = ('subject', 'email_account', 'message_count', 'total_size', 'last_activity_at')
+    list_filter = ('email_account',)
+    search_fields = ('subject',)
+    readonly_fields = ('created_at', 'updated_at')
+
+@admin.register(SyncProfilingTarget)
+class SyncProfilingTargetAdmin(admin.ModelAdmin):
+    list_display = ('email_account', 'worker', 'interval', 'expires_at', 'created_at')
+    raw_id_fields = ('email_account',)
+    readonly_fields = ('created_at',)
+
+@admin.register(RetentionPolicy)
+class RetentionPolicyAdmin(admin.ModelAdmin):
+    list_display = ('user', 'email_account', 'archive_after_days', 'updated_at')
+    raw_id_fields = ('user', 'email_account')
+    readonly_fields = ('created_at', 'updated_at')
+
+@admin.register(ArchivePack)
+class ArchivePackAdmin(admin.ModelAdmin):
+    list_display = ('storage_key', 'user', 'month', 'message_count', 'size', 'created_at')
+    list_filter = ('month',)
+    search_fields = ('storage_key',)
+    raw_id_fields = ('user',)
+    readonly_fields = ('created_at',)
@@ -0,0 +1,344 @@
+import json
+import logging
+import struct
+import tempfile
+import uuid
+import zlib
+from datetime import timedelta
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+from django.db import transaction
+from django.utils import timezone
+from .models import ArchiveEntry, ArchivePack, EmailAttachment, EmailMessage, RetentionPolicy
+from .storage import get_attachment_store
+
+logger = logging.getLogger(__name__)
+
+PACK_MAGIC = b'ISPACK1\n'
+RAW = b'r'
+ZLIB = b'z'
+COPY_CHUNK_SIZE = 1024 * 1024
+
+# Payloads that are compressed already; zlib would only spend CPU on them
+INCOMPRESSIBLE_TYPES = (
+    'image/jpeg', 'image/png', 'image/gif', 'image/webp', 'video/', 'audio/',
+    'application/zip', 'application/gzip', 'application/x-7z-compressed', 'application/x-rar',
+)
+
+EMPTY_RECORD = {'body_plain': '', 'body_html': '', 'attachments': {}}
+
+class PackWriter:
+    """
+    Writes one archive pack to a temporary file.
+
+    A pack is PACK_MAGIC followed by chunks, each a method byte (RAW or
+    ZLIB) and its data. Every message has a record chunk holding its bodies
+    and the locations of its attachment chunks; the last chunk is an index
+    of message id -> record location, followed by its 8-byte offset, so a
+    pack can be read back without the database.
+    """
+
+    def __init__(self, level=None):
+        self.level = getattr(settings, 'ARCHIVE_COMPRESSION_LEVEL', 6) if level is None else level
+        self.index = {}
+        self.size = 0
+        self._file = tempfile.TemporaryFile()
+        self._write(PACK_MAGIC)
+
+    def _write(self, data):
+        self._file.write(data)
+        self.size += len(data)
+
+    def _chunk(self, data):
+        offset = self.size
+        packed = zlib.compress(data, self.level)
+        if len(packed) < len(data):
+            self._write(ZLIB + packed)
+        else:
+            self._write(RAW + data)
+        return offset, self.size - offset
+
+    def _stream_chunk(self, f, compress):
+        offset = self.size
+        compressor = zlib.compressobj(self.level) if compress else None
+        self._write(ZLIB if compress else RAW)
+        while True:
+            data = f.read(COPY_CHUNK_SIZE)
+            if not data:
+                break
+            self._write(compressor.compress(data) if compress else data)
+        if compress:
+            self._write(compressor.flush())
+        return offset, self.size - offset
+
+    def add(self, message_id, body_plain, body_html, attachments=()):
+        """
+        Add a message; attachments are (attachment id, content type, readable file) triples.
+        Returns the (offset, length) of the message record.
+        """
+        stored = {}
+        for attachment_id, content_type, f in attachments:
+            compress = not (content_type or '').startswith(INCOMPRESSIBLE_TYPES)
+            stored[str(attachment_id)] = self._stream_chunk(f, compress)
+        record = json.dumps(
+            {'body_plain': body_plain, 'body_html': body_html, 'attachments': stored}, separators=(',', ':'),
+        )
+        location = self.index[str(message_id)] = self._chunk(record.encode('utf-8', 'surrogatepass'))
+        return location
+
+    def finish(self):
+        """
+        Write the index and return the pack file, positioned at its start
+        """
+        offset, _ = self._chunk(json.dumps(self.index, separators=(',', ':')).encode())
+        self._write(struct.pack('>Q', offset))
+        self._file.seek(0)
+        return self._file
+
+    def close(self):
+        self._file.close()
+
+def read_chunk(f, offset, length):
+    """
+    Read and decompress the chunk at offset in an open pack file
+    """
+    f.seek(offset)
+    data = f.read(length)
+    method, data = data[:1], data[1:]
+    if method == ZLIB:
+        return zlib.decompress(data)
+    if method == RAW:
+        return data
+    raise ValueError(f"Unknown archive chunk method {method!r} at offset {offset}")
+
+def read_index(f):
+    """
+    The message id -> (offset, length) index stored at the end of an open pack file
+    """
+    f.seek(0, 2)
+    end = f.tell()
+    f.seek(end - 8)
+    offset, = struct.unpack('>Q', f.read(8))
+    return {key: tuple(value) for key, value in json.loads(read_chunk(f, offset, end - 8 - offset)).items()}
+
+class ArchiveStore:
+    """
+    Archive packs on top of a Django storage backend
+    """
+
+    def __init__(self, storage=None):
+        self.storage = storage or FileSystemStorage(
+            location=getattr(settings, 'ARCHIVE_STORE_ROOT', settings.BASE_DIR / 'archive'),
+        )
+
+    def save(self, key, f):
+        return self.storage.save(key, File(f, name=key))
+
+    def open(self, key):
+        return self.storage.open(key, 'rb')
+
+    def read(self, key, offset, length):
+        with self.open(key) as f:
+            return read_chunk(f, offset, length)
+
+    def delete(self, key):
+        self.storage.delete(key)
+
+_default_store = None
+
+def get_archive_store():
+    """
+    Return the process-wide archive store
+    """
+    global _default_store
+    if _default_store is None:
+        _default_store = ArchiveStore()
+    return _default_store
+
+class ArchiveService:
+    """
+    Service class for moving old message bodies and attachments to cold storage.
+
+    Messages due under a RetentionPolicy are written, grouped by user and
+    month received, into compressed archive packs; an ArchiveEntry per
+    message records where its record sits. The inline bodies are cleared
+    and attachment payloads leave the attachment store, so message rows
+    shrink to metadata. EmailMessage.get_body_plain() and get_body_html()
+    read archived bodies back transparently.
+    """
+
+    @staticmethod
+    def due_messages(policy, now=None):
+        """
+        Live messages the policy moves to the archive.
+
+        A policy without an account skips accounts that have a policy of
+        their own. Bodies shared between accounts stay in MessageBody.
+        """
+        cutoff = (now or timezone.now()) - timedelta(days=policy.archive_after_days)
+        messages = EmailMessage.objects.live().filter(
+            user_id=policy.user_id,
+            is_archived=False,
+            shared_body__isnull=True,
+            received_at__lt=cutoff,
+        )
+        if policy.email_account_id:
+            return messages.filter(email_account_id=policy.email_account_id)
+        return messages.exclude(email_account_id__in=RetentionPolicy.objects.filter(
+            user_id=policy.user_id, email_account__isnull=False,
+        ).values('email_account_id'))
+
+    @staticmethod
+    def archive_due(policies=None, store=None, attachment_store=None, limit=None):
+        """
+        Archive the messages due under every policy (or the given ones), returning totals
+        """
+        if policies is None:
+            policies = RetentionPolicy.objects.all()
+        totals = {'messages': 0, 'packs': 0, 'bytes': 0}
+        for policy in policies:
+            if limit is not None and totals['messages'] >= limit:
+                break
+            due = ArchiveService.due_messages(policy)
+            if limit is not None:
+                due = due.order_by('received_at')[:limit - totals['messages']]
+            result = ArchiveService.archive_messages(due, store=store, attachment_store=attachment_store)
+            for key in totals:
+                totals[key] += result[key]
+        return totals
+
+    @staticmethod
+    def archive_messages(queryset, store=None, attachment_store=None, max_pack_bytes=None, chunk_size=None):
+        """
+        Move the bodies and attachments of the queryset's messages into packs.
+
+        Messages are read in received order, one pack per user and month,
+        split when a pack reaches max_pack_bytes. Each pack is saved before
+        the transaction that points its messages at it, so a failure leaves
+        at worst an unreferenced pack file, never a message without a body.
+        """
+        store = store or get_archive_store()
+        attachment_store = attachment_store or get_attachment_store()
+        max_pack_bytes = max_pack_bytes or getattr(settings, 'ARCHIVE_PACK_MAX_BYTES', 64 * 1024 * 1024)
+        chunk_size = chunk_size or getattr(settings, 'ARCHIVE_CHUNK_SIZE', 200)
+        totals = {'messages': 0, 'packs': 0, 'bytes': 0}
+
+        messages = EmailMessage.objects.filter(pk__in=queryset.values('pk')).order_by('user_id', 'received_at', 'pk').prefetch_related('attachments')
+        group = writer = None
+        archived = []
+        for message in messages.iterator(chunk_size=chunk_size):
+            month = message.received_at.date().replace(day=1)
+            if writer is not None and (group != (message.user_id, month) or writer.size >= max_pack_bytes):
+                ArchiveService._seal(group, writer, archived, store, attachment_store, totals)
+                writer, archived = None, []
+            if writer is None:
+                group, writer = (message.user_id, month), PackWriter()
+            try:
+                archived.append(ArchiveService._add(writer, message, attachment_store))
+            except Exception:
+                writer.close()
+                raise
+        if writer is not None:
+            ArchiveService._seal(group, writer, archived, store, attachment_store, totals)
+        return totals
+
+    @staticmethod
+    def _add(writer, message, attachment_store):
+        payloads = []
+        attachment_ids = []
+        keys = []
+        try:
+            for attachment in message.attachments.all():
+                if not attachment.storage_key:
+                    continue
+                try:
+                    payloads.append((attachment.pk, attachment.content_type, attachment_store.open(attachment.storage_key)))
+                except OSError as e:
+                    # Left in the attachment store, where it is still served from
+                    logger.warning(f"Not archiving attachment {attachment.pk} of message {message.pk}: {e}")
+                    continue
+                attachment_ids.append(attachment.pk)
+                keys.append(attachment.storage_key)
+            offset, length = writer.add(message.pk, message.body_plain, message.body_html, payloads)
+        finally:
+            for _, _, f in payloads:
+                f.close()
+        return message.pk, offset, length, attachment_ids, keys
+
+    @staticmethod
+    def _seal(group, writer, archived, store, attachment_store, totals):
+        user_id, month = group
+        try:
+            key = store.save(f"{user_id}/{month:%Y-%m}/{uuid.uuid4().hex}.pack", writer.finish())
+            size = writer.size
+        finally:
+            writer.close()
+        try:
+            with transaction.atomic():
+                pack = ArchivePack.objects.create(
+                    user_id=user_id, month=month, storage_key=key, size=size, message_count=len(archived),
+                )
+                ArchiveEntry.objects.bulk_create([
+                    ArchiveEntry(email_message_id=message_id, pack=pack, offset=offset, length=length)
+                    for message_id, offset, length, _, _ in archived
+                ])
+                EmailMessage.objects.filter(pk__in=[item[0] for item in archived]).update(
+                    is_archived=True, body_plain='', body_html='',
+                )
+                EmailAttachment.objects.filter(
+                    pk__in=[attachment_id for item in archived for attachment_id in item[3]],
+                ).update(storage_key='')
+        except Exception:
+            store.delete(key)
+            raise
+        attachment_store.delete_unreferenced(key for item in archived for key in item[4])
+        logger.info(f"Archived {len(archived)} messages of user {user_id} from {month:%Y-%m} into {key} ({size} bytes)")
+        totals['messages'] += len(archived)
+        totals['packs'] += 1
+        totals['bytes'] += size
+
+    @staticmethod
+    def load(email_message, store=None):
+        """
+        The archived record of a message: its bodies and attachment locations.
+
+        Read once per instance; select_related('archive_entry__pack') saves
+        the index lookup. An unreadable record is logged and read as empty.
+        """
+        record = getattr(email_message, '_archive_record', None)
+        if record is not None:
+            return record
+        store = store or get_archive_store()
+        try:
+            entry = email_message.archive_entry
+            record = json.loads(store.read(entry.pack.storage_key, entry.offset, entry.length))
+        except (ArchiveEntry.DoesNotExist, OSError, ValueError, zlib.error) as e:
+            logger.error(f"Could not read archived message {email_message.pk}: {e}")
+            record = EMPTY_RECORD
+        email_message._archive_record = record
+        return record
+
+    @staticmethod
+    def read_attachment(email_message, attachment, store=None):
+        """
+        The archived payload of one of the message's attachments, or None if it was not archived
+        """
+        store = store or get_archive_store()
+        location = ArchiveService.load(email_message, store).get('attachments', {}).get(str(attachment.pk))
+        if location is None:
+            return None
+        return store.read(email_message.archive_entry.pack.storage_key, *location)
+
+    @staticmethod
+    def delete_empty_packs(store=None):
+        """
+        Delete packs whose messages have all been purged, returning the number deleted
+        """
+        store = store or get_archive_store()
+        deleted = 0
+        for pack in ArchivePack.objects.filter(entries__isnull=True):
+            store.delete(pack.storage_key)
+            pack.delete()
+            deleted += 1
+        return deleted
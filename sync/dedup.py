@@ -0,0 +1,147 @@
+import hashlib
+import json
+import logging
+from datetime import datetime, timezone as dt_timezone
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from .models import EmailMessage, MessageBody
+
+logger = logging.getLogger(__name__)
+
+def _addresses(value):
+    if isinstance(value, str):
+        try:
+            value = json.loads(value)
+        except ValueError:
+            value = value.split(',')
+    return sorted({address.strip().lower() for address in value or [] if address.strip()})
+
+def _timestamp(value):
+    if isinstance(value, datetime):
+        if value.tzinfo is not None:
+            value = value.astimezone(dt_timezone.utc)
+        return value.replace(microsecond=0, tzinfo=None).isoformat()
+    return str(value or '')
+
+def compute_fingerprint(internet_message_id, message_data):
+    """
+    Stable fingerprint of a message, equal for its copies in different accounts.
+
+    Combines the RFC 822 Message-ID with a hash of normalized headers (sender,
+    recipients, subject, sent date), so a reused or forged Message-ID alone
+    does not make two messages duplicates. Messages without a Message-ID get
+    no fingerprint.
+    """
+    if not internet_message_id:
+        return ''
+    headers = '\n'.join([
+        (message_data.get('from') or '').strip().lower(),
+        ','.join(_addresses(message_data.get('to'))),
+        ','.join(_addresses(message_data.get('cc'))),
+        ' '.join((message_data.get('subject') or '').split()),
+        _timestamp(message_data.get('sent_at')),
+    ])
+    header_hash = hashlib.sha256(headers.encode('utf-8', 'surrogatepass')).hexdigest()
+    return hashlib.sha256(f"{internet_message_id}\n{header_hash}".encode('utf-8', 'surrogatepass')).hexdigest()
+
+def body_digest(body_plain, body_html):
+    """
+    SHA-256 of a message's body content
+    """
+    digest = hashlib.sha256()
+    digest.update((body_plain or '').encode('utf-8', 'surrogatepass'))
+    digest.update(b'\0')
+    digest.update((body_html or '').encode('utf-8', 'surrogatepass'))
+    return digest.hexdigest()
+
+class DedupService:
+    """
+    Service class for sharing message bodies between copies in several accounts
+    """
+
+    @staticmethod
+    def is_enabled():
+        return getattr(settings, 'MESSAGE_DEDUP_ENABLED', True)
+
+    @staticmethod
+    def share_body(email_message):
+        """
+        Move the body of a newly ingested duplicate into a shared MessageBody.
+
+        The first copy of a message keeps its body inline. When a second copy
+        with the same fingerprint and identical content arrives, both are
+        pointed at one MessageBody and their inline bodies are cleared.
+        Copies whose content differs keep their own body. Returns the shared
+        body or None.
+        """
+        if not DedupService.is_enabled() or not email_message.fingerprint:
+            return None
+        if not (email_message.body_plain or email_message.body_html):
+            return None
+
+        # Singletons, the common case, cost a single indexed lookup
+        twin = EmailMessage.objects.filter(
+            user_id=email_message.user_id,
+            fingerprint=email_message.fingerprint,
+        ).exclude(pk=email_message.pk).order_by(F('shared_body_id').asc(nulls_last=True)).values('id', 'shared_body_id').first()
+        if twin is None:
+            return None
+
+        digest = body_digest(email_message.body_plain, email_message.body_html)
+        with transaction.atomic():
+            if twin['shared_body_id']:
+                shared = MessageBody.objects.get(pk=twin['shared_body_id'])
+            else:
+                twin = EmailMessage.objects.only('id', 'body_plain', 'body_html').get(pk=twin['id'])
+                if body_digest(twin.body_plain, twin.body_html) != digest:
+                    return None
+                shared, _ = MessageBody.objects.get_or_create(
+                    user_id=email_message.user_id,
+                    fingerprint=email_message.fingerprint,
+                    defaults={
+                        'body_digest': digest,
+                        'body_plain': email_message.body_plain,
+                        'body_html': email_message.body_html,
+                    },
+                )
+                DedupService._link(twin, shared, digest)
+
+            if not DedupService._link(email_message, shared, digest):
+                return None
+        logger.debug(f"Message {email_message.pk} shares body {shared.pk}")
+        return shared
+
+    @staticmethod
+    def _link(email_message, shared, digest):
+        """
+        Point a message at a shared body if the content matches, clearing its inline copy
+        """
+        if shared.body_digest != digest:
+            return False
+        EmailMessage.objects.filter(pk=email_message.pk).update(shared_body=shared, body_plain='', body_html='')
+        email_message.shared_body = shared
+        email_message.body_plain = email_message.body_html = ''
+        return True
+
+    @staticmethod
+    def delete_orphans(body_ids=None):
+        """
+        Delete shared bodies no message refers to any more, returning the number deleted
+        """
+        queryset = MessageBody.objects.filter(messages__isnull=True)
+        if body_ids is not None:
+            queryset = queryset.filter(pk__in=body_ids)
+        deleted, _ = queryset.delete()
+        return deleted
+
+    @staticmethod
+    def get_other_accounts(email_message):
+        """
+        Accounts, other than the message's own, that hold a live copy of it
+        """
+        return [
+            duplicate.email_account
+            for duplicate in email_message.get_duplicates().select_related('email_account')
+            if duplicate.email_account_id != email_message.email_account_id
+        ]
@@ -0,0 +1,263 @@
+import json
+import logging
+import re
+from email import policy
+from email.message import EmailMessage as MimeMessage
+from email.utils import format_datetime
+from django.conf import settings
+from django.http import StreamingHttpResponse
+from .archive import ArchiveService
+from .storage import get_attachment_store
+
+logger = logging.getLogger(__name__)
+
+MBOX_POLICY = policy.default.clone(linesep='\n')
+MBOXRD_FROM_RE = re.compile(rb'^(>*From )', re.MULTILINE)
+
+# Metadata columns of the Parquet and Arrow exports: (field, arrow type name)
+METADATA_COLUMNS = (
+    ('id', 'int64'),
+    ('email_account_id', 'int64'),
+    ('message_id', 'string'),
+    ('internet_message_id', 'string'),
+    ('folder', 'string'),
+    ('thread_id', 'string'),
+    ('conversation_id', 'int64'),
+    ('subject', 'string'),
+    ('from_address', 'string'),
+    ('to_addresses', 'list'),
+    ('cc_addresses', 'list'),
+    ('labels', 'list'),
+    ('sent_at', 'timestamp'),
+    ('received_at', 'timestamp'),
+    ('size', 'int64'),
+    ('is_read', 'bool'),
+    ('is_starred', 'bool'),
+    ('is_draft', 'bool'),
+    ('is_spam', 'bool'),
+    ('is_important', 'bool'),
+    ('is_deleted', 'bool'),
+    ('deleted_at', 'timestamp'),
+)
+
+class ExportUnavailable(Exception):
+    """Raised when an export format needs an optional dependency that is not installed"""
+
+class StreamBuffer:
+    """
+    Write-only file object for Arrow writers; drain() hands out what was written since the last drain
+    """
+
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+        self.closed = False
+
+    def write(self, data):
+        data = bytes(data)
+        self.chunks.append(data)
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def writable(self):
+        return True
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks.clear()
+        return data
+
+def _json_list(value):
+    if not value:
+        return []
+    try:
+        value = json.loads(value)
+    except ValueError:
+        return []
+    return [str(item) for item in value] if isinstance(value, list) else []
+
+def _header(value):
+    # Stored values come from untrusted mail; never let them start a new header
+    return ' '.join(str(value).split())
+
+class ExportService:
+    """
+    Streaming exports of EmailMessage querysets.
+
+    Rows are read with .iterator(chunk_size), a server-side cursor on
+    PostgreSQL, and every format is produced as a generator of byte chunks
+    for StreamingHttpResponse or a file, so memory depends on the chunk and
+    row group sizes, not on the number of messages.
+    """
+    FORMATS = {
+        'mbox': ('application/mbox', 'mbox'),
+        'parquet': ('application/vnd.apache.parquet', 'parquet'),
+        'arrow': ('application/vnd.apache.arrow.stream', 'arrows'),
+    }
+
+    @staticmethod
+    def stream(queryset, export_format, **options):
+        """
+        Return (byte chunk iterator, content type, file extension) for export_format.
+
+        Raises ValueError for unknown formats and ExportUnavailable when
+        pyarrow is missing, before anything is streamed.
+        """
+        if export_format not in ExportService.FORMATS:
+            raise ValueError(f"Unknown export format {export_format!r}")
+        content_type, extension = ExportService.FORMATS[export_format]
+        if export_format == 'mbox':
+            chunks = ExportService.iter_mbox(queryset, **options)
+        else:
+            pa = ExportService._pyarrow()
+            chunks = ExportService.iter_arrow(queryset, pa, parquet=export_format == 'parquet', **options)
+        return chunks, content_type, extension
+
+    @staticmethod
+    def _pyarrow():
+        try:
+            import pyarrow
+            import pyarrow.parquet  # noqa: F401
+        except ImportError:
+            raise ExportUnavailable("Parquet and Arrow exports need pyarrow (pip install pyarrow)")
+        return pyarrow
+
+    @staticmethod
+    def iter_mbox(queryset, store=None, attachments=True, chunk_size=None):
+        """
+        Yield the messages as mboxrd entries, one message at a time.
+
+        Only metadata and bodies are stored, so messages are rebuilt as
+        multipart MIME with their attachments read back from the attachment
+        store or the archive; Status and X-Keywords carry the read, starred and label state.
+        """
+        store = store or get_attachment_store()
+        chunk_size = chunk_size or getattr(settings, 'EXPORT_MBOX_CHUNK_SIZE', 200)
+        queryset = queryset.select_related('shared_body', 'archive_entry__pack').order_by('pk')
+        if attachments:
+            queryset = queryset.prefetch_related('attachments')
+        for message in queryset.iterator(chunk_size=chunk_size):
+            yield ExportService.mbox_entry(message, store, attachments)
+
+    @staticmethod
+    def mbox_entry(message, store, attachments=True):
+        mime = MimeMessage(policy=MBOX_POLICY)
+        mime['From'] = _header(message.from_address)
+        for name, value in (('To', message.to_addresses), ('Cc', message.cc_addresses)):
+            addresses = _json_list(value)
+            if addresses:
+                mime[name] = ', '.join(_header(address) for address in addresses)
+        mime['Subject'] = _header(message.subject)
+        mime['Date'] = format_datetime(message.sent_at)
+        if message.internet_message_id:
+            mime['Message-ID'] = f"<{_header(message.internet_message_id)}>"
+        mime['Status'] = 'RO' if message.is_read else 'O'
+        if message.is_starred:
+            mime['X-Status'] = 'F'
+        labels = _json_list(message.labels)
+        if labels:
+            mime['X-Keywords'] = ', '.join(_header(label) for label in labels)
+
+        mime.set_content(message.get_body_plain() or '')
+        body_html = message.get_body_html()
+        if body_html:
+            mime.add_alternative(body_html, subtype='html')
+        if attachments:
+            for attachment in message.attachments.all():
+                try:
+                    if attachment.storage_key:
+                        with store.open(attachment.storage_key) as f:
+                            payload = f.read()
+                    elif message.is_archived:
+                        payload = ArchiveService.read_attachment(message, attachment)
+                    else:
+                        payload = None
+                except OSError as e:
+                    logger.warning(f"Skipping attachment {attachment.pk} of message {message.pk} in export: {e}")
+                    continue
+                if payload is None:
+                    continue
+                maintype, _, subtype = (attachment.content_type or 'application/octet-stream').partition('/')
+                mime.add_attachment(
+                    payload, maintype=maintype, subtype=subtype or 'octet-stream', filename=attachment.filename,
+                )
+
+        raw = MBOXRD_FROM_RE.sub(rb'>\1', mime.as_bytes())
+        envelope_sender = message.from_address or 'MAILER-DAEMON'
+        from_line = f"From {_header(envelope_sender)} {message.received_at.strftime('%a %b %d %H:%M:%S %Y')}\n"
+        return from_line.encode() + raw + (b'\n' if raw.endswith(b'\n') else b'\n\n')
+
+    @staticmethod
+    def arrow_schema(pa):
+        types = {
+            'int64': pa.int64(),
+            'string': pa.string(),
+            'list': pa.list_(pa.string()),
+            'timestamp': pa.timestamp('us', tz='UTC'),
+            'bool': pa.bool_(),
+        }
+        return pa.schema([(name, types[kind]) for name, kind in METADATA_COLUMNS])
+
+    @staticmethod
+    def iter_arrow(queryset, pa, parquet=True, row_group_size=None):
+        """
+        Yield message metadata as Parquet (one row group per row_group_size
+        messages) or as an Arrow IPC stream, flushing after every group
+        """
+        row_group_size = row_group_size or getattr(settings, 'EXPORT_ROW_GROUP_SIZE', 10000)
+        schema = ExportService.arrow_schema(pa)
+        names = [name for name, _ in METADATA_COLUMNS]
+        lists = {name for name, kind in METADATA_COLUMNS if kind == 'list'}
+        rows = queryset.order_by('pk').values_list(*names).iterator(chunk_size=row_group_size)
+
+        sink = StreamBuffer()
+        if parquet:
+            writer = pa.parquet.ParquetWriter(sink, schema, compression='zstd')
+        else:
+            writer = pa.ipc.new_stream(sink, schema)
+        try:
+            columns = [[] for _ in names]
+            for row in rows:
+                for column, name, value in zip(columns, names, row):
+                    column.append(_json_list(value) if name in lists else value)
+                if len(columns[0]) >= row_group_size:
+                    writer.write_table(pa.Table.from_pydict(dict(zip(names, columns)), schema=schema))
+                    columns = [[] for _ in names]
+                    yield sink.drain()
+            if columns[0]:
+                writer.write_table(pa.Table.from_pydict(dict(zip(names, columns)), schema=schema))
+        finally:
+            writer.close()
+        yield sink.drain()
+
+    @staticmethod
+    def response(queryset, export_format, filename, **options):
+        """
+        A StreamingHttpResponse downloading the export as filename.<extension>
+        """
+        chunks, content_type, extension = ExportService.stream(queryset, export_format, **options)
+        response = StreamingHttpResponse(chunks, content_type=content_type)
+        response['Content-Disposition'] = f'attachment; filename="{filename}.{extension}"'
+        return response
+
+    @staticmethod
+    def write(queryset, export_format, path, **options):
+        """
+        Export to a file, returning the number of bytes written
+        """
+        chunks, _, _ = ExportService.stream(queryset, export_format, **options)
+        written = 0
+        with open(path, 'wb') as f:
+            for chunk in chunks:
+                f.write(chunk)
+                written += len(chunk)
+        return written
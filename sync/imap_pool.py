@@ -0,0 +1,254 @@
+import atexit
+import imaplib
+import logging
+import threading
+import time
+from django.conf import settings
+from oauth.tokens import get_token_manager
+
+logger = logging.getLogger(__name__)
+
+# Errors after which an IMAP connection cannot be trusted any more
+CONNECTION_ERRORS = (imaplib.IMAP4.error, OSError, EOFError)
+
+class ImapPoolExhausted(Exception):
+    """Raised when no IMAP session for an account frees up within the timeout"""
+
+def open_imap_connection(email_account):
+    """
+    Open a TLS connection and authenticate with OAuth (XOAUTH2) or the account password
+    """
+    if getattr(settings, 'IMAP_USE_SSL', True):
+        connection = imaplib.IMAP4_SSL(email_account.imap_server, email_account.imap_port)
+    else:
+        connection = imaplib.IMAP4(email_account.imap_server, email_account.imap_port)
+    if email_account.oauth_token:
+        token = get_token_manager().token_for_account(email_account)
+        auth_string = f"user={email_account.email_address}\x01auth=Bearer {token}\x01\x01"
+        connection.authenticate('XOAUTH2', lambda _: auth_string.encode())
+    else:
+        connection.login(email_account.email_address, email_account.password)
+    # Servers commonly advertise more (e.g. UIDPLUS) once authenticated
+    typ, data = connection.capability()
+    if typ == 'OK' and data and data[-1]:
+        connection.capabilities = tuple(data[-1].decode().upper().split())
+    return connection
+
+class ImapSession:
+    """
+    One authenticated IMAP connection plus the folder it has selected
+    """
+
+    def __init__(self, account_id, connection):
+        self.account_id = account_id
+        self.connection = connection
+        self.selected_folder = None
+        self.uid_validity = None
+        self.last_used = time.monotonic()
+        self.broken = False
+
+    def select(self, folder, force=False):
+        """
+        SELECT folder unless it is already the selected one, recording its UIDVALIDITY
+        """
+        if self.selected_folder == folder and not force:
+            return
+        typ, data = self.connection.select(folder)
+        if typ != 'OK':
+            self.selected_folder = None
+            self.uid_validity = None
+            raise imaplib.IMAP4.error(f"SELECT {folder} failed: {data!r}")
+        self.selected_folder = folder
+        _, validity = self.connection.response('UIDVALIDITY')
+        self.uid_validity = int(validity[-1]) if validity and validity[-1] else None
+
+    def is_healthy(self):
+        """
+        NOOP round trip; also picks up mailbox changes since the last command
+        """
+        try:
+            typ, _ = self.connection.noop()
+        except CONNECTION_ERRORS:
+            return False
+        return typ == 'OK'
+
+    def logout(self):
+        try:
+            self.connection.logout()
+        except CONNECTION_ERRORS as e:
+            logger.debug(f"Error logging out IMAP session for account {self.account_id}: {e}")
+
+class ImapSessionPool:
+    """
+    Authenticated IMAP sessions reused across sync jobs and flag write-backs.
+
+    Sessions are keyed by EmailAccount. An idle session is health checked
+    with NOOP when it has not been used for check_after seconds and logged
+    out once idle for idle_timeout seconds; at most max_per_account sessions
+    per account are open at once, further callers wait for one to be
+    released. Hit rate and the handshake time saved are reported by stats().
+    """
+
+    def __init__(self, connect=open_imap_connection, max_per_account=None, idle_timeout=None,
+                 check_after=None, acquire_timeout=None, clock=time.monotonic):
+        self.connect = connect
+        self.max_per_account = max_per_account or getattr(settings, 'IMAP_POOL_MAX_SESSIONS_PER_ACCOUNT', 4)
+        self.idle_timeout = idle_timeout or getattr(settings, 'IMAP_POOL_IDLE_TIMEOUT', 300)
+        self.check_after = getattr(settings, 'IMAP_POOL_CHECK_AFTER', 10) if check_after is None else check_after
+        self.acquire_timeout = acquire_timeout or getattr(settings, 'IMAP_POOL_ACQUIRE_TIMEOUT', 60)
+        self.clock = clock
+        self._idle = {}
+        self._open = {}
+        self._condition = threading.Condition()
+        self.hits = 0
+        self.misses = 0
+        self.handshakes = 0
+        self.handshake_seconds = 0.0
+        self.discarded = 0
+
+    def acquire(self, email_account, folder=None):
+        """
+        Return a healthy session for the account, with folder selected if given
+        """
+        account_id = email_account.pk
+        deadline = time.monotonic() + self.acquire_timeout
+        expired = []
+        with self._condition:
+            while True:
+                session = self._take_idle(account_id, expired)
+                if session is not None:
+                    break
+                if self._open.get(account_id, 0) < self.max_per_account:
+                    # Reserve the slot; the handshake happens outside the lock
+                    self._open[account_id] = self._open.get(account_id, 0) + 1
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise ImapPoolExhausted(f"No IMAP session for account {account_id} became free")
+                self._condition.wait(remaining)
+        for stale in expired:
+            stale.logout()
+
+        if session is None:
+            session = self._open_session(email_account)
+        elif self.clock() - session.last_used > self.check_after and not session.is_healthy():
+            # Replace the dead session in the same slot
+            session.logout()
+            with self._condition:
+                self.discarded += 1
+            session = self._open_session(email_account)
+        else:
+            with self._condition:
+                self.hits += 1
+
+        if folder is not None:
+            try:
+                session.select(folder)
+            except CONNECTION_ERRORS:
+                self.release(session, broken=True)
+                raise
+        return session
+
+    def _take_idle(self, account_id, expired):
+        """
+        Pop the most recently used idle session, moving expired ones to expired
+        """
+        sessions = self._idle.get(account_id)
+        while sessions:
+            session = sessions.pop()
+            if self.clock() - session.last_used <= self.idle_timeout:
+                return session
+            self._open[account_id] -= 1
+            self.discarded += 1
+            expired.append(session)
+        return None
+
+    def _open_session(self, email_account):
+        """
+        Handshake a new session in a slot already counted in _open
+        """
+        started = time.perf_counter()
+        try:
+            connection = self.connect(email_account)
+        except BaseException:
+            with self._condition:
+                self._open[email_account.pk] -= 1
+                self._condition.notify()
+            raise
+        elapsed = time.perf_counter() - started
+        with self._condition:
+            self.misses += 1
+            self.handshakes += 1
+            self.handshake_seconds += elapsed
+        logger.debug(f"Opened IMAP session for account {email_account.pk} in {elapsed * 1000:.0f} ms")
+        session = ImapSession(email_account.pk, connection)
+        session.last_used = self.clock()
+        return session
+
+    def _discard(self, session):
+        with self._condition:
+            self._open[session.account_id] -= 1
+            self.discarded += 1
+            self._condition.notify()
+        session.logout()
+
+    def release(self, session, broken=False):
+        """
+        Return a session to the pool, or log it out if it can no longer be used
+        """
+        if broken or session.broken:
+            self._discard(session)
+            return
+        session.last_used = self.clock()
+        with self._condition:
+            self._idle.setdefault(session.account_id, []).append(session)
+            self._condition.notify()
+
+    def close_idle(self, max_idle=None):
+        """
+        Log out sessions idle for longer than max_idle seconds (the idle timeout by default)
+        """
+        max_idle = self.idle_timeout if max_idle is None else max_idle
+        expired = []
+        with self._condition:
+            now = self.clock()
+            for account_id, sessions in self._idle.items():
+                keep = [session for session in sessions if now - session.last_used < max_idle]
+                expired.extend(session for session in sessions if session not in keep)
+                self._open[account_id] -= len(sessions) - len(keep)
+                sessions[:] = keep
+            self.discarded += len(expired)
+        for session in expired:
+            session.logout()
+        return len(expired)
+
+    def stats(self):
+        """
+        Pool hit rate and the handshake time saved by reusing sessions
+        """
+        with self._condition:
+            acquisitions = self.hits + self.misses
+            average = self.handshake_seconds / self.handshakes if self.handshakes else 0.0
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / acquisitions, 3) if acquisitions else 0.0,
+                'handshakes': self.handshakes,
+                'average_handshake_ms': round(average * 1000, 1),
+                'handshake_seconds_saved': round(self.hits * average, 3),
+                'open_sessions': sum(self._open.values()),
+                'idle_sessions': sum(len(sessions) for sessions in self._idle.values()),
+                'discarded': self.discarded,
+            }
+
+_default_pool = None
+
+def get_imap_pool():
+    """
+    Return the process-wide IMAP session pool
+    """
+    global _default_pool
+    if _default_pool is None:
+        _default_pool = ImapSessionPool()
+        atexit.register(_default_pool.close_idle, 0)
+    return _default_pool
@@ -0,0 +1,299 @@
+import hashlib
+import logging
+import mmap
+import os
+import re
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone as dt_timezone
+from django.conf import settings
+from .pipeline import parse_fetched
+from .providers import FetchedMessage
+from .services import EmailSyncService
+from .storage import get_attachment_store
+from .timing import SyncProfile
+
+logger = logging.getLogger(__name__)
+
+MBOX_SEPARATOR = b'\nFrom '
+HEADER_END_RE = re.compile(rb'\r?\n\r?\n')
+STATUS_RE = re.compile(rb'^(?:X-)?Status:[ \t]*([A-Za-z]*)', re.MULTILINE | re.IGNORECASE)
+GMAIL_LABELS_RE = re.compile(rb'^X-Gmail-Labels:[ \t]*(.*(?:\r?\n[ \t].*)*)', re.MULTILINE | re.IGNORECASE)
+MBOXRD_FROM_RE = re.compile(rb'^>(>*From )', re.MULTILINE)
+
+class MailboxSource:
+    """
+    One mbox file or Maildir folder to import; folder is stored on the messages
+    """
+
+    def __init__(self, kind, path, folder=''):
+        self.kind = kind
+        self.path = path
+        self.folder = folder
+
+    def __repr__(self):
+        return f"MailboxSource({self.kind!r}, {self.path!r}, {self.folder!r})"
+
+def find_sources(path):
+    """
+    Mailboxes under path: an mbox file, a Maildir (with Maildir++ subfolders)
+    or a directory of mbox files such as a Takeout export
+    """
+    if os.path.isfile(path):
+        return [MailboxSource('mbox', path, os.path.splitext(os.path.basename(path))[0])]
+    if os.path.isdir(os.path.join(path, 'cur')):
+        sources = [MailboxSource('maildir', path, '')]
+        for name in sorted(os.listdir(path)):
+            if name.startswith('.') and os.path.isdir(os.path.join(path, name, 'cur')):
+                sources.append(MailboxSource('maildir', os.path.join(path, name), name[1:]))
+        return sources
+    sources = []
+    for root, dirs, files in os.walk(path):
+        dirs.sort()
+        for name in sorted(files):
+            file_path = os.path.join(root, name)
+            with open(file_path, 'rb') as f:
+                if f.read(5) == b'From ':
+                    sources.append(MailboxSource('mbox', file_path, os.path.splitext(name)[0]))
+    return sources
+
+def mbox_spans(path):
+    """
+    Yield (start, end) byte offsets of the messages in an mbox file.
+
+    The file is memory-mapped and scanned for "From " at the start of a line,
+    so it is never read whole and the page cache does the buffering.
+    """
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            if hasattr(data, 'madvise'):
+                data.madvise(mmap.MADV_SEQUENTIAL)
+            if data[:5] == b'From ':
+                start = 0
+            else:
+                start = data.find(MBOX_SEPARATOR) + 1
+                if not start:
+                    return
+            while True:
+                end = data.find(MBOX_SEPARATOR, start)
+                if end == -1:
+                    yield start, len(data)
+                    return
+                yield start, end + 1
+                start = end + 1
+
+def maildir_spans(path):
+    """
+    Yield the message file paths of a Maildir folder, new mail first
+    """
+    for subdir in ('new', 'cur'):
+        directory = os.path.join(path, subdir)
+        if os.path.isdir(directory):
+            for name in sorted(os.listdir(directory)):
+                if not name.startswith('.'):
+                    yield os.path.join(directory, name)
+
+# Memory maps of mbox files opened by this (worker) process
+_mapped = {}
+
+def _read_mbox(path, start, end):
+    data = _mapped.get(path)
+    if data is None:
+        with open(path, 'rb') as f:
+            data = _mapped[path] = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    return data[start:end]
+
+def close_mapped():
+    while _mapped:
+        _, data = _mapped.popitem()
+        data.close()
+
+def _from_line_date(line):
+    # "From sender Tue Apr  1 10:00:00 2025"
+    parts = line.decode('ascii', 'replace').split(None, 2)
+    if len(parts) == 3:
+        try:
+            return datetime.strptime(' '.join(parts[2].split()[:5]), '%a %b %d %H:%M:%S %Y').replace(tzinfo=dt_timezone.utc)
+        except ValueError:
+            pass
+    return None
+
+def mbox_message(raw):
+    """
+    Split an mbox entry into the RFC 822 message and its provider-side state
+    """
+    line_end = raw.find(b'\n')
+    from_line, raw = raw[:line_end], raw[line_end + 1:]
+    if raw.endswith(b'\r\n'):
+        raw = raw[:-2]
+    elif raw.endswith(b'\n'):
+        raw = raw[:-1]
+    if b'>From ' in raw:
+        raw = MBOXRD_FROM_RE.sub(rb'\1', raw)
+
+    match = HEADER_END_RE.search(raw)
+    headers = raw[:match.start()] if match else raw
+    extra = {}
+    labels = GMAIL_LABELS_RE.search(headers)
+    if labels:
+        # Takeout exports carry Gmail labels and state instead of Status flags
+        labels = [label.strip() for label in re.sub(rb'\r?\n[ \t]', b' ', labels.group(1)).decode('utf-8', 'replace').split(',')]
+        labels = [label for label in labels if label]
+        extra.update(
+            is_read='Unread' not in labels,
+            is_starred='Starred' in labels,
+            is_draft='Draft' in labels,
+            is_spam='Spam' in labels,
+            is_important='Important' in labels,
+            labels=[label for label in labels if label not in ('Unread', 'Opened')],
+        )
+    else:
+        status = ''.join(value.decode('ascii', 'replace') for value in STATUS_RE.findall(headers))
+        extra.update(is_read='R' in status, is_starred='F' in status, is_draft='D' in status)
+    received_at = _from_line_date(from_line)
+    if received_at:
+        extra['received_at'] = received_at
+    return raw, extra
+
+def maildir_message(path):
+    """
+    Read a Maildir message; state comes from the ":2,FRS" info suffix and the delivery time from the name
+    """
+    with open(path, 'rb') as f:
+        raw = f.read()
+    name = os.path.basename(path)
+    flags = name.rsplit(':2,', 1)[1] if ':2,' in name else ''
+    extra = {
+        'is_read': 'S' in flags,
+        'is_starred': 'F' in flags,
+        'is_draft': 'D' in flags,
+        'is_deleted': 'T' in flags,
+    }
+    delivered = name.split('.', 1)[0]
+    timestamp = int(delivered) if delivered.isdigit() else os.path.getmtime(path)
+    extra['received_at'] = datetime.fromtimestamp(timestamp, tz=dt_timezone.utc)
+    return raw, extra
+
+def parse_span_batch(kind, path, folder, spans, store=None, max_plain=None, snippet_length=None):
+    """
+    Process pool entry point: read and parse a batch of messages of one mailbox.
+
+    Only offsets and paths cross the process boundary on the way in; each
+    worker maps the mbox file itself. Returns (message_data list, bytes
+    read, seconds spent, failures).
+    """
+    started = time.perf_counter()
+    parsed = []
+    size = failed = 0
+    for span in spans:
+        try:
+            if kind == 'mbox':
+                raw, extra = mbox_message(_read_mbox(path, *span))
+            else:
+                raw, extra = maildir_message(span)
+            size += len(raw)
+            if folder:
+                extra['folder'] = folder
+            # Content addressed, so importing the same export twice updates instead of duplicating
+            message_id = f"import-{hashlib.sha1(raw).hexdigest()}"
+            parsed.append(parse_fetched(
+                FetchedMessage(message_id, raw, extra), store, max_plain=max_plain, snippet_length=snippet_length,
+            ))
+        except Exception as e:
+            logger.error(f"Could not import message at {path} {span}: {e}")
+            failed += 1
+    return parsed, size, time.perf_counter() - started, failed
+
+class MailboxImporter:
+    """
+    Import mbox files and Maildir folders into an EmailAccount.
+
+    The calling thread scans mailboxes for message boundaries and hands
+    batches of offsets to a pool of parse processes (inline when processes
+    is 0), keeping at most two batches per process in flight, and stores
+    each parsed batch with EmailSyncService.persist_batch as it arrives;
+    memory stays bounded by the batches in flight whatever the mailbox size.
+    The import is recorded as a SyncLog of type 'import'.
+    """
+
+    def __init__(self, email_account, store=None, processes=None, batch_size=None, max_batch_bytes=None):
+        self.email_account = email_account
+        self.store = store or get_attachment_store()
+        if processes is None:
+            # An import is CPU-bound and runs alone in its process, so it uses
+            # the spare cores even when syncs parse in-thread
+            processes = getattr(settings, 'SYNC_PARSE_PROCESSES', 0) or max((os.cpu_count() or 1) - 1, 0)
+        self.processes = processes
+        self.batch_size = batch_size or getattr(settings, 'SYNC_PERSIST_BATCH_SIZE', 100)
+        self.max_batch_bytes = max_batch_bytes or getattr(settings, 'IMPORT_MAX_BATCH_BYTES', 16 * 1024 * 1024)
+        self.max_plain = getattr(settings, 'MESSAGE_BODY_PLAIN_MAX_CHARS', 1000000)
+        self.snippet_length = getattr(settings, 'MESSAGE_SNIPPET_LENGTH', 200)
+        self.failed = 0
+
+    def batches(self, sources):
+        """
+        Yield (kind, path, folder, spans) with at most batch_size messages or max_batch_bytes each
+        """
+        for source in sources:
+            if source.kind == 'mbox':
+                spans, sizes = mbox_spans(source.path), lambda span: span[1] - span[0]
+            else:
+                spans, sizes = maildir_spans(source.path), os.path.getsize
+            batch, batch_bytes = [], 0
+            for span in spans:
+                batch.append(span)
+                batch_bytes += sizes(span)
+                if len(batch) >= self.batch_size or batch_bytes >= self.max_batch_bytes:
+                    yield source.kind, source.path, source.folder, batch
+                    batch, batch_bytes = [], 0
+            if batch:
+                yield source.kind, source.path, source.folder, batch
+
+    def run(self, sources, progress=None):
+        """
+        Import the MailboxSources (see find_sources), returning the SyncLog; progress(sync_log) is called per batch
+        """
+        sync_log = EmailSyncService.start_sync(self.email_account.id, 'import')
+        profile = SyncProfile()
+        options = {'store': self.store, 'max_plain': self.max_plain, 'snippet_length': self.snippet_length}
+        executor = ProcessPoolExecutor(max_workers=self.processes) if self.processes else None
+        try:
+            pending = deque()
+            for kind, path, folder, spans in self.batches(sources):
+                if executor is None:
+                    self._store(parse_span_batch(kind, path, folder, spans, **options), sync_log, profile)
+                else:
+                    pending.append(executor.submit(parse_span_batch, kind, path, folder, spans, **options))
+                    if len(pending) >= self.processes * 2:
+                        self._store(pending.popleft().result(), sync_log, profile)
+                if progress is not None:
+                    progress(sync_log)
+            while pending:
+                self._store(pending.popleft().result(), sync_log, profile)
+            EmailSyncService.complete_sync(
+                sync_log, error_message=f"{self.failed} messages failed to import" if self.failed else None,
+                profile=profile,
+            )
+        except Exception as e:
+            logger.error(f"Mailbox import failed for {self.email_account}: {e}")
+            EmailSyncService.complete_sync(sync_log, error_message=str(e), profile=profile)
+        finally:
+            if executor is not None:
+                executor.shutdown(cancel_futures=True)
+            close_mapped()
+        return sync_log
+
+    def _store(self, result, sync_log, profile):
+        parsed, size, parse_seconds, failed = result
+        profile.add_time('parse', parse_seconds)
+        profile.add(bytes=size, fetch_batches=1)
+        with profile.phase('persist'):
+            added, updated, persist_failed = EmailSyncService.persist_batch(self.email_account, parsed)
+            EmailSyncService.update_sync_progress(
+                sync_log, processed=len(parsed) + failed, added=added, updated=updated,
+            )
+        profile.add(persist_batches=1)
+        self.failed += failed + persist_failed
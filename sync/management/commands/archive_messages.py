@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+from sync.archive import ArchiveService
+from sync.models import RetentionPolicy
+
+class Command(BaseCommand):
+    help = "Move bodies and attachments of messages due under retention policies into archive packs"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', type=int, default=None, help="Only apply the policies of this user ID")
+        parser.add_argument('--account', type=int, default=None, help="Only apply the policy of this email account ID")
+        parser.add_argument('--limit', type=int, default=None, help="Archive at most this many messages")
+        parser.add_argument('--dry-run', action='store_true', help="Only count the messages due")
+
+    def handle(self, *args, **options):
+        policies = RetentionPolicy.objects.select_related('user', 'email_account').order_by('pk')
+        if options['user'] is not None:
+            policies = policies.filter(user_id=options['user'])
+        if options['account'] is not None:
+            policies = policies.filter(email_account_id=options['account'])
+
+        if options['dry_run']:
+            for policy in policies:
+                self.stdout.write(f"{policy}: {ArchiveService.due_messages(policy).count()} messages due")
+            return
+
+        totals = ArchiveService.archive_due(policies, limit=options['limit'])
+        deleted = ArchiveService.delete_empty_packs()
+        self.stdout.write(
+            f"Archived {totals['messages']} messages into {totals['packs']} packs ({totals['bytes']} bytes); "
+            f"deleted {deleted} empty packs"
+        )
@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand, CommandError
+from emails.models import EmailAccount
+from sync.exports import ExportService, ExportUnavailable
+from sync.models import EmailMessage
+
+class Command(BaseCommand):
+    help = "Export an account's messages to an mbox file, or their metadata to Parquet or Arrow, in constant memory"
+
+    def add_arguments(self, parser):
+        parser.add_argument('account', type=int, help="Email account ID to export")
+        parser.add_argument('path', help="File to write")
+        parser.add_argument('--format', choices=sorted(ExportService.FORMATS), default='mbox')
+        parser.add_argument('--include-deleted', action='store_true', help="Also export soft-deleted messages")
+        parser.add_argument('--no-attachments', action='store_true', help="Leave attachments out of mbox exports")
+
+    def handle(self, *args, **options):
+        try:
+            email_account = EmailAccount.objects.get(id=options['account'])
+        except EmailAccount.DoesNotExist:
+            raise CommandError(f"Email account {options['account']} not found")
+        queryset = EmailMessage.objects.filter(email_account=email_account)
+        if not options['include_deleted']:
+            queryset = queryset.live()
+        export_options = {'attachments': False} if options['format'] == 'mbox' and options['no_attachments'] else {}
+
+        try:
+            written = ExportService.write(queryset, options['format'], options['path'], **export_options)
+        except ExportUnavailable as e:
+            raise CommandError(str(e))
+        self.stdout.write(f"Wrote {written} bytes to {options['path']}")
@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand, CommandError
+from emails.models import EmailAccount
+from sync.importers import MailboxImporter, find_sources
+
+class Command(BaseCommand):
+    help = "Import mbox files and Maildir folders (e.g. a Takeout export) into an email account"
+
+    def add_arguments(self, parser):
+        parser.add_argument('account', type=int, help="Email account ID to import into")
+        parser.add_argument('paths', nargs='+', help="mbox files, Maildir folders or directories of mbox files")
+        parser.add_argument('--processes', type=int, default=None, help="Parse processes; 0 parses in this process")
+        parser.add_argument('--batch-size', type=int, default=None, help="Messages per parse task and transaction")
+
+    def handle(self, *args, **options):
+        try:
+            email_account = EmailAccount.objects.get(id=options['account'])
+        except EmailAccount.DoesNotExist:
+            raise CommandError(f"Email account {options['account']} not found")
+        sources = [source for path in options['paths'] for source in find_sources(path)]
+        if not sources:
+            raise CommandError("No mbox files or Maildir folders found")
+        for source in sources:
+            self.stdout.write(f"Importing {source.kind} {source.path}")
+
+        importer = MailboxImporter(email_account, processes=options['processes'], batch_size=options['batch_size'])
+
+        def progress(sync_log):
+            if options['verbosity'] > 1:
+                self.stdout.write(f"{sync_log.messages_processed} messages imported")
+
+        sync_log = importer.run(sources, progress=progress)
+        timing = sync_log.timing
+        self.stdout.write(
+            f"Imported {sync_log.messages_processed} messages ({sync_log.messages_added} new, "
+            f"{sync_log.messages_updated} updated) in {timing.get('wall', 0):.1f}s"
+        )
+        if sync_log.status == 'failed':
+            raise CommandError(sync_log.error_message)
@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand, CommandError
+from emails.models import EmailAccount
+from sync.models import SyncProfilingTarget
+from sync.profiler import SyncProfilerService, current_worker
+
+class Command(BaseCommand):
+    help = "Turn the sampling profiler for syncs on or off, per account and per worker"
+
+    def add_arguments(self, parser):
+        parser.add_argument('action', choices=('enable', 'disable', 'status'))
+        parser.add_argument('--account', type=int, default=None, help="Email account ID; all accounts when omitted")
+        parser.add_argument('--worker', default='', help="Worker hostname; all workers when omitted")
+        parser.add_argument('--this-worker', action='store_true', help="Only the worker running this command")
+        parser.add_argument('--interval', type=float, default=None, help="Seconds between stack samples")
+        parser.add_argument('--duration', type=float, default=None, help="Stop profiling after this many seconds")
+
+    def handle(self, *args, **options):
+        worker = current_worker() if options['this_worker'] else options['worker']
+        email_account = None
+        if options['account'] is not None:
+            try:
+                email_account = EmailAccount.objects.get(id=options['account'])
+            except EmailAccount.DoesNotExist:
+                raise CommandError(f"Email account {options['account']} not found")
+
+        if options['action'] == 'enable':
+            target = SyncProfilerService.enable(
+                email_account, worker=worker, interval=options['interval'], duration=options['duration'],
+            )
+            self.stdout.write(f"{target}, sampling every {target.interval}s")
+        elif options['action'] == 'disable':
+            disabled = SyncProfilerService.disable(email_account, worker=worker or None)
+            self.stdout.write(f"Removed {disabled} profiling targets")
+        else:
+            targets = SyncProfilingTarget.objects.select_related('email_account').order_by('created_at')
+            for target in targets:
+                expiry = 'expired' if not target.is_active else f"until {target.expires_at or 'disabled'}"
+                self.stdout.write(f"{target}, every {target.interval}s, {expiry}")
+            if not targets:
+                self.stdout.write("Sync profiling is off")
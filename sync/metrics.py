@@ -0,0 +1,35 @@
+from core.metrics import get_metrics_registry
+
+registry = get_metrics_registry()
+
+MESSAGES_FETCHED = registry.counter(
+    'sync_messages_fetched_total', 'Messages downloaded from providers', ['provider'],
+)
+MESSAGES_PERSISTED = registry.counter(
+    'sync_messages_persisted_total', 'Messages written to the database', ['provider', 'result'],
+)
+MESSAGES_FAILED = registry.counter(
+    'sync_messages_failed_total', 'Messages or fetch batches a sync stage failed on', ['provider', 'stage'],
+)
+SYNC_RUNS = registry.counter(
+    'sync_runs_total', 'Finished account syncs', ['provider', 'status'],
+)
+PROVIDER_REQUESTS = registry.counter(
+    'sync_provider_requests_total', 'Provider requests by outcome (ok, throttled, error)', ['provider', 'outcome'],
+)
+FETCH_BATCH_SECONDS = registry.histogram(
+    'sync_fetch_batch_seconds', 'Time to fetch one batch of messages from a provider', ['provider'],
+)
+PARSE_SECONDS = registry.histogram(
+    'sync_parse_seconds', 'Time to parse and classify one message',
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0),
+)
+PERSIST_BATCH_SECONDS = registry.histogram(
+    'sync_persist_batch_seconds', 'Time to write one batch of messages in a transaction', ['provider'],
+)
+ACTIVE_SYNCS = registry.gauge(
+    'sync_active', 'Account syncs currently running',
+)
+QUEUE_DEPTH = registry.gauge(
+    'sync_queue_depth', 'Items waiting in front of a pipeline stage', ['stage'],
+)
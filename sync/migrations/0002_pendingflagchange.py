@@ -0,0 +1,32 @@
+# Generated by Django 5.2.18 on 2026-10-19 04:32
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('emails', '0001_initial'),
+        ('sync', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PendingFlagChange',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('base_is_read', models.BooleanField(blank=True, null=True)),
+                ('base_is_starred', models.BooleanField(blank=True, null=True)),
+                ('base_labels', models.TextField(blank=True, help_text='JSON list of labels on the provider', null=True)),
+                ('version', models.IntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('email_account', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='emails.emailaccount')),
+                ('email_message', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='pending_flag_change', to='sync.emailmessage')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['email_account', 'id'], name='sync_pendin_email_a_e1d28a_idx')],
+            },
+        ),
+    ]
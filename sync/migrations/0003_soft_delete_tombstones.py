@@ -0,0 +1,57 @@
+# Generated by Django 5.2.18 on 2026-10-19 04:34
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('emails', '0001_initial'),
+        ('sync', '0002_pendingflagchange'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='emailmessage',
+            name='sync_emailm_user_id_e2fc78_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='emailmessage',
+            name='sync_emailm_user_id_1f0802_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='emailmessage',
+            name='sync_emailm_user_id_f36a05_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='emailmessage',
+            name='sync_emailm_email_a_2b6e37_idx',
+        ),
+        migrations.AddField(
+            model_name='emailmessage',
+            name='deleted_at',
+            field=models.DateTimeField(blank=True, help_text='When the message was soft-deleted', null=True),
+        ),
+        migrations.AddIndex(
+            model_name='emailmessage',
+            index=models.Index(condition=models.Q(('is_deleted', False)), fields=['user', 'received_at'], name='email_live_user_received'),
+        ),
+        migrations.AddIndex(
+            model_name='emailmessage',
+            index=models.Index(condition=models.Q(('is_deleted', False)), fields=['user', 'is_read'], name='email_live_user_read'),
+        ),
+        migrations.AddIndex(
+            model_name='emailmessage',
+            index=models.Index(condition=models.Q(('is_deleted', False)), fields=['user', 'is_spam'], name='email_live_user_spam'),
+        ),
+        migrations.AddIndex(
+            model_name='emailmessage',
+            index=models.Index(condition=models.Q(('is_deleted', False)), fields=['email_account', 'received_at'], name='email_live_account_received'),
+        ),
+        migrations.AddIndex(
+            model_name='emailmessage',
+            index=models.Index(condition=models.Q(('is_deleted', True)), fields=['deleted_at'], name='email_tombstone_deleted_at'),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 5.2.18 on 2026-10-19 04:40
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('emails', '0001_initial'),
+        ('sync', '0003_soft_delete_tombstones'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='emailmessage',
+            index=models.Index(condition=models.Q(('is_deleted', False)), fields=['user', '-size'], name='email_live_user_size'),
+        ),
+    ]
@@ -0,0 +1,65 @@
+# Generated by Django 5.2.18 on 2026-10-19 04:42
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('emails', '0001_initial'),
+        ('sync', '0004_emailmessage_email_live_user_size'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='emailmessage',
+            name='internet_message_id',
+            field=models.CharField(blank=True, help_text='RFC 5322 Message-ID header', max_length=255),
+        ),
+        migrations.CreateModel(
+            name='Thread',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('subject', models.CharField(blank=True, help_text='Subject of the first message, without Re:/Fwd: prefixes', max_length=500)),
+                ('message_count', models.IntegerField(default=0)),
+                ('total_size', models.BigIntegerField(default=0)),
+                ('participants', models.TextField(blank=True, help_text='JSON list of sender addresses')),
+                ('last_activity_at', models.DateTimeField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('email_account', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='emails.emailaccount')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='emailmessage',
+            name='conversation',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='messages', to='sync.thread'),
+        ),
+        migrations.CreateModel(
+            name='ThreadContainer',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('message_id', models.CharField(help_text='Message-ID without angle brackets', max_length=255)),
+                ('email_account', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='emails.emailaccount')),
+                ('email_message', models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='thread_container', to='sync.emailmessage')),
+                ('parent', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='children', to='sync.threadcontainer')),
+                ('thread', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='containers', to='sync.thread')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='thread',
+            index=models.Index(condition=models.Q(('message_count__gt', 0)), fields=['user', '-last_activity_at'], name='thread_live_user_activity'),
+        ),
+        migrations.AddIndex(
+            model_name='thread',
+            index=models.Index(condition=models.Q(('message_count__gt', 0)), fields=['email_account', '-last_activity_at'], name='thread_live_account_activity'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='threadcontainer',
+            unique_together={('email_account', 'message_id')},
+        ),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 5.2.18 on 2026-10-19 04:45
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('emails', '0001_initial'),
+        ('sync', '0005_threads'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='emailmessage',
+            name='fingerprint',
+            field=models.CharField(blank=True, help_text='Hash of Message-ID and normalized headers, equal across accounts', max_length=64),
+        ),
+        migrations.CreateModel(
+            name='MessageBody',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fingerprint', models.CharField(help_text='Message fingerprint shared by all copies', max_length=64)),
+                ('body_digest', models.CharField(help_text='SHA-256 of the body content', max_length=64)),
+                ('body_plain', models.TextField(blank=True)),
+                ('body_html', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='emailmessage',
+            name='shared_body',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='messages', to='sync.messagebody'),
+        ),
+        migrations.AddIndex(
+            model_name='emailmessage',
+            index=models.Index(condition=models.Q(('fingerprint', ''), _negated=True), fields=['user', 'fingerprint'], name='email_user_fingerprint'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='messagebody',
+            unique_together={('user', 'fingerprint')},
+        ),
+    ]
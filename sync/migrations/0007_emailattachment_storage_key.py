@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-19 04:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sync', '0006_message_dedup'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='emailattachment',
+            name='storage_key',
+            field=models.CharField(blank=True, db_index=True, help_text='Attachment store key of the payload', max_length=100),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-19 05:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sync', '0007_emailattachment_storage_key'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='emailmessage',
+            name='folder',
+            field=models.CharField(blank=True, help_text='IMAP folder the UID in message_id belongs to', max_length=255),
+        ),
+        migrations.AddField(
+            model_name='emailmessage',
+            name='uid_validity',
+            field=models.BigIntegerField(blank=True, help_text='UIDVALIDITY of the folder when the UID was seen', null=True),
+        ),
+    ]
@@ -0,0 +1,20 @@
+from django.db import migrations
+from django.db.models import F
+
+
+def backfill_deleted_at(apps, schema_editor):
+    # Messages deleted before tombstones existed have no deleted_at and would
+    # never expire; their last update is the closest record of the deletion
+    EmailMessage = apps.get_model('sync', 'EmailMessage')
+    EmailMessage.objects.filter(is_deleted=True, deleted_at__isnull=True).update(deleted_at=F('updated_at'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sync', '0008_imap_uid_validity'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_deleted_at, migrations.RunPython.noop),
+    ]
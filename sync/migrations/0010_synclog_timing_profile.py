@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-19 05:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sync', '0009_backfill_deleted_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='synclog',
+            name='timing_profile',
+            field=models.TextField(blank=True),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 5.2.18 on 2026-10-19 05:55
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('emails', '0001_initial'),
+        ('sync', '0010_synclog_timing_profile'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SyncProfilingTarget',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('worker', models.CharField(blank=True, help_text='Worker hostname; blank for every worker', max_length=255)),
+                ('interval', models.FloatField(default=0.01, help_text='Seconds between stack samples')),
+                ('expires_at', models.DateTimeField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('email_account', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='emails.emailaccount')),
+            ],
+        ),
+    ]
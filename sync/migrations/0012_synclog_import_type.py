@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-19 05:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sync', '0011_syncprofilingtarget'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='synclog',
+            name='sync_type',
+            field=models.CharField(choices=[('full', 'Full Sync'), ('incremental', 'Incremental Sync'), ('folder', 'Folder Sync'), ('import', 'Mailbox Import')], max_length=20),
+        ),
+    ]
@@ -0,0 +1,66 @@
+# Generated by Django 5.2.18 on 2026-10-19 06:08
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('emails', '0001_initial'),
+        ('sync', '0012_synclog_import_type'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='emailmessage',
+            name='is_archived',
+            field=models.BooleanField(default=False, help_text='Body and attachments moved to an archive pack'),
+        ),
+        migrations.CreateModel(
+            name='ArchivePack',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateField(help_text='First day of the month the messages were received in')),
+                ('storage_key', models.CharField(help_text='Archive store key of the pack file', max_length=255)),
+                ('size', models.BigIntegerField(help_text='Pack size in bytes')),
+                ('message_count', models.IntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ArchiveEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('offset', models.BigIntegerField()),
+                ('length', models.IntegerField()),
+                ('email_message', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='archive_entry', to='sync.emailmessage')),
+                ('pack', models.ForeignKey(on_delete=django.db.models.deletion.RESTRICT, related_name='entries', to='sync.archivepack')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='RetentionPolicy',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('archive_after_days', models.PositiveIntegerField(default=365)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('email_account', models.ForeignKey(blank=True, help_text="Blank for all of the user's accounts", null=True, on_delete=django.db.models.deletion.CASCADE, to='emails.emailaccount')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name_plural': 'Retention policies',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='archivepack',
+            index=models.Index(fields=['user', 'month'], name='archive_pack_user_month'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='retentionpolicy',
+            unique_together={('user', 'email_account')},
+        ),
+    ]
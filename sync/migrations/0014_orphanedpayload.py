@@ -0,0 +1,22 @@
+# Generated by Django 5.2.18 on 2026-10-19 06:25
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sync', '0013_archive_packs'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OrphanedPayload',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('storage_key', models.CharField(max_length=100, unique=True)),
+                ('orphaned_at', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+            ],
+        ),
+    ]
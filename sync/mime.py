@@ -0,0 +1,366 @@
+import binascii
+import codecs
+import logging
+from email import policy
+from email.parser import BytesHeaderParser
+from email.utils import getaddresses, parsedate_to_datetime
+from django.conf import settings
+from .text import make_snippet
+
+logger = logging.getLogger(__name__)
+
+# A boundary line is '--' + at most 70 characters + optional '--' and whitespace
+MAX_BOUNDARY_LINE = 200
+
+class IdentityDecoder:
+    """Content-Transfer-Encoding 7bit/8bit/binary"""
+
+    def feed(self, data):
+        return data
+
+    def flush(self):
+        return b''
+
+class Base64Decoder:
+    """Incremental base64 decoder that tolerates arbitrary chunk boundaries"""
+
+    def __init__(self):
+        self._rest = b''
+
+    def feed(self, data):
+        data = self._rest + data.translate(None, b' \t\r\n')
+        usable = len(data) // 4 * 4
+        self._rest = data[usable:]
+        try:
+            return binascii.a2b_base64(data[:usable])
+        except binascii.Error:
+            return b''
+
+    def flush(self):
+        rest, self._rest = self._rest, b''
+        if not rest:
+            return b''
+        try:
+            return binascii.a2b_base64(rest + b'=' * (-len(rest) % 4))
+        except binascii.Error:
+            return b''
+
+class QuotedPrintableDecoder:
+    """Incremental quoted-printable decoder working on complete lines"""
+
+    def __init__(self):
+        self._rest = b''
+
+    def feed(self, data):
+        data = self._rest + data
+        end = data.rfind(b'\n') + 1
+        self._rest = data[end:]
+        return binascii.a2b_qp(data[:end]) if end else b''
+
+    def flush(self):
+        rest, self._rest = self._rest, b''
+        return binascii.a2b_qp(rest) if rest else b''
+
+TRANSFER_DECODERS = {
+    'base64': Base64Decoder,
+    'quoted-printable': QuotedPrintableDecoder,
+}
+
+class NullSink:
+    """Discards preambles, epilogues and parts nobody needs"""
+
+    def write(self, data):
+        pass
+
+    def close(self):
+        pass
+
+class TextSink:
+    """Decodes a text part into at most cap characters"""
+
+    def __init__(self, decoder, charset, cap, on_close):
+        self.decoder = decoder
+        try:
+            self.text = codecs.getincrementaldecoder(charset or 'us-ascii')(errors='replace')
+        except LookupError:
+            self.text = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        self.cap = cap
+        self.on_close = on_close
+        self.chunks = []
+        self.length = 0
+
+    def write(self, data):
+        if self.length >= self.cap:
+            return
+        self._append(self.text.decode(self.decoder.feed(data)))
+
+    def _append(self, text):
+        text = text[:self.cap - self.length]
+        if text:
+            self.chunks.append(text)
+            self.length += len(text)
+
+    def close(self):
+        if self.length < self.cap:
+            self._append(self.text.decode(self.decoder.flush(), final=True))
+        self.on_close(''.join(self.chunks))
+
+class AttachmentSink:
+    """Streams a decoded attachment to the attachment store, or just measures it"""
+
+    def __init__(self, decoder, writer, on_close):
+        self.decoder = decoder
+        self.writer = writer
+        self.on_close = on_close
+        self.size = 0
+
+    def write(self, data):
+        self._write(self.decoder.feed(data))
+
+    def _write(self, data):
+        self.size += len(data)
+        if self.writer is not None:
+            self.writer.write(data)
+
+    def close(self):
+        self._write(self.decoder.flush())
+        key = self.writer.commit() if self.writer is not None else ''
+        self.on_close(self.size, key)
+
+class StreamingMessageParser:
+    """
+    Incremental RFC 822/MIME parser with bounded memory.
+
+    Bytes are fed in chunks of any size. Only header blocks and a small tail
+    of the current chunk are buffered: text/plain and text/html parts are
+    decoded into at most the configured number of characters, and
+    attachments are streamed through their transfer decoding into the
+    attachment store (or only measured when no store is given). close()
+    returns the message in the message_data format used by
+    EmailSyncService.create_or_update_email_message.
+    """
+
+    def __init__(self, store=None, max_plain=None, max_html=None, snippet_length=None, max_header_bytes=None):
+        self.store = store
+        self.max_plain = max_plain or getattr(settings, 'MESSAGE_BODY_PLAIN_MAX_CHARS', 1000000)
+        self.max_html = max_html or getattr(settings, 'MESSAGE_BODY_HTML_MAX_CHARS', 2000000)
+        self.snippet_length = snippet_length or getattr(settings, 'MESSAGE_SNIPPET_LENGTH', 200)
+        self.max_header_bytes = max_header_bytes or getattr(settings, 'MIME_MAX_HEADER_BYTES', 256 * 1024)
+
+        self.size = 0
+        self.headers = None
+        self.plain_parts = []
+        self.html_parts = []
+        self.attachments = []
+
+        self._buffer = b''
+        self._at_line_start = True
+        self._in_headers = True
+        self._header_lines = []
+        self._header_size = 0
+        self._pending_eol = b''
+        self._sink = NullSink()
+        # One entry per open multipart: [boundary marker, part path, children seen]
+        self._multiparts = []
+        self._part_path = ()
+
+    def feed(self, data):
+        self.size += len(data)
+        self._buffer += data
+        while self._buffer:
+            if self._in_headers:
+                if not self._consume_header_line():
+                    break
+            elif not self._consume_body():
+                break
+
+    def close(self):
+        if self._in_headers:
+            if self._buffer:
+                self._header_lines.append(self._buffer)
+            self._buffer = b''
+            self._end_headers()
+        self._write(self._buffer)
+        self._buffer = b''
+        # At end of input a trailing line break belongs to the body
+        self._sink.write(self._pending_eol)
+        self._sink.close()
+        self._sink = NullSink()
+        return self.result()
+
+    # Headers
+
+    def _consume_header_line(self):
+        end = self._buffer.find(b'\n')
+        if end == -1:
+            if len(self._buffer) > self.max_header_bytes:
+                self._buffer = b''  # Runaway header line: drop it
+            return False
+        line, self._buffer = self._buffer[:end + 1], self._buffer[end + 1:]
+        if line in (b'\r\n', b'\n'):
+            self._end_headers()
+        elif self._header_size < self.max_header_bytes:
+            self._header_lines.append(line)
+            self._header_size += len(line)
+        return True
+
+    def _end_headers(self):
+        headers = BytesHeaderParser(policy=policy.compat32).parsebytes(b''.join(self._header_lines))
+        self._header_lines = []
+        self._header_size = 0
+        self._in_headers = False
+        self._at_line_start = True
+        if self.headers is None:
+            self.headers = headers
+            self._part_path = (1,)
+
+        content_type = headers.get_content_type()
+        boundary = headers.get_boundary() if headers.get_content_maintype() == 'multipart' else None
+        if boundary:
+            path = self._part_path if self._multiparts else ()
+            self._multiparts.append([b'--' + boundary.encode('ascii', 'replace'), path, 0])
+            self._sink = NullSink()
+            return
+
+        decoder = TRANSFER_DECODERS.get((headers.get('Content-Transfer-Encoding') or '').strip().lower(), IdentityDecoder)()
+        is_attachment = (
+            headers.get_filename() is not None
+            or (headers.get('Content-Disposition') or '').strip().lower().startswith('attachment')
+        )
+        if content_type == 'text/plain' and not is_attachment:
+            self._sink = TextSink(decoder, headers.get_content_charset(), self.max_plain, self.plain_parts.append)
+        elif content_type == 'text/html' and not is_attachment:
+            self._sink = TextSink(decoder, headers.get_content_charset(), self.max_html, self.html_parts.append)
+        else:
+            part_id = '.'.join(str(number) for number in self._part_path)
+            filename = headers.get_filename() or ''
+
+            def add_attachment(size, key):
+                self.attachments.append({
+                    'id': part_id,
+                    'filename': filename[:255],
+                    'content_type': content_type,
+                    'size': size,
+                    'storage_key': key,
+                })
+
+            writer = self.store.open_writer() if self.store is not None else None
+            self._sink = AttachmentSink(decoder, writer, add_attachment)
+
+    # Bodies
+
+    def _write(self, data):
+        if not data:
+            return
+        if self._pending_eol:
+            self._sink.write(self._pending_eol)
+            self._pending_eol = b''
+        self._sink.write(data)
+
+    def _consume_body(self):
+        if not self._multiparts:
+            self._write(self._buffer)
+            self._buffer = b''
+            return False
+
+        if self._at_line_start and self._buffer.startswith(b'--'):
+            end = self._buffer.find(b'\n')
+            if end == -1:
+                if len(self._buffer) <= MAX_BOUNDARY_LINE:
+                    return False  # Possibly a boundary; wait for the rest of the line
+            elif self._handle_boundary(self._buffer[:end].rstrip()):
+                self._buffer = self._buffer[end + 1:]
+                return True
+
+        # Everything before the next line starting with '--' is plain part data
+        candidate = self._buffer.find(b'\n--')
+        if candidate == -1:
+            # Keep a short tail in case a '\r\n--' straddles the next chunk
+            if len(self._buffer) <= 3:
+                return False
+            self._write(self._buffer[:-3])
+            self._buffer = self._buffer[-3:]
+            self._at_line_start = False
+            return False
+        # The line break before a boundary belongs to the boundary, so hold it back
+        eol_start = candidate - 1 if candidate and self._buffer[candidate - 1:candidate] == b'\r' else candidate
+        self._write(self._buffer[:eol_start])
+        self._pending_eol += self._buffer[eol_start:candidate + 1]
+        self._buffer = self._buffer[candidate + 1:]
+        self._at_line_start = True
+        return True
+
+    def _handle_boundary(self, line):
+        for depth in range(len(self._multiparts) - 1, -1, -1):
+            marker, path, children = self._multiparts[depth]
+            if line == marker or line == marker + b'--':
+                break
+        else:
+            return False
+
+        self._pending_eol = b''
+        self._sink.close()
+        self._sink = NullSink()
+        del self._multiparts[depth + 1:]
+        if line == marker + b'--':
+            # Closing boundary: what follows is the epilogue
+            self._multiparts.pop()
+        else:
+            self._multiparts[depth][2] += 1
+            self._part_path = path + (self._multiparts[depth][2],)
+            self._in_headers = True
+        self._at_line_start = True
+        return True
+
+    # Result
+
+    def result(self):
+        headers = self.headers
+        body_plain = '\n'.join(self.plain_parts)[:self.max_plain]
+        body_html = '\n'.join(self.html_parts)[:self.max_html]
+        senders = _addresses(headers.get_all('From', []))
+        message_data = {
+            'subject': decode_header_value(headers.get('Subject', '')),
+            'from': senders[0] if senders else '',
+            'to': _addresses(headers.get_all('To', [])),
+            'cc': _addresses(headers.get_all('Cc', [])),
+            'message_id_header': headers.get('Message-ID', ''),
+            'in_reply_to': headers.get('In-Reply-To', ''),
+            'references': headers.get('References', ''),
+            'body_plain': body_plain,
+            'body_html': body_html,
+            # HTML-only mail gets its snippet from the text extraction stage
+            'snippet': make_snippet(body_plain, self.snippet_length),
+            'size': self.size,
+            'attachments': self.attachments,
+        }
+        if headers.get('Date'):
+            try:
+                message_data['sent_at'] = parsedate_to_datetime(headers['Date'])
+            except (TypeError, ValueError):
+                logger.debug(f"Unparseable Date header: {headers['Date']!r}")
+        return message_data
+
+def decode_header_value(value):
+    """
+    Decode RFC 2047 encoded words in a header value
+    """
+    try:
+        return str(policy.default.header_factory('X-Decoded', str(value)))
+    except Exception:
+        return str(value)
+
+def _addresses(values):
+    return [address.lower() for _, address in getaddresses([str(value) for value in values]) if address]
+
+def parse_message(chunks, store=None, **options):
+    """
+    Parse a message from an iterable of byte chunks (or a binary file object)
+    """
+    if hasattr(chunks, 'read'):
+        stream = chunks
+        chunks = iter(lambda: stream.read(64 * 1024), b'')
+    parser = StreamingMessageParser(store=store, **options)
+    for chunk in chunks:
+        parser.feed(chunk)
+    return parser.close()
@@ -1,8 +1,74 @@
+import json
 from django.db import models
 from emails.models import User, EmailAccount
 from oauth.models import OAuthConnection
 from django.utils import timezone
 
+class EmailMessageQuerySet(models.QuerySet):
+    """
+    QuerySet helpers for separating live messages from soft-deleted tombstones
+    """
+    
+    def live(self):
+        """Messages that have not been deleted; matches the partial list indexes"""
+        return self.filter(is_deleted=False)
+    
+    def tombstones(self):
+        """Soft-deleted messages awaiting purge"""
+        return self.filter(is_deleted=True)
+
+class Thread(models.Model):
+    """
+    Conversation reconstructed from Message-ID/In-Reply-To/References headers.
+
+    The counters are a rollup over the thread's live messages, so thread
+    listings never have to aggregate EmailMessage.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    email_account = models.ForeignKey(EmailAccount, on_delete=models.CASCADE)
+    
+    subject = models.CharField(max_length=500, blank=True, help_text="Subject of the first message, without Re:/Fwd: prefixes")
+    
+    # Rollup over live messages
+    message_count = models.IntegerField(default=0)
+    total_size = models.BigIntegerField(default=0)
+    participants = models.TextField(blank=True, help_text="JSON list of sender addresses")
+    last_activity_at = models.DateTimeField(null=True, blank=True)
+    
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', '-last_activity_at'], condition=models.Q(message_count__gt=0), name='thread_live_user_activity'),
+            models.Index(fields=['email_account', '-last_activity_at'], condition=models.Q(message_count__gt=0), name='thread_live_account_activity'),
+        ]
+    
+    def __str__(self):
+        return f"{self.subject} ({self.message_count} messages)"
+
+class MessageBody(models.Model):
+    """
+    Body content shared by copies of the same message in several of a user's accounts.
+
+    Messages seen in a single account keep their body inline; the body moves
+    here once a second copy with the same fingerprint and content arrives.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    fingerprint = models.CharField(max_length=64, help_text="Message fingerprint shared by all copies")
+    body_digest = models.CharField(max_length=64, help_text="SHA-256 of the body content")
+    
+    body_plain = models.TextField(blank=True)
+    body_html = models.TextField(blank=True)
+    
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        unique_together = ('user', 'fingerprint')
+    
+    def __str__(self):
+        return f"Shared body {self.fingerprint[:12]}"
+
 class EmailMessage(models.Model):
     """
     Model to store email message metadata
@@ -13,7 +79,12 @@ class EmailMessage(models.Model):
     
     # Message identifiers
     message_id = models.CharField(max_length=255, help_text="Provider-specific message ID")
+    folder = models.CharField(max_length=255, blank=True, help_text="IMAP folder the UID in message_id belongs to")
+    uid_validity = models.BigIntegerField(null=True, blank=True, help_text="UIDVALIDITY of the folder when the UID was seen")
     thread_id = models.CharField(max_length=255, blank=True, help_text="Thread/conversation ID")
+    internet_message_id = models.CharField(max_length=255, blank=True, help_text="RFC 5322 Message-ID header")
+    conversation = models.ForeignKey(Thread, on_delete=models.SET_NULL, null=True, blank=True, related_name='messages')
+    fingerprint = models.CharField(max_length=64, blank=True, help_text="Hash of Message-ID and normalized headers, equal across accounts")
     
     # Message metadata
     subject = models.CharField(max_length=500)
@@ -26,6 +97,8 @@ class EmailMessage(models.Model):
     snippet = models.TextField(blank=True, help_text="Short preview of message content")
     body_plain = models.TextField(blank=True, help_text="Plain text body")
     body_html = models.TextField(blank=True, help_text="HTML body")
+    shared_body = models.ForeignKey(MessageBody, on_delete=models.SET_NULL, null=True, blank=True, related_name='messages')
+    is_archived = models.BooleanField(default=False, help_text="Body and attachments moved to an archive pack")
     
     # Dates
     sent_at = models.DateTimeField()
@@ -36,6 +109,7 @@ class EmailMessage(models.Model):
     is_starred = models.BooleanField(default=False)
     is_draft = models.BooleanField(default=False)
     is_deleted = models.BooleanField(default=False)
+    deleted_at = models.DateTimeField(null=True, blank=True, help_text="When the message was soft-deleted")
     
     # Categories
     is_spam = models.BooleanField(default=False)
@@ -52,17 +126,73 @@ class EmailMessage(models.Model):
     updated_at = models.DateTimeField(auto_now=True)
     last_synced_at = models.DateTimeField(default=timezone.now)
     
+    objects = EmailMessageQuerySet.as_manager()
+    
     class Meta:
         unique_together = ('email_account', 'message_id')
+        # List and stat indexes only cover live rows, so tombstones never bloat them
         indexes = [
-            models.Index(fields=['user', 'received_at']),
-            models.Index(fields=['user', 'is_read']),
-            models.Index(fields=['user', 'is_spam']),
-            models.Index(fields=['email_account', 'received_at']),
+            models.Index(fields=['user', 'received_at'], condition=models.Q(is_deleted=False), name='email_live_user_received'),
+            models.Index(fields=['user', 'is_read'], condition=models.Q(is_deleted=False), name='email_live_user_read'),
+            models.Index(fields=['user', 'is_spam'], condition=models.Q(is_deleted=False), name='email_live_user_spam'),
+            models.Index(fields=['email_account', 'received_at'], condition=models.Q(is_deleted=False), name='email_live_account_received'),
+            models.Index(fields=['user', '-size'], condition=models.Q(is_deleted=False), name='email_live_user_size'),
+            models.Index(fields=['deleted_at'], condition=models.Q(is_deleted=True), name='email_tombstone_deleted_at'),
+            models.Index(fields=['user', 'fingerprint'], condition=~models.Q(fingerprint=''), name='email_user_fingerprint'),
         ]
     
     def __str__(self):
         return f"{self.subject} - {self.from_address}"
+    
+    def get_body_plain(self):
+        """Plain text body, wherever it is stored"""
+        if self.shared_body_id:
+            return self.shared_body.body_plain
+        if self.is_archived:
+            return self.get_archived()['body_plain']
+        return self.body_plain
+    
+    def get_body_html(self):
+        """HTML body, wherever it is stored"""
+        if self.shared_body_id:
+            return self.shared_body.body_html
+        if self.is_archived:
+            return self.get_archived()['body_html']
+        return self.body_html
+    
+    def get_archived(self):
+        """The archived record of the message (see sync.archive)"""
+        from .archive import ArchiveService
+        return ArchiveService.load(self)
+    
+    def get_duplicates(self):
+        """Live copies of this message in the user's other accounts"""
+        if not self.fingerprint:
+            return EmailMessage.objects.none()
+        return EmailMessage.objects.live().filter(
+            user_id=self.user_id,
+            fingerprint=self.fingerprint,
+        ).exclude(pk=self.pk)
+
+class ThreadContainer(models.Model):
+    """
+    Persistent Message-ID -> thread index (a JWZ container).
+
+    There is one row per Message-ID seen or referenced in an account. Rows for
+    referenced messages that have not arrived yet have no email_message, so a
+    late-arriving parent finds its thread with a single indexed lookup.
+    """
+    email_account = models.ForeignKey(EmailAccount, on_delete=models.CASCADE)
+    message_id = models.CharField(max_length=255, help_text="Message-ID without angle brackets")
+    thread = models.ForeignKey(Thread, on_delete=models.CASCADE, related_name='containers')
+    parent = models.ForeignKey('self', on_delete=models.SET_NULL, null=True, blank=True, related_name='children')
+    email_message = models.OneToOneField(EmailMessage, on_delete=models.SET_NULL, null=True, blank=True, related_name='thread_container')
+    
+    class Meta:
+        unique_together = ('email_account', 'message_id')
+    
+    def __str__(self):
+        return f"<{self.message_id}> in thread {self.thread_id}"
 
 class EmailAttachment(models.Model):
     """
@@ -75,15 +205,27 @@ class EmailAttachment(models.Model):
     size = models.IntegerField(help_text="Attachment size in bytes")
     attachment_id = models.CharField(max_length=255, help_text="Provider-specific attachment ID")
     
-    # In a production environment, we would store the actual attachment content
-    # using a storage backend like S3 or Google Cloud Storage
-    # For now, we'll just store metadata
+    # Payloads live in the content-addressed attachment store (sync.storage),
+    # which can sit on any Django storage backend such as S3
+    storage_key = models.CharField(max_length=100, blank=True, db_index=True, help_text="Attachment store key of the payload")
     
     created_at = models.DateTimeField(auto_now_add=True)
     
     def __str__(self):
         return f"{self.filename} ({self.content_type})"
 
+class OrphanedPayload(models.Model):
+    """
+    An attachment store payload no row refers to that was written or reused
+    too recently to delete; AttachmentStore.delete_unreferenced() checks it
+    again once the grace period has passed.
+    """
+    storage_key = models.CharField(max_length=100, unique=True)
+    orphaned_at = models.DateTimeField(default=timezone.now, db_index=True)
+    
+    def __str__(self):
+        return f"Orphaned payload {self.storage_key}"
+
 class SyncStatus(models.Model):
     """
     Model to track synchronization status for email accounts
@@ -132,6 +274,7 @@ class SyncLog(models.Model):
         ('full', 'Full Sync'),
         ('incremental', 'Incremental Sync'),
         ('folder', 'Folder Sync'),
+        ('import', 'Mailbox Import'),
     ]
     
     SYNC_STATUSES = [
@@ -157,6 +300,8 @@ class SyncLog(models.Model):
     # Timing
     started_at = models.DateTimeField()
     completed_at = models.DateTimeField(null=True, blank=True)
+    # Compact JSON from sync.timing.SyncProfile: seconds per phase, bytes, batches, retries, throttle waits
+    timing_profile = models.TextField(blank=True)
     
     created_at = models.DateTimeField(auto_now_add=True)
     
@@ -167,4 +312,141 @@ class SyncLog(models.Model):
         ]
     
     def __str__(self):
-        return f"Sync log for {self.email_account} - {self.sync_type} ({self.status})"
\ No newline at end of file
+        return f"Sync log for {self.email_account} - {self.sync_type} ({self.status})"
+    
+    @property
+    def timing(self):
+        """The timing profile as a dict, empty for syncs that did not record one"""
+        if not self.timing_profile:
+            return {}
+        try:
+            return json.loads(self.timing_profile)
+        except ValueError:
+            return {}
+    
+    @property
+    def timing_phases(self):
+        """(phase, seconds, percent of the summed phase time) for phases that took any time"""
+        phases = self.timing.get('phases', {})
+        total = sum(phases.values())
+        return [
+            (phase, seconds, round(seconds / total * 100))
+            for phase, seconds in phases.items() if seconds > 0
+        ]
+
+class PendingFlagChange(models.Model):
+    """
+    Outbound queue entry for local flag/label changes not yet pushed to the provider.
+
+    There is at most one row per message. The base_* fields hold the values the
+    provider last had for each changed field (null means the field is unchanged);
+    the values to push are always the message's current local values, so the
+    last write wins and toggles that return to the base cancel out.
+    """
+    email_message = models.OneToOneField(EmailMessage, on_delete=models.CASCADE, related_name='pending_flag_change')
+    email_account = models.ForeignKey(EmailAccount, on_delete=models.CASCADE)
+    
+    # Provider-side values before the first local change
+    base_is_read = models.BooleanField(null=True, blank=True)
+    base_is_starred = models.BooleanField(null=True, blank=True)
+    base_labels = models.TextField(null=True, blank=True, help_text="JSON list of labels on the provider")
+    
+    # Bumped on every local change so a flush never drops a newer write
+    version = models.IntegerField(default=0)
+    
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['email_account', 'id']),
+        ]
+    
+    def __str__(self):
+        return f"Pending flag change for message {self.email_message_id}"
+    
+    @property
+    def tracked_fields(self):
+        """Names of the message fields with unpushed local changes"""
+        return [
+            field for field in ('is_read', 'is_starred', 'labels')
+            if getattr(self, f'base_{field}') is not None
+        ]
+
+class SyncProfilingTarget(models.Model):
+    """
+    Opt-in sampling profiler for syncs of one account (all accounts when
+    email_account is empty) on one worker host (all workers when worker is
+    blank), until expires_at. Managed with `manage.py sync_profiler` or the
+    SyncStatus admin actions.
+    """
+    email_account = models.ForeignKey(EmailAccount, on_delete=models.CASCADE, null=True, blank=True)
+    worker = models.CharField(max_length=255, blank=True, help_text="Worker hostname; blank for every worker")
+    interval = models.FloatField(default=0.01, help_text="Seconds between stack samples")
+    expires_at = models.DateTimeField(null=True, blank=True)
+    
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    def __str__(self):
+        account = self.email_account or 'all accounts'
+        return f"Profile syncs of {account} on {self.worker or 'all workers'}"
+    
+    @property
+    def is_active(self):
+        return self.expires_at is None or self.expires_at > timezone.now()
+
+class RetentionPolicy(models.Model):
+    """
+    Storage tiering for a user's mail: the bodies and attachments of messages
+    received more than archive_after_days ago move to compressed archive
+    packs. A policy for one account overrides the user's policy without one.
+    Applied by `manage.py archive_messages`.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    email_account = models.ForeignKey(EmailAccount, on_delete=models.CASCADE, null=True, blank=True, help_text="Blank for all of the user's accounts")
+    archive_after_days = models.PositiveIntegerField(default=365)
+    
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        unique_together = ('user', 'email_account')
+        verbose_name_plural = 'Retention policies'
+    
+    def __str__(self):
+        return f"Archive mail of {self.email_account or self.user} after {self.archive_after_days} days"
+
+class ArchivePack(models.Model):
+    """
+    A compressed segment of the archive store holding the bodies and
+    attachments of one user's messages received in one month. A month
+    archived over several runs, or bigger than ARCHIVE_PACK_MAX_BYTES, has
+    several packs.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    month = models.DateField(help_text="First day of the month the messages were received in")
+    storage_key = models.CharField(max_length=255, help_text="Archive store key of the pack file")
+    size = models.BigIntegerField(help_text="Pack size in bytes")
+    message_count = models.IntegerField(default=0)
+    
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'month'], name='archive_pack_user_month'),
+        ]
+    
+    def __str__(self):
+        return f"{self.storage_key} ({self.message_count} messages)"
+
+class ArchiveEntry(models.Model):
+    """
+    Archive index: where the record of an archived message sits in its pack
+    """
+    email_message = models.OneToOneField(EmailMessage, on_delete=models.CASCADE, related_name='archive_entry')
+    pack = models.ForeignKey(ArchivePack, on_delete=models.RESTRICT, related_name='entries')
+    offset = models.BigIntegerField()
+    length = models.IntegerField()
+    
+    def __str__(self):
+        return f"Message {self.email_message_id} at {self.pack_id}:{self.offset}"
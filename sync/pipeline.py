@@ -0,0 +1,304 @@
+import logging
+import multiprocessing
+import queue
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+import django
+from django.conf import settings
+from .metrics import PARSE_SECONDS, QUEUE_DEPTH
+from .mime import parse_message
+from .providers import chunked
+from .text import extract_text
+
+logger = logging.getLogger(__name__)
+
+# End-of-stream marker passed down the queues
+STOP = object()
+
+class StageMetrics:
+    """
+    Counters for one pipeline stage.
+
+    blocked_on_input is time workers waited for work (the stage is starved);
+    blocked_on_output is time they waited for room downstream (backpressure).
+    """
+
+    def __init__(self, name, workers):
+        self.name = name
+        self.workers = workers
+        self.items = 0
+        self.errors = 0
+        self.busy = 0.0
+        self.blocked_on_input = 0.0
+        self.blocked_on_output = 0.0
+        self.max_queue_depth = 0
+        self.started_at = None
+        self.finished_at = None
+        self._lock = threading.Lock()
+
+    def add(self, **values):
+        with self._lock:
+            for name, value in values.items():
+                setattr(self, name, getattr(self, name) + value)
+
+    def observe_depth(self, depth):
+        QUEUE_DEPTH.labels(stage=self.name).set(depth)
+        if depth > self.max_queue_depth:
+            self.max_queue_depth = depth
+
+    def as_dict(self):
+        elapsed = (self.finished_at or time.perf_counter()) - (self.started_at or time.perf_counter())
+        return {
+            'stage': self.name,
+            'workers': self.workers,
+            'items': self.items,
+            'errors': self.errors,
+            'items_per_second': round(self.items / elapsed, 1) if elapsed > 0 else 0.0,
+            'busy_seconds': round(self.busy, 3),
+            'blocked_on_input_seconds': round(self.blocked_on_input, 3),
+            'blocked_on_output_seconds': round(self.blocked_on_output, 3),
+            'max_queue_depth': self.max_queue_depth,
+        }
+
+class Stage:
+    """
+    A pool of worker threads between a bounded input queue and the next stage.
+
+    Each worker applies func to items and puts every non-None result on the
+    output queue. When the input is exhausted the last worker to finish
+    forwards STOP to each worker of the next stage.
+    """
+
+    def __init__(self, name, func, workers, input_queue, output_queue, downstream_workers=1):
+        self.name = name
+        self.func = func
+        self.workers = max(int(workers), 1)
+        self.input_queue = input_queue
+        self.output_queue = output_queue
+        self.downstream_workers = downstream_workers
+        self.metrics = StageMetrics(name, self.workers)
+        self._running = self.workers
+        self._lock = threading.Lock()
+        self._threads = []
+
+    def start(self):
+        self.metrics.started_at = time.perf_counter()
+        for index in range(self.workers):
+            thread = threading.Thread(target=self._work, name=f"sync-{self.name}-{index}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def join(self):
+        for thread in self._threads:
+            thread.join()
+
+    def _work(self):
+        try:
+            while True:
+                waited = time.perf_counter()
+                item = self.input_queue.get()
+                self.metrics.add(blocked_on_input=time.perf_counter() - waited)
+                if item is STOP:
+                    break
+                self.metrics.observe_depth(self.input_queue.qsize())
+
+                started = time.perf_counter()
+                try:
+                    results = self.func(item)
+                except Exception as e:
+                    logger.error(f"Pipeline stage {self.name} failed on an item: {e}")
+                    self.metrics.add(errors=1, busy=time.perf_counter() - started)
+                    continue
+                self.metrics.add(items=1, busy=time.perf_counter() - started)
+
+                for result in results or ():
+                    waited = time.perf_counter()
+                    self.output_queue.put(result)
+                    self.metrics.add(blocked_on_output=time.perf_counter() - waited)
+        finally:
+            with self._lock:
+                self._running -= 1
+                last = self._running == 0
+            if last:
+                self.metrics.finished_at = time.perf_counter()
+                for _ in range(self.downstream_workers):
+                    self.output_queue.put(STOP)
+
+def parse_fetched(fetched, store=None, classifiers=(), max_plain=None, snippet_length=None):
+    """
+    CPU stage: turn a FetchedMessage into message_data.
+
+    Also the process pool entry point, so limits are passed in rather than
+    read from settings; classifiers are picklable callables that annotate
+    message_data in place (is_spam, is_important, labels, ...).
+    """
+    message_data = parse_message(
+        [fetched.raw], store=store, max_plain=max_plain, snippet_length=snippet_length,
+    )
+    message_data['body_plain'], message_data['snippet'] = extract_text(
+        message_data['body_plain'], message_data['body_html'], message_data['snippet'],
+        max_plain=max_plain, snippet_length=snippet_length,
+    )
+    message_data.update(fetched.extra, id=fetched.message_id)
+    if classifiers:
+        started = time.perf_counter()
+        for classify in classifiers:
+            classify(message_data)
+        # Reported back for the sync timing profile; popped again by SyncPipeline
+        message_data['classify_seconds'] = time.perf_counter() - started
+    return message_data
+
+def _started(_):
+    time.sleep(0.01)
+
+# Parse pools shared by every sync of this process, by number of processes
+_parse_pools = {}
+_parse_pools_lock = threading.Lock()
+
+def get_parse_pool(processes):
+    """
+    Return the process-wide pool of processes parse workers, started and warm.
+
+    Workers come from a forkserver instead of being forked from a process
+    whose fetch threads may hold locks, and are all started here, before any
+    stage thread runs, so syncs never pay the process start-up.
+    """
+    with _parse_pools_lock:
+        pool = _parse_pools.get(processes)
+        if pool is None:
+            pool = _parse_pools[processes] = ProcessPoolExecutor(
+                max_workers=processes,
+                mp_context=multiprocessing.get_context('forkserver'),
+                # Set up Django before tasks unpickle this module and its models
+                initializer=django.setup,
+            )
+            # Workers are started on demand; one task each starts them all now
+            list(pool.map(_started, range(processes)))
+        return pool
+
+class SyncPipeline:
+    """
+    Staged fetch -> parse/classify -> persist pipeline with bounded queues.
+
+    Fetching runs on fetch_workers threads, so network waits overlap;
+    parsing runs on parse_workers threads, inline or, when parse_processes
+    (SYNC_PARSE_PROCESSES) is set, handing work to a shared process pool
+    (see get_parse_pool); persisting happens on the calling thread, the single database writer, in batches of
+    persist_batch_size messages per transaction (persist may return the
+    number of messages in the batch it failed to store). Every queue is bounded, so a
+    slow stage throttles the ones before it instead of buffering the mailbox.
+    Parse and classification time are added to profile (a SyncProfile), if given,
+    and the stage threads are registered with sampler (a SamplingProfiler).
+    """
+
+    def __init__(self, fetch, persist, store=None, fetch_workers=None, fetch_batch_size=None, parse_workers=None,
+                 parse_processes=None, persist_batch_size=None, queue_size=None, classifiers=(), profile=None,
+                 sampler=None):
+        self.fetch = fetch
+        self.persist = persist
+        self.store = store
+        self.fetch_workers = fetch_workers or getattr(settings, 'SYNC_FETCH_WORKERS', 4)
+        self.fetch_batch_size = fetch_batch_size or getattr(settings, 'SYNC_FETCH_BATCH_SIZE', 50)
+        self.parse_workers = parse_workers or getattr(settings, 'SYNC_PARSE_WORKERS', 2)
+        if parse_processes is None:
+            # Processes cost a pickle round trip per message, so only pay off
+            # with CPU-heavy mail on several cores
+            parse_processes = getattr(settings, 'SYNC_PARSE_PROCESSES', 0) or 0
+        self.parse_processes = parse_processes
+        self.persist_batch_size = persist_batch_size or getattr(settings, 'SYNC_PERSIST_BATCH_SIZE', 100)
+        self.queue_size = queue_size or getattr(settings, 'SYNC_QUEUE_SIZE', 200)
+        self.classifiers = tuple(classifiers)
+        self.profile = profile
+        self.sampler = sampler
+        self.max_plain = getattr(settings, 'MESSAGE_BODY_PLAIN_MAX_CHARS', 1000000)
+        self.snippet_length = getattr(settings, 'MESSAGE_SNIPPET_LENGTH', 200)
+        self.persist_metrics = StageMetrics('persist', 1)
+        self.stages = []
+
+    def run(self, message_ids):
+        """
+        Sync the given provider message IDs and return per-stage metrics
+        """
+        id_queue = queue.Queue()
+        fetched_queue = queue.Queue(maxsize=self.queue_size)
+        parsed_queue = queue.Queue(maxsize=self.queue_size)
+
+        for batch in chunked(list(message_ids), self.fetch_batch_size):
+            id_queue.put(batch)
+        for _ in range(self.fetch_workers):
+            id_queue.put(STOP)
+
+        executor = get_parse_pool(self.parse_processes) if self.parse_processes else None
+
+        def parse(fetched):
+            args = (fetched, self.store, self.classifiers, self.max_plain, self.snippet_length)
+            started = time.perf_counter()
+            if executor is not None:
+                message_data = executor.submit(parse_fetched, *args).result()
+            else:
+                message_data = parse_fetched(*args)
+            elapsed = time.perf_counter() - started
+            PARSE_SECONDS.observe(elapsed)
+            classify_seconds = message_data.pop('classify_seconds', 0.0)
+            if self.profile is not None:
+                self.profile.add_time('parse', elapsed - classify_seconds)
+                self.profile.add_time('classify', classify_seconds)
+            return [message_data]
+
+        parse_workers = max(self.parse_workers, self.parse_processes or 0)
+        fetch_stage = Stage('fetch', self.fetch, self.fetch_workers, id_queue, fetched_queue, parse_workers)
+        parse_stage = Stage('parse', parse, parse_workers, fetched_queue, parsed_queue, 1)
+        self.stages = [fetch_stage, parse_stage]
+        try:
+            for stage in self.stages:
+                stage.start()
+                if self.sampler is not None:
+                    for thread in stage._threads:
+                        self.sampler.add_thread(thread.ident, f"sync-{stage.name}")
+            self._persist_loop(parsed_queue)
+            for stage in self.stages:
+                stage.join()
+        finally:
+            for stage in ('fetch', 'parse', 'persist'):
+                QUEUE_DEPTH.labels(stage=stage).set(0)
+        return self.get_metrics()
+
+    def _persist_loop(self, parsed_queue):
+        """
+        Single writer: drain parsed messages into batches and persist each in one transaction
+        """
+        metrics = self.persist_metrics
+        metrics.started_at = time.perf_counter()
+        finished = False
+        while not finished:
+            waited = time.perf_counter()
+            item = parsed_queue.get()
+            metrics.add(blocked_on_input=time.perf_counter() - waited)
+            batch = []
+            while item is not STOP:
+                batch.append(item)
+                if len(batch) >= self.persist_batch_size:
+                    break
+                try:
+                    item = parsed_queue.get_nowait()
+                except queue.Empty:
+                    break
+            else:
+                finished = True
+            metrics.observe_depth(parsed_queue.qsize())
+
+            if batch:
+                started = time.perf_counter()
+                try:
+                    failed = self.persist(batch) or 0
+                    metrics.add(items=len(batch) - failed, errors=failed)
+                except Exception as e:
+                    logger.error(f"Pipeline failed to persist a batch of {len(batch)} messages: {e}")
+                    metrics.add(errors=len(batch))
+                metrics.add(busy=time.perf_counter() - started)
+        metrics.finished_at = time.perf_counter()
+
+    def get_metrics(self):
+        metrics = [stage.metrics for stage in self.stages] + [self.persist_metrics]
+        return [stage_metrics.as_dict() for stage_metrics in metrics]
@@ -0,0 +1,100 @@
+import logging
+import socket
+import threading
+from datetime import timedelta
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+from core.sampling import SamplingProfiler
+from .models import SyncProfilingTarget
+
+logger = logging.getLogger(__name__)
+
+def current_worker():
+    """
+    Name this worker is matched on by SyncProfilingTarget.worker
+    """
+    return socket.gethostname()
+
+class SyncProfilerService:
+    """
+    Turn the sampling profiler on and off for syncs and dump its stacks per sync
+    """
+
+    @staticmethod
+    def enable(email_account=None, worker='', interval=None, duration=None):
+        """
+        Profile the syncs of email_account (None for all) on worker ('' for all),
+        for duration seconds or until disabled
+        """
+        interval = interval or getattr(settings, 'SYNC_PROFILER_INTERVAL', 0.01)
+        target, _ = SyncProfilingTarget.objects.update_or_create(
+            email_account=email_account,
+            worker=worker,
+            defaults={
+                'interval': max(interval, getattr(settings, 'SYNC_PROFILER_MIN_INTERVAL', 0.005)),
+                'expires_at': timezone.now() + timedelta(seconds=duration) if duration else None,
+            },
+        )
+        logger.info(f"Enabled sync profiling: {target}")
+        return target
+
+    @staticmethod
+    def disable(email_account=None, worker=None):
+        """
+        Remove the matching targets (worker None matches every worker), returning how many there were
+        """
+        targets = SyncProfilingTarget.objects.filter(email_account=email_account)
+        if worker is not None:
+            targets = targets.filter(worker=worker)
+        deleted, _ = targets.delete()
+        return deleted
+
+    @staticmethod
+    def target_for(email_account, worker=None):
+        """
+        The active target covering a sync of email_account on this worker, if any
+        """
+        return SyncProfilingTarget.objects.filter(
+            Q(email_account=email_account) | Q(email_account__isnull=True),
+            Q(worker=worker or current_worker()) | Q(worker=''),
+            Q(expires_at__isnull=True) | Q(expires_at__gt=timezone.now()),
+        ).order_by('interval').first()
+
+    @staticmethod
+    def start(email_account):
+        """
+        Start sampling the calling thread if profiling is enabled for this sync.
+
+        Returns the running SamplingProfiler, or None. The pipeline registers
+        its stage threads with it.
+        """
+        target = SyncProfilerService.target_for(email_account)
+        if target is None:
+            return None
+        profiler = SamplingProfiler(
+            interval=target.interval,
+            max_depth=getattr(settings, 'SYNC_PROFILER_MAX_DEPTH', 64),
+            max_stacks=getattr(settings, 'SYNC_PROFILER_MAX_STACKS', 10000),
+        )
+        # The calling thread is the pipeline's database writer
+        profiler.add_thread(threading.get_ident(), 'sync-persist')
+        return profiler.start()
+
+    @staticmethod
+    def finish(profiler, sync_log):
+        """
+        Stop profiler and write its collapsed-stack and speedscope files, returning their paths
+        """
+        profiler.stop()
+        directory = getattr(settings, 'SYNC_PROFILER_DIR', settings.BASE_DIR / 'profiles')
+        try:
+            paths = profiler.dump(directory, f"sync-{sync_log.email_account_id}-{sync_log.id}")
+        except OSError as e:
+            logger.warning(f"Could not write sync profile to {directory}: {e}")
+            return ()
+        logger.info(
+            f"Sync profile for {sync_log.email_account}: {profiler.samples} samples, "
+            f"{profiler.overhead:.3f}s sampling overhead, written to {paths[0]}"
+        )
+        return paths
@@ -0,0 +1,496 @@
+import base64
+import imaplib
+import json
+import logging
+import re
+import time
+import urllib.error
+import urllib.request
+from collections import defaultdict
+from datetime import datetime, timezone as dt_timezone
+from email.utils import parsedate_to_datetime
+from typing import NamedTuple
+from django.conf import settings
+from oauth.tokens import get_token_manager
+from .imap_pool import CONNECTION_ERRORS, ImapPoolExhausted, get_imap_pool
+from .metrics import PROVIDER_REQUESTS
+from .ratelimit import get_rate_limiter, provider_key
+
+logger = logging.getLogger(__name__)
+
+class ProviderError(Exception):
+    """Raised when a mail provider rejects or fails a request"""
+
+class ProviderThrottled(ProviderError):
+    """
+    Raised when a provider refuses a request for exceeding a quota.
+
+    scope is 'user' for per-mailbox quotas and 'app' for per-application ones.
+    """
+
+    def __init__(self, message, retry_after=None, scope='user'):
+        super().__init__(message)
+        self.retry_after = retry_after
+        self.scope = scope
+
+class UidValidityMismatch(ProviderError):
+    """
+    Raised instead of pushing a UID command when the folder's UIDVALIDITY changed.
+
+    The stored UIDs may then name different messages, so acting on them is unsafe.
+    """
+
+def parse_retry_after(value):
+    """
+    Seconds to wait from a Retry-After header (delta-seconds or an HTTP date)
+    """
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max((parsedate_to_datetime(value) - datetime.now(dt_timezone.utc)).total_seconds(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+# System flags in the neutral vocabulary used by FlagChange
+SEEN = '\\Seen'
+FLAGGED = '\\Flagged'
+
+class FlagChange(NamedTuple):
+    """
+    Flags/labels to add to and remove from one provider message.
+
+    System state is expressed as the IMAP flags SEEN and FLAGGED; anything
+    else is a label/keyword name.
+    """
+    message_id: str
+    add: frozenset = frozenset()
+    remove: frozenset = frozenset()
+
+class FetchedMessage(NamedTuple):
+    """
+    A raw RFC 822 message fetched from a provider, plus provider-side state.
+
+    extra holds message_data keys the provider knows better than the message
+    itself (flags, labels, received_at, thread_id).
+    """
+    message_id: str
+    raw: bytes
+    extra: dict
+
+def compress_uid_set(uids):
+    """
+    Render UIDs as a compact IMAP sequence set, e.g. [1, 2, 3, 7] -> '1:3,7'
+    """
+    ranges = []
+    for uid in sorted(set(int(uid) for uid in uids)):
+        if ranges and uid == ranges[-1][1] + 1:
+            ranges[-1][1] = uid
+        else:
+            ranges.append([uid, uid])
+    return ','.join(
+        str(start) if start == end else f"{start}:{end}"
+        for start, end in ranges
+    )
+
+def chunked(items, size):
+    """
+    Yield successive lists of at most size items
+    """
+    items = list(items)
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+class ProviderClient:
+    """
+    Base class for provider write-back clients.
+
+    Every provider request goes through the shared rate limiter via _limited,
+    which adds its throttle waits and retries to profile when a sync sets one.
+    """
+    batch_size = 500
+    max_throttle_retries = 3
+    profile = None
+
+    def __init__(self, email_account, rate_limiter=None):
+        self.email_account = email_account
+        self.rate_limiter = rate_limiter or get_rate_limiter()
+        self.provider = provider_key(email_account.provider)
+
+    def _limited(self, cost, func, *args):
+        """
+        Run one provider request under the rate limiter, retrying after throttling
+        """
+        user_id = self.email_account.user_id
+        for attempt in range(self.max_throttle_retries + 1):
+            waited = time.perf_counter()
+            self.rate_limiter.acquire(self.provider, user_id, cost)
+            if self.profile is not None:
+                self.profile.add(throttle_wait=time.perf_counter() - waited, retries=1 if attempt else 0)
+            try:
+                result = func(*args)
+            except ProviderThrottled as e:
+                PROVIDER_REQUESTS.labels(provider=self.provider, outcome='throttled').inc()
+                if self.profile is not None:
+                    self.profile.add(throttled=1)
+                self.rate_limiter.record_throttle(self.provider, user_id, retry_after=e.retry_after, scope=e.scope)
+                if attempt == self.max_throttle_retries:
+                    raise
+                continue
+            except ProviderError:
+                PROVIDER_REQUESTS.labels(provider=self.provider, outcome='error').inc()
+                raise
+            PROVIDER_REQUESTS.labels(provider=self.provider, outcome='ok').inc()
+            self.rate_limiter.record_success(self.provider, user_id)
+            return result
+
+    def list_message_ids(self):
+        """
+        Return the provider IDs of all messages in the synced mailbox
+        """
+        raise NotImplementedError
+
+    def fetch_messages(self, message_ids):
+        """
+        Fetch raw messages, returning a list of FetchedMessage
+        """
+        raise NotImplementedError
+
+    def delete_messages(self, message_ids, folder=None, uid_validity=None):
+        """
+        Permanently delete messages on the provider, returning the number deleted.
+
+        folder and uid_validity are the values stored with the messages; UID
+        based providers refuse the delete if they no longer match.
+        """
+        raise NotImplementedError
+
+    def apply_flag_changes(self, changes):
+        """
+        Push FlagChanges to the provider in batches, returning the number of messages changed
+        """
+        raise NotImplementedError
+
+    def close(self):
+        """
+        Release any resources held by the client
+        """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+class ImapProviderClient(ProviderClient):
+    """
+    Provider client speaking IMAP, where message IDs are folder UIDs
+    """
+    batch_size = 1000
+
+    def __init__(self, email_account, folder='INBOX', rate_limiter=None, pool=None):
+        super().__init__(email_account, rate_limiter=rate_limiter)
+        self.folder = folder
+        self.pool = pool or get_imap_pool()
+        self._session = None
+        self._connection = None
+
+    def _connect(self):
+        """
+        Check out a pooled session with the folder selected on first use
+        """
+        if self._connection is not None:
+            return self._connection
+
+        try:
+            self._session = self.pool.acquire(self.email_account, self.folder)
+        except (ImapPoolExhausted, *CONNECTION_ERRORS) as e:
+            raise ProviderError(f"Could not open IMAP session for {self.email_account}: {e}") from e
+        self._connection = self._session.connection
+        return self._connection
+
+    @staticmethod
+    def _check(response):
+        typ, data = response
+        if typ != 'OK':
+            if any(b'THROTTLED' in line.upper() for line in data if isinstance(line, bytes)):
+                raise ProviderThrottled(f"IMAP command throttled: {data!r}")
+            raise ProviderError(f"IMAP command failed: {data!r}")
+        return data
+
+    def _uid(self, *args):
+        """
+        Run a rate-limited UID command and return its checked data
+        """
+        connection = self._connect()
+        return self._limited(1, lambda: self._check(self._command(connection.uid, *args)))
+
+    def _command(self, method, *args):
+        """
+        Send a command, marking the pooled session broken if the connection fails
+        """
+        try:
+            return method(*args)
+        except CONNECTION_ERRORS as e:
+            if self._session is not None:
+                self._session.broken = True
+            raise ProviderError(f"IMAP connection to {self.email_account} failed: {e}") from e
+
+    FETCH_META_RE = re.compile(rb'UID (\d+)|FLAGS \(([^)]*)\)|(INTERNALDATE "[^"]+")')
+
+    def list_message_ids(self):
+        data = self._uid('SEARCH', None, 'ALL')
+        return [uid.decode() for uid in (data[0] or b'').split()]
+
+    def fetch_messages(self, message_ids):
+        uids = [uid for uid in message_ids if str(uid).isdigit()]
+        if not uids:
+            return []
+
+        fetched = []
+        for batch in chunked(uids, self.batch_size):
+            data = self._uid('FETCH', compress_uid_set(batch), '(UID FLAGS INTERNALDATE BODY.PEEK[])')
+            for item in data:
+                if isinstance(item, tuple):
+                    fetched.append(self._fetched_message(item[0], item[1]))
+        return fetched
+
+    def _fetched_message(self, meta, raw):
+        uid, flags, received_at = None, [], None
+        for match in self.FETCH_META_RE.finditer(meta):
+            if match.group(1):
+                uid = match.group(1).decode()
+            elif match.group(2) is not None:
+                flags = match.group(2).decode().split()
+            elif match.group(3):
+                parsed = imaplib.Internaldate2tuple(match.group(3))
+                if parsed:
+                    received_at = datetime.fromtimestamp(time.mktime(parsed), tz=dt_timezone.utc)
+        extra = {
+            'is_read': SEEN in flags,
+            'is_starred': FLAGGED in flags,
+            'is_draft': '\\Draft' in flags,
+            'labels': [flag for flag in flags if not flag.startswith('\\')],
+        }
+        if received_at:
+            extra['received_at'] = received_at
+        extra['folder'] = self.folder
+        if self._session is not None and self._session.uid_validity is not None:
+            extra['uid_validity'] = self._session.uid_validity
+        return FetchedMessage(uid, raw, extra)
+
+    def _select_verified(self, folder, uid_validity):
+        """
+        Re-select folder and make sure stored UIDs still refer to the same messages
+        """
+        self._connect()
+        self._command(self._session.select, folder, True)
+        current = self._session.uid_validity
+        if uid_validity is None or current != uid_validity:
+            raise UidValidityMismatch(
+                f"UIDVALIDITY of {folder} for {self.email_account} is {current}, stored UIDs have {uid_validity}"
+            )
+
+    def delete_messages(self, message_ids, folder=None, uid_validity=None):
+        uids = [uid for uid in message_ids if str(uid).isdigit()]
+        if len(uids) != len(message_ids):
+            logger.warning(f"Skipping {len(message_ids) - len(uids)} non-UID message IDs for {self.email_account}")
+        if not uids:
+            return 0
+
+        self._select_verified(folder or self.folder, uid_validity)
+        connection = self._connection
+        if 'UIDPLUS' not in connection.capabilities:
+            # A plain EXPUNGE would also remove messages other clients flagged \Deleted
+            logger.warning(
+                f"{self.email_account} lacks UIDPLUS; leaving {len(uids)} messages flagged \\Deleted without expunging"
+            )
+        for batch in chunked(uids, self.batch_size):
+            uid_set = compress_uid_set(batch)
+            self._uid('STORE', uid_set, '+FLAGS.SILENT', r'(\Deleted)')
+            if 'UIDPLUS' in connection.capabilities:
+                self._uid('EXPUNGE', uid_set)
+        return len(uids)
+
+    def apply_flag_changes(self, changes):
+        # One UID STORE per (flag, direction) over a compressed UID set
+        groups = defaultdict(list)
+        for change in changes:
+            if not str(change.message_id).isdigit():
+                continue
+            for flag in change.add:
+                groups[(self._imap_flag(flag), '+FLAGS.SILENT')].append(change.message_id)
+            for flag in change.remove:
+                groups[(self._imap_flag(flag), '-FLAGS.SILENT')].append(change.message_id)
+        if not groups:
+            return 0
+
+        for (flag, operation), uids in groups.items():
+            for batch in chunked(uids, self.batch_size):
+                self._uid('STORE', compress_uid_set(batch), operation, f"({flag})")
+        return len(changes)
+
+    @staticmethod
+    def _imap_flag(flag):
+        """
+        System flags pass through; labels become IMAP keywords (atoms)
+        """
+        if flag.startswith('\\'):
+            return flag
+        return re.sub(r'[^A-Za-z0-9_.$-]', '_', flag)
+
+    def close(self):
+        """
+        Hand the session back to the pool; it stays logged in with the folder selected
+        """
+        if self._session is not None:
+            self.pool.release(self._session)
+        self._session = None
+        self._connection = None
+
+class GmailProviderClient(ProviderClient):
+    """
+    Provider client for the Gmail REST API
+    """
+    API_BASE = 'https://gmail.googleapis.com/gmail/v1/users/me'
+    batch_size = 1000  # Gmail's limit for batchDelete/batchModify
+
+    # Quota units per request; messages.list and messages.get cost 5
+    QUOTA_UNITS = {'batchDelete': 50, 'batchModify': 50}
+
+    def __init__(self, email_account, api_base=None, timeout=30, rate_limiter=None):
+        super().__init__(email_account, rate_limiter=rate_limiter)
+        self.provider = 'google'
+        self.api_base = api_base or getattr(settings, 'GMAIL_API_BASE', self.API_BASE)
+        self.timeout = timeout
+
+    def _request(self, method, path, body=None):
+        """
+        Send an authenticated, rate-limited JSON request and return the decoded response
+        """
+        cost = self.QUOTA_UNITS.get(path.split('?')[0].rsplit('/', 1)[-1], 5)
+        return self._limited(cost, self._send, method, path, body)
+
+    def _send(self, method, path, body=None):
+        data = json.dumps(body).encode() if body is not None else None
+        request = urllib.request.Request(
+            f"{self.api_base}{path}",
+            data=data,
+            method=method,
+            headers={
+                'Authorization': f"Bearer {get_token_manager().token_for_account(self.email_account)}",
+                'Content-Type': 'application/json',
+            },
+        )
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                payload = response.read()
+        except urllib.error.HTTPError as e:
+            self._raise_if_throttled(e, method, path)
+            raise ProviderError(f"Gmail API {method} {path} failed with {e.code}") from e
+        except urllib.error.URLError as e:
+            raise ProviderError(f"Gmail API {method} {path} failed: {e.reason}") from e
+        return json.loads(payload) if payload else {}
+
+    @staticmethod
+    def _raise_if_throttled(error, method, path):
+        """
+        Turn 429s and 403 rate limit errors into ProviderThrottled
+        """
+        if error.code not in (403, 429):
+            return
+        try:
+            reason = error.read().decode('utf-8', 'replace')
+        except OSError:
+            reason = ''
+        if error.code == 403 and 'RateLimitExceeded' not in reason and 'rateLimitExceeded' not in reason:
+            return
+        # rateLimitExceeded is the project-wide quota, userRateLimitExceeded the mailbox one
+        scope = 'app' if 'rateLimitExceeded' in reason and 'userRateLimitExceeded' not in reason else 'user'
+        raise ProviderThrottled(
+            f"Gmail API {method} {path} throttled with {error.code}",
+            retry_after=parse_retry_after(error.headers.get('Retry-After') if error.headers else None),
+            scope=scope,
+        ) from error
+
+    def list_message_ids(self):
+        message_ids = []
+        page_token = None
+        while True:
+            path = '/messages?maxResults=500' + (f"&pageToken={page_token}" if page_token else '')
+            response = self._request('GET', path)
+            message_ids.extend(message['id'] for message in response.get('messages', []))
+            page_token = response.get('nextPageToken')
+            if not page_token:
+                return message_ids
+
+    def fetch_messages(self, message_ids):
+        fetched = []
+        for message_id in message_ids:
+            response = self._request('GET', f"/messages/{message_id}?format=raw")
+            labels = response.get('labelIds', [])
+            extra = {
+                'thread_id': response.get('threadId', ''),
+                'is_read': 'UNREAD' not in labels,
+                'is_starred': 'STARRED' in labels,
+                'is_spam': 'SPAM' in labels,
+                'is_important': 'IMPORTANT' in labels,
+                'is_draft': 'DRAFT' in labels,
+                'labels': labels,
+            }
+            if response.get('internalDate'):
+                extra['received_at'] = datetime.fromtimestamp(int(response['internalDate']) / 1000, tz=dt_timezone.utc)
+            raw = base64.urlsafe_b64decode(response.get('raw', '') + '=' * (-len(response.get('raw', '')) % 4))
+            fetched.append(FetchedMessage(message_id, raw, extra))
+        return fetched
+
+    def delete_messages(self, message_ids, folder=None, uid_validity=None):
+        # Gmail message IDs are stable, so folder and UIDVALIDITY do not apply
+        for batch in chunked(message_ids, self.batch_size):
+            self._request('POST', '/messages/batchDelete', {'ids': batch})
+        return len(message_ids)
+
+    def apply_flag_changes(self, changes):
+        # Messages with identical label edits share one batchModify call
+        groups = defaultdict(list)
+        for change in changes:
+            add, remove = set(), set()
+            for flag in change.add:
+                self._gmail_label(flag, add, remove)
+            for flag in change.remove:
+                self._gmail_label(flag, remove, add)
+            if add or remove:
+                groups[(frozenset(add), frozenset(remove))].append(change.message_id)
+
+        for (add, remove), message_ids in groups.items():
+            for batch in chunked(message_ids, self.batch_size):
+                body = {'ids': batch}
+                if add:
+                    body['addLabelIds'] = sorted(add)
+                if remove:
+                    body['removeLabelIds'] = sorted(remove)
+                self._request('POST', '/messages/batchModify', body)
+        return len(changes)
+
+    @staticmethod
+    def _gmail_label(flag, same, opposite):
+        """
+        Translate a neutral flag into Gmail label edits; reading removes UNREAD
+        """
+        if flag == SEEN:
+            opposite.add('UNREAD')
+        elif flag == FLAGGED:
+            same.add('STARRED')
+        else:
+            same.add(flag)
+
+def get_provider_client(email_account):
+    """
+    Return the write-back client appropriate for an email account
+    """
+    if email_account.provider.lower() in ('google', 'gmail') and email_account.oauth_token:
+        return GmailProviderClient(email_account)
+    return ImapProviderClient(email_account)
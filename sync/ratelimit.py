@@ -0,0 +1,291 @@
+import logging
+import threading
+import time
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# Provider quotas as (requests per second, burst) per user mailbox and per
+# application. Costs are in provider quota units, e.g. a Gmail messages.get
+# costs 5 of the 250 units a user may spend per second.
+DEFAULT_PROVIDER_RATE_LIMITS = {
+    'google': {'user': (250, 250), 'app': (20000, 20000)},
+    'microsoft': {'user': (16, 30), 'app': (2000, 2000)},
+    'yahoo': {'user': (5, 10), 'app': (500, 500)},
+    'imap': {'user': (10, 20), 'app': (1000, 1000)},
+}
+
+PROVIDER_ALIASES = {
+    'gmail': 'google',
+    'googlemail': 'google',
+    'outlook': 'microsoft',
+    'hotmail': 'microsoft',
+    'office365': 'microsoft',
+    'exchange': 'microsoft',
+}
+
+def provider_key(name):
+    """
+    Map a free-form provider name (EmailAccount.provider) to a rate limit family
+    """
+    name = (name or '').strip().lower()
+    name = PROVIDER_ALIASES.get(name, name)
+    return name if name in DEFAULT_PROVIDER_RATE_LIMITS else 'imap'
+
+class RateLimitTimeout(Exception):
+    """Raised when a request cannot be admitted within the caller's timeout"""
+
+class InMemoryRateLimitBackend:
+    """
+    Token buckets for a single process.
+
+    Each bucket holds its available tokens, the current (adaptive) refill
+    rate and the time until which the provider asked us to back off.
+    """
+
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def _bucket(self, key, max_rate, capacity, now):
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = {'tokens': capacity, 'updated': now, 'rate': max_rate, 'blocked_until': 0.0}
+        bucket['rate'] = min(bucket['rate'], max_rate)
+        bucket['tokens'] = min(capacity, bucket['tokens'] + max(now - bucket['updated'], 0) * bucket['rate'])
+        bucket['updated'] = now
+        return bucket
+
+    def take(self, buckets, cost, increase=0.0):
+        """
+        Take cost tokens from every (key, max_rate, capacity) bucket, or none of them.
+
+        Each bucket's rate first grows by increase * max_rate (capped at
+        max_rate). Returns 0 when admitted, else the seconds to wait before
+        trying again.
+        """
+        with self._lock:
+            now = self.clock()
+            states = [self._bucket(key, max_rate, capacity, now) for key, max_rate, capacity in buckets]
+            wait = 0.0
+            for state, (_, max_rate, _) in zip(states, buckets):
+                if increase:
+                    state['rate'] = min(max_rate, state['rate'] + max_rate * increase)
+                if state['blocked_until'] > now:
+                    wait = max(wait, state['blocked_until'] - now)
+                elif state['tokens'] < cost:
+                    wait = max(wait, (cost - state['tokens']) / state['rate'])
+            if not wait:
+                for state in states:
+                    state['tokens'] -= cost
+            return wait
+
+    def adjust(self, key, max_rate, capacity, rate, blocked_for=0.0):
+        """
+        Set a bucket's refill rate and optionally block it for blocked_for seconds
+        """
+        with self._lock:
+            now = self.clock()
+            bucket = self._bucket(key, max_rate, capacity, now)
+            bucket['rate'] = rate
+            if blocked_for:
+                bucket['tokens'] = 0
+                bucket['blocked_until'] = max(bucket['blocked_until'], now + blocked_for)
+
+    def get_rate(self, key, max_rate):
+        with self._lock:
+            bucket = self._buckets.get(key)
+            return min(bucket['rate'], max_rate) if bucket else max_rate
+
+# Both scripts use the Redis server clock so every worker sees the same time
+REDIS_TAKE_SCRIPT = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local cost = tonumber(ARGV[1])
+local ttl = tonumber(ARGV[2])
+local increase = tonumber(ARGV[3])
+local wait = 0
+local states = {}
+for i, key in ipairs(KEYS) do
+    local max_rate = tonumber(ARGV[2 * i + 2])
+    local capacity = tonumber(ARGV[2 * i + 3])
+    local s = redis.call('HMGET', key, 'tokens', 'updated', 'rate', 'blocked_until')
+    local rate = math.min(tonumber(s[3]) or max_rate, max_rate)
+    local tokens = tonumber(s[1]) or capacity
+    local updated = tonumber(s[2]) or now
+    local blocked_until = tonumber(s[4]) or 0
+    tokens = math.min(capacity, tokens + math.max(now - updated, 0) * rate)
+    rate = math.min(max_rate, rate + max_rate * increase)
+    if blocked_until > now then
+        wait = math.max(wait, blocked_until - now)
+    elseif tokens < cost then
+        wait = math.max(wait, (cost - tokens) / rate)
+    end
+    states[i] = {tokens, rate, blocked_until}
+end
+for i, key in ipairs(KEYS) do
+    local tokens = states[i][1]
+    if wait == 0 then
+        tokens = tokens - cost
+    end
+    redis.call('HSET', key, 'tokens', tokens, 'updated', now, 'rate', states[i][2], 'blocked_until', states[i][3])
+    redis.call('EXPIRE', key, ttl)
+end
+return tostring(wait)
+"""
+
+REDIS_ADJUST_SCRIPT = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local max_rate = tonumber(ARGV[1])
+local capacity = tonumber(ARGV[2])
+local rate = tonumber(ARGV[3])
+local blocked_for = tonumber(ARGV[4])
+local ttl = tonumber(ARGV[5])
+local s = redis.call('HMGET', KEYS[1], 'tokens', 'updated', 'rate', 'blocked_until')
+local tokens = tonumber(s[1]) or capacity
+local updated = tonumber(s[2]) or now
+local blocked_until = tonumber(s[4]) or 0
+tokens = math.min(capacity, tokens + math.max(now - updated, 0) * math.min(tonumber(s[3]) or max_rate, max_rate))
+if blocked_for > 0 then
+    tokens = 0
+    blocked_until = math.max(blocked_until, now + blocked_for)
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'updated', now, 'rate', rate, 'blocked_until', blocked_until)
+redis.call('EXPIRE', KEYS[1], ttl)
+return 1
+"""
+
+class RedisRateLimitBackend:
+    """
+    Token buckets shared by every worker in the cluster.
+
+    Buckets are Redis hashes updated atomically by Lua scripts; idle
+    buckets expire after ttl seconds.
+    """
+
+    def __init__(self, client=None, url=None, prefix='ratelimit', ttl=3600):
+        if client is None:
+            import redis
+
+            client = redis.Redis.from_url(url or getattr(settings, 'REDIS_URL', 'redis://localhost:6379/0'))
+        self.client = client
+        self.prefix = prefix
+        self.ttl = ttl
+        self._take = client.register_script(REDIS_TAKE_SCRIPT)
+        self._adjust = client.register_script(REDIS_ADJUST_SCRIPT)
+
+    def _key(self, key):
+        return f"{self.prefix}:{key}"
+
+    def take(self, buckets, cost, increase=0.0):
+        keys = [self._key(key) for key, _, _ in buckets]
+        args = [cost, self.ttl, increase]
+        for _, max_rate, capacity in buckets:
+            args.extend([max_rate, capacity])
+        return float(self._take(keys=keys, args=args))
+
+    def adjust(self, key, max_rate, capacity, rate, blocked_for=0.0):
+        self._adjust(keys=[self._key(key)], args=[max_rate, capacity, rate, blocked_for, self.ttl])
+
+    def get_rate(self, key, max_rate):
+        rate = self.client.hget(self._key(key), 'rate')
+        return min(float(rate), max_rate) if rate is not None else max_rate
+
+class RateLimiter:
+    """
+    Adaptive per-provider rate limiter.
+
+    Every request takes tokens from two buckets: one for the (provider, user)
+    pair and one for the (provider, app) pair. Buckets refill at an adaptive
+    rate managed AIMD-style: each success adds a small fraction of the quota
+    back, each throttling response halves the rate and blocks the bucket for
+    the provider's Retry-After (or a default backoff), so sync runs close to
+    the quota ceiling without repeatedly tripping it.
+    """
+
+    def __init__(self, backend=None, limits=None, increase=None, decrease=None, min_rate=None,
+                 default_backoff=None, sleep=time.sleep):
+        self.backend = backend or InMemoryRateLimitBackend()
+        self.limits = limits or getattr(settings, 'PROVIDER_RATE_LIMITS', DEFAULT_PROVIDER_RATE_LIMITS)
+        self.increase = increase or getattr(settings, 'RATE_LIMIT_INCREASE', 0.02)
+        self.decrease = decrease or getattr(settings, 'RATE_LIMIT_DECREASE', 0.5)
+        self.min_rate = min_rate or getattr(settings, 'RATE_LIMIT_MIN_RATE', 0.05)
+        self.default_backoff = default_backoff or getattr(settings, 'RATE_LIMIT_DEFAULT_BACKOFF', 1.0)
+        self.sleep = sleep
+        self._successes = {}
+        self._lock = threading.Lock()
+
+    def _buckets(self, provider, user_id):
+        provider = provider_key(provider)
+        limits = self.limits.get(provider) or DEFAULT_PROVIDER_RATE_LIMITS[provider]
+        return [
+            (f"{provider}:user:{user_id}", *limits['user']),
+            (f"{provider}:app", *limits['app']),
+        ]
+
+    def acquire(self, provider, user_id, cost=1, timeout=None):
+        """
+        Block until cost units may be spent, returning the seconds waited
+        """
+        buckets = self._buckets(provider, user_id)
+        # A request larger than a bucket could never be admitted
+        cost = min(cost, *(capacity for _, _, capacity in buckets))
+        with self._lock:
+            successes = self._successes.pop((provider, user_id), 0)
+        waited = 0.0
+        while True:
+            wait = self.backend.take(buckets, cost, increase=successes * self.increase)
+            successes = 0
+            if not wait:
+                return waited
+            if timeout is not None and waited + wait > timeout:
+                raise RateLimitTimeout(f"Rate limit for {provider} would delay the request by {waited + wait:.1f}s")
+            self.sleep(wait)
+            waited += wait
+
+    def record_success(self, provider, user_id):
+        """
+        Additive increase: give back a fraction of each quota after a successful request.
+
+        The increase is applied by the next acquire for the same provider and user.
+        """
+        with self._lock:
+            self._successes[(provider, user_id)] = self._successes.get((provider, user_id), 0) + 1
+
+    def record_throttle(self, provider, user_id, retry_after=None, scope='user'):
+        """
+        Multiplicative decrease after the provider throttled us, plus a pause of retry_after seconds
+        """
+        blocked_for = retry_after if retry_after is not None else self.default_backoff
+        with self._lock:
+            self._successes.pop((provider, user_id), None)
+        for key, max_rate, capacity in self._buckets(provider, user_id):
+            if scope == 'user' and ':app' in key:
+                continue
+            rate = self.backend.get_rate(key, max_rate)
+            rate = max(max_rate * self.min_rate, rate * self.decrease)
+            self.backend.adjust(key, max_rate, capacity, rate, blocked_for=blocked_for)
+            logger.info(f"Throttled by {provider}: {key} slowed to {rate:.2f}/s for {blocked_for:.1f}s")
+
+    def get_rates(self, provider, user_id):
+        """
+        Current refill rates of the user and app buckets
+        """
+        return {key: self.backend.get_rate(key, max_rate) for key, max_rate, _ in self._buckets(provider, user_id)}
+
+_default_limiter = None
+
+def get_rate_limiter():
+    """
+    Return the process-wide rate limiter, backed by Redis when RATE_LIMIT_BACKEND is 'redis'
+    """
+    global _default_limiter
+    if _default_limiter is None:
+        if getattr(settings, 'RATE_LIMIT_BACKEND', 'memory') == 'redis':
+            backend = RedisRateLimitBackend(url=getattr(settings, 'RATE_LIMIT_REDIS_URL', None))
+        else:
+            backend = InMemoryRateLimitBackend()
+        _default_limiter = RateLimiter(backend=backend)
+    return _default_limiter
@@ -1,11 +1,31 @@
 import logging
 import json
+import threading
+import time
 from datetime import datetime, timedelta
 from django.utils import timezone
 from django.db import transaction
-from .models import EmailMessage, EmailAttachment, SyncStatus, SyncLog
+from django.db.models import Count, F
+from .models import EmailMessage, EmailAttachment, SyncStatus, SyncLog, PendingFlagChange
+from .providers import FlagChange, SEEN, FLAGGED, get_provider_client
 from emails.models import EmailAccount
 from oauth.models import OAuthConnection
+from spam.services import SenderReputationService
+from analytics.services import RollupService, StorageService
+from .threads import ThreadService, thread_headers
+from .dedup import DedupService, compute_fingerprint
+from .mime import parse_message
+from .pipeline import SyncPipeline
+from .profiler import SyncProfilerService
+from .timing import SyncProfile
+from .text import extract_text
+from .storage import get_attachment_store
+from .imap_pool import get_imap_pool
+from .metrics import (
+    ACTIVE_SYNCS, FETCH_BATCH_SECONDS, MESSAGES_FAILED, MESSAGES_FETCHED, MESSAGES_PERSISTED,
+    PERSIST_BATCH_SECONDS, SYNC_RUNS,
+)
+from .ratelimit import provider_key
 
 logger = logging.getLogger(__name__)
 
@@ -44,6 +64,13 @@ class EmailSyncService:
                 started_at=timezone.now(),
             )
             
+            # Push local flag changes first so inbound sync sees them on the server
+            if sync_type == 'incremental':
+                try:
+                    FlagSyncService.flush(email_account)
+                except Exception as e:
+                    logger.warning(f"Could not flush pending flag changes for {email_account}: {e}")
+            
             logger.info(f"Started {sync_type} sync for {email_account}")
             return sync_log
             
@@ -76,11 +103,14 @@ class EmailSyncService:
                 pass
     
     @staticmethod
-    def complete_sync(sync_log, error_message=None):
+    def complete_sync(sync_log, error_message=None, profile=None):
         """
-        Complete synchronization
+        Complete synchronization, storing the SyncProfile if one was recorded
         """
         sync_log.completed_at = timezone.now()
+        if profile is not None:
+            sync_log.timing_profile = profile.dumps()
+            logger.info(f"Sync timing for {sync_log.email_account}: {sync_log.timing_profile}")
         
         if error_message:
             sync_log.status = 'failed'
@@ -90,6 +120,19 @@ class EmailSyncService:
         
         sync_log.save()
         
+        # Persist reputation counts gathered during this sync
+        SenderReputationService.flush()
+        
+        # Log out IMAP sessions nobody has reused for a while
+        pool = get_imap_pool()
+        pool.close_idle()
+        pool_stats = pool.stats()
+        if pool_stats['hits'] or pool_stats['misses']:
+            logger.info(
+                f"IMAP session pool: {pool_stats['hit_rate']:.0%} hit rate, "
+                f"{pool_stats['handshake_seconds_saved']:.1f}s of handshakes saved"
+            )
+        
         # Update sync status
         if sync_log.email_account:
             try:
@@ -104,6 +147,143 @@ class EmailSyncService:
         
         logger.info(f"Completed sync for {sync_log.email_account} with status: {sync_log.status}")
     
+    @staticmethod
+    def ingest_raw_message(email_account, message_id, raw, store=None, **extra):
+        """
+        Parse a raw RFC 822 message (byte chunks or a binary file) with bounded memory and store it.
+
+        Attachments are spooled to the attachment store while parsing; extra
+        message_data keys (flags, labels, received_at, ...) override parsed values.
+        """
+        message_data = parse_message(raw, store=store or get_attachment_store())
+        message_data.update(extra, id=message_id)
+        return EmailSyncService.create_or_update_email_message(email_account, message_data)
+
+    @staticmethod
+    def persist_batch(email_account, batch):
+        """
+        Store a batch of parsed messages in one transaction.
+
+        Each message keeps its own savepoint, so one bad message is logged and
+        skipped without losing the rest. Returns (added, updated, failed).
+        """
+        added = updated = failed = 0
+        with transaction.atomic():
+            for message_data in batch:
+                try:
+                    _, created = EmailSyncService.create_or_update_email_message(email_account, message_data)
+                except Exception:
+                    failed += 1
+                    continue
+                if created:
+                    added += 1
+                else:
+                    updated += 1
+        return added, updated, failed
+
+    @staticmethod
+    def sync_account(email_account_id, sync_type='full', client_factory=None, **pipeline_options):
+        """
+        Run a full mailbox sync through the staged fetch/parse/persist pipeline.
+
+        Each fetch worker gets its own provider client from client_factory, as
+        IMAP connections cannot be shared between threads. Returns the sync
+        log, with its timing profile, and the per-stage pipeline metrics.
+        """
+        client_factory = client_factory or get_provider_client
+        sync_log = EmailSyncService.start_sync(email_account_id, sync_type)
+        email_account = sync_log.email_account
+        local = threading.local()
+        clients = []
+        clients_lock = threading.Lock()
+        profile = SyncProfile()
+
+        def get_client():
+            if not hasattr(local, 'client'):
+                local.client = client_factory(email_account)
+                local.client.profile = profile
+                with clients_lock:
+                    clients.append(local.client)
+            return local.client
+
+        provider = provider_key(email_account.provider)
+
+        def fetch(batch):
+            started = time.perf_counter()
+            try:
+                fetched = get_client().fetch_messages(batch)
+            except Exception:
+                MESSAGES_FAILED.labels(provider=provider, stage='fetch').inc(len(batch))
+                raise
+            elapsed = time.perf_counter() - started
+            FETCH_BATCH_SECONDS.labels(provider=provider).observe(elapsed)
+            MESSAGES_FETCHED.labels(provider=provider).inc(len(fetched))
+            profile.add_time('fetch', elapsed)
+            profile.add(bytes=sum(len(message.raw) for message in fetched), fetch_batches=1)
+            return fetched
+
+        def persist(batch):
+            started = time.perf_counter()
+            try:
+                added, updated, failed = EmailSyncService.persist_batch(email_account, batch)
+            except Exception:
+                MESSAGES_FAILED.labels(provider=provider, stage='persist').inc(len(batch))
+                raise
+            PERSIST_BATCH_SECONDS.labels(provider=provider).observe(time.perf_counter() - started)
+            MESSAGES_PERSISTED.labels(provider=provider, result='added').inc(added)
+            MESSAGES_PERSISTED.labels(provider=provider, result='updated').inc(updated)
+            if failed:
+                MESSAGES_FAILED.labels(provider=provider, stage='persist').inc(failed)
+            EmailSyncService.update_sync_progress(sync_log, processed=len(batch), added=added, updated=updated)
+            profile.add_time('persist', time.perf_counter() - started)
+            profile.add(persist_batches=1)
+            return failed
+
+        metrics = []
+        ACTIVE_SYNCS.inc()
+        sampler = SyncProfilerService.start(email_account)
+        if sampler is not None:
+            # The sampler only sees this process's threads, so parse in-process while profiling
+            pipeline_options['parse_processes'] = 0
+        try:
+            # Listing happens before the fetch workers start, so its session is free for them
+            client = client_factory(email_account)
+            client.profile = profile
+            try:
+                with profile.phase('list'):
+                    message_ids = client.list_message_ids()
+            finally:
+                client.close()
+            SyncStatus.objects.filter(email_account=email_account).update(total_messages=len(message_ids))
+            pipeline = SyncPipeline(
+                fetch=fetch,
+                persist=persist,
+                store=pipeline_options.pop('store', None) or get_attachment_store(),
+                profile=profile,
+                sampler=sampler,
+                **pipeline_options
+            )
+            metrics = pipeline.run(message_ids)
+            for stage in metrics:
+                logger.info(f"Sync pipeline stage for {email_account}: {stage}")
+                if stage['stage'] == 'parse' and stage['errors']:
+                    MESSAGES_FAILED.labels(provider=provider, stage='parse').inc(stage['errors'])
+            failed = sum(stage['errors'] for stage in metrics)
+            EmailSyncService.complete_sync(
+                sync_log, error_message=f"{failed} pipeline items failed" if failed else None, profile=profile,
+            )
+        except Exception as e:
+            logger.error(f"Pipeline sync failed for {email_account}: {e}")
+            EmailSyncService.complete_sync(sync_log, error_message=str(e), profile=profile)
+        finally:
+            for client in clients:
+                client.close()
+            ACTIVE_SYNCS.dec()
+            SYNC_RUNS.labels(provider=provider, status=sync_log.status).inc()
+            if sampler is not None:
+                SyncProfilerService.finish(sampler, sync_log)
+        return sync_log, metrics
+
     @staticmethod
     def create_or_update_email_message(email_account, message_data):
         """
@@ -116,48 +296,123 @@ class EmailSyncService:
                 cc_addresses = json.dumps(message_data.get('cc', []))
                 bcc_addresses = json.dumps(message_data.get('bcc', []))
                 labels = json.dumps(message_data.get('labels', []))
+                # HTML-only mail gets a plain text body and snippet (a no-op if the
+                # extraction stage already filled them in)
+                body_plain, snippet = extract_text(
+                    message_data.get('body_plain', ''),
+                    message_data.get('body_html', ''),
+                    message_data.get('snippet', ''),
+                )
+                
+                defaults = {
+                    'user': email_account.user,
+                    'folder': message_data.get('folder', ''),
+                    'uid_validity': message_data.get('uid_validity'),
+                    'thread_id': message_data.get('thread_id', ''),
+                    'subject': message_data.get('subject', ''),
+                    'from_address': message_data.get('from', ''),
+                    'to_addresses': to_addresses,
+                    'cc_addresses': cc_addresses,
+                    'bcc_addresses': bcc_addresses,
+                    'snippet': snippet,
+                    'body_plain': body_plain,
+                    'body_html': message_data.get('body_html', ''),
+                    'sent_at': message_data.get('sent_at', timezone.now()),
+                    'received_at': message_data.get('received_at', timezone.now()),
+                    'is_read': message_data.get('is_read', False),
+                    'is_starred': message_data.get('is_starred', False),
+                    'is_draft': message_data.get('is_draft', False),
+                    'is_spam': message_data.get('is_spam', False),
+                    'is_important': message_data.get('is_important', False),
+                    'size': message_data.get('size', 0),
+                    'labels': labels,
+                    'last_synced_at': timezone.now(),
+                }
+                
+                # New messages take the provider's deletion state; existing ones are only
+                # ever tombstoned by it, so a local soft delete is never resurrected
+                is_deleted = message_data.get('is_deleted', False)
+                deleted_at = timezone.now() if is_deleted else None
+                internet_message_id, references = thread_headers(message_data)
+                create_defaults = dict(
+                    defaults,
+                    is_deleted=is_deleted,
+                    deleted_at=deleted_at,
+                    internet_message_id=internet_message_id,
+                    fingerprint=compute_fingerprint(internet_message_id, message_data),
+                )
+                if is_deleted:
+                    defaults.update(is_deleted=True, deleted_at=deleted_at)
                 
-                # Create or update the email message
-                email_message, created = EmailMessage.objects.update_or_create(
+                email_message = EmailMessage.objects.select_for_update().filter(
                     email_account=email_account,
                     message_id=message_data['id'],
-                    defaults={
-                        'user': email_account.user,
-                        'thread_id': message_data.get('thread_id', ''),
-                        'subject': message_data.get('subject', ''),
-                        'from_address': message_data.get('from', ''),
-                        'to_addresses': to_addresses,
-                        'cc_addresses': cc_addresses,
-                        'bcc_addresses': bcc_addresses,
-                        'snippet': message_data.get('snippet', ''),
-                        'body_plain': message_data.get('body_plain', ''),
-                        'body_html': message_data.get('body_html', ''),
-                        'sent_at': message_data.get('sent_at', timezone.now()),
-                        'received_at': message_data.get('received_at', timezone.now()),
-                        'is_read': message_data.get('is_read', False),
-                        'is_starred': message_data.get('is_starred', False),
-                        'is_draft': message_data.get('is_draft', False),
-                        'is_deleted': message_data.get('is_deleted', False),
-                        'is_spam': message_data.get('is_spam', False),
-                        'is_important': message_data.get('is_important', False),
-                        'size': message_data.get('size', 0),
-                        'labels': labels,
-                        'last_synced_at': timezone.now(),
-                    }
-                )
+                ).first()
+                created = email_message is None
+                
+                if created:
+                    email_message = EmailMessage.objects.create(
+                        email_account=email_account,
+                        message_id=message_data['id'],
+                        **create_defaults
+                    )
+                    RollupService.record(after=[email_message])
+                    DedupService.share_body(email_message)
+                else:
+                    # Local changes still waiting to be pushed win over provider values
+                    pending = PendingFlagChange.objects.filter(email_message=email_message).first()
+                    if pending is not None:
+                        for field in pending.tracked_fields:
+                            defaults.pop(field)
+                    
+                    # Shared and archived bodies are immutable; never re-inline them
+                    if email_message.shared_body_id or email_message.is_archived:
+                        defaults.pop('body_plain')
+                        defaults.pop('body_html')
+                    
+                    before = RollupService.snapshot(email_message)
+                    for field, value in defaults.items():
+                        setattr(email_message, field, value)
+                    email_message.save()
+                    RollupService.record_change(before, email_message)
+                    # The user changed the spam verdict in their mail client
+                    if email_message.is_spam != before['is_spam']:
+                        SenderReputationService.record_spam(
+                            email_message.from_address, 1 if email_message.is_spam else -1
+                        )
+                    if email_message.is_deleted and not before['is_deleted']:
+                        StorageService.record_message_attachments([email_message.pk], -1)
+                        ThreadService.refresh_threads([email_message.conversation_id])
+                
+                # Thread new messages, and older ones the first time they are seen again
+                if email_message.conversation_id is None:
+                    if not email_message.internet_message_id and internet_message_id:
+                        email_message.internet_message_id = internet_message_id
+                        email_message.save(update_fields=['internet_message_id'])
+                    ThreadService.add_message(email_message, internet_message_id, references)
                 
                 # Handle attachments
                 if 'attachments' in message_data:
+                    new_attachments = []
                     for attachment_data in message_data['attachments']:
-                        EmailAttachment.objects.update_or_create(
+                        attachment, attachment_created = EmailAttachment.objects.update_or_create(
                             email_message=email_message,
                             attachment_id=attachment_data['id'],
                             defaults={
                                 'filename': attachment_data.get('filename', ''),
                                 'content_type': attachment_data.get('content_type', ''),
                                 'size': attachment_data.get('size', 0),
+                                'storage_key': attachment_data.get('storage_key', ''),
                             }
                         )
+                        if attachment_created:
+                            new_attachments.append(attachment)
+                    StorageService.record_attachments(email_message, new_attachments)
+                
+                if created:
+                    SenderReputationService.record_received(
+                        email_message.from_address, is_spam=email_message.is_spam
+                    )
                 
                 return email_message, created
                 
@@ -187,11 +442,145 @@ class EmailSyncService:
         """
         Get email count by account for a user
         """
-        return EmailMessage.objects.filter(user=user).values(
+        return EmailMessage.objects.live().filter(user=user).values(
             'email_account__email_address'
         ).annotate(
-            count=models.Count('id')
+            count=Count('id')
         ).order_by('-count')
 
+class FlagSyncService:
+    """
+    Service class for pushing local flag and label changes back to the provider
+    """
+    
+    TRACKED_FIELDS = ('is_read', 'is_starred', 'labels')
+    
+    @staticmethod
+    def record_changes(message_ids, fields):
+        """
+        Queue outbound changes for messages about to be modified locally.
+        
+        Must be called before the local update, inside the same transaction,
+        so the provider-side values can be captured as the base.
+        """
+        fields = [field for field in fields if field in FlagSyncService.TRACKED_FIELDS]
+        if not message_ids or not fields:
+            return
+        
+        rows = EmailMessage.objects.filter(pk__in=message_ids).values(
+            'pk', 'email_account_id', 'is_read', 'is_starred', 'labels'
+        )
+        existing = {
+            pending.email_message_id: pending
+            for pending in PendingFlagChange.objects.filter(email_message_id__in=message_ids)
+        }
+        
+        created, updated = [], []
+        for row in rows:
+            pending = existing.get(row['pk'])
+            if pending is None:
+                pending = PendingFlagChange(email_message_id=row['pk'], email_account_id=row['email_account_id'])
+                created.append(pending)
+            else:
+                updated.append(pending)
+            for field in fields:
+                if getattr(pending, f'base_{field}') is None:
+                    setattr(pending, f'base_{field}', row[field])
+        
+        base_fields = [f'base_{field}' for field in FlagSyncService.TRACKED_FIELDS]
+        PendingFlagChange.objects.bulk_create(created, ignore_conflicts=True)
+        PendingFlagChange.objects.bulk_update(updated, base_fields)
+        PendingFlagChange.objects.filter(email_message_id__in=existing).update(
+            version=F('version') + 1,
+            updated_at=timezone.now(),
+        )
+    
+    @staticmethod
+    def get_flag_change(pending):
+        """
+        Diff a message's current values against the provider base, or None if they match
+        """
+        message = pending.email_message
+        add, remove = set(), set()
+        for field, flag in (('is_read', SEEN), ('is_starred', FLAGGED)):
+            base = getattr(pending, f'base_{field}')
+            current = getattr(message, field)
+            if base is not None and base != current:
+                (add if current else remove).add(flag)
+        if pending.base_labels is not None:
+            base_labels = set(json.loads(pending.base_labels or '[]'))
+            current_labels = set(json.loads(message.labels or '[]'))
+            add |= current_labels - base_labels
+            remove |= base_labels - current_labels
+        if not add and not remove:
+            return None
+        return FlagChange(message.message_id, frozenset(add), frozenset(remove))
+    
+    @staticmethod
+    def flush(email_account, client=None, batch_size=1000):
+        """
+        Push all pending changes for an account in provider batches.
+        
+        Returns the number of messages changed on the provider. Changes that
+        cancelled out locally are dropped without any provider call.
+        """
+        queryset = PendingFlagChange.objects.filter(
+            email_account=email_account
+        ).select_related('email_message').order_by('pk')
+        
+        pushed = 0
+        last_pk = 0
+        owns_client = False
+        try:
+            while True:
+                batch = list(queryset.filter(pk__gt=last_pk)[:batch_size])
+                if not batch:
+                    break
+                last_pk = batch[-1].pk
+                
+                changes = []
+                pushed_bases = {}
+                for pending in batch:
+                    change = FlagSyncService.get_flag_change(pending)
+                    if change is not None:
+                        changes.append(change)
+                    # After the push these are the provider's values
+                    pushed_bases[pending.pk] = {
+                        f'base_{field}': getattr(pending.email_message, field)
+                        for field in pending.tracked_fields
+                    }
+                
+                if changes:
+                    if client is None:
+                        client = get_provider_client(email_account)
+                        owns_client = True
+                    client.apply_flag_changes(changes)
+                    pushed += len(changes)
+                
+                # Keep rows that were changed again while we were pushing, rebased
+                # onto the values just pushed so the next flush sends only the new diff
+                seen_versions = {pending.pk: pending.version for pending in batch}
+                with transaction.atomic():
+                    done, kept = [], []
+                    for current in PendingFlagChange.objects.select_for_update().filter(pk__in=seen_versions):
+                        if current.version == seen_versions[current.pk]:
+                            done.append(current.pk)
+                            continue
+                        for field, value in pushed_bases[current.pk].items():
+                            setattr(current, field, value)
+                        kept.append(current)
+                    PendingFlagChange.objects.filter(pk__in=done).delete()
+                    if kept:
+                        PendingFlagChange.objects.bulk_update(
+                            kept, [f'base_{field}' for field in FlagSyncService.TRACKED_FIELDS]
+                        )
+        finally:
+            if owns_client:
+                client.close()
+        
+        if pushed:
+            logger.info(f"Pushed flag changes for {pushed} messages to {email_account}")
+        return pushed
+
 # Provider-specific sync services would be implemented here
 # For example: GmailSyncService, OutlookSyncService, etc.
\ No newline at end of file
@@ -0,0 +1,146 @@
+import hashlib
+import logging
+import os
+import tempfile
+from datetime import timedelta
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+from django.utils import timezone
+from .models import EmailAttachment, OrphanedPayload
+
+logger = logging.getLogger(__name__)
+
+class AttachmentWriter:
+    """
+    Streams one attachment to a temporary file while hashing it.
+
+    Nothing is held in memory beyond the chunk being written; commit() moves
+    the content into the store under its SHA-256, so identical attachments
+    are stored once.
+    """
+
+    def __init__(self, store):
+        self.store = store
+        self.size = 0
+        self._digest = hashlib.sha256()
+        self._file = tempfile.TemporaryFile()
+
+    def write(self, data):
+        if data:
+            self._digest.update(data)
+            self._file.write(data)
+            self.size += len(data)
+
+    def commit(self):
+        """
+        Save the content and return its storage key
+        """
+        digest = self._digest.hexdigest()
+        key = f"{digest[:2]}/{digest[2:4]}/{digest}"
+        try:
+            if self.store.storage.exists(key):
+                # Reused: keep the collector off it until the new row exists
+                self.store.touch(key, self._file)
+            else:
+                self._file.seek(0)
+                key = self.store.storage.save(key, File(self._file, name=key))
+        finally:
+            self._file.close()
+        return key
+
+    def abort(self):
+        self._file.close()
+
+class AttachmentStore:
+    """
+    Content-addressed attachment payload store on top of a Django storage backend
+    """
+
+    def __init__(self, storage=None):
+        self.storage = storage or FileSystemStorage(
+            location=getattr(settings, 'ATTACHMENT_STORE_ROOT', settings.BASE_DIR / 'attachments'),
+        )
+
+    def open_writer(self):
+        return AttachmentWriter(self)
+
+    def open(self, key):
+        return self.storage.open(key, 'rb')
+
+    @staticmethod
+    def grace_period():
+        return timedelta(seconds=getattr(settings, 'ATTACHMENT_GC_GRACE_SECONDS', 3600))
+
+    def modified_at(self, key):
+        """
+        When the payload was last written or reused, None if unknown
+        """
+        try:
+            return self.storage.get_modified_time(key)
+        except (NotImplementedError, OSError):
+            return None
+
+    def touch(self, key, content):
+        """
+        Mark an existing payload as just reused, restarting its collection grace period
+        """
+        try:
+            path = self.storage.path(key)
+        except NotImplementedError:
+            # No local file (S3 and the like): write the identical content again
+            # in place, at most once per half grace period
+            modified_at = self.modified_at(key)
+            if modified_at is None or modified_at > timezone.now() - self.grace_period() / 2:
+                return
+            content.seek(0)
+            self.storage._save(key, File(content, name=key))
+        else:
+            try:
+                os.utime(path)
+            except FileNotFoundError:
+                content.seek(0)
+                self.storage.save(key, File(content, name=key))
+
+    def delete_unreferenced(self, keys):
+        """
+        Delete stored payloads no attachment row refers to any more, returning the number deleted.
+
+        A sync can reuse a payload (AttachmentWriter.commit finds its key)
+        some time before it creates the row referring to it, so payloads
+        written or reused within the grace period are queued as
+        OrphanedPayload rows instead, and deleted by a later call if they
+        are still unreferenced by then.
+        """
+        now = timezone.now()
+        cutoff = now - self.grace_period()
+        queued = set(OrphanedPayload.objects.filter(orphaned_at__lt=cutoff).values_list('storage_key', flat=True))
+        keys = set(filter(None, keys)) | queued
+        referenced = set(
+            EmailAttachment.objects.filter(storage_key__in=keys).values_list('storage_key', flat=True)
+        )
+        deleted = 0
+        recent = []
+        for key in keys - referenced:
+            modified_at = self.modified_at(key)
+            if modified_at is not None and modified_at > cutoff:
+                recent.append(key)
+                continue
+            self.storage.delete(key)
+            deleted += 1
+        OrphanedPayload.objects.filter(storage_key__in=queued).delete()
+        OrphanedPayload.objects.bulk_create(
+            [OrphanedPayload(storage_key=key, orphaned_at=now) for key in recent], ignore_conflicts=True,
+        )
+        return deleted
+
+_default_store = None
+
+def get_attachment_store():
+    """
+    Return the process-wide attachment store
+    """
+    global _default_store
+    if _default_store is None:
+        _default_store = AttachmentStore()
+    return _default_store
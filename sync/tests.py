@@ -1,12 +1,51 @@
-from django.test import TestCase
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
 from django.contrib.auth import get_user_model
 from django.utils import timezone
 from datetime import timedelta
-from .models import EmailMessage, EmailAttachment, SyncStatus, SyncLog
+from django.core.files.storage import FileSystemStorage, InMemoryStorage
+import base64
+import imaplib
+import io
+import os
+import sys
+import tempfile
+import urllib.error
+import tracemalloc
+from .models import (
+    EmailMessage, EmailAttachment, SyncStatus, SyncLog, PendingFlagChange, Thread, ThreadContainer, MessageBody,
+    RetentionPolicy, ArchivePack, OrphanedPayload,
+)
 from emails.models import EmailAccount
-from .services import EmailSyncService
+from review.services import SelectionService, TombstoneService
+from .services import EmailSyncService, FlagSyncService
+from .dedup import DedupService
+from . import archive
+from .archive import ArchiveService, ArchiveStore, read_index
+from .mime import parse_message
+from .exports import ExportService
+from .importers import MailboxImporter, find_sources, mbox_message, mbox_spans
+from .pipeline import SyncPipeline
+from .providers import (
+    FLAGGED, SEEN, FetchedMessage, FlagChange, GmailProviderClient, ImapProviderClient, ProviderError,
+    ProviderThrottled, UidValidityMismatch,
+)
+from .imap_pool import ImapPoolExhausted, ImapSessionPool
+from . import metrics as sync_metrics
+from .ratelimit import InMemoryRateLimitBackend, RateLimiter, RateLimitTimeout, RedisRateLimitBackend
+from .storage import AttachmentStore
+from .text import HtmlTextExtractor, html_to_text
+from .timing import SyncProfile
+from .profiler import SyncProfilerService
+from .threads import ThreadService, parse_message_ids, normalize_subject, thread_headers
 import json
 
+# The benchmark helpers import each other as top-level modules, as in the bench_* scripts
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks'))
+from fake_providers import FakeGmailServer, FakeImapServer, FakeProviderState
+from synthetic_mailbox import KINDS, REPLY_RATE, SyntheticMailbox
+
 User = get_user_model()
 
 class SyncModelTest(TestCase):
@@ -89,6 +128,24 @@ class SyncModelTest(TestCase):
         
         self.assertEqual(str(sync_log), f"Sync log for {self.email_account} - full (completed)")
 
+    def test_email_detail_view(self):
+        """The detail view resolves the message from the email_id URL argument"""
+        message = EmailMessage.objects.create(
+            email_account=self.email_account,
+            user=self.user,
+            message_id='12345',
+            subject='Detail Email',
+            from_address='sender@example.com',
+            sent_at=timezone.now(),
+            received_at=timezone.now(),
+            size=1024,
+        )
+        self.client.force_login(self.user)
+
+        response = self.client.get(reverse('sync:email_detail', kwargs={'email_id': message.id}))
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Detail Email')
+
 class SyncServiceTest(TestCase):
     def setUp(self):
         self.user = User.objects.create_user(
@@ -158,4 +215,1330 @@ class SyncServiceTest(TestCase):
         
         self.assertTrue(created)
         self.assertEqual(email_message.subject, 'Test Email')
-        self.assertEqual(email_message.from_address, 'sender@example.com')
\ No newline at end of file
+        self.assertEqual(email_message.from_address, 'sender@example.com')
+
+class ProviderHelpersTest(TestCase):
+    def test_compress_uid_set(self):
+        """Test that UIDs are rendered as compact IMAP sequence sets"""
+        from .providers import compress_uid_set
+        self.assertEqual(compress_uid_set([7, 1, 2, 3, '5', 8, 3]), '1:3,5,7:8')
+        self.assertEqual(compress_uid_set([]), '')
+
+class RecordingFlagClient:
+    """Provider client double that records pushed flag changes"""
+    def __init__(self):
+        self.calls = []
+    
+    def apply_flag_changes(self, changes):
+        self.calls.append(list(changes))
+        return len(changes)
+    
+    def close(self):
+        pass
+
+class FlagSyncServiceTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='testuser',
+            email='test@example.com',
+            password='testpass123'
+        )
+        self.email_account = EmailAccount.objects.create(
+            user=self.user,
+            email_address='test@example.com',
+            provider='imap',
+            imap_server='imap.example.com',
+            smtp_server='smtp.example.com',
+        )
+        self.message, _ = EmailSyncService.create_or_update_email_message(self.email_account, {
+            'id': '42',
+            'subject': 'Hello',
+            'from': 'sender@example.com',
+            'labels': ['Inbox'],
+        })
+    
+    def set_flags(self, **values):
+        FlagSyncService.record_changes([self.message.pk], list(values))
+        EmailMessage.objects.filter(pk=self.message.pk).update(**values)
+    
+    def test_changes_are_coalesced_last_write_wins(self):
+        """Test that repeated local changes collapse into one provider change"""
+        self.set_flags(is_read=True)
+        self.set_flags(is_starred=True)
+        self.set_flags(is_starred=False)
+        self.set_flags(labels=json.dumps(['Inbox', 'Receipts']))
+        client = RecordingFlagClient()
+        
+        self.assertEqual(FlagSyncService.flush(self.email_account, client=client), 1)
+        
+        change = client.calls[0][0]
+        self.assertEqual(change.message_id, '42')
+        self.assertEqual(change.add, frozenset({'\\Seen', 'Receipts'}))
+        self.assertEqual(change.remove, frozenset())
+        self.assertFalse(PendingFlagChange.objects.exists())
+    
+    def test_redundant_toggles_cancel_out(self):
+        """Test that toggling a flag back to its provider value sends nothing"""
+        self.set_flags(is_read=True)
+        self.set_flags(is_read=False)
+        client = RecordingFlagClient()
+        
+        self.assertEqual(FlagSyncService.flush(self.email_account, client=client), 0)
+        self.assertEqual(client.calls, [])
+        self.assertFalse(PendingFlagChange.objects.exists())
+    
+    def test_changes_made_during_a_push_are_rebased(self):
+        """Test that a row changed mid-flush is kept with the pushed values as its new base"""
+        self.set_flags(is_read=True)
+        test = self
+        
+        class ConcurrentClient(RecordingFlagClient):
+            def apply_flag_changes(self, changes):
+                if not self.calls:
+                    test.set_flags(is_starred=True)
+                return super().apply_flag_changes(changes)
+        
+        client = ConcurrentClient()
+        self.assertEqual(FlagSyncService.flush(self.email_account, client=client), 1)
+        pending = PendingFlagChange.objects.get()
+        self.assertEqual((pending.base_is_read, pending.base_is_starred), (True, False))
+        
+        self.assertEqual(FlagSyncService.flush(self.email_account, client=client), 1)
+        self.assertEqual(client.calls[1][0].add, frozenset({'\\Flagged'}))
+        self.assertFalse(PendingFlagChange.objects.exists())
+    
+    def test_inbound_sync_does_not_overwrite_pending_changes(self):
+        """Test that a stale provider value cannot revert an unpushed local change"""
+        self.set_flags(is_read=True)
+        
+        EmailSyncService.create_or_update_email_message(self.email_account, {
+            'id': '42',
+            'subject': 'Hello',
+            'from': 'sender@example.com',
+            'is_read': False,
+            'is_starred': True,
+        })
+        
+        self.message.refresh_from_db()
+        self.assertTrue(self.message.is_read)
+        self.assertTrue(self.message.is_starred)
+    
+    def test_gmail_batch_modify_groups_identical_changes(self):
+        """Test that Gmail label edits are grouped into batchModify calls"""
+        from .providers import FlagChange, GmailProviderClient, SEEN, FLAGGED
+        client = GmailProviderClient(self.email_account)
+        requests = []
+        client._request = lambda method, path, body=None: requests.append((path, body)) or {}
+        
+        client.apply_flag_changes([
+            FlagChange('a', add=frozenset({SEEN})),
+            FlagChange('b', add=frozenset({SEEN})),
+            FlagChange('c', add=frozenset({FLAGGED}), remove=frozenset({'Promotions'})),
+        ])
+        
+        self.assertIn(('/messages/batchModify', {'ids': ['a', 'b'], 'removeLabelIds': ['UNREAD']}), requests)
+        self.assertIn(('/messages/batchModify', {'ids': ['c'], 'addLabelIds': ['STARRED'], 'removeLabelIds': ['Promotions']}), requests)
+
+class ThreadingTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='testuser',
+            email='test@example.com',
+            password='testpass123'
+        )
+        self.email_account = EmailAccount.objects.create(
+            user=self.user,
+            email_address='test@example.com',
+            provider='imap',
+            imap_server='imap.example.com',
+            smtp_server='smtp.example.com',
+        )
+    
+    def ingest(self, uid, message_id, references='', sender='a@example.com', size=100, **extra):
+        message_data = {
+            'id': uid,
+            'subject': f"Re: Plans {uid}",
+            'from': sender,
+            'size': size,
+            'headers': {'Message-ID': f"<{message_id}>", 'References': references},
+        }
+        message_data.update(extra)
+        return EmailSyncService.create_or_update_email_message(self.email_account, message_data)[0]
+    
+    def test_header_parsing(self):
+        """Test Message-ID extraction and reference ordering"""
+        self.assertEqual(parse_message_ids('<a@x> <b@x>\n <a@x>'), ['a@x', 'b@x'])
+        self.assertEqual(normalize_subject('Re: Fwd: RE[2]: Lunch'), 'Lunch')
+        message_id, references = thread_headers({
+            'message_id_header': '<c@x>',
+            'references': '<a@x>',
+            'in_reply_to': '<b@x> (comment)',
+        })
+        self.assertEqual((message_id, references), ('c@x', ['a@x', 'b@x']))
+    
+    def test_replies_join_parent_thread(self):
+        """Test that replies are threaded and the rollup is maintained"""
+        root = self.ingest('1', 'root@x', size=100)
+        reply = self.ingest('2', 'reply@x', '<root@x>', sender='b@example.com', size=50)
+        
+        self.assertEqual(reply.conversation_id, root.conversation_id)
+        thread = Thread.objects.get()
+        self.assertEqual((thread.message_count, thread.total_size), (2, 150))
+        self.assertEqual(json.loads(thread.participants), ['a@example.com', 'b@example.com'])
+        self.assertEqual(thread.subject, 'Plans 1')
+        container = ThreadContainer.objects.get(message_id='reply@x')
+        self.assertEqual(container.parent.email_message_id, root.pk)
+    
+    def test_late_parent_merges_threads(self):
+        """Test that a late-arriving parent merges its children's threads"""
+        first = self.ingest('1', 'child1@x', '<parent@x>')
+        second = self.ingest('2', 'child2@x', '<grandparent@x>')
+        self.assertNotEqual(first.conversation_id, second.conversation_id)
+        
+        parent = self.ingest('3', 'parent@x', '<grandparent@x>')
+        
+        self.assertEqual(Thread.objects.count(), 1)
+        self.assertEqual(
+            set(EmailMessage.objects.values_list('conversation_id', flat=True)),
+            {parent.conversation_id},
+        )
+        self.assertEqual(Thread.objects.get().message_count, 3)
+        # The placeholder container was filled in rather than duplicated
+        self.assertEqual(ThreadContainer.objects.get(message_id='parent@x').email_message_id, parent.pk)
+    
+    def test_reference_loops_are_ignored(self):
+        """Test that contradictory References headers cannot create a cycle"""
+        self.ingest('1', 'a@x', '<b@x>')
+        self.ingest('2', 'b@x', '<a@x>')
+        
+        a = ThreadContainer.objects.get(message_id='a@x')
+        b = ThreadContainer.objects.get(message_id='b@x')
+        self.assertFalse(a.parent_id == b.pk and b.parent_id == a.pk)
+        self.assertEqual(Thread.objects.count(), 1)
+    
+    def test_thread_listing_and_delete(self):
+        """Test listing threads from the rollup and deleting a whole thread"""
+        root = self.ingest('1', 'root@x')
+        self.ingest('2', 'reply@x', '<root@x>')
+        self.ingest('3', 'other@x')
+        
+        threads = ThreadService.get_threads(self.user)
+        self.assertEqual(len(threads), 2)
+        
+        deleted, _ = TombstoneService.soft_delete_threads(self.user, [root.conversation_id])
+        self.assertEqual(deleted, 2)
+        self.assertEqual([thread.subject for thread in ThreadService.get_threads(self.user)], ['Plans 3'])
+
+class DedupTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='testuser',
+            email='test@example.com',
+            password='testpass123'
+        )
+        self.accounts = [
+            EmailAccount.objects.create(
+                user=self.user,
+                email_address=address,
+                provider='imap',
+                imap_server='imap.example.com',
+                smtp_server='smtp.example.com',
+            )
+            for address in ('test@example.com', 'alias@example.com')
+        ]
+        self.sent_at = timezone.now().replace(microsecond=0)
+    
+    def ingest(self, account, uid, body='Hello there', **extra):
+        message_data = {
+            'id': uid,
+            'subject': 'Quarterly report',
+            'from': 'boss@example.com',
+            'to': ['test@example.com'],
+            'sent_at': self.sent_at,
+            'message_id_header': '<report-1@example.com>',
+            'body_plain': body,
+        }
+        message_data.update(extra)
+        return EmailSyncService.create_or_update_email_message(account, message_data)[0]
+    
+    def test_duplicates_share_one_body(self):
+        """Test that a copy in a second account moves the body into a shared row"""
+        first = self.ingest(self.accounts[0], '1')
+        second = self.ingest(self.accounts[1], 'abc')
+        first.refresh_from_db()
+        
+        self.assertEqual(first.fingerprint, second.fingerprint)
+        self.assertEqual(MessageBody.objects.count(), 1)
+        self.assertEqual((first.body_plain, second.body_plain), ('', ''))
+        self.assertEqual(first.get_body_plain(), 'Hello there')
+        self.assertEqual(DedupService.get_other_accounts(first), [self.accounts[1]])
+        
+        # Re-syncing a shared copy does not re-inline its body
+        self.ingest(self.accounts[1], 'abc')
+        second.refresh_from_db()
+        self.assertEqual(second.body_plain, '')
+    
+    def test_differing_content_is_not_shared(self):
+        """Test that copies with the same fingerprint but different bodies stay separate"""
+        self.ingest(self.accounts[0], '1')
+        other = self.ingest(self.accounts[1], 'abc', body='Something else')
+        
+        self.assertFalse(MessageBody.objects.exists())
+        self.assertEqual(other.get_body_plain(), 'Something else')
+    
+    def test_different_headers_are_not_duplicates(self):
+        """Test that a reused Message-ID with other headers gets a different fingerprint"""
+        first = self.ingest(self.accounts[0], '1')
+        second = self.ingest(self.accounts[1], 'abc', subject='Different')
+        self.assertNotEqual(first.fingerprint, second.fingerprint)
+    
+    def test_orphaned_bodies_are_deleted(self):
+        """Test that shared bodies go away with their last copy"""
+        first = self.ingest(self.accounts[0], '1')
+        second = self.ingest(self.accounts[1], 'abc')
+        
+        EmailMessage.objects.filter(pk=first.pk).delete()
+        self.assertEqual(DedupService.delete_orphans(), 0)
+        EmailMessage.objects.filter(pk=second.pk).delete()
+        self.assertEqual(DedupService.delete_orphans(), 1)
+
+RAW_MESSAGE = (
+    b'From: "Bob" <Bob@Example.com>\r\n'
+    b'To: me@example.com\r\n'
+    b'Subject: =?utf-8?q?R=C3=A9sum=C3=A9?=\r\n'
+    b'Date: Tue, 01 Apr 2025 10:00:00 +0000\r\n'
+    b'Message-ID: <cv-1@example.com>\r\n'
+    b'Content-Type: multipart/mixed; boundary="outer"\r\n'
+    b'\r\n'
+    b'preamble\r\n'
+    b'--outer\r\n'
+    b'Content-Type: multipart/alternative; boundary="inner"\r\n'
+    b'\r\n'
+    b'--inner\r\n'
+    b'Content-Type: text/plain; charset=utf-8\r\n'
+    b'Content-Transfer-Encoding: quoted-printable\r\n'
+    b'\r\n'
+    b'Caf=C3=A9 and a soft=\r\n'
+    b' break\r\n'
+    b'--inner\r\n'
+    b'Content-Type: text/html\r\n'
+    b'\r\n'
+    b'<p>Hi</p>\r\n'
+    b'--inner--\r\n'
+    b'--outer\r\n'
+    b'Content-Type: application/pdf\r\n'
+    b'Content-Disposition: attachment; filename="cv.pdf"\r\n'
+    b'Content-Transfer-Encoding: base64\r\n'
+    b'\r\n'
+    b'SGVsbG8gd29y\r\n'
+    b'bGQ=\r\n'
+    b'--outer--\r\n'
+    b'epilogue\r\n'
+)
+
+def large_message(attachment_bytes, text_bytes=0, chunk_size=64 * 1024):
+    """Yield a message with a large base64 attachment without ever materializing it"""
+    yield (
+        b'From: a@example.com\r\nSubject: Big\r\n'
+        b'Content-Type: multipart/mixed; boundary="b"\r\n\r\n'
+        b'--b\r\nContent-Type: text/plain\r\n\r\n'
+    )
+    line = b'All work and no play makes Jack a dull boy.\r\n'
+    for _ in range(text_bytes // len(line)):
+        yield line
+    yield b'\r\n--b\r\nContent-Type: application/octet-stream\r\nContent-Transfer-Encoding: base64\r\n\r\n'
+    block = base64.encodebytes(bytes(range(256)) * (chunk_size // 256 // 4 * 3))
+    raw_block = len(block) // 77 * 57
+    for _ in range(attachment_bytes // raw_block):
+        yield block
+    yield b'--b--\r\n'
+
+class StreamingParserTest(TestCase):
+    def test_parses_nested_multipart_in_any_chunking(self):
+        """Test that the result does not depend on how the input is chunked"""
+        expected = None
+        for size in (1, 2, 3, 5, 64, 1 << 16):
+            result = parse_message(RAW_MESSAGE[i:i + size] for i in range(0, len(RAW_MESSAGE), size))
+            if expected is None:
+                expected = result
+            self.assertEqual(result, expected)
+        
+        self.assertEqual(expected['subject'], 'Résumé')
+        self.assertEqual(expected['from'], 'bob@example.com')
+        self.assertEqual(expected['body_plain'], 'Café and a soft break')
+        self.assertEqual(expected['body_html'], '<p>Hi</p>')
+        self.assertEqual(expected['attachments'], [{
+            'id': '2', 'filename': 'cv.pdf', 'content_type': 'application/pdf', 'size': 11, 'storage_key': '',
+        }])
+        self.assertEqual(expected['size'], len(RAW_MESSAGE))
+    
+    def test_parses_bare_newline_messages(self):
+        """Test that mbox-style LF line endings find parts after a nested multipart"""
+        raw = (
+            b'Content-Type: multipart/mixed; boundary="outer"\n'
+            b'\n'
+            b'--outer\n'
+            b'Content-Type: multipart/alternative; boundary="inner"\n'
+            b'\n'
+            b'--inner\n'
+            b'Content-Type: text/html\n'
+            b'\n'
+            b'<p>Hi</p>\n'
+            b'--inner--\n'
+            b'\n'
+            b'--outer\n'
+            b'Content-Type: application/pdf\n'
+            b'Content-Disposition: attachment; filename="cv.pdf"\n'
+            b'\n'
+            b'%PDF\n'
+            b'--outer--\n'
+        )
+        for size in (1, 7, 1 << 16):
+            result = parse_message(raw[i:i + size] for i in range(0, len(raw), size))
+            self.assertEqual(result['body_html'], '<p>Hi</p>')
+            self.assertEqual([attachment['filename'] for attachment in result['attachments']], ['cv.pdf'])
+    
+    def test_text_caps_and_snippet(self):
+        """Test that bodies are truncated to the configured caps"""
+        result = parse_message(large_message(0, text_bytes=100000), max_plain=1000, snippet_length=20)
+        self.assertEqual(len(result['body_plain']), 1000)
+        self.assertEqual(result['snippet'], 'All work and no play')
+    
+    def test_attachments_are_spooled_to_the_store(self):
+        """Test that attachment payloads land in the content-addressed store"""
+        store = AttachmentStore(InMemoryStorage())
+        result = parse_message([RAW_MESSAGE], store=store)
+        key = result['attachments'][0]['storage_key']
+        with store.open(key) as payload:
+            self.assertEqual(payload.read(), b'Hello world')
+        
+        # Identical payloads share a key
+        self.assertEqual(parse_message([RAW_MESSAGE], store=store)['attachments'][0]['storage_key'], key)
+    
+    def test_recently_reused_payloads_survive_collection(self):
+        """Test that a payload reused by a sync whose row does not exist yet is not deleted"""
+        with tempfile.TemporaryDirectory() as root:
+            store = AttachmentStore(FileSystemStorage(location=root))
+            key = parse_message([RAW_MESSAGE], store=store)['attachments'][0]['storage_key']
+            path = store.storage.path(key)
+            os.utime(path, (0, 0))
+            
+            # A sync finds the payload, then the last row referring to it is purged
+            self.assertEqual(parse_message([RAW_MESSAGE], store=store)['attachments'][0]['storage_key'], key)
+            self.assertEqual(store.delete_unreferenced([key]), 0)
+            self.assertTrue(store.storage.exists(key))
+            self.assertTrue(OrphanedPayload.objects.filter(storage_key=key).exists())
+            
+            # Still unreferenced once the grace period has passed
+            os.utime(path, (0, 0))
+            OrphanedPayload.objects.update(orphaned_at=timezone.now() - timedelta(days=1))
+            self.assertEqual(store.delete_unreferenced([]), 1)
+            self.assertFalse(store.storage.exists(key))
+            self.assertFalse(OrphanedPayload.objects.exists())
+    
+    def test_ingest_raw_message(self):
+        """Test parsing and storing a raw message through the sync service"""
+        user = User.objects.create_user(username='testuser', email='test@example.com', password='testpass123')
+        account = EmailAccount.objects.create(
+            user=user,
+            email_address='test@example.com',
+            provider='imap',
+            imap_server='imap.example.com',
+            smtp_server='smtp.example.com',
+        )
+        store = AttachmentStore(InMemoryStorage())
+        message, created = EmailSyncService.ingest_raw_message(account, '7', [RAW_MESSAGE], store=store, is_read=True)
+        
+        self.assertTrue(created)
+        self.assertEqual((message.subject, message.internet_message_id, message.is_read), ('Résumé', 'cv-1@example.com', True))
+        attachment = message.attachments.get()
+        self.assertEqual(attachment.attachment_id, '2')
+        self.assertTrue(store.storage.exists(attachment.storage_key))
+
+class MimeMemoryBudgetTest(TestCase):
+    """Peak Python heap while parsing must not grow with message size"""
+    
+    BUDGET = 2 * 1024 * 1024
+    
+    def measure(self, messages, **options):
+        with tempfile.TemporaryDirectory() as root:
+            store = AttachmentStore(FileSystemStorage(location=root))
+            tracemalloc.start()
+            try:
+                result = parse_message(messages, store=store, **options)
+                _, peak = tracemalloc.get_traced_memory()
+            finally:
+                tracemalloc.stop()
+        return result, peak
+    
+    def test_large_attachment_stays_within_budget(self):
+        """Test that a 24 MB attachment is parsed within the memory budget"""
+        result, peak = self.measure(large_message(24 * 1024 * 1024))
+        
+        self.assertGreater(result['attachments'][0]['size'], 23 * 1024 * 1024)
+        self.assertLess(peak, self.BUDGET)
+    
+    def test_large_text_body_stays_within_budget(self):
+        """Test that an oversized text body only costs its cap"""
+        result, peak = self.measure(large_message(0, text_bytes=8 * 1024 * 1024), max_plain=100000)
+        
+        self.assertEqual(len(result['body_plain']), 100000)
+        self.assertLess(peak, self.BUDGET)
+
+MARKETING_HTML = """<html><head><title>Sale</title><style>p { color: red }</style></head>
+<body><div>Big&nbsp;<b>summer</b> sale!</div><script>track("<p>")</script>
+<table><tr><td>Shoes</td><td>-40%</td></tr></table>
+<p>Ends   on
+ Friday</p><img alt="Logo"></body></html>"""
+
+class HtmlToTextTest(TestCase):
+    def test_strips_scripts_and_collapses_whitespace(self):
+        """Test conversion of typical marketing HTML"""
+        self.assertEqual(html_to_text(MARKETING_HTML), 'Big summer sale!\n\nShoes\n-40%\n\nEnds on Friday\nLogo')
+    
+    def test_chunked_feeding_matches_whole_input(self):
+        """Test that tags and skipped elements split across chunks are handled"""
+        for size in (1, 3, 7, 50):
+            extractor = HtmlTextExtractor()
+            for start in range(0, len(MARKETING_HTML), size):
+                extractor.feed(MARKETING_HTML[start:start + size])
+            extractor.close()
+            self.assertEqual(extractor.get_text(), html_to_text(MARKETING_HTML))
+    
+    def test_stops_after_limit(self):
+        """Test that conversion stops once the limit is reached"""
+        html = '<p>word</p>' * 100000
+        self.assertEqual(html_to_text(html, limit=10), 'word\n\nword')
+    
+    def test_html_only_mail_gets_plain_text_and_snippet(self):
+        """Test that ingestion fills body_plain and snippet for HTML-only mail"""
+        user = User.objects.create_user(username='testuser', email='test@example.com', password='testpass123')
+        account = EmailAccount.objects.create(
+            user=user,
+            email_address='test@example.com',
+            provider='imap',
+            imap_server='imap.example.com',
+            smtp_server='smtp.example.com',
+        )
+        message, _ = EmailSyncService.create_or_update_email_message(account, {
+            'id': '1',
+            'subject': 'Sale',
+            'body_html': MARKETING_HTML,
+        })
+        self.assertTrue(message.body_plain.startswith('Big summer sale!'))
+        self.assertEqual(message.snippet, 'Big summer sale! Shoes -40% Ends on Friday Logo')
+
+class FakeMailboxClient:
+    """Provider client serving RAW_MESSAGE copies from memory"""
+    
+    def __init__(self, count, fail_ids=()):
+        self.count = count
+        self.fail_ids = set(fail_ids)
+        self.closed = False
+    
+    def list_message_ids(self):
+        return [str(uid) for uid in range(1, self.count + 1)]
+    
+    def fetch_messages(self, message_ids):
+        if self.fail_ids & set(message_ids):
+            raise ProviderError("FETCH failed")
+        return [
+            FetchedMessage(uid, RAW_MESSAGE.replace(b'cv-1@', f"cv-{uid}@".encode()), {'is_read': uid == '1'})
+            for uid in message_ids
+        ]
+    
+    def close(self):
+        self.closed = True
+
+class SyncPipelineTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', email='test@example.com', password='testpass123')
+        self.account = EmailAccount.objects.create(
+            user=self.user,
+            email_address='test@example.com',
+            provider='imap',
+            imap_server='imap.example.com',
+            smtp_server='smtp.example.com',
+        )
+        self.store = AttachmentStore(storage=InMemoryStorage())
+        self.clients = []
+    
+    def client_factory(self, count, fail_ids=()):
+        def factory(email_account):
+            client = FakeMailboxClient(count, fail_ids)
+            self.clients.append(client)
+            return client
+        return factory
+    
+    def test_sync_account_persists_every_message(self):
+        """Test that a pipeline sync stores all messages and records progress and metrics"""
+        sync_log, metrics = EmailSyncService.sync_account(
+            self.account.id, client_factory=self.client_factory(23), store=self.store,
+            fetch_workers=3, fetch_batch_size=4, parse_workers=2, parse_processes=0, persist_batch_size=5, queue_size=2,
+        )
+        
+        self.assertEqual(sync_log.status, 'completed')
+        self.assertEqual(sync_log.messages_added, 23)
+        self.assertEqual(EmailMessage.objects.filter(email_account=self.account).count(), 23)
+        message = EmailMessage.objects.get(email_account=self.account, message_id='1')
+        self.assertTrue(message.is_read)
+        self.assertEqual(message.subject, 'Résumé')
+        attachment = message.attachments.get()
+        self.assertEqual(self.store.open(attachment.storage_key).read(), b'Hello world')
+        
+        self.assertEqual([stage['stage'] for stage in metrics], ['fetch', 'parse', 'persist'])
+        self.assertEqual([stage['items'] for stage in metrics], [6, 23, 23])
+        self.assertLessEqual(metrics[1]['max_queue_depth'], 2)
+        self.assertTrue(all(client.closed for client in self.clients))
+        self.assertEqual(SyncStatus.objects.get(email_account=self.account).total_messages, 23)
+    
+    def test_failed_fetch_is_counted_and_fails_the_sync(self):
+        """Test that a failing stage item is reported without stopping the pipeline"""
+        sync_log, metrics = EmailSyncService.sync_account(
+            self.account.id, client_factory=self.client_factory(10, fail_ids={'5'}), store=self.store,
+            fetch_workers=2, fetch_batch_size=5, parse_processes=0,
+        )
+        
+        self.assertEqual(sync_log.status, 'failed')
+        self.assertEqual(metrics[0]['errors'], 1)
+        self.assertEqual(EmailMessage.objects.filter(email_account=self.account).count(), 5)
+    
+    def test_sync_account_records_timing_profile(self):
+        """Test that a sync stores its per-phase timing and transfer counters on the log"""
+        self.client.force_login(self.user)
+        sync_log, _ = EmailSyncService.sync_account(
+            self.account.id, client_factory=self.client_factory(12), store=self.store,
+            fetch_workers=2, fetch_batch_size=5, parse_processes=0, persist_batch_size=100,
+        )
+        
+        timing = SyncLog.objects.get(pk=sync_log.pk).timing
+        self.assertEqual(set(timing['phases']), {'list', 'fetch', 'parse', 'classify', 'persist'})
+        self.assertGreater(timing['phases']['persist'], 0)
+        self.assertEqual(timing['fetch_batches'], 3)
+        self.assertGreaterEqual(timing['persist_batches'], 1)
+        self.assertGreater(timing['bytes'], 12 * 100)
+        self.assertEqual((timing['retries'], timing['throttled']), (0, 0))
+        self.assertIn('persist', [phase for phase, _, _ in sync_log.timing_phases])
+        
+        response = self.client.get(reverse('sync:sync_history', kwargs={'account_id': self.account.id}))
+        self.assertContains(response, f"in {timing['fetch_batches']} batches")
+    
+    def test_sync_account_dumps_sampling_profile_when_enabled(self):
+        """Test that an account with profiling enabled gets stack files for its sync"""
+        directory = tempfile.mkdtemp()
+        with self.settings(SYNC_PROFILER_DIR=directory, SYNC_PROFILER_MIN_INTERVAL=0.001):
+            SyncProfilerService.enable(self.account, interval=0.001)
+            sync_log, _ = EmailSyncService.sync_account(
+                self.account.id, client_factory=self.client_factory(30), store=self.store,
+                fetch_workers=2, fetch_batch_size=5, parse_processes=2,
+            )
+        
+        self.assertEqual(sync_log.status, 'completed')
+        basename = f"{directory}/sync-{self.account.id}-{sync_log.id}"
+        with open(f"{basename}.collapsed") as f:
+            roots = {line.split(';', 1)[0] for line in f}
+        self.assertTrue(roots & {'sync-fetch', 'sync-parse', 'sync-persist'}, roots)
+        with open(f"{basename}.speedscope.json") as f:
+            self.assertEqual(json.load(f)['profiles'][0]['type'], 'sampled')
+    
+    def test_profiling_targets_match_account_and_worker(self):
+        """Test that profiling targets apply to their account and worker until they expire"""
+        other = EmailAccount.objects.create(
+            user=self.user, email_address='other@example.com', provider='imap',
+            imap_server='imap.example.com', smtp_server='smtp.example.com',
+        )
+        SyncProfilerService.enable(self.account, worker='worker-1')
+        self.assertIsNotNone(SyncProfilerService.target_for(self.account, worker='worker-1'))
+        self.assertIsNone(SyncProfilerService.target_for(self.account, worker='worker-2'))
+        self.assertIsNone(SyncProfilerService.target_for(other, worker='worker-1'))
+        
+        SyncProfilerService.enable(worker='', duration=-1)
+        self.assertIsNone(SyncProfilerService.target_for(other, worker='worker-1'))
+        
+        out = io.StringIO()
+        call_command('sync_profiler', 'enable', '--interval', '0.05', stdout=out)
+        self.assertEqual(SyncProfilerService.target_for(other, worker='worker-2').interval, 0.05)
+        call_command('sync_profiler', 'disable', stdout=out)
+        self.assertIsNone(SyncProfilerService.target_for(other, worker='worker-2'))
+        call_command('sync_profiler', 'status', stdout=out)
+        self.assertIn(f"Profile syncs of {self.account} on worker-1", out.getvalue())
+    
+    def test_sync_account_updates_prometheus_metrics(self):
+        """Test that a sync counts fetched, persisted and failed messages per provider"""
+        collect = sync_metrics.registry.collect
+        before = collect()
+        EmailSyncService.sync_account(
+            self.account.id, client_factory=self.client_factory(10, fail_ids={'5'}), store=self.store,
+            fetch_workers=2, fetch_batch_size=5, parse_processes=0,
+        )
+        after = collect()
+        
+        def delta(name, *labels):
+            return after[name].get(labels, 0) - before.get(name, {}).get(labels, 0)
+        
+        def observations(collected):
+            return collected.get('sync_fetch_batch_seconds', {}).get(('imap',), [None, 0, 0])[2]
+        
+        self.assertEqual(delta('sync_messages_fetched_total', 'imap'), 5)
+        self.assertEqual(delta('sync_messages_persisted_total', 'imap', 'added'), 5)
+        self.assertEqual(delta('sync_messages_failed_total', 'imap', 'fetch'), 5)
+        self.assertEqual(delta('sync_runs_total', 'imap', 'failed'), 1)
+        self.assertEqual(observations(after) - observations(before), 1)
+        self.assertEqual(after['sync_active'][()], 0)
+        self.assertEqual(after['sync_queue_depth'][('parse',)], 0)
+    
+    def test_process_pool_parse_matches_inline(self):
+        """Test that parsing in worker processes yields the same message data"""
+        client = FakeMailboxClient(6)
+        results = {}
+        for processes in (0, 2):
+            batches = []
+            SyncPipeline(
+                fetch=client.fetch_messages, persist=batches.extend,
+                fetch_workers=2, fetch_batch_size=2, parse_processes=processes,
+            ).run(client.list_message_ids())
+            results[processes] = sorted(batches, key=lambda message_data: message_data['id'])
+        
+        self.assertEqual(len(results[2]), 6)
+        self.assertEqual(results[2], results[0])
+
+class FakeImapConnection:
+    """IMAP connection double replaying canned UID command responses"""
+    
+    capabilities = ()
+    uid_validity = 1
+    
+    def __init__(self, responses=()):
+        self.responses = list(responses)
+        self.commands = []
+        self.alive = True
+        self.logged_out = False
+    
+    def uid(self, *args):
+        self.commands.append(args)
+        return self.responses.pop(0)
+    
+    def select(self, folder):
+        self.commands.append(('SELECT', folder))
+        return 'OK', [b'1']
+    
+    def response(self, code):
+        return code, [str(self.uid_validity).encode()]
+    
+    def noop(self):
+        self.commands.append(('NOOP',))
+        if not self.alive:
+            raise imaplib.IMAP4.abort('socket error: EOF')
+        return 'OK', [b'']
+    
+    def logout(self):
+        self.logged_out = True
+
+class RateLimiterTest(TestCase):
+    def setUp(self):
+        self.now = 0.0
+        self.limiter = RateLimiter(
+            backend=InMemoryRateLimitBackend(clock=lambda: self.now),
+            limits={'imap': {'user': (10, 10), 'app': (15, 15)}},
+            increase=0.1,
+            decrease=0.5,
+            min_rate=0.1,
+            default_backoff=2.0,
+            sleep=self.sleep,
+        )
+    
+    def sleep(self, seconds):
+        self.now += seconds
+    
+    def test_burst_then_steady_rate(self):
+        """Test that the bucket admits a burst and then paces requests at the refill rate"""
+        waits = [self.limiter.acquire('imap', 1) for _ in range(12)]
+        self.assertEqual(waits[:10], [0.0] * 10)
+        self.assertAlmostEqual(waits[10], 0.1)
+        self.assertAlmostEqual(self.now, 0.2)
+    
+    def test_app_bucket_is_shared_between_users(self):
+        """Test that the per-app quota caps the combined rate of all users"""
+        for _ in range(10):
+            self.limiter.acquire('imap', 1)
+        waits = [self.limiter.acquire('outlook.example', 2) for _ in range(6)]
+        self.assertEqual(waits[:5], [0.0] * 5)
+        self.assertGreater(waits[5], 0)
+    
+    def test_throttle_backs_off_and_recovers_additively(self):
+        """Test the AIMD response to a throttling signal"""
+        self.limiter.record_throttle('imap', 1, retry_after=5)
+        self.assertEqual(self.limiter.get_rates('imap', 1), {'imap:user:1': 5.0, 'imap:app': 15})
+        self.assertAlmostEqual(self.limiter.acquire('imap', 1), 5.0)
+        
+        # Successes are folded into the next take instead of costing round trips
+        self.limiter.record_success('imap', 1)
+        self.assertEqual(self.limiter.get_rates('imap', 1)['imap:user:1'], 5.0)
+        self.limiter.acquire('imap', 1)
+        self.assertAlmostEqual(self.limiter.get_rates('imap', 1)['imap:user:1'], 6.0)
+        for _ in range(10):
+            self.limiter.record_success('imap', 1)
+        self.limiter.acquire('imap', 1)
+        self.assertEqual(self.limiter.get_rates('imap', 1)['imap:user:1'], 10)
+    
+    def test_redis_backend_matches_in_memory_backend(self):
+        """Test the Lua token bucket scripts against a Redis server emulation"""
+        try:
+            import fakeredis
+            client = fakeredis.FakeStrictRedis()
+            client.eval('return 1', 0)
+        except Exception:
+            self.skipTest("fakeredis with Lua support is not installed")
+        limiter = RateLimiter(
+            backend=RedisRateLimitBackend(client=client, prefix='test'),
+            limits={'imap': {'user': (10, 10), 'app': (15, 15)}},
+            increase=0.1, decrease=0.5, min_rate=0.1, default_backoff=2.0, sleep=lambda seconds: None,
+        )
+        
+        self.assertEqual([limiter.backend.take(limiter._buckets('imap', 1), 1) for _ in range(10)], [0.0] * 10)
+        self.assertGreater(limiter.backend.take(limiter._buckets('imap', 1), 1), 0)
+        
+        limiter.record_throttle('imap', 1, retry_after=30)
+        self.assertEqual(limiter.get_rates('imap', 1), {'imap:user:1': 5.0, 'imap:app': 15})
+        self.assertGreater(limiter.backend.take(limiter._buckets('imap', 1), 1), 29)
+        limiter.record_success('imap', 1)
+        limiter.backend.take(limiter._buckets('imap', 1), 1, increase=0.1)
+        self.assertAlmostEqual(limiter.get_rates('imap', 1)['imap:user:1'], 6.0)
+        self.assertGreater(client.ttl('test:imap:user:1'), 0)
+    
+    def test_timeout(self):
+        """Test that callers can refuse to wait longer than a timeout"""
+        self.limiter.record_throttle('imap', 1, retry_after=30)
+        with self.assertRaises(RateLimitTimeout):
+            self.limiter.acquire('imap', 1, timeout=10)
+    
+    def test_imap_client_retries_throttled_commands(self):
+        """Test that an IMAP [THROTTLED] response slows the client down and is retried"""
+        user = User.objects.create_user(username='testuser', email='test@example.com', password='testpass123')
+        account = EmailAccount.objects.create(
+            user=user,
+            email_address='test@example.com',
+            provider='imap',
+            imap_server='imap.example.com',
+            smtp_server='smtp.example.com',
+        )
+        client = ImapProviderClient(account, rate_limiter=self.limiter)
+        client.profile = SyncProfile()
+        client._connection = FakeImapConnection([
+            ('NO', [b'[THROTTLED] Too many commands']),
+            ('OK', [b'1 2 3']),
+        ])
+        
+        self.assertEqual(client.list_message_ids(), ['1', '2', '3'])
+        self.assertEqual(len(client._connection.commands), 2)
+        self.assertEqual((client.profile.counters['throttled'], client.profile.counters['retries']), (1, 1))
+        self.assertAlmostEqual(self.now, 2.0)
+        self.assertEqual(self.limiter.get_rates('imap', user.id)[f"imap:user:{user.id}"], 5.0)
+        self.limiter.acquire('imap', user.id)
+        self.assertEqual(self.limiter.get_rates('imap', user.id)[f"imap:user:{user.id}"], 6.0)
+    
+    def test_gmail_rate_limit_errors_are_throttles(self):
+        """Test that Gmail 429/403 quota errors carry Retry-After and quota scope"""
+        def http_error(code, body, headers=None):
+            return urllib.error.HTTPError('https://gmail.example', code, 'error', headers or {}, io.BytesIO(body))
+        
+        with self.assertRaises(ProviderThrottled) as raised:
+            GmailProviderClient._raise_if_throttled(http_error(429, b'', {'Retry-After': '3'}), 'GET', '/messages')
+        self.assertEqual((raised.exception.retry_after, raised.exception.scope), (3.0, 'user'))
+        
+        with self.assertRaises(ProviderThrottled) as raised:
+            GmailProviderClient._raise_if_throttled(
+                http_error(403, b'{"error": {"errors": [{"reason": "rateLimitExceeded"}]}}'), 'GET', '/messages',
+            )
+        self.assertEqual(raised.exception.scope, 'app')
+        
+        GmailProviderClient._raise_if_throttled(http_error(403, b'{"reason": "forbidden"}'), 'GET', '/messages')
+
+class ImapSessionPoolTest(TestCase):
+    def setUp(self):
+        self.now = 0.0
+        self.connections = []
+        self.pool = ImapSessionPool(
+            connect=self.connect, max_per_account=2, idle_timeout=300, check_after=10,
+            acquire_timeout=0.01, clock=lambda: self.now,
+        )
+        user = User.objects.create_user(username='testuser', email='test@example.com', password='testpass123')
+        self.account = EmailAccount.objects.create(
+            user=user,
+            email_address='test@example.com',
+            provider='imap',
+            imap_server='imap.example.com',
+            smtp_server='smtp.example.com',
+        )
+        self.limiter = RateLimiter(backend=InMemoryRateLimitBackend())
+    
+    def connect(self, email_account):
+        connection = FakeImapConnection()
+        self.connections.append(connection)
+        return connection
+    
+    def test_successive_clients_reuse_a_warm_session(self):
+        """Test that sync and write-back clients share one selected session"""
+        for responses in ([('OK', [b'1 2'])], [('OK', [b''])]):
+            client = ImapProviderClient(self.account, rate_limiter=self.limiter, pool=self.pool)
+            client._connect()
+            client._session.connection.responses = responses
+            client.list_message_ids()
+            client.close()
+        
+        self.assertEqual(len(self.connections), 1)
+        selects = [command for command in self.connections[0].commands if command[0] == 'SELECT']
+        self.assertEqual(selects, [('SELECT', 'INBOX')])
+        stats = self.pool.stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['hit_rate']), (1, 1, 0.5))
+        self.assertGreaterEqual(stats['handshake_seconds_saved'], 0)
+    
+    def test_dead_sessions_are_replaced_after_noop(self):
+        """Test that a session failing its NOOP health check is swapped for a new one"""
+        session = self.pool.acquire(self.account, 'INBOX')
+        self.pool.release(session)
+        session.connection.alive = False
+        self.now += 60
+        
+        replacement = self.pool.acquire(self.account, 'INBOX')
+        self.assertIsNot(replacement, session)
+        self.assertTrue(session.connection.logged_out)
+        self.assertEqual(self.pool.stats()['open_sessions'], 1)
+    
+    def test_idle_expiry_and_session_limit(self):
+        """Test the per-account session cap and logout of long-idle sessions"""
+        first = self.pool.acquire(self.account)
+        second = self.pool.acquire(self.account)
+        with self.assertRaises(ImapPoolExhausted):
+            self.pool.acquire(self.account)
+        
+        self.pool.release(first)
+        self.pool.release(second, broken=True)
+        self.now += 301
+        self.assertEqual(self.pool.close_idle(), 1)
+        self.assertTrue(first.connection.logged_out)
+        self.assertEqual(self.pool.stats()['open_sessions'], 0)
+    
+    def test_delete_refuses_changed_uid_validity(self):
+        """Test that deletes are only pushed while the folder keeps the stored UIDVALIDITY"""
+        client = ImapProviderClient(self.account, rate_limiter=self.limiter, pool=self.pool)
+        client._connect()
+        connection = client._session.connection
+        connection.uid_validity = 42
+        
+        with self.assertRaises(UidValidityMismatch):
+            client.delete_messages(['1', '2'], folder='INBOX', uid_validity=41)
+        with self.assertRaises(UidValidityMismatch):
+            client.delete_messages(['1', '2'], folder='INBOX', uid_validity=None)
+        self.assertFalse([command for command in connection.commands if command[0] == 'STORE'])
+    
+    def test_delete_without_uidplus_skips_expunge(self):
+        """Test that servers without UID EXPUNGE only get the \\Deleted flag set"""
+        client = ImapProviderClient(self.account, rate_limiter=self.limiter, pool=self.pool)
+        client._connect()
+        connection = client._session.connection
+        connection.responses = [('OK', [b''])]
+        
+        self.assertEqual(client.delete_messages(['1', '2', '3'], folder='INBOX', uid_validity=1), 3)
+        self.assertEqual(connection.commands[-1], ('STORE', '1:3', '+FLAGS.SILENT', r'(\Deleted)'))
+        self.assertEqual(connection.commands[-2], ('SELECT', 'INBOX'))
+        
+        connection.capabilities = ('IMAP4REV1', 'UIDPLUS')
+        connection.responses = [('OK', [b'']), ('OK', [b''])]
+        client.delete_messages(['5'], folder='INBOX', uid_validity=1)
+        self.assertEqual(connection.commands[-1], ('EXPUNGE', '5'))
+    
+    def test_fetched_messages_record_folder_and_uid_validity(self):
+        """Test that fetched messages carry the folder and UIDVALIDITY their UIDs belong to"""
+        client = ImapProviderClient(self.account, rate_limiter=self.limiter, pool=self.pool)
+        client._connect()
+        client._session.connection.responses = [
+            ('OK', [(b'1 (UID 7 FLAGS (\\Seen))', b'Subject: Hi\r\n\r\nBody'), b')']),
+        ]
+        
+        [fetched] = client.fetch_messages(['7'])
+        self.assertEqual((fetched.extra['folder'], fetched.extra['uid_validity']), ('INBOX', 1))
+
+MBOX = (
+    b'From bob@example.com Tue Apr  1 10:00:00 2025\n'
+    b'From: bob@example.com\n'
+    b'Subject: First\n'
+    b'Message-ID: <first@example.com>\n'
+    b'Status: RO\n'
+    b'\n'
+    b'Hello\n'
+    b'>From the archive, with an escaped line\n'
+    b'\n'
+    b'From alice@example.com Wed Apr  2 11:30:00 2025\n'
+    b'From: alice@example.com\n'
+    b'Subject: Second\n'
+    b'Message-ID: <second@example.com>\n'
+    b'X-Gmail-Labels: Inbox,Starred,Unread,\n'
+    b' Work\n'
+    b'\n'
+    b'Hi there\n'
+    b'\n'
+    b'From carol@example.com Thu Apr  3 12:00:00 2025\n'
+    b'From: carol@example.com\n'
+    b'Subject: Third\n'
+    b'\n'
+    b'Last one\n'
+)
+
+class MailboxImportTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', email='test@example.com', password='testpass123')
+        self.account = EmailAccount.objects.create(
+            user=self.user,
+            email_address='test@example.com',
+            provider='imap',
+            imap_server='imap.example.com',
+            smtp_server='smtp.example.com',
+        )
+        self.store = AttachmentStore(storage=InMemoryStorage())
+        self.directory = tempfile.mkdtemp()
+        self.mbox_path = f"{self.directory}/Takeout.mbox"
+        with open(self.mbox_path, 'wb') as f:
+            f.write(MBOX)
+    
+    def test_mbox_spans_split_on_from_lines(self):
+        """Test that the memory-mapped scan finds each message without reading the file whole"""
+        spans = list(mbox_spans(self.mbox_path))
+        self.assertEqual(len(spans), 3)
+        self.assertEqual(spans[0][0], 0)
+        self.assertEqual(spans[-1][1], len(MBOX))
+        self.assertTrue(all(MBOX[start:end].startswith(b'From ') for start, end in spans))
+        
+        raw, extra = mbox_message(MBOX[spans[0][0]:spans[0][1]])
+        self.assertTrue(raw.startswith(b'From: bob@example.com\n'))
+        self.assertTrue(raw.endswith(b'\nFrom the archive, with an escaped line\n'))
+        self.assertEqual((extra['is_read'], extra['is_starred']), (True, False))
+        self.assertEqual(extra['received_at'].isoformat(), '2025-04-01T10:00:00+00:00')
+        
+        _, extra = mbox_message(MBOX[spans[1][0]:spans[1][1]])
+        self.assertEqual((extra['is_read'], extra['is_starred']), (False, True))
+        self.assertEqual(extra['labels'], ['Inbox', 'Starred', 'Work'])
+    
+    def test_import_mbox_and_maildir(self):
+        """Test that mbox and Maildir messages are imported with their state, idempotently"""
+        maildir = f"{self.directory}/Maildir"
+        for folder in ('', '.Sent'):
+            for subdir in ('cur', 'new', 'tmp'):
+                os.makedirs(f"{maildir}/{folder}/{subdir}")
+        with open(f"{maildir}/cur/1743501600.M1P1.host:2,FS", 'wb') as f:
+            f.write(b'From: dave@example.com\nSubject: Maildir\n\nBody\n')
+        with open(f"{maildir}/.Sent/new/1743501601.M2P1.host", 'wb') as f:
+            f.write(b'From: test@example.com\nSubject: Sent one\n\nBody\n')
+        sources = find_sources(self.mbox_path) + find_sources(maildir)
+        self.assertEqual([source.kind for source in sources], ['mbox', 'maildir', 'maildir'])
+        
+        for processes in (0, 2):
+            sync_log = MailboxImporter(self.account, store=self.store, processes=processes, batch_size=2).run(sources)
+            self.assertEqual(sync_log.status, 'completed', sync_log.error_message)
+            self.assertEqual(sync_log.sync_type, 'import')
+            self.assertEqual(sync_log.messages_processed, 5)
+        self.assertEqual((sync_log.messages_added, sync_log.messages_updated), (0, 5))
+        self.assertEqual(sync_log.timing['fetch_batches'], 4)
+        
+        messages = EmailMessage.objects.filter(email_account=self.account)
+        self.assertEqual(messages.count(), 5)
+        first = messages.get(subject='First')
+        self.assertTrue(first.is_read)
+        self.assertEqual(first.folder, 'Takeout')
+        self.assertIn('From the archive', first.body_plain)
+        self.assertTrue(messages.get(subject='Second').is_starred)
+        maildir_message = messages.get(subject='Maildir')
+        self.assertTrue(maildir_message.is_read and maildir_message.is_starred)
+        self.assertEqual(maildir_message.received_at.isoformat(), '2025-04-01T10:00:00+00:00')
+        self.assertEqual(messages.get(subject='Sent one').folder, 'Sent')
+    
+    def test_import_mailbox_command(self):
+        """Test the import_mailbox management command"""
+        out = io.StringIO()
+        call_command('import_mailbox', str(self.account.id), self.mbox_path, '--processes', '0', stdout=out)
+        self.assertIn('Imported 3 messages (3 new, 0 updated)', out.getvalue())
+        self.assertEqual(EmailMessage.objects.filter(email_account=self.account).count(), 3)
+
+class ExportTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', email='test@example.com', password='testpass123')
+        self.account = EmailAccount.objects.create(
+            user=self.user,
+            email_address='test@example.com',
+            provider='imap',
+            imap_server='imap.example.com',
+            smtp_server='smtp.example.com',
+        )
+        self.store = AttachmentStore(storage=InMemoryStorage())
+        EmailSyncService.sync_account(
+            self.account.id, client_factory=lambda account: FakeMailboxClient(5), store=self.store, parse_processes=0,
+        )
+        self.messages = EmailMessage.objects.filter(email_account=self.account)
+        first = self.messages.get(message_id='1')
+        first.body_plain = 'From here on, a line mbox readers would split on\n' + first.body_plain
+        first.labels = json.dumps(['Work'])
+        first.save()
+    
+    def test_mbox_export_round_trips(self):
+        """Test that exported mbox entries parse back with bodies, state and attachments"""
+        mbox = b''.join(ExportService.iter_mbox(self.messages, store=self.store, chunk_size=2))
+        self.assertEqual(len(self._spans(mbox)), 5)
+        
+        mbox = b''.join(ExportService.iter_mbox(self.messages.filter(message_id='1'), store=self.store))
+        [(start, end)] = self._spans(mbox)
+        raw, extra = mbox_message(mbox[start:end])
+        parsed = parse_message([raw], store=self.store)
+        self.assertEqual(parsed['subject'], 'Résumé')
+        self.assertTrue(parsed['body_plain'].startswith('From here on'))
+        self.assertEqual([attachment['filename'] for attachment in parsed['attachments']], ['cv.pdf'])
+        self.assertTrue(extra['is_read'])
+        self.assertIn(b'X-Keywords: Work', raw)
+    
+    def _spans(self, mbox):
+        path = f"{tempfile.mkdtemp()}/export.mbox"
+        with open(path, 'wb') as f:
+            f.write(mbox)
+        return list(mbox_spans(path))
+    
+    def test_parquet_export_writes_row_groups(self):
+        """Test that metadata exports write one row group per row_group_size messages"""
+        try:
+            import pyarrow.parquet as pq
+        except ImportError:
+            self.skipTest("pyarrow is not installed")
+        chunks, _, _ = ExportService.stream(self.messages, 'parquet', row_group_size=2)
+        chunks = list(chunks)
+        self.assertGreaterEqual(len(chunks), 3)
+        
+        parquet = pq.ParquetFile(io.BytesIO(b''.join(chunks)))
+        self.assertEqual(parquet.metadata.num_row_groups, 3)
+        table = parquet.read()
+        self.assertEqual(table.num_rows, 5)
+        [row] = [row for row in table.to_pylist() if row['message_id'] == '1']
+        self.assertEqual((row['labels'], row['is_read']), (['Work'], True))
+        self.assertEqual(row['to_addresses'], ['me@example.com'])
+    
+    def test_export_views_stream(self):
+        """Test the account and selection export endpoints"""
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('sync:export', kwargs={'account_id': self.account.id, 'export_format': 'mbox'}))
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Disposition'], f'attachment; filename="account-{self.account.id}.mbox"')
+        self.assertEqual(b''.join(response.streaming_content).count(b'\nFrom '), 4)
+        
+        response = self.client.get(reverse('sync:export', kwargs={'account_id': self.account.id, 'export_format': 'csv'}))
+        self.assertEqual(response.status_code, 404)
+        
+        selection = SelectionService.create_selection(self.user, self.account, include=[self.messages.get(message_id='2').pk])
+        response = self.client.get(reverse('review:selection_export', kwargs={'selection_id': selection.id, 'export_format': 'mbox'}))
+        self.assertEqual(b''.join(response.streaming_content).count(b'Subject: '), 1)
+
+class ArchiveTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', email='test@example.com', password='testpass123')
+        self.account = EmailAccount.objects.create(
+            user=self.user,
+            email_address='test@example.com',
+            provider='imap',
+            imap_server='imap.example.com',
+            smtp_server='smtp.example.com',
+        )
+        self.store = AttachmentStore(storage=InMemoryStorage())
+        self.archive_store = ArchiveStore(storage=InMemoryStorage())
+        # Model methods and views read through the process-wide archive store
+        archive._default_store, default_store = self.archive_store, archive._default_store
+        self.addCleanup(setattr, archive, '_default_store', default_store)
+        EmailSyncService.sync_account(
+            self.account.id, client_factory=lambda account: FakeMailboxClient(5), store=self.store, parse_processes=0,
+        )
+        self.messages = EmailMessage.objects.filter(email_account=self.account)
+        now = timezone.now()
+        self.messages.filter(message_id__in=['1', '2']).update(received_at=now - timedelta(days=400))
+        self.messages.filter(message_id='3').update(received_at=now - timedelta(days=440))
+        self.body_plain = self.messages.get(message_id='1').body_plain
+    
+    def archive(self, **kwargs):
+        return ArchiveService.archive_due(store=self.archive_store, attachment_store=self.store, **kwargs)
+    
+    def test_archive_moves_bodies_and_attachments_into_monthly_packs(self):
+        """Test that due messages are packed per month and read back transparently"""
+        RetentionPolicy.objects.create(user=self.user, archive_after_days=365)
+        totals = self.archive()
+        self.assertEqual((totals['messages'], totals['packs']), (3, 2))
+        self.assertEqual(ArchivePack.objects.get(entries__email_message__message_id='3').message_count, 1)
+        self.assertEqual(self.archive()['messages'], 0)
+        
+        message = self.messages.select_related('archive_entry__pack').get(message_id='1')
+        self.assertTrue(message.is_archived)
+        self.assertEqual((message.body_plain, message.body_html), ('', ''))
+        with self.assertNumQueries(0):
+            self.assertEqual(message.get_body_plain(), self.body_plain)
+            self.assertIn('<p>Hi</p>', message.get_body_html())
+        
+        # The payload stays in the attachment store while recent messages still refer to it
+        self.assertEqual(message.attachments.get().storage_key, '')
+        key = self.messages.get(message_id='4').attachments.get().storage_key
+        self.assertTrue(self.store.storage.exists(key))
+        self.assertEqual(ArchiveService.read_attachment(message, message.attachments.get()), b'Hello world')
+        
+        pack = message.archive_entry.pack
+        with self.archive_store.open(pack.storage_key) as f:
+            index = read_index(f)
+        self.assertEqual(index[str(message.pk)], (message.archive_entry.offset, message.archive_entry.length))
+        
+        mbox = b''.join(ExportService.iter_mbox(self.messages.filter(message_id='1'), store=self.store))
+        self.assertIn(b'filename="cv.pdf"', mbox)
+        self.assertIn(base64.b64encode(b'Hello world'), mbox)
+    
+    def test_resync_keeps_archived_body_out_of_the_row(self):
+        """Test that syncing an archived message again does not re-inline its body"""
+        RetentionPolicy.objects.create(user=self.user, archive_after_days=365)
+        self.archive()
+        EmailSyncService.sync_account(
+            self.account.id, client_factory=lambda account: FakeMailboxClient(5), store=self.store, parse_processes=0,
+        )
+        message = self.messages.get(message_id='1')
+        self.assertEqual(message.body_plain, '')
+        self.assertEqual(message.get_body_plain(), self.body_plain)
+    
+    def test_account_policy_overrides_user_policy(self):
+        """Test that an account policy replaces the user-wide policy for that account"""
+        RetentionPolicy.objects.create(user=self.user, archive_after_days=30)
+        policy = RetentionPolicy.objects.create(user=self.user, email_account=self.account, archive_after_days=420)
+        self.assertEqual(self.archive()['messages'], 1)
+        self.assertEqual(list(self.messages.filter(is_archived=True).values_list('message_id', flat=True)), ['3'])
+        self.assertEqual(ArchiveService.due_messages(policy).count(), 0)
+    
+    def test_email_detail_reads_from_archive(self):
+        """Test that the detail view shows archived bodies"""
+        RetentionPolicy.objects.create(user=self.user, archive_after_days=365)
+        self.archive()
+        self.client.force_login(self.user)
+        message = self.messages.get(message_id='1')
+        response = self.client.get(reverse('sync:email_detail', kwargs={'email_id': message.pk}))
+        self.assertContains(response, '<p>Hi</p>')
+        
+        message.delete()
+        self.assertEqual(ArchiveService.delete_empty_packs(store=self.archive_store), 0)
+        self.messages.filter(is_archived=True).delete()
+        self.assertEqual(ArchiveService.delete_empty_packs(store=self.archive_store), 2)
+        self.assertFalse(ArchivePack.objects.exists())
+
+@override_settings(IMAP_USE_SSL=False)
+class FakeProvidersTest(TestCase):
+    """The provider clients against the benchmark IMAP and Gmail servers"""
+    
+    def setUp(self):
+        self.state = FakeProviderState(messages=20, seed=3)
+        self.imap = FakeImapServer(self.state).start()
+        self.gmail = FakeGmailServer(self.state).start()
+        self.user = User.objects.create_user(username='testuser', email='test@example.com', password='testpass123')
+        self.limiter = RateLimiter(backend=InMemoryRateLimitBackend())
+        self.pool = ImapSessionPool()
+    
+    def tearDown(self):
+        self.pool.close_idle(max_idle=0)
+        self.imap.stop()
+        self.gmail.stop()
+    
+    def test_imap_client(self):
+        """Test LIST/SELECT, UID SEARCH/FETCH, UID STORE and UID EXPUNGE with UIDPLUS"""
+        account = EmailAccount.objects.create(
+            user=self.user, email_address='alice@fake.example', provider='imap', password='secret',
+            imap_server='127.0.0.1', imap_port=self.imap.port, smtp_server='127.0.0.1',
+        )
+        fake = self.state.account('alice@fake.example')
+        client = ImapProviderClient(account, rate_limiter=self.limiter, pool=self.pool)
+        try:
+            typ, folders = client._connect().list()
+            self.assertEqual(typ, 'OK')
+            self.assertIn(b'INBOX', folders[0])
+            self.assertEqual(client._session.uid_validity, fake.uid_validity)
+            
+            self.assertEqual(client.list_message_ids(), [str(uid) for uid in range(1, 21)])
+            fetched = client.fetch_messages(['1', '2', '3'])
+            self.assertEqual([message.message_id for message in fetched], ['1', '2', '3'])
+            self.assertEqual(fetched[0].raw, fake.message(1).raw)
+            self.assertEqual(fetched[0].extra['is_read'], SEEN in fake.flags_of(1))
+            self.assertEqual(parse_message([fetched[1].raw])['subject'], fake.message(2).subject)
+            
+            client.apply_flag_changes([
+                FlagChange('2', add=frozenset({FLAGGED, 'Work'})),
+                FlagChange('3', remove=frozenset({SEEN})),
+            ])
+            self.assertTrue({FLAGGED, 'Work'} <= fake.flags_of(2))
+            self.assertNotIn(SEEN, fake.flags_of(3))
+            extra = client.fetch_messages(['2'])[0].extra
+            self.assertTrue(extra['is_starred'])
+            self.assertEqual(extra['labels'], ['Work'])
+            
+            self.assertIn('UIDPLUS', client._connection.capabilities)
+            with self.assertRaises(UidValidityMismatch):
+                client.delete_messages(['4'], uid_validity=fake.uid_validity + 1)
+            self.assertEqual(client.delete_messages(['4', '5'], uid_validity=fake.uid_validity), 2)
+            self.assertFalse(fake.is_live(4))
+            self.assertFalse(fake.is_live(5))
+            self.assertEqual(len(client.list_message_ids()), 18)
+        finally:
+            client.close()
+    
+    def test_gmail_client(self):
+        """Test messages.list/get, batchModify and batchDelete"""
+        # The fake Gmail server takes the bearer token as the account name
+        account = EmailAccount.objects.create(
+            user=self.user, email_address='bob@fake.example', provider='google', oauth_token='bob@fake.example',
+            imap_server='imap.gmail.com', smtp_server='smtp.gmail.com',
+        )
+        fake = self.state.account('bob@fake.example')
+        client = GmailProviderClient(account, api_base=self.gmail.api_base, rate_limiter=self.limiter)
+        
+        message_ids = client.list_message_ids()
+        self.assertEqual(len(message_ids), 20)
+        # Newest first, like Gmail
+        self.assertEqual(message_ids[0], f'{20:016x}')
+        
+        fetched = client.fetch_messages(message_ids[:2])
+        self.assertEqual(fetched[0].raw, fake.message(20).raw)
+        self.assertEqual(fetched[0].extra['thread_id'], f'{fake.message(20).thread_root:016x}')
+        self.assertIn('INBOX', fetched[0].extra['labels'])
+        self.assertEqual(fetched[1].extra['received_at'].replace(microsecond=0), fake.message(19).received_at)
+        
+        client.apply_flag_changes([FlagChange(message_ids[0], add=frozenset({SEEN, FLAGGED, 'Work'}))])
+        self.assertTrue({SEEN, FLAGGED, 'Work'} <= fake.flags_of(20))
+        extra = client.fetch_messages(message_ids[:1])[0].extra
+        self.assertTrue(extra['is_read'])
+        self.assertTrue(extra['is_starred'])
+        
+        self.assertEqual(client.delete_messages(message_ids[:2]), 2)
+        self.assertFalse(fake.is_live(20))
+        self.assertFalse(fake.is_live(19))
+        self.assertEqual(client.list_message_ids(), message_ids[2:])
+
+class SyntheticMailboxTest(TestCase):
+    def test_same_seed_gives_same_messages(self):
+        """Test that a mailbox is reproducible from its seed alone"""
+        first, second = SyntheticMailbox(50, seed=7), SyntheticMailbox(50, seed=7)
+        self.assertEqual(list(first), list(second))
+        # Any UID can be generated on its own, in any order
+        self.assertEqual(SyntheticMailbox(50, seed=7).message(42), first.message(42))
+        self.assertNotEqual(SyntheticMailbox(50, seed=8).message(42).raw, first.message(42).raw)
+    
+    def test_messages_parse_with_configured_ratios(self):
+        """Test that generated messages parse and roughly honour the attachment, HTML and reply rates"""
+        mailbox = SyntheticMailbox(300, seed=5)
+        attachments = html = replies = 0
+        for message in mailbox:
+            result = parse_message([message.raw])
+            self.assertEqual(result['subject'], message.subject)
+            self.assertEqual(result['message_id_header'], f"<{message.message_id}>")
+            self.assertEqual(sum(attachment['size'] for attachment in result['attachments']), message.attachment_bytes)
+            self.assertEqual(bool(result['body_html']), message.kind in ('newsletter', 'notification'))
+            self.assertEqual(bool(result['in_reply_to']), message.thread_root != message.uid)
+            attachments += bool(result['attachments'])
+            html += bool(result['body_html'])
+            replies += bool(result['in_reply_to'])
+        
+        shares = {kind: (share, attachment_rate) for kind, share, _, attachment_rate, _ in KINDS}
+        self.assertAlmostEqual(attachments / len(mailbox), sum(share * rate for share, rate in shares.values()), delta=0.04)
+        self.assertAlmostEqual(html / len(mailbox), shares['newsletter'][0] + shares['notification'][0], delta=0.08)
+        self.assertAlmostEqual(replies / len(mailbox), shares['personal'][0] * REPLY_RATE, delta=0.06)
@@ -0,0 +1,170 @@
+import html
+import logging
+import re
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# Elements whose content is never visible text
+SKIPPED_TAGS = frozenset(['script', 'style', 'head', 'title', 'noscript', 'template', 'svg', 'object'])
+# Elements that start a new line of text
+BLOCK_TAGS = frozenset([
+    'address', 'article', 'aside', 'blockquote', 'br', 'dd', 'div', 'dl', 'dt', 'fieldset',
+    'figcaption', 'figure', 'footer', 'form', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'header',
+    'hr', 'li', 'main', 'nav', 'ol', 'p', 'pre', 'section', 'table', 'tbody', 'td', 'tfoot',
+    'th', 'thead', 'tr', 'ul',
+])
+WHITESPACE_RE = re.compile(r'[\s\u00a0\u200b\u200c\u200d\ufeff]+')
+
+TOKEN_RE = re.compile(r"""
+    (?P<comment><!--.*?-->)
+  | (?P<declaration><[!?][^>]*>)
+  | <(?P<close>/?)(?P<tag>[a-zA-Z][^\s/>]*)(?P<attrs>(?:[^>"']|"[^"]*"|'[^']*')*)>
+  | (?P<text>[^<]+)
+  | (?P<stray><)
+""", re.DOTALL | re.VERBOSE)
+ALT_RE = re.compile(r"""\balt\s*=\s*(?:"([^"]*)"|'([^']*)'|([^\s>]+))""", re.IGNORECASE)
+SKIP_END_RES = {
+    tag: re.compile(rf'</{tag}\s*>' + (r'|<body[\s>]' if tag == 'head' else ''), re.IGNORECASE)
+    for tag in SKIPPED_TAGS
+}
+PARAGRAPH_TAGS = frozenset(['p', 'div', 'table', 'h1', 'h2', 'h3', 'blockquote'])
+# Longest run of tag-free text held back between chunks
+MAX_HELD_TEXT = 64 * 1024
+
+class HtmlTextExtractor:
+    """
+    Streaming HTML-to-text converter driven by a single-pass regex tokenizer.
+
+    No DOM is built and attributes are never parsed (except img alt text).
+    Text outside script/style/head is emitted with entities decoded and
+    whitespace collapsed, block elements become line breaks, and skipped
+    elements are jumped over with one search for their end tag. Once limit
+    characters have been produced the rest of the input is ignored.
+    """
+
+    def __init__(self, limit=None):
+        self.limit = limit
+        self.length = 0
+        self.done = False
+        self._chunks = []
+        self._buffer = ''
+        self._skipping = None
+        self._pending_space = False
+        self._pending_newlines = 0
+
+    def feed(self, data):
+        if self.done:
+            return
+        self._buffer += data
+        # Hold back an unfinished tag, or trailing text that may continue
+        # (a word or entity split across chunks), until the next chunk
+        cut = self._buffer.rfind('<')
+        if cut == -1 or self._buffer.find('>', cut) != -1:
+            cut = self._buffer.rfind('>') + 1
+            if len(self._buffer) - cut > MAX_HELD_TEXT:
+                cut = max(self._buffer.rfind(' ', cut), cut)
+        self._process(cut)
+
+    def close(self):
+        if not self.done:
+            self._process(len(self._buffer))
+        self._buffer = ''
+
+    def _process(self, end):
+        buffer = self._buffer
+        position = 0
+        while position < end and not self.done:
+            if self._skipping:
+                match = SKIP_END_RES[self._skipping].search(buffer, position, end)
+                if match is None:
+                    # Keep enough to recognise an end tag split across chunks
+                    position = max(position, end - 16)
+                    break
+                position = match.end()
+                self._skipping = None
+                continue
+
+            match = TOKEN_RE.match(buffer, position, end)
+            position = match.end()
+            if match.lastgroup == 'text':
+                self._text(match.group('text'))
+            elif match.lastgroup == 'stray':
+                self._text('<')
+            elif match.group('tag'):
+                self._tag(match.group('tag').lower(), match.group('close'), match.group('attrs'))
+        self._buffer = buffer[position:]
+
+    def _tag(self, tag, close, attrs):
+        if tag in SKIPPED_TAGS:
+            if not close and not attrs.endswith('/'):
+                self._skipping = tag
+        elif tag in BLOCK_TAGS:
+            self._newline(2 if tag in PARAGRAPH_TAGS and not close else 1)
+        elif tag == 'img' and not close:
+            alt = ALT_RE.search(attrs)
+            if alt:
+                self._text(next(group for group in alt.groups() if group is not None))
+
+    def _text(self, data):
+        if '&' in data:
+            data = html.unescape(data)
+        text = WHITESPACE_RE.sub(' ', data).strip()
+        if not text:
+            self._pending_space = self._pending_space or bool(data)
+            return
+
+        if self.length:
+            if self._pending_newlines:
+                self._emit('\n' * self._pending_newlines)
+            elif self._pending_space or data[:1].isspace():
+                self._emit(' ')
+        self._pending_newlines = 0
+        self._pending_space = data[-1:].isspace()
+        self._emit(text)
+
+    def _newline(self, count):
+        if self.length:
+            self._pending_newlines = max(self._pending_newlines, count)
+            self._pending_space = False
+
+    def _emit(self, text):
+        if self.done:
+            return
+        if self.limit is not None and self.length + len(text) >= self.limit:
+            text = text[:self.limit - self.length]
+            self.done = True
+        self._chunks.append(text)
+        self.length += len(text)
+
+    def get_text(self):
+        return ''.join(self._chunks)
+
+def html_to_text(html_body, limit=None):
+    """
+    Convert HTML to plain text, stopping after limit characters
+    """
+    if not html_body:
+        return ''
+    extractor = HtmlTextExtractor(limit=limit)
+    extractor.feed(html_body)
+    extractor.close()
+    return extractor.get_text()
+
+def make_snippet(text, length):
+    """
+    Single-line preview of plain text
+    """
+    return WHITESPACE_RE.sub(' ', text[:length * 2]).strip()[:length]
+
+def extract_text(body_plain, body_html, snippet='', max_plain=None, snippet_length=None):
+    """
+    Fill in a missing plain text body and snippet; returns (body_plain, snippet)
+    """
+    max_plain = max_plain or getattr(settings, 'MESSAGE_BODY_PLAIN_MAX_CHARS', 1000000)
+    snippet_length = snippet_length or getattr(settings, 'MESSAGE_SNIPPET_LENGTH', 200)
+    if not body_plain and body_html:
+        body_plain = html_to_text(body_html, limit=max_plain)
+    if not snippet:
+        snippet = make_snippet(body_plain or '', snippet_length)
+    return body_plain, snippet
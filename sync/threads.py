@@ -0,0 +1,234 @@
+import json
+import logging
+import re
+from django.db import transaction
+from django.db.models import Count, Max, Sum
+from .models import EmailMessage, Thread, ThreadContainer
+
+logger = logging.getLogger(__name__)
+
+MESSAGE_ID_RE = re.compile(r'<([^<>\s]+)>')
+SUBJECT_PREFIX_RE = re.compile(r'^\s*((re|fwd?|aw|sv|antw)(\[\d+\])?\s*:\s*)+', re.IGNORECASE)
+
+# Upper bounds that keep hostile or broken headers from costing unbounded work
+MAX_REFERENCES = 50
+MAX_PARENT_DEPTH = 200
+MAX_PARTICIPANTS = 50
+
+def parse_message_ids(value):
+    """
+    Extract Message-IDs from a header value, in order and without duplicates
+    """
+    if not value:
+        return []
+    if isinstance(value, (list, tuple)):
+        value = ' '.join(value)
+    ids = []
+    for message_id in MESSAGE_ID_RE.findall(value):
+        message_id = message_id[:255]
+        if message_id not in ids:
+            ids.append(message_id)
+    return ids
+
+def normalize_subject(subject):
+    """
+    Strip reply/forward prefixes such as 'Re: Fwd:' from a subject
+    """
+    return SUBJECT_PREFIX_RE.sub('', subject or '').strip()
+
+def thread_headers(message_data):
+    """
+    Return (message_id, references) for ingested message data.
+
+    Accepts either a raw 'headers' mapping or the parsed 'message_id_header',
+    'in_reply_to' and 'references' keys. References are ordered oldest first,
+    as in JWZ: the References header, else the first In-Reply-To ID.
+    """
+    headers = {key.lower(): value for key, value in (message_data.get('headers') or {}).items()}
+    message_ids = parse_message_ids(message_data.get('message_id_header') or headers.get('message-id'))
+    references = parse_message_ids(message_data.get('references') or headers.get('references'))
+    in_reply_to = parse_message_ids(message_data.get('in_reply_to') or headers.get('in-reply-to'))
+    if in_reply_to and in_reply_to[0] not in references:
+        references.append(in_reply_to[0])
+
+    message_id = message_ids[0] if message_ids else ''
+    references = [ref for ref in references if ref != message_id][-MAX_REFERENCES:]
+    return message_id, references
+
+class ThreadService:
+    """
+    Service class for incremental JWZ threading and thread rollups
+    """
+
+    @staticmethod
+    def add_message(email_message, message_id, references):
+        """
+        Attach a newly ingested message to its thread.
+
+        Only the containers for the message and its references are read, so
+        the cost is independent of mailbox size. When the message links
+        threads that were separate so far (e.g. a late-arriving parent), they
+        are merged into the oldest one.
+        """
+        account = email_message.email_account
+        # Messages without a Message-ID still get a (singleton) container
+        message_id = message_id or f"{email_message.message_id}@{account.id}.local"
+        wanted = references + [message_id]
+
+        with transaction.atomic():
+            containers = {
+                container.message_id: container
+                for container in ThreadContainer.objects.select_for_update().filter(
+                    email_account=account,
+                    message_id__in=wanted,
+                )
+            }
+            own = containers.get(message_id)
+            if own is not None and own.email_message_id not in (None, email_message.pk):
+                # Duplicate Message-ID (e.g. the same message in two folders): share the thread only
+                thread = own.thread
+                ThreadService._link_message(email_message, thread)
+                return thread
+
+            thread_ids = sorted({container.thread_id for container in containers.values()})
+            if not thread_ids:
+                thread = Thread.objects.create(
+                    user_id=email_message.user_id,
+                    email_account=account,
+                    subject=normalize_subject(email_message.subject),
+                )
+            else:
+                thread = ThreadService.merge_threads(thread_ids)
+
+            missing = [
+                ThreadContainer(email_account=account, message_id=ref, thread=thread)
+                for ref in wanted if ref not in containers
+            ]
+            ThreadContainer.objects.bulk_create(missing)
+            if missing and missing[0].pk is None:
+                # Backends that don't return primary keys from bulk inserts
+                missing = ThreadContainer.objects.filter(
+                    email_account=account,
+                    message_id__in=[container.message_id for container in missing],
+                )
+            containers.update({container.message_id: container for container in missing})
+
+            # JWZ step 1B: link each reference to the one before it, unless already parented
+            parents = {container.pk: container.parent_id for container in containers.values()}
+            chain = [containers[ref] for ref in references]
+            for parent, child in zip(chain, chain[1:]):
+                if child.parent_id is None and not ThreadService._creates_loop(parent.pk, child.pk, parents):
+                    child.parent = parent
+                    parents[child.pk] = parent.pk
+                    child.save(update_fields=['parent'])
+
+            # JWZ step 1C: the message's parent is its last reference, replacing any guess
+            own = containers[message_id]
+            own.email_message = email_message
+            own.parent = None
+            if chain and not ThreadService._creates_loop(chain[-1].pk, own.pk, parents):
+                own.parent = chain[-1]
+            own.save(update_fields=['email_message', 'parent'])
+
+            ThreadService._link_message(email_message, thread)
+        return thread
+
+    @staticmethod
+    def _creates_loop(parent_id, child_id, parents):
+        """
+        Check whether making parent_id the parent of child_id would create a cycle
+        """
+        node_id, depth = parent_id, 0
+        while node_id is not None and depth < MAX_PARENT_DEPTH:
+            if node_id == child_id:
+                return True
+            if node_id not in parents:
+                parents[node_id] = ThreadContainer.objects.filter(pk=node_id).values_list('parent_id', flat=True).first()
+            node_id = parents[node_id]
+            depth += 1
+        return depth >= MAX_PARENT_DEPTH
+
+    @staticmethod
+    def _link_message(email_message, thread):
+        """
+        Point a message at its thread and add it to the thread rollup
+        """
+        EmailMessage.objects.filter(pk=email_message.pk).update(conversation=thread)
+        email_message.conversation = thread
+        if email_message.is_deleted:
+            return
+
+        thread = Thread.objects.select_for_update().get(pk=thread.pk)
+        thread.message_count += 1
+        thread.total_size += email_message.size or 0
+        if thread.last_activity_at is None or email_message.received_at > thread.last_activity_at:
+            thread.last_activity_at = email_message.received_at
+        participants = json.loads(thread.participants or '[]')
+        sender = (email_message.from_address or '').lower()
+        if sender and sender not in participants and len(participants) < MAX_PARTICIPANTS:
+            participants.append(sender)
+        thread.participants = json.dumps(participants)
+        thread.save(update_fields=['message_count', 'total_size', 'last_activity_at', 'participants', 'updated_at'])
+
+    @staticmethod
+    def merge_threads(thread_ids):
+        """
+        Merge threads into the oldest one and return it.
+
+        Work is proportional to the size of the merged threads, never the mailbox.
+        """
+        survivor_id, *others = sorted(thread_ids)
+        survivor = Thread.objects.select_for_update().get(pk=survivor_id)
+        if not others:
+            return survivor
+
+        ThreadContainer.objects.filter(thread_id__in=others).update(thread=survivor)
+        EmailMessage.objects.filter(conversation_id__in=others).update(conversation=survivor)
+        Thread.objects.filter(pk__in=others).delete()
+        ThreadService.refresh_threads([survivor_id])
+        survivor.refresh_from_db()
+        logger.debug(f"Merged threads {others} into {survivor_id}")
+        return survivor
+
+    @staticmethod
+    def refresh_threads(thread_ids):
+        """
+        Recompute the rollups of the given threads from their live messages
+        """
+        thread_ids = {thread_id for thread_id in thread_ids if thread_id is not None}
+        if not thread_ids:
+            return
+
+        live = EmailMessage.objects.live().filter(conversation_id__in=thread_ids)
+        totals = {
+            row['conversation_id']: row
+            for row in live.values('conversation_id').annotate(
+                count=Count('id'),
+                size=Sum('size'),
+                last=Max('received_at'),
+            ).order_by()
+        }
+        participants = {thread_id: [] for thread_id in thread_ids}
+        for thread_id, sender in live.order_by('received_at').values_list('conversation_id', 'from_address'):
+            sender = (sender or '').lower()
+            if sender and sender not in participants[thread_id] and len(participants[thread_id]) < MAX_PARTICIPANTS:
+                participants[thread_id].append(sender)
+
+        threads = list(Thread.objects.filter(pk__in=thread_ids))
+        for thread in threads:
+            row = totals.get(thread.pk, {})
+            thread.message_count = row.get('count', 0)
+            thread.total_size = row.get('size') or 0
+            thread.last_activity_at = row.get('last')
+            thread.participants = json.dumps(participants[thread.pk])
+        Thread.objects.bulk_update(threads, ['message_count', 'total_size', 'last_activity_at', 'participants'])
+
+    @staticmethod
+    def get_threads(user, email_account=None, limit=50):
+        """
+        Most recently active threads with live messages, read from the rollup
+        """
+        queryset = Thread.objects.filter(user=user, message_count__gt=0)
+        if email_account is not None:
+            queryset = queryset.filter(email_account=email_account)
+        return queryset.order_by('-last_activity_at')[:limit]
@@ -0,0 +1,52 @@
+import json
+import threading
+import time
+from contextlib import contextmanager
+
+PHASES = ('list', 'fetch', 'parse', 'classify', 'persist')
+COUNTERS = ('bytes', 'fetch_batches', 'persist_batches', 'retries', 'throttled', 'throttle_wait')
+
+class SyncProfile:
+    """
+    Where the time of one account sync went, stored on SyncLog.timing_profile.
+
+    Phase times are summed over the worker threads of a stage, so with four
+    fetch workers the fetch phase can exceed the sync's wall-clock time;
+    compare phases with each other and across syncs. throttle_wait is the
+    part of list and fetch spent blocked in the rate limiter, retries the
+    requests repeated after the provider throttled them.
+    """
+
+    def __init__(self):
+        self.phases = dict.fromkeys(PHASES, 0.0)
+        self.counters = dict.fromkeys(COUNTERS, 0)
+        self.started = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def add_time(self, phase, seconds):
+        with self._lock:
+            self.phases[phase] = self.phases.get(phase, 0.0) + seconds
+
+    def add(self, **counters):
+        with self._lock:
+            for name, value in counters.items():
+                self.counters[name] = self.counters.get(name, 0) + value
+
+    @contextmanager
+    def phase(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - started)
+
+    def as_dict(self):
+        with self._lock:
+            return {
+                'wall': round(time.perf_counter() - self.started, 3),
+                'phases': {name: round(seconds, 3) for name, seconds in self.phases.items()},
+                **{name: round(value, 3) if isinstance(value, float) else value for name, value in self.counters.items()},
+            }
+
+    def dumps(self):
+        return json.dumps(self.as_dict(), separators=(',', ':'))
@@ -9,5 +9,7 @@ urlpatterns = [
     path('account/<int:account_id>/status/', views.SyncStatusView.as_view(), name='sync_status'),
     path('account/<int:account_id>/history/', views.SyncHistoryView.as_view(), name='sync_history'),
     path('account/<int:account_id>/emails/', views.EmailListView.as_view(), name='email_list'),
+    path('account/<int:account_id>/export/<str:export_format>/', views.MessageExportView.as_view(), name='export'),
     path('email/<int:email_id>/', views.EmailDetailView.as_view(), name='email_detail'),
+    path('threads/', views.ThreadListView.as_view(), name='thread_list'),
 ]
\ No newline at end of file
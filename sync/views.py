@@ -6,13 +6,16 @@ from django.views.decorators.http import require_http_methods
 from django.views.generic import TemplateView, ListView, DetailView
 from django.views import View
 from django.utils.decorators import method_decorator
-from core.mixins import AuthRequiredMixin, AjaxResponseMixin
+from core.mixins import AuthRequiredMixin, AjaxResponseMixin, ReplicaReadMixin
 from .models import SyncStatus, SyncLog, EmailMessage
 from emails.models import EmailAccount
 from .services import EmailSyncService
+from .threads import ThreadService
+from .dedup import DedupService
+from .exports import ExportService, ExportUnavailable
 import json
 
-class SyncDashboardView(AuthRequiredMixin, TemplateView):
+class SyncDashboardView(AuthRequiredMixin, ReplicaReadMixin, TemplateView):
     """Display synchronization dashboard"""
     template_name = 'sync/dashboard.html'
     
@@ -28,7 +31,7 @@ class SyncDashboardView(AuthRequiredMixin, TemplateView):
         )
         sync_logs = SyncLog.objects.filter(
             email_account__in=email_accounts
-        ).order_by('-started_at')[:10]
+        ).select_related('email_account').order_by('-started_at')[:10]
         
         context.update({
             'email_accounts': email_accounts,
@@ -96,7 +99,7 @@ class SyncStatusView(AuthRequiredMixin, AjaxResponseMixin, View):
         
         return self.render_to_json_response(response_data)
 
-class SyncHistoryView(AuthRequiredMixin, TemplateView):
+class SyncHistoryView(AuthRequiredMixin, ReplicaReadMixin, TemplateView):
     """Display synchronization history for an email account"""
     template_name = 'sync/history.html'
     
@@ -117,7 +120,7 @@ class SyncHistoryView(AuthRequiredMixin, TemplateView):
         })
         return context
 
-class EmailListView(AuthRequiredMixin, ListView):
+class EmailListView(AuthRequiredMixin, ReplicaReadMixin, ListView):
     """Display list of synchronized emails for an account"""
     model = EmailMessage
     template_name = 'sync/email_list.html'
@@ -126,10 +129,11 @@ class EmailListView(AuthRequiredMixin, ListView):
     
     def get_queryset(self):
         account_id = self.kwargs['account_id']
-        return EmailMessage.objects.filter(
+        # The list only shows metadata and snippets; bodies stay out of the row cache
+        return EmailMessage.objects.live().filter(
             email_account__id=account_id,
             email_account__user=self.request.user
-        ).order_by('-received_at')
+        ).defer('body_plain', 'body_html').order_by('-received_at')
     
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
@@ -140,13 +144,62 @@ class EmailListView(AuthRequiredMixin, ListView):
         )
         return context
 
-class EmailDetailView(AuthRequiredMixin, DetailView):
+class EmailDetailView(AuthRequiredMixin, ReplicaReadMixin, DetailView):
     """Display details of a synchronized email"""
     model = EmailMessage
     template_name = 'sync/email_detail.html'
     context_object_name = 'email'
+    pk_url_kwarg = 'email_id'
     
     def get_queryset(self):
-        return EmailMessage.objects.filter(
+        return EmailMessage.objects.live().filter(
             email_account__user=self.request.user
-        )
\ No newline at end of file
+        ).select_related('shared_body', 'archive_entry__pack')
+    
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['other_accounts'] = DedupService.get_other_accounts(self.object)
+        return context
+
+class ThreadListView(AuthRequiredMixin, ReplicaReadMixin, AjaxResponseMixin, View):
+    """List the most recently active threads from the thread rollup"""
+    
+    def get(self, request):
+        account = None
+        if request.GET.get('account'):
+            account = get_object_or_404(EmailAccount, id=request.GET['account'], user=request.user)
+        try:
+            limit = min(int(request.GET.get('limit', 50)), 200)
+        except ValueError as e:
+            return self.render_to_json_response({'status': 'error', 'message': str(e)}, status=400)
+        
+        threads = ThreadService.get_threads(request.user, email_account=account, limit=limit)
+        return self.render_to_json_response({
+            'threads': [
+                {
+                    'id': thread.id,
+                    'account': thread.email_account_id,
+                    'subject': thread.subject,
+                    'message_count': thread.message_count,
+                    'total_size': thread.total_size,
+                    'participants': json.loads(thread.participants or '[]'),
+                    'last_activity_at': thread.last_activity_at.isoformat() if thread.last_activity_at else None,
+                }
+                for thread in threads
+            ],
+        })
+
+class MessageExportView(AuthRequiredMixin, ReplicaReadMixin, AjaxResponseMixin, View):
+    """Stream an account's messages as mbox, or their metadata as Parquet or Arrow"""
+    
+    def get(self, request, account_id, export_format):
+        email_account = get_object_or_404(EmailAccount, id=account_id, user=request.user)
+        queryset = EmailMessage.objects.filter(email_account=email_account, user=request.user)
+        if request.GET.get('deleted') != '1':
+            queryset = queryset.live()
+        try:
+            return ExportService.response(queryset, export_format, f"account-{email_account.id}")
+        except ValueError as e:
+            return self.render_to_json_response({'status': 'error', 'message': str(e)}, status=404)
+        except ExportUnavailable as e:
+            return self.render_to_json_response({'status': 'error', 'message': str(e)}, status=501)
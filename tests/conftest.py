@@ -1,5 +1,7 @@
 import pytest
+from functools import partial
 from django.contrib.auth import get_user_model
+from core.testing import assert_max_queries, assert_view_queries
 from emails.models import EmailAccount
 
 User = get_user_model()
@@ -23,4 +25,14 @@ def email_account(user):
         imap_server='imap.gmail.com',
         smtp_server='smtp.gmail.com',
         password='testpassword'
-    )
\ No newline at end of file
+    )
+
+@pytest.fixture
+def max_queries():
+    """Context manager failing when a block exceeds a query budget"""
+    return assert_max_queries
+
+@pytest.fixture
+def view_queries(client):
+    """Request a URL with the test client and fail when its view exceeds a query budget"""
+    return partial(assert_view_queries, client)
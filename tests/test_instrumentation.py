@@ -0,0 +1,86 @@
+import pytest
+from django.test import RequestFactory, override_settings
+from django.http import HttpResponse
+from django.urls import reverse
+from core.cache import TTLCache
+from core.instrumentation import (
+    RequestInstrumentationMiddleware, RequestMetricsRegistry, current_request_metrics, get_request_metrics,
+)
+from core.testing import assert_max_queries
+from emails.models import EmailAccount
+
+@pytest.fixture
+def registry():
+    registry = get_request_metrics()
+    registry.reset()
+    yield registry
+    registry.reset()
+
+@pytest.mark.django_db
+def test_middleware_records_queries_and_latency_per_view(client, user, registry):
+    """Sampled requests are aggregated under their view name"""
+    client.force_login(user)
+    response = client.get(reverse('sync:dashboard'))
+
+    assert response.request_metrics.queries > 0
+    stats = registry.snapshot()['sync:dashboard']
+    assert stats['requests'] == 1
+    assert stats['queries_max'] == response.request_metrics.queries
+    assert stats['latency_p95_ms'] >= stats['db_avg_ms'] >= 0
+
+@pytest.mark.django_db
+def test_middleware_counts_cache_hits_and_misses(user):
+    """TTLCache lookups made while a request is handled count towards it"""
+    cache = TTLCache(maxsize=10, ttl=60)
+    cache.set('known', 1)
+
+    def view(request):
+        assert current_request_metrics() is not None
+        cache.get('known')
+        cache.get('unknown')
+        EmailAccount.objects.count()
+        return HttpResponse('ok')
+
+    registry = RequestMetricsRegistry()
+    middleware = RequestInstrumentationMiddleware(view)
+    middleware.registry = registry
+    response = middleware(RequestFactory().get('/anything/'))
+
+    metrics = response.request_metrics
+    assert (metrics.cache_hits, metrics.cache_misses, metrics.queries) == (1, 1, 1)
+    assert registry.snapshot()['unresolved']['cache_hits'] == 1
+    assert current_request_metrics() is None
+
+@override_settings(REQUEST_METRICS_SAMPLE_RATE=0)
+def test_unsampled_requests_are_not_measured():
+    """With sampling off the middleware only passes the request through"""
+    registry = RequestMetricsRegistry()
+    middleware = RequestInstrumentationMiddleware(lambda request: HttpResponse('ok'))
+    middleware.registry = registry
+
+    response = middleware(RequestFactory().get('/anything/'))
+    assert not hasattr(response, 'request_metrics')
+    assert registry.snapshot() == {}
+
+@pytest.mark.django_db
+def test_metrics_endpoint_is_staff_only(client, user, registry):
+    """The metrics endpoint serves the per-view snapshot to staff"""
+    client.force_login(user)
+    assert client.get(reverse('request_metrics')).status_code == 403
+
+    user.is_staff = True
+    user.save()
+    client.get(reverse('sync:dashboard'))
+    response = client.get(reverse('request_metrics'))
+    assert response.status_code == 200
+    assert response.json()['views']['sync:dashboard']['requests'] == 1
+
+@pytest.mark.django_db
+def test_assert_max_queries_reports_the_queries():
+    """The budget helper fails with the offending SQL"""
+    with assert_max_queries(1):
+        EmailAccount.objects.count()
+    with pytest.raises(AssertionError, match='2 queries exceed the budget of 1'):
+        with assert_max_queries(1):
+            EmailAccount.objects.count()
+            EmailAccount.objects.exists()
@@ -0,0 +1,121 @@
+import json
+import os
+import pytest
+from django.test import override_settings
+from django.urls import reverse
+from core.metrics import MetricsRegistry
+
+def test_render_counters_and_gauges_in_text_format():
+    """Metrics render with HELP, TYPE and one sample per label set"""
+    registry = MetricsRegistry()
+    requests = registry.counter('app_requests_total', 'Requests served', ['method'])
+    requests.labels('get').inc()
+    requests.labels(method='get').inc(2)
+    requests.labels(method='post').inc()
+    registry.gauge('app_active', 'Active workers').set(3)
+
+    assert registry.render().splitlines() == [
+        '# HELP app_active Active workers',
+        '# TYPE app_active gauge',
+        'app_active 3',
+        '# HELP app_requests_total Requests served',
+        '# TYPE app_requests_total counter',
+        'app_requests_total{method="get"} 3',
+        'app_requests_total{method="post"} 1',
+    ]
+
+def test_histogram_buckets_are_cumulative():
+    """Histogram samples count observations at or below each bound"""
+    registry = MetricsRegistry()
+    latency = registry.histogram('app_seconds', 'Latency', buckets=(0.1, 1.0))
+    for value in (0.05, 0.1, 0.5, 3):
+        latency.observe(value)
+
+    lines = registry.render().splitlines()
+    assert 'app_seconds_bucket{le="0.1"} 2' in lines
+    assert 'app_seconds_bucket{le="1"} 3' in lines
+    assert 'app_seconds_bucket{le="+Inf"} 4' in lines
+    assert 'app_seconds_sum 3.65' in lines
+    assert 'app_seconds_count 4' in lines
+
+def test_counters_reject_decrements_and_wrong_labels():
+    """Counters only go up and every label must be given"""
+    registry = MetricsRegistry()
+    counter = registry.counter('app_total', 'Things', ['kind'])
+    with pytest.raises(ValueError):
+        counter.labels('a').inc(-1)
+    with pytest.raises(ValueError):
+        counter.labels()
+    with pytest.raises(ValueError):
+        registry.gauge('app_total', 'Same name, other type')
+
+def test_multiprocess_values_are_summed(tmp_path):
+    """A scrape of one process includes the values other processes flushed"""
+    worker = MetricsRegistry(multiprocess_dir=str(tmp_path), flush_interval=0)
+    web = MetricsRegistry(multiprocess_dir=str(tmp_path), flush_interval=0)
+    for registry in (worker, web):
+        registry.counter('jobs_total', 'Jobs', ['queue'])
+        registry.histogram('job_seconds', 'Job time', buckets=(1.0,))
+    worker.metrics['jobs_total'].labels('sync').inc(2)
+    worker.metrics['job_seconds'].observe(0.5)
+    web.metrics['jobs_total'].labels('sync').inc()
+    web.metrics['job_seconds'].observe(2)
+
+    # Both registries live in this process, so they are told apart by their token
+    collected = web.collect()
+    assert collected['jobs_total'][('sync',)] == 3
+    assert collected['job_seconds'][()] == [[1, 1], 2.5, 2]
+
+def test_gauges_of_exited_processes_are_dropped(tmp_path):
+    """Counters of a dead process still count, its gauges do not"""
+    dead_pid = 2 ** 22 + 1
+    with open(tmp_path / f'{dead_pid}-abc.json', 'w') as f:
+        json.dump({'pid': dead_pid, 'metrics': {
+            'jobs_total': [[[], 5]],
+            'jobs_running': [[[], 4]],
+        }}, f)
+    registry = MetricsRegistry(multiprocess_dir=str(tmp_path))
+    registry.counter('jobs_total', 'Jobs').inc()
+    registry.gauge('jobs_running', 'Running jobs').set(1)
+
+    collected = registry.collect()
+    assert collected['jobs_total'][()] == 6
+    assert collected['jobs_running'][()] == 1
+
+def test_forked_child_starts_from_zero(tmp_path):
+    """A forked process does not report its parent's values again"""
+    registry = MetricsRegistry(multiprocess_dir=str(tmp_path), flush_interval=0)
+    counter = registry.counter('jobs_total', 'Jobs')
+    counter.inc(5)
+
+    pid = os.fork()
+    if pid == 0:
+        counter.inc()
+        os._exit(0)
+    os.waitpid(pid, 0)
+
+    assert registry.collect()['jobs_total'][()] == 6
+
+@pytest.mark.django_db
+@override_settings(METRICS_TOKEN='scrape-secret')
+def test_metrics_endpoint_requires_the_token(client):
+    """Scrapers authenticate with the bearer token"""
+    url = reverse('metrics')
+    assert client.get(url).status_code == 401
+    assert client.get(url, HTTP_AUTHORIZATION='Bearer wrong').status_code == 401
+
+    response = client.get(url, HTTP_AUTHORIZATION='Bearer scrape-secret')
+    assert response.status_code == 200
+    assert response['Content-Type'].startswith('text/plain; version=0.0.4')
+    assert '# TYPE sync_messages_fetched_total counter' in response.content.decode()
+
+@pytest.mark.django_db
+@override_settings(METRICS_TOKEN='')
+def test_metrics_endpoint_without_token_is_staff_only(client, user):
+    """Without a token only staff sessions can read the metrics"""
+    client.force_login(user)
+    assert client.get(reverse('metrics')).status_code == 403
+
+    user.is_staff = True
+    user.save()
+    assert client.get(reverse('metrics')).status_code == 200
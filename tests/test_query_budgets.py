@@ -0,0 +1,79 @@
+import pytest
+from django.urls import reverse
+from django.utils import timezone
+from emails.models import EmailAccount
+from sync.models import EmailMessage, SyncLog, SyncStatus
+
+# Maximum queries per view, including session and user lookups. A view
+# whose count grows with the data (an N+1) also fails test_no_n_plus_one.
+QUERY_BUDGETS = [
+    ('sync:dashboard', None, 5),
+    ('sync:sync_history', 'account', 4),
+    ('sync:email_list', 'account', 5),
+    ('sync:email_detail', 'email', 5),
+    ('sync:thread_list', None, 3),
+    ('analytics:daily_volume', None, 3),
+    ('analytics:sender_trends', None, 3),
+    ('analytics:storage_overview', None, 5),
+    ('analytics:largest_messages', None, 4),
+    ('analytics:reclaimable', None, 3),
+]
+
+def populate(user, accounts, messages):
+    """Give user active accounts, each with a sync status, sync logs and messages"""
+    now = timezone.now()
+    for _ in range(accounts):
+        account = EmailAccount.objects.create(
+            user=user,
+            email_address=f'budget{EmailAccount.objects.count()}@example.com',
+            provider='imap',
+            imap_server='imap.example.com',
+            smtp_server='smtp.example.com',
+        )
+        SyncStatus.objects.create(email_account=account, last_sync_completed=now)
+        for _ in range(2):
+            SyncLog.objects.create(email_account=account, sync_type='full', status='completed', started_at=now)
+        EmailMessage.objects.bulk_create([
+            EmailMessage(
+                email_account=account,
+                user=user,
+                message_id=f'{account.id}-{j}',
+                subject=f'Message {j}',
+                from_address=f'sender{j % 3}@example.com',
+                sent_at=now,
+                received_at=now,
+                size=1000 + j,
+            )
+            for j in range(messages)
+        ])
+
+def url_for(name, target, user):
+    account = EmailAccount.objects.filter(user=user).order_by('id').first()
+    if target == 'account':
+        return reverse(name, kwargs={'account_id': account.id})
+    if target == 'email':
+        return reverse(name, kwargs={'email_id': EmailMessage.objects.filter(email_account=account).first().id})
+    return reverse(name)
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('name,target,budget', QUERY_BUDGETS)
+def test_view_query_budget(client, user, view_queries, name, target, budget):
+    """Each view stays within its query budget"""
+    populate(user, accounts=2, messages=5)
+    client.force_login(user)
+
+    response = view_queries(url_for(name, target, user), budget)
+    assert response.status_code == 200
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('name,target,budget', QUERY_BUDGETS)
+def test_no_n_plus_one(client, user, name, target, budget):
+    """Query counts do not grow with the number of accounts, logs and messages"""
+    populate(user, accounts=1, messages=2)
+    client.force_login(user)
+    url = url_for(name, target, user)
+    small = client.get(url).request_metrics.queries
+
+    populate(user, accounts=4, messages=10)
+    large = client.get(url).request_metrics.queries
+    assert large == small
@@ -0,0 +1,84 @@
+import pytest
+from django.db import connections, transaction
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from core import routers
+from core.routers import ReplicaMonitor, ReplicaRouter, replica_reads
+from sync.models import EmailMessage, SyncLog
+
+@pytest.fixture
+def monitor(monkeypatch):
+    """A fresh process-wide replica monitor with a controllable clock and lag"""
+    clock = [0.0]
+    monitor = ReplicaMonitor(max_lag=5, interval=2, clock=lambda: clock[0])
+    monitor.clock = clock
+    monitor.lags = {}
+    monkeypatch.setattr(monitor, 'measure', lambda alias: monitor.lags.get(alias, 0.0))
+    monkeypatch.setattr(routers, '_default_monitor', monitor)
+    return monitor
+
+@pytest.mark.django_db(transaction=True)
+@override_settings(DATABASE_REPLICAS=['replica'])
+def test_reads_use_replica_only_inside_replica_reads(monitor):
+    router = ReplicaRouter()
+    assert router.db_for_read(EmailMessage) == 'default'
+    with replica_reads():
+        assert router.db_for_read(EmailMessage) == 'replica'
+        with transaction.atomic():
+            assert router.db_for_read(EmailMessage) == 'default'
+        assert router.db_for_write(EmailMessage) == 'default'
+        # Read your own writes
+        assert router.db_for_read(EmailMessage) == 'default'
+    assert router.db_for_read(EmailMessage) == 'default'
+
+@override_settings(DATABASE_REPLICAS=['replica'])
+def test_lagging_replica_falls_back_to_primary(monitor):
+    router = ReplicaRouter()
+    monitor.lags['replica'] = 30.0
+    with replica_reads():
+        assert router.db_for_read(EmailMessage) == 'default'
+        # Lag is only measured again once the check interval has passed
+        monitor.lags['replica'] = 0.5
+        assert router.db_for_read(EmailMessage) == 'default'
+        monitor.clock[0] += 2
+        assert router.db_for_read(EmailMessage) == 'replica'
+        monitor.lags['replica'] = None
+        monitor.clock[0] += 2
+        assert router.db_for_read(EmailMessage) == 'default'
+
+@pytest.mark.django_db(transaction=True, databases=['default', 'replica'])
+@override_settings(DATABASE_REPLICAS=['replica'])
+def test_views_read_from_replica_until_the_user_writes(client, user, email_account, monitor):
+    message = EmailMessage.objects.create(
+        email_account=email_account, user=user, message_id='1', subject='Hello', from_address='a@example.com',
+        to_addresses='[]', sent_at=timezone.now(), received_at=timezone.now(), size=1,
+    )
+    SyncLog.objects.create(email_account=email_account, sync_type='full', status='completed', started_at=timezone.now())
+    client.force_login(user)
+
+    with CaptureQueriesContext(connections['replica']) as replica:
+        response = client.get(reverse('sync:email_detail', kwargs={'email_id': message.pk}))
+    assert response.status_code == 200
+    assert any('sync_emailmessage' in query['sql'] for query in replica.captured_queries)
+    assert not any('django_session' in query['sql'] for query in replica.captured_queries)
+    assert 'primary_until' not in response.cookies
+
+    # Streaming exports query the replica while the response is consumed
+    with CaptureQueriesContext(connections['replica']) as replica:
+        response = client.get(reverse('sync:export', kwargs={'account_id': email_account.id, 'export_format': 'mbox'}))
+        b''.join(response.streaming_content)
+    assert any('sync_emailmessage' in query['sql'] for query in replica.captured_queries)
+
+    response = client.post(reverse('sync:start_sync', kwargs={'account_id': email_account.id}))
+    assert 'primary_until' in response.cookies
+    with CaptureQueriesContext(connections['replica']) as replica:
+        client.get(reverse('sync:email_list', kwargs={'account_id': email_account.id}))
+    assert replica.captured_queries == []
+
+    # Views without ReplicaReadMixin always read from primary
+    client.cookies.pop('primary_until')
+    with CaptureQueriesContext(connections['replica']) as replica:
+        client.get(reverse('sync:sync_status', kwargs={'account_id': email_account.id}))
+    assert replica.captured_queries == []
@@ -0,0 +1,58 @@
+import json
+import threading
+import time
+from core.sampling import SamplingProfiler
+
+def busy_leaf(until):
+    while time.perf_counter() < until:
+        pass
+
+def busy_caller(seconds):
+    busy_leaf(time.perf_counter() + seconds)
+
+def test_samples_registered_threads_only():
+    """Stacks of registered threads are counted under their name, root first"""
+    profiler = SamplingProfiler(interval=0.001)
+    worker = threading.Thread(target=busy_caller, args=(0.2,))
+    other = threading.Thread(target=busy_caller, args=(0.2,))
+    with profiler:
+        worker.start()
+        other.start()
+        profiler.add_thread(worker.ident, 'worker')
+        worker.join()
+        other.join()
+
+    assert profiler.samples > 0
+    roots = {stack[0][0] for stack in profiler.stacks}
+    assert roots == {'worker'}
+    lines = profiler.collapsed().splitlines()
+    assert any('busy_caller (test_sampling.py:' in line and line.split(';')[-1].startswith('busy_leaf') for line in lines)
+    assert sum(int(line.rsplit(' ', 1)[1]) for line in lines) == sum(profiler.stacks.values())
+
+def test_max_stacks_folds_new_stacks_into_other():
+    """Once max_stacks distinct stacks are kept, new ones are counted as [other]"""
+    profiler = SamplingProfiler(max_stacks=1)
+    profiler.add_thread(threading.get_ident(), 'main')
+    profiler.sample()
+    (lambda: profiler.sample())()
+
+    assert len(profiler.stacks) == 2
+    assert profiler.stacks[(('main', '', 0), ('[other]', '', 0))] == 1
+
+def test_speedscope_export(tmp_path):
+    """The dump is a valid speedscope sampled profile weighted in seconds"""
+    profiler = SamplingProfiler(interval=0.01)
+    profiler.add_thread(threading.get_ident(), 'main')
+    for _ in range(3):
+        profiler.sample()
+
+    collapsed_path, speedscope_path = profiler.dump(str(tmp_path), 'sync-1-2')
+    with open(speedscope_path) as f:
+        profile = json.load(f)
+    assert open(collapsed_path).read() == profiler.collapsed()
+    sampled = profile['profiles'][0]
+    assert sampled['type'] == 'sampled'
+    assert sampled['weights'] == [0.03]
+    frames = profile['shared']['frames']
+    assert frames[sampled['samples'][0][0]] == {'name': 'main'}
+    assert frames[sampled['samples'][0][-1]]['name'] == 'sample'